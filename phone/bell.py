@@ -0,0 +1,365 @@
+# Bell driver.
+#
+# The bell is rung by alternating the polarity of the ring magnet at
+# 1 / (2 * RING_PULSE_TIME) Hz in bursts given by a cadence. Cadences
+# are compiled into tables of (offset, bell state) steps once, and the
+# steps are scheduled at absolute deadlines from the start of the ring,
+# so a late step doesn't shift the ones after it.
+#
+# Bell does the scheduling. It is either driven by the phone_io loop
+# (NextDeadline / Update, used with the simulator), or by BellThread,
+# which gives the bell its own thread so dial decoding and bell timing
+# don't compete for the same loop.
+#
+# Every step is a half-cycle of the ring signal. Its timing error (how
+# late it was applied) is collected in BellStats.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import collections
+import errno
+import os
+import select
+import threading
+
+import gpio_backend
+import metrics
+
+# Output ports:
+PORT_RING_ENABLE = 25 # Enable / disable ring magnet.
+PORT_RING_LEFT = 24   # Enable / disable left bell.
+PORT_RING_RIGHT = 23  # Enable / disable right bell.
+
+# The output ports of a bell.
+RingPins = collections.namedtuple('RingPins', ['enable', 'left', 'right'])
+
+DEFAULT_RING_PINS = RingPins(PORT_RING_ENABLE, PORT_RING_LEFT,
+                             PORT_RING_RIGHT)
+
+# Expresses the frequency of the ring signal:
+# Frequency = 1 / (2 * RING_PULSE).
+RING_PULSE_TIME = 0.05
+
+# Sleep time in seconds between ring sequences.
+RING_SLEEP_TIME = 2
+
+# Active time of the bell in seconds.
+RING_ACTIVE_TIME = 1
+
+# Bell states.
+BELL_OFF = 0
+BELL_LEFT = 1
+BELL_RIGHT = 2
+
+# Half-cycles applied later than this many seconds count as late.
+LATE_ERROR = 0.002
+
+# Buckets of the timing error histogram in seconds.
+ERROR_BUCKETS = [0.0001, 0.0002, 0.0005, 0.001, LATE_ERROR, 0.005, 0.01,
+                 0.02, 0.05]
+
+# Named cadences as [(seconds ringing, seconds silent)], played in a loop.
+CADENCES = {
+  'standard': [(RING_ACTIVE_TIME, RING_SLEEP_TIME)],
+  'double': [(0.4, 0.2), (0.4, 2.0)],
+  'triple': [(0.3, 0.2), (0.3, 0.2), (0.3, 1.5)],
+  'short': [(0.5, 2.5)],
+}
+
+DEFAULT_CADENCE = 'standard'
+
+# Cadences with this prefix are melodies played from an audio file.
+AUDIO_PREFIX = 'audio:'
+
+class Cadence:
+  ''' Cadence is the compiled step table of a ring cadence.'''
+
+  def __init__(self, steps, duration):
+    ''' Construct Cadence instance.
+
+    Args:
+      steps: [(offset from the start of the cycle, bell state)], sorted
+             by offset. Must not be empty.
+      duration: Seconds of one cycle.
+    '''
+    self.steps_ = steps
+    self.duration_ = duration
+
+  def GetSteps(self):
+    return self.steps_
+
+  def GetDuration(self):
+    ''' GetDuration returns the seconds of one cycle.'''
+    return self.duration_
+
+def BurstCadence(bursts, pulse_time=RING_PULSE_TIME):
+  ''' Returns the Cadence ringing bursts.
+
+  Args:
+    bursts: [(seconds ringing, seconds silent)].
+    pulse_time: Seconds per half-cycle of the ring signal.
+  '''
+  steps = []
+  offset = 0
+  for on, off in bursts:
+    pulses = int(round(on / pulse_time))
+    for i in range(pulses):
+      steps.append((offset + i * pulse_time,
+                    BELL_LEFT if i % 2 == 0 else BELL_RIGHT))
+    offset += pulses * pulse_time
+    steps.append((offset, BELL_OFF))
+    offset += off
+  return Cadence(steps, offset)
+
+def ParseCadence(spec):
+  ''' Returns the Cadence described by spec.
+
+  Args:
+    spec: The name of one of CADENCES, alternating seconds ringing
+          and silent, e.g. '0.4 0.2 0.4 2', or audio:<file> to ring a
+          melody, see bell_audio.py.
+
+  Raises:
+    ValueError: spec is malformed.
+  '''
+  if spec in CADENCES:
+    return BurstCadence(CADENCES[spec])
+  if spec.startswith(AUDIO_PREFIX):
+    # Only import on demand, bell_audio needs numpy.
+    import bell_audio
+    return bell_audio.LoadCadence(spec[len(AUDIO_PREFIX):])
+  return BurstCadence(_ParseBursts(spec))
+
+def ValidateCadence(spec):
+  ''' Check spec like ParseCadence, but cheaply: of an audio cadence,
+  only check that the file exists. Decoding it is left to phone_io.
+
+  Raises:
+    ValueError: spec is malformed or its audio file is missing.
+  '''
+  if spec in CADENCES:
+    return
+  if spec.startswith(AUDIO_PREFIX):
+    path = spec[len(AUDIO_PREFIX):]
+    if not os.path.isfile(path):
+      raise ValueError('Audio file of cadence %r not found' % spec)
+    return
+  _ParseBursts(spec)
+
+def _ParseBursts(spec):
+  ''' Returns the [(seconds ringing, seconds silent)] of a numeric
+  cadence spec, see ParseCadence.'''
+  values = [float(v) for v in spec.replace(',', ' ').split()]
+  if not values or len(values) % 2 or min(values) < 0 or not sum(values):
+    raise ValueError('Invalid cadence %r' % spec)
+  return zip(values[0::2], values[1::2])
+
+class BellStats:
+  ''' BellStats counts half-cycles and their timing errors.'''
+
+  def __init__(self):
+    self.count_ = 0
+    self.late_ = 0
+    self.total_error_ = 0.0
+    self.max_error_ = 0.0
+    self.errors_ = metrics.Histogram(ERROR_BUCKETS)
+
+  def Add(self, error):
+    self.errors_.Observe(error)
+    self.count_ += 1
+    self.total_error_ += error
+    self.max_error_ = max(self.max_error_, error)
+    if error > LATE_ERROR:
+      self.late_ += 1
+
+  def GetCount(self):
+    return self.count_
+
+  def GetLate(self):
+    ''' GetLate returns the number of half-cycles later than LATE_ERROR.'''
+    return self.late_
+
+  def GetMeanError(self):
+    if not self.count_:
+      return 0.0
+    return self.total_error_ / self.count_
+
+  def GetMaxError(self):
+    return self.max_error_
+
+  def GetErrors(self):
+    ''' GetErrors returns the metrics.Histogram of timing errors.'''
+    return self.errors_
+
+  def __str__(self):
+    return ('%d half-cycles, mean error %.3fms, max %.3fms, %d late' %
+            (self.count_, self.GetMeanError() * 1000,
+             self.max_error_ * 1000, self.late_))
+
+class Bell:
+  ''' Bell drives the bell pins according to a cadence.'''
+
+  def __init__(self, backend, cadences=None, pins=DEFAULT_RING_PINS):
+    ''' Construct Bell instance and set up the pins.
+
+    Args:
+      backend: The gpio_backend.Backend to use.
+      cadences: List of Cadences that can be selected by index. Index 0
+                is the default and always exists.
+      pins: The RingPins of the bell.
+    '''
+    self.backend_ = backend
+    self.cadences_ = [ParseCadence(DEFAULT_CADENCE)] + list(cadences or [])
+    self.pins_ = pins
+    self.stats_ = BellStats()
+    for port in pins:
+      backend.SetupOutput(port)
+    self.state_ = BELL_OFF
+    # Cadence being rung, None while the bell is off.
+    self.cadence_ = None
+    # Start of the current cycle and index of the next step in it.
+    self.cycle_start_ = 0
+    self.step_ = 0
+
+  def GetStats(self):
+    return self.stats_
+
+  def Start(self, index, now):
+    ''' Start ringing with cadence index (0 if unknown) at time now.'''
+    if not 0 <= index < len(self.cadences_):
+      index = 0
+    self.cadence_ = self.cadences_[index]
+    self.cycle_start_ = now
+    self.step_ = 0
+
+  def Stop(self, now):
+    ''' Stop ringing. The bell is switched off with the next Update.'''
+    self.cadence_ = None
+
+  def IsRinging(self):
+    return self.cadence_ is not None
+
+  def NextDeadline(self):
+    ''' NextDeadline returns the time Update must be called at next, None
+    if there is nothing to do.'''
+    if self.cadence_ is None:
+      if self.state_ != BELL_OFF:
+        return self.backend_.Now()
+      return None
+    return self.cycle_start_ + self.cadence_.GetSteps()[self.step_][0]
+
+  def Update(self, now):
+    ''' Apply all steps due at now.'''
+    if self.cadence_ is None:
+      self.SetState(BELL_OFF)
+      return
+    steps = self.cadence_.GetSteps()
+    state = None
+    while True:
+      offset, step_state = steps[self.step_]
+      deadline = self.cycle_start_ + offset
+      if deadline > now:
+        break
+      self.stats_.Add(now - deadline)
+      state = step_state
+      self.step_ += 1
+      if self.step_ == len(steps):
+        self.step_ = 0
+        self.cycle_start_ += self.cadence_.GetDuration()
+    if state is not None:
+      self.SetState(state)
+
+  def SetState(self, state):
+    ''' Set the bell pins if the bell state changed. Cadences in progress
+    override this with their next step.'''
+    if state == self.state_:
+      return
+    self.state_ = state
+    LOW = gpio_backend.LOW
+    HIGH = gpio_backend.HIGH
+    pins = self.pins_
+    self.backend_.Output(pins.enable, LOW)
+    self.backend_.Output(pins.left, LOW if state == BELL_LEFT else HIGH)
+    self.backend_.Output(pins.right, HIGH if state == BELL_LEFT else LOW)
+    self.backend_.Output(pins.enable, HIGH)
+
+class BellThread:
+  ''' BellThread runs one or more Bells on its own thread.
+
+  The thread sleeps in select until the next step is due or it is woken
+  up through a pipe, which is far more precise than the timed waits of
+  threading.Condition.
+  '''
+
+  def __init__(self, bells, backend):
+    ''' Construct BellThread instance and start the thread.
+
+    Args:
+      bells: A Bell or a list of Bells, which are indexed in that order.
+      backend: The gpio_backend.Backend of the bells.
+    '''
+    if isinstance(bells, Bell):
+      bells = [bells]
+    self.bells_ = bells
+    self.backend_ = backend
+    self.lock_ = threading.Lock()
+    self.wakeup_read_, self.wakeup_write_ = os.pipe()
+    self.closed_ = False
+    self.thread_ = threading.Thread(target=self.run_, name='bell')
+    self.thread_.daemon = True
+    self.thread_.start()
+
+  def Start(self, index, bell=0):
+    ''' Start ringing bell with cadence index.'''
+    with self.lock_:
+      self.bells_[bell].Start(index, self.backend_.Now())
+    self.wakeup_()
+
+  def Stop(self, bell=0):
+    with self.lock_:
+      self.bells_[bell].Stop(self.backend_.Now())
+    self.wakeup_()
+
+  def Close(self):
+    ''' Switch the bells off and end the thread.'''
+    for i in range(len(self.bells_)):
+      self.Stop(i)
+    with self.lock_:
+      self.closed_ = True
+    self.wakeup_()
+    self.thread_.join()
+    os.close(self.wakeup_read_)
+    os.close(self.wakeup_write_)
+
+  def wakeup_(self):
+    os.write(self.wakeup_write_, b'x')
+
+  def run_(self):
+    while True:
+      with self.lock_:
+        if self.closed_:
+          # The stops of Close may not have been applied yet.
+          now = self.backend_.Now()
+          for b in self.bells_:
+            b.Update(now)
+          return
+        deadlines = [b.NextDeadline() for b in self.bells_]
+      deadlines = [d for d in deadlines if d is not None]
+      timeout = None
+      if deadlines:
+        deadline = min(deadlines)
+        timeout = max(0, deadline - self.backend_.Now())
+      try:
+        readable, _, _ = select.select([self.wakeup_read_], [], [], timeout)
+      except select.error as e:
+        if e.args[0] != errno.EINTR:
+          raise
+        readable = []
+      if readable:
+        os.read(self.wakeup_read_, 4096)
+      with self.lock_:
+        now = self.backend_.Now()
+        for b in self.bells_:
+          b.Update(now)
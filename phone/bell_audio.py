@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+# Ring melodies on the mechanical bell.
+#
+# The bell can't play samples, all it can do is switch the polarity of
+# its magnet (or let go of it). An audio file is therefore
+#  1. decoded (WAV directly, anything else through mpg123),
+#  2. low-pass filtered and resampled to the bell's edge rate, which
+#     bounds how fast the magnet is switched,
+#  3. gated by its envelope, so quiet passages leave the bell off,
+#  4. turned into a schedule of (offset, bell state) edges: the polarity
+#     follows the sign of the signal.
+# All of that is vectorized with numpy. The schedule is a bell.Cadence,
+# so it can be rung by phone_io (Cadence=audio:<file> in phony.conf) or
+# played once from here with a deadline based scheduler. The latter
+# reports requested against achieved edge timing.
+#
+# Usage: bell_audio.py <audio file> [--rate HZ] [--threshold RATIO]
+#
+# This replaces experimental/play.py.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import subprocess
+import time
+import wave
+
+import numpy
+
+import bell
+import clock
+import gpio_backend
+
+# Edges per second the bell is driven with at most.
+EDGE_RATE = 200
+
+# Rate mpg123 decodes to.
+DECODE_RATE = 8000
+
+# Seconds the envelope is averaged over.
+ENVELOPE_TIME = 0.02
+
+# Parts of the audio with an envelope below this fraction of its peak
+# leave the bell off.
+THRESHOLD = 0.1
+
+# Seconds of silence between two repetitions when the melody is used as
+# a cadence.
+MELODY_PAUSE = 2.0
+
+# The scheduler sleeps until this many seconds before an edge and spins
+# for the rest, sleeping isn't precise enough.
+SPIN_TIME = 0.001
+
+def Decode(path):
+  ''' Decode an audio file.
+
+  Returns:
+    A tuple (samples, rate) of mono float samples in [-1, 1] and their
+    sample rate.
+
+  Raises:
+    IOError: The file can't be decoded.
+  '''
+  if path.lower().endswith('.wav'):
+    w = wave.open(path, 'rb')
+    try:
+      channels, width, rate, frames = w.getparams()[:4]
+      data = w.readframes(frames)
+    finally:
+      w.close()
+    if width == 1:
+      samples = (numpy.frombuffer(data, numpy.uint8).astype(numpy.float64)
+                 - 128) / 128
+    elif width == 2:
+      samples = numpy.frombuffer(data, '<i2').astype(numpy.float64) / 32768
+    else:
+      raise IOError('%s: %d byte samples not supported' % (path, width))
+  else:
+    try:
+      data = subprocess.check_output(
+        ['mpg123', '-q', '-s', '-e', 's16', '-r', str(DECODE_RATE), '-m',
+         path])
+    except (OSError, subprocess.CalledProcessError) as e:
+      raise IOError('Can\'t decode %s with mpg123: %s' % (path, e))
+    channels, rate = 1, DECODE_RATE
+    samples = numpy.frombuffer(data, '<i2').astype(numpy.float64) / 32768
+  samples = samples[:len(samples) // channels * channels]
+  return samples.reshape(-1, channels).mean(axis=1), rate
+
+def Resample(samples, rate, new_rate):
+  ''' Resample samples from rate to new_rate.
+
+  When downsampling, a moving average over one output sample suppresses
+  frequencies the new rate can't represent.
+  '''
+  if new_rate < rate:
+    window = int(rate // new_rate)
+    samples = numpy.convolve(samples, numpy.ones(window) / window, 'same')
+  count = int(len(samples) * new_rate // rate)
+  return numpy.interp(numpy.arange(count) * (rate / new_rate),
+                      numpy.arange(len(samples)), samples)
+
+def Schedule(samples, rate, threshold=THRESHOLD):
+  ''' Turn samples at the bell's edge rate into bell edges.
+
+  Returns:
+    A tuple (offsets, states) of numpy arrays: the bell changes to
+    states[i] offsets[i] seconds from the start. The last edge switches
+    the bell off.
+  '''
+  window = max(1, int(round(ENVELOPE_TIME * rate)))
+  envelope = numpy.convolve(numpy.abs(samples), numpy.ones(window) / window,
+                            'same')
+  peak = envelope.max() if len(envelope) else 0
+  states = numpy.where(samples >= 0, bell.BELL_LEFT, bell.BELL_RIGHT)
+  states[envelope <= threshold * peak] = bell.BELL_OFF
+  # The bell starts and ends off.
+  states = numpy.concatenate([[bell.BELL_OFF], states, [bell.BELL_OFF]])
+  changes = numpy.flatnonzero(numpy.diff(states)) + 1
+  return (changes - 1) / rate, states[changes]
+
+def LoadSchedule(path, edge_rate=EDGE_RATE, threshold=THRESHOLD):
+  ''' Returns the schedule (offsets, states) of the audio file path.'''
+  samples, rate = Decode(path)
+  return Schedule(Resample(samples, rate, edge_rate), edge_rate, threshold)
+
+def LoadCadence(path, edge_rate=EDGE_RATE, threshold=THRESHOLD):
+  ''' Returns a bell.Cadence ringing the audio file path, followed by
+  MELODY_PAUSE seconds of silence.
+
+  Raises:
+    IOError: The file can't be decoded.
+    ValueError: The file is silent.
+  '''
+  offsets, states = LoadSchedule(path, edge_rate, threshold)
+  if not len(offsets):
+    raise ValueError('%s is silent' % path)
+  return bell.Cadence(zip(offsets.tolist(), states.tolist()),
+                      offsets[-1] + MELODY_PAUSE)
+
+def Play(b, offsets, states, now=clock.Monotonic):
+  ''' Play a schedule on Bell b once.
+
+  Edges are due at absolute times from the start, so delays don't add
+  up.
+
+  Returns:
+    The times the edges were applied at, relative to the start.
+  '''
+  achieved = numpy.empty(len(offsets))
+  start = now() + SPIN_TIME
+  for i in range(len(offsets)):
+    deadline = start + offsets[i]
+    delay = deadline - now() - SPIN_TIME
+    if delay > 0:
+      time.sleep(delay)
+    while now() < deadline:
+      pass
+    b.SetState(states[i])
+    achieved[i] = now() - start
+  return achieved
+
+def Report(offsets, achieved):
+  ''' Returns a summary of requested against achieved edge times.'''
+  errors = (achieved - offsets) * 1000
+  duration = offsets[-1]
+  return ('%d edges in %.3fs requested, %.3fs achieved (%.0f edges/s)\n'
+          'edge error: mean %.3fms p50 %.3fms p99 %.3fms max %.3fms' %
+          (len(offsets), duration, achieved[-1],
+           len(offsets) / duration if duration else 0,
+           errors.mean(), numpy.percentile(errors, 50),
+           numpy.percentile(errors, 99), errors.max()))
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Ring a melody on the bell.')
+  parser.add_argument('file', help='WAV file, or anything mpg123 decodes.')
+  parser.add_argument('--rate', type=float, default=EDGE_RATE,
+                      help='Maximum edges per second.')
+  parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                      help='Envelope threshold relative to the peak.')
+  args = parser.parse_args()
+
+  offsets, states = LoadSchedule(args.file, args.rate, args.threshold)
+  if not len(offsets):
+    print('%s is silent.' % args.file)
+    return
+  backend = gpio_backend.GetBackend()
+  try:
+    achieved = Play(bell.Bell(backend), offsets, states)
+  finally:
+    backend.Cleanup()
+  print(Report(offsets, achieved))
+
+if __name__ == '__main__':
+  main()
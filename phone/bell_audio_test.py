@@ -0,0 +1,66 @@
+import array
+import bell
+import bell_audio
+import gpio_simulator
+import math
+import numpy
+import os
+import shutil
+import tempfile
+import unittest
+import wave
+
+class TestBellAudio(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def writeWav(self, samples, rate=8000):
+    path = os.path.join(self.dir, 'melody.wav')
+    w = wave.open(path, 'wb')
+    w.setnchannels(1)
+    w.setsampwidth(2)
+    w.setframerate(rate)
+    w.writeframes(array.array('h', samples).tostring())
+    w.close()
+    return path
+
+  def test_Schedule(self):
+    # 0.5s of a 20 Hz tone, then 0.5s of silence.
+    samples = [int(10000 * math.sin(2 * math.pi * 20 * (i + 0.5) / 8000))
+               for i in range(4000)] + [0] * 4000
+    offsets, states = bell_audio.LoadSchedule(self.writeWav(samples))
+    # One edge per half-cycle, give or take one at the ends, then off.
+    self.assertIn(len(offsets), [20, 21, 22])
+    numpy.testing.assert_allclose(0.025, numpy.diff(offsets[1:-2]),
+                                  atol=0.006)
+    self.assertEqual([bell.BELL_LEFT, bell.BELL_RIGHT] * 10,
+                     states[:20].tolist())
+    self.assertEqual(bell.BELL_OFF, states[-1])
+    self.assertAlmostEqual(0.5, offsets[-1], delta=0.02)
+
+  def test_Cadence(self):
+    samples = [10000] * 800 + [-10000] * 800
+    cadence = bell.ParseCadence('audio:' + self.writeWav(samples))
+    self.assertEqual([bell.BELL_LEFT, bell.BELL_RIGHT, bell.BELL_OFF],
+                     [state for _, state in cadence.GetSteps()])
+    self.assertAlmostEqual(0.2 + bell_audio.MELODY_PAUSE,
+                           cadence.GetDuration(), delta=0.01)
+    self.assertRaises(ValueError, bell_audio.LoadCadence,
+                      self.writeWav([0] * 800))
+
+  def test_Play(self):
+    backend = gpio_simulator.SimulatedBackend(realtime=True)
+    offsets = numpy.arange(10) * 0.005
+    states = numpy.array([bell.BELL_LEFT, bell.BELL_RIGHT] * 5)
+    achieved = bell_audio.Play(bell.Bell(backend), offsets, states)
+    self.assertTrue((achieved >= offsets).all())
+    self.assertLess((achieved - offsets).max(), 0.005)
+    enables = [port for _, port, level in backend.GetOutputs()
+               if port == bell.PORT_RING_ENABLE and level]
+    self.assertEqual(10, len(enables))
+
+if __name__ == '__main__':
+  unittest.main()
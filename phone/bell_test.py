@@ -0,0 +1,98 @@
+import bell
+import gpio_simulator
+import time
+import unittest
+
+class TestBell(unittest.TestCase):
+  def test_Cadence(self):
+    cadence = bell.ParseCadence('0.1 0.2 0.05 1')
+    self.assertEqual([(0, bell.BELL_LEFT), (0.05, bell.BELL_RIGHT),
+                      (0.1, bell.BELL_OFF),
+                      (0.30000000000000004, bell.BELL_LEFT),
+                      (0.35000000000000003, bell.BELL_OFF)],
+                     cadence.GetSteps())
+    self.assertAlmostEqual(1.35, cadence.GetDuration())
+    self.assertEqual(
+      bell.RING_ACTIVE_TIME / bell.RING_PULSE_TIME + 1,
+      len(bell.ParseCadence('standard').GetSteps()))
+    for spec in ['', 'fast', '0.1', '0.1 -1', '0 0']:
+      self.assertRaises(ValueError, bell.ParseCadence, spec)
+      self.assertRaises(ValueError, bell.ValidateCadence, spec)
+
+  def test_ValidateCadence(self):
+    bell.ValidateCadence('double')
+    bell.ValidateCadence('0.4 0.2 0.4 2')
+    # Only checks the file is there, without decoding it.
+    bell.ValidateCadence(bell.AUDIO_PREFIX + __file__)
+    self.assertRaises(ValueError, bell.ValidateCadence,
+                      bell.AUDIO_PREFIX + '/nonexistent.wav')
+
+  def test_LateUpdate(self):
+    backend = gpio_simulator.SimulatedBackend()
+    b = bell.Bell(backend)
+    b.Start(0, 0)
+    b.Update(0.12)
+    # Three half-cycles were due, the bell jumps to the latest.
+    stats = b.GetStats()
+    self.assertEqual(3, stats.GetCount())
+    self.assertEqual(3, stats.GetLate())
+    self.assertAlmostEqual(0.12, stats.GetMaxError())
+    self.assertAlmostEqual(0.15, b.NextDeadline())
+    b.Stop(0.13)
+    self.assertEqual(backend.Now(), b.NextDeadline())
+    b.Update(0.13)
+    self.assertIsNone(b.NextDeadline())
+
+  def test_BellThread(self):
+    backend = gpio_simulator.SimulatedBackend(realtime=True)
+    b = bell.Bell(backend, [bell.ParseCadence('0.2 0.1')])
+    thread = bell.BellThread(b, backend)
+    thread.Start(1)
+    time.sleep(0.32)
+    thread.Close()
+    enables = [t for t, port, level in backend.GetOutputs()
+               if port == bell.PORT_RING_ENABLE and level]
+    # Four half-cycles and off, then the next burst and finally off.
+    self.assertEqual(7, len(enables))
+    self.assertEqual(6, b.GetStats().GetCount())
+    self.assertLess(b.GetStats().GetMaxError(), 0.02)
+
+  def test_BellThreadCloseSwitchesOff(self):
+    def Levels(backend):
+      levels = {}
+      for _, port, level in backend.GetOutputs():
+        levels[port] = level
+      return levels
+    reference = gpio_simulator.SimulatedBackend()
+    b = bell.Bell(reference)
+    b.SetState(bell.BELL_LEFT)
+    b.SetState(bell.BELL_OFF)
+    off = Levels(reference)
+    # Close races with the thread picking up the first half-cycle.
+    for _ in range(300):
+      backend = gpio_simulator.SimulatedBackend(realtime=True)
+      b = bell.Bell(backend)
+      thread = bell.BellThread(b, backend)
+      thread.Start(0)
+      time.sleep(0.0005)
+      thread.Close()
+      self.assertIsNone(b.NextDeadline())
+      # Nothing is written if the thread never got to ring.
+      self.assertIn(Levels(backend), [{}, off])
+
+  def test_BellThreadSeveralBells(self):
+    backend = gpio_simulator.SimulatedBackend(realtime=True)
+    second = bell.RingPins(19, 26, 21)
+    bells = [bell.Bell(backend), bell.Bell(backend, pins=second)]
+    thread = bell.BellThread(bells, backend)
+    thread.Start(0, bell=1)
+    time.sleep(0.12)
+    thread.Close()
+    ports = set(port for _, port, level in backend.GetOutputs() if level)
+    self.assertIn(second.enable, ports)
+    self.assertNotIn(bell.PORT_RING_ENABLE, ports)
+    self.assertEqual(0, bells[0].GetStats().GetCount())
+    self.assertLess(0, bells[1].GetStats().GetCount())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+#
+# Call detail records.
+#
+# Phony records every call: its direction, the number, the provider,
+# how long the call took to set up (from the number being complete to
+# the remote side ringing, or from the bell starting to ring to the
+# handset being lifted), how long it was talked and why it ended.
+#
+# RecordStore takes the records from the main loop into a bounded
+# queue, so the main loop never waits for the SD card. A writer thread
+# inserts them in batches into an append-only SQLite table, indexed by
+# time and number. If the queue is full, records are dropped and
+# counted.
+#
+# Run as a script, it answers questions about the records, e.g.
+#   call_records.py --db /var/lib/phony/calls.db slowest --days 7
+#   call_records.py --db /var/lib/phony/calls.db number 0301234567
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import atexit
+import collections
+import logging
+import os
+import Queue
+import sqlite3
+import threading
+import time
+
+import clock
+
+# Records queued at most.
+DEFAULT_QUEUE_SIZE = 1000
+
+# Records inserted with one transaction at most.
+BATCH_SIZE = 100
+
+# Call directions.
+OUTBOUND = 'out'
+INBOUND = 'in'
+
+# End reasons of calls ended on our side. Calls ended by the remote
+# side or the network carry linphone's message.
+REASON_HANGUP = 'local hangup'
+REASON_CANCELLED = 'cancelled'
+REASON_MISSED = 'missed'
+REASON_REMOTE_HANGUP = 'remote hangup'
+
+# A finished call. start is the wall clock time the number was complete
+# or the call came in. setup and talk are in seconds, None if the call
+# never rang or was never answered.
+Record = collections.namedtuple('Record', [
+  'start', 'direction', 'phone', 'number', 'provider', 'setup', 'talk',
+  'reason'])
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS calls (
+  start REAL NOT NULL,
+  direction TEXT NOT NULL,
+  phone TEXT,
+  number TEXT,
+  provider TEXT,
+  setup REAL,
+  talk REAL,
+  reason TEXT);
+CREATE INDEX IF NOT EXISTS calls_start ON calls (start);
+CREATE INDEX IF NOT EXISTS calls_number ON calls (number, start);
+'''
+
+INSERT = 'INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+
+class Call:
+  ''' Call collects the record of a call in progress. Times are taken
+  from clock.Monotonic, except for the start.'''
+
+  def __init__(self, direction, phone, number, provider=None):
+    self.direction = direction
+    self.phone = phone
+    self.number = number
+    self.provider = provider
+    self.start = time.time()
+    self.started_ = clock.Monotonic()
+    self.rang_ = None
+    self.answered_ = None
+
+  def Rang(self):
+    ''' The remote side rings, or our bell started ringing.'''
+    if self.rang_ is None:
+      self.rang_ = clock.Monotonic()
+
+  def Answered(self):
+    ''' The call was answered, by either side.'''
+    if self.answered_ is None:
+      self.Rang()
+      self.answered_ = clock.Monotonic()
+
+  def IsAnswered(self):
+    return self.answered_ is not None
+
+  def Finish(self, reason):
+    ''' Returns the Record of the call ended for reason.'''
+    now = clock.Monotonic()
+    if self.direction == OUTBOUND:
+      setup = self.rang_ and self.rang_ - self.started_
+    else:
+      # Ours rang right away, it took the handset to set the call up.
+      setup = self.answered_ and self.answered_ - self.started_
+    talk = self.answered_ and now - self.answered_
+    return Record(self.start, self.direction, self.phone, self.number,
+                  self.provider, setup, talk, reason)
+
+class RecordStore:
+  ''' RecordStore writes Records to SQLite from a thread of its own.'''
+
+  def __init__(self, path, queue_size=DEFAULT_QUEUE_SIZE):
+    ''' Construct RecordStore instance and start its writer.
+
+    Args:
+      path: The SQLite database, created if it doesn't exist.
+      queue_size: Records queued at most.
+    '''
+    self.path_ = path
+    self.queue_ = Queue.Queue(queue_size)
+    self.dropped_ = 0
+    # Connect here, so a bad path shows at startup. The writer thread
+    # takes the connection over.
+    self.db_ = Connect(path)
+    self.writer_ = threading.Thread(target=self.write_, name='cdr')
+    self.writer_.daemon = True
+    self.writer_.start()
+    atexit.register(self.Close)
+
+  def Add(self, record):
+    ''' Queue record for writing, never blocks.'''
+    try:
+      self.queue_.put_nowait(record)
+    except Queue.Full:
+      self.dropped_ += 1
+
+  def GetDropped(self):
+    ''' GetDropped returns the records dropped because the queue was
+    full.'''
+    return self.dropped_
+
+  def Flush(self, timeout=None):
+    ''' Wait until the queued records are written.'''
+    done = threading.Event()
+    try:
+      self.queue_.put(done, timeout=timeout)
+    except Queue.Full:
+      return
+    done.wait(timeout)
+
+  def Close(self, timeout=1):
+    ''' Write the queued records and stop the writer.'''
+    if not self.writer_.is_alive():
+      return
+    try:
+      self.queue_.put(None, timeout=timeout)
+    except Queue.Full:
+      return
+    self.writer_.join(timeout)
+
+  def write_(self):
+    ''' The writer thread.'''
+    empty = Queue.Empty
+    stopped = False
+    while not stopped:
+      batch = [self.queue_.get()]
+      while len(batch) < BATCH_SIZE:
+        try:
+          batch.append(self.queue_.get_nowait())
+        except empty:
+          break
+      records = [r for r in batch if isinstance(r, Record)]
+      if records:
+        try:
+          with self.db_:
+            self.db_.executemany(INSERT, records)
+        except sqlite3.Error as e:
+          logging.error('Can\'t write %d call records to %s: %s' % (
+            len(records), self.path_, e))
+      for item in batch:
+        if item is None:
+          stopped = True
+        elif not isinstance(item, Record):
+          # Flush.
+          item.set()
+    self.db_.close()
+
+def Connect(path):
+  ''' Returns a connection to the database at path, creating the table
+  if needed. The connection may move to another thread.'''
+  db = sqlite3.connect(path, check_same_thread=False)
+  db.executescript(SCHEMA)
+  return db
+
+def Query(db, where='', args=(), order='start DESC', limit=20):
+  ''' Returns the Records matching where, in order.'''
+  sql = 'SELECT * FROM calls'
+  if where:
+    sql += ' WHERE ' + where
+  sql += ' ORDER BY %s LIMIT ?' % order
+  return [Record(*row) for row in db.execute(sql, tuple(args) + (limit,))]
+
+def Slowest(db, since, limit=20):
+  ''' Returns the outbound calls since time since with the slowest
+  setup.'''
+  return Query(db, 'start >= ? AND direction = ? AND setup IS NOT NULL',
+               (since, OUTBOUND), 'setup DESC', limit)
+
+def Recent(db, limit=20):
+  ''' Returns the latest calls.'''
+  return Query(db, limit=limit)
+
+def OfNumber(db, number, limit=20):
+  ''' Returns the latest calls from or to number.'''
+  return Query(db, 'number = ?', (number,), limit=limit)
+
+def Format(record):
+  ''' Returns record as a line of a table.'''
+  def Seconds(value):
+    return '-' if value is None else '%.1fs' % value
+  return '{start} {direction:>3} {phone:<10} {number:<16} {provider:<24} ' \
+         '{setup:>7} {talk:>8}  {reason}'.format(
+           start=time.strftime('%Y-%m-%d %H:%M:%S',
+                               time.localtime(record.start)),
+           direction=record.direction, phone=record.phone or '-',
+           number=record.number or '-', provider=record.provider or '-',
+           setup=Seconds(record.setup), talk=Seconds(record.talk),
+           reason=record.reason or '-')
+
+def main():
+  parser = argparse.ArgumentParser(description='Query phony\'s calls.')
+  parser.add_argument('--db', default='/var/lib/phony/calls.db',
+                      help='The call record database, see call_records '
+                      'in phony.conf.')
+  parser.add_argument('--limit', type=int, default=20)
+  commands = parser.add_subparsers(dest='command')
+  commands.add_parser('recent', help='The latest calls.')
+  slowest = commands.add_parser(
+    'slowest', help='Outbound calls with the slowest setup.')
+  slowest.add_argument('--days', type=float, default=7)
+  number = commands.add_parser('number', help='Calls from or to a number.')
+  number.add_argument('number')
+  args = parser.parse_args()
+
+  if not os.path.exists(args.db):
+    parser.error('%s doesn\'t exist.' % args.db)
+  db = Connect(args.db)
+  if args.command == 'recent':
+    records = Recent(db, args.limit)
+  elif args.command == 'slowest':
+    records = Slowest(db, time.time() - args.days * 24 * 3600, args.limit)
+  else:
+    records = OfNumber(db, args.number, args.limit)
+  for record in records:
+    print(Format(record))
+
+if __name__ == '__main__':
+  main()
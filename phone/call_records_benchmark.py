@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+# Call detail record benchmark.
+#
+# Runs the outbound and inbound scenarios of phony_benchmark.py with
+# call records enabled and prints the records Phony wrote. Then compares
+# what recording a call costs the main loop: inserting and committing
+# every record right away, as a synchronous store would, against
+# call_records.RecordStore.Add.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import ConfigParser
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+import clock
+# Installs fake_linphone, so it must come before phony.
+import phony_benchmark
+import call_records
+
+def RunScenarios(path, iterations, number):
+  ''' Place and receive iterations calls with records written to path.'''
+  config = ConfigParser.ConfigParser()
+  username = phony_benchmark.USERNAME
+  config.add_section(username)
+  config.set(username, 'Username', username)
+  config.set(username, 'Password', 'secret')
+  config.set(username, 'Gateway', 'example.com')
+  config.add_section('phony')
+  config.set('phony', 'call_records', path)
+  instance = phony_benchmark.BenchmarkPhony(config)
+  scenario = phony_benchmark.Scenario(instance)
+  errors = []
+  def Play():
+    try:
+      for _ in range(iterations):
+        scenario.Outbound(number)
+        scenario.Inbound()
+    except Exception as e:
+      errors.append(e)
+    finally:
+      instance.loop_.Stop()
+
+  player = threading.Thread(target=Play)
+  player.start()
+  instance.Run()
+  player.join()
+  if errors:
+    raise errors[0]
+
+def Measure(add, records):
+  ''' Returns the sorted durations of add(record) for every record.'''
+  durations = []
+  for record in records:
+    start = clock.Monotonic()
+    add(record)
+    durations.append(clock.Monotonic() - start)
+  return sorted(durations)
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Call detail record benchmark.')
+  parser.add_argument('--iterations', type=int, default=3)
+  parser.add_argument('--number', default='0301234567')
+  parser.add_argument('--records', type=int, default=500)
+  args = parser.parse_args()
+
+  # Keep Phony's logging from dominating the measurement.
+  logging.basicConfig(level=logging.WARNING)
+  directory = tempfile.mkdtemp()
+  try:
+    path = os.path.join(directory, 'scenarios.db')
+    RunScenarios(path, args.iterations, args.number)
+    db = call_records.Connect(path)
+    for record in reversed(call_records.Recent(db)):
+      print(call_records.Format(record))
+    db.close()
+    print('')
+
+    records = [call_records.Record(i, call_records.OUTBOUND, 'hallway',
+                                   args.number, 'example.com', 0.5, 60.0,
+                                   call_records.REASON_HANGUP)
+               for i in range(args.records)]
+    sync = call_records.Connect(os.path.join(directory, 'sync.db'))
+    def AddSync(record):
+      with sync:
+        sync.execute(call_records.INSERT, record)
+    store = call_records.RecordStore(os.path.join(directory, 'async.db'))
+    print('%-8s %10s %10s %10s' % ('store', 'p50', 'p99', 'max'))
+    for name, add in [('sync', AddSync), ('queued', store.Add)]:
+      durations = Measure(add, records)
+      print('%-8s %8.3fms %8.3fms %8.3fms' % (
+        name, durations[len(durations) // 2] * 1000,
+        durations[int(len(durations) * 0.99)] * 1000, durations[-1] * 1000))
+    store.Close()
+    sync.close()
+  finally:
+    shutil.rmtree(directory)
+
+if __name__ == '__main__':
+  main()
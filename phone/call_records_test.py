@@ -0,0 +1,76 @@
+import call_records
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestCall(unittest.TestCase):
+  @mock.patch('clock.Monotonic')
+  def test_Outbound(self, monotonic):
+    monotonic.return_value = 10.0
+    call = call_records.Call(call_records.OUTBOUND, 'hallway', '112',
+                             'gw.example.com')
+    monotonic.return_value = 11.5
+    call.Rang()
+    monotonic.return_value = 14.0
+    call.Answered()
+    monotonic.return_value = 74.0
+    record = call.Finish(call_records.REASON_HANGUP)
+    self.assertEqual(('out', 'hallway', '112', 'gw.example.com', 1.5, 60.0,
+                      'local hangup'), record[1:])
+
+  @mock.patch('clock.Monotonic')
+  def test_Missed(self, monotonic):
+    monotonic.return_value = 10.0
+    call = call_records.Call(call_records.INBOUND, 'hallway', '0301234567',
+                             'user')
+    monotonic.return_value = 70.0
+    record = call.Finish(call_records.REASON_MISSED)
+    self.assertIsNone(record.setup)
+    self.assertIsNone(record.talk)
+
+class TestRecordStore(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'calls.db')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_WriteAndQuery(self):
+    store = call_records.RecordStore(self.path)
+    for i, (number, setup) in enumerate([('110', 0.5), ('112', 2.0),
+                                         ('110', 1.0), ('112', None)]):
+      store.Add(call_records.Record(1000.0 + i, call_records.OUTBOUND,
+                                    'hallway', number, 'gw', setup, None,
+                                    'cancelled'))
+    store.Add(call_records.Record(900.0, call_records.OUTBOUND, 'hallway',
+                                  '110', 'gw', 5.0, None, 'cancelled'))
+    store.Close()
+    self.assertFalse(store.writer_.is_alive())
+
+    db = call_records.Connect(self.path)
+    self.assertEqual([2.0, 1.0, 0.5],
+                     [r.setup for r in call_records.Slowest(db, 1000.0)])
+    self.assertEqual([1002.0, 1000.0, 900.0],
+                     [r.start for r in call_records.OfNumber(db, '110')])
+    self.assertEqual(2, len(call_records.Recent(db, limit=2)))
+
+  def test_QueueFull(self):
+    store = call_records.RecordStore(self.path, queue_size=1)
+    # Keep the writer from taking records off the queue.
+    with store.queue_.mutex:
+      store.queue_.queue.append(None)
+    record = call_records.Record(0.0, call_records.INBOUND, None, '110',
+                                 'user', None, None, 'declined, busy')
+    store.Add(record)
+    self.assertEqual(1, store.GetDropped())
+    # Let the writer stop on the None.
+    with store.queue_.mutex:
+      store.queue_.not_empty.notify()
+    store.writer_.join(1)
+    self.assertFalse(store.writer_.is_alive())
+
+if __name__ == '__main__':
+  unittest.main()
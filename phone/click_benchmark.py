@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# Click onset latency benchmark.
+#
+# Pulses of a dial are fed into a streaming tone sink at 10 pulses per
+# second, the way Phony does when it processes phone_io events. The
+# stream is written to a recorder instead of a sound card, and the onset
+# of every click is located in the recorded audio. We report:
+#  - dispatch: capture of the pulse to the Click call. A click played
+#    with play_local starts this late, plus linphone's player setup.
+#  - onset: capture of the pulse to the click's first frame in the
+#    stream, plus the sound card's constant output latency.
+#  - margin: how long before it was due the period holding the click
+#    was written. Negative values would be audible gaps.
+#
+# With --load, busy threads compete for the interpreter to show how
+# processing delays affect both paths.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import array
+import os
+import random
+import threading
+import time
+
+import clock
+import tones
+
+# Pulses per second of a dial.
+PULSE_RATE = 10
+
+class RecordingSink(tones.StreamSink):
+  ''' A StreamSink recording what it writes and when.'''
+
+  def __init__(self):
+    self.periods_ = []
+    tones.StreamSink.__init__(self)
+
+  def open_(self):
+    pass
+
+  def write_(self, data):
+    self.periods_.append((clock.Monotonic(), data))
+
+  def close_(self):
+    pass
+
+def Busy(stop):
+  while not stop.is_set():
+    sum(range(1000))
+
+def Percentiles(values):
+  values = sorted(values)
+  return tuple(values[min(len(values) - 1, int(len(values) * p / 100))] * 1000
+               for p in [50, 90, 99, 100])
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Click onset latency benchmark.')
+  parser.add_argument('--pulses', type=int, default=100)
+  parser.add_argument('--load', type=int, default=0,
+                      help='Number of busy threads.')
+  args = parser.parse_args()
+
+  pulse = tones.LoadWav('pulse', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'pulse.wav'))
+  samples = array.array('h', pulse.GetPCM())
+  pulse_onset = next(i for i, s in enumerate(samples) if s)
+
+  stop = threading.Event()
+  for _ in range(args.load):
+    t = threading.Thread(target=Busy, args=(stop,))
+    t.daemon = True
+    t.start()
+
+  sink = RecordingSink()
+  mixer = sink.GetMixer()
+  dispatch = []
+  expected = []
+  next_pulse = clock.Monotonic()
+  for _ in range(args.pulses):
+    next_pulse += 1 / PULSE_RATE
+    time.sleep(max(0, next_pulse - clock.Monotonic()))
+    # The pulse traveled through the phone_io pipe before we see it.
+    capture_ts = clock.Monotonic() - random.uniform(0.0002, 0.002)
+    dispatch.append(clock.Monotonic() - capture_ts)
+    sink.Click(pulse, None, capture_ts)
+    expected.append(
+      (capture_ts,
+       mixer.FrameAt(capture_ts + tones.StreamSink.CLICK_DELAY)))
+  time.sleep(4 * tones.StreamSink.LEAD + 0.1)
+  sink.Close()
+  stop.set()
+
+  stream = array.array('h', b''.join(data for _, data in sink.periods_))
+  period_frames = len(sink.periods_[0][1]) // tones.SAMPLE_WIDTH
+  onset = []
+  margin = []
+  late = 0
+  for capture_ts, frame in expected:
+    # Find the click's first sound in the stream, it's silent otherwise.
+    found = next(i for i in range(frame, len(stream)) if stream[i])
+    found -= pulse_onset
+    if found != frame:
+      late += 1
+    onset.append(mixer.TimeOf(found) - capture_ts)
+    written, _ = sink.periods_[found // period_frames]
+    margin.append(mixer.TimeOf(found // period_frames * period_frames) -
+                  written)
+
+  print('%d pulses, %d busy threads, %d clicks late' %
+        (args.pulses, args.load, late))
+  for name, values in [('dispatch', dispatch), ('onset', onset),
+                       ('margin', margin)]:
+    print('%-10s p50=%7.3fms p90=%7.3fms p99=%7.3fms max=%7.3fms' %
+          ((name,) + Percentiles(values)))
+  jitter = Percentiles(onset)
+  print('onset jitter (max - p50): %.3fms' % (jitter[3] - jitter[0]))
+
+if __name__ == '__main__':
+  main()
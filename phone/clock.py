@@ -0,0 +1,63 @@
+# Monotonic clock.
+#
+# Python 2.7 has no time.monotonic(), but all of our timers and
+# deadlines must be immune to wall clock changes (NTP adjusting the
+# clock of a freshly booted Pi is the common case). We therefore read
+# CLOCK_MONOTONIC through clock_gettime directly.
+#
+# coding=utf-8
+
+import ctypes
+import ctypes.util
+import time
+
+# Clock ids on Linux.
+CLOCK_MONOTONIC = 1
+CLOCK_THREAD_CPUTIME_ID = 3
+
+class _Timespec(ctypes.Structure):
+  _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def _LoadClockGettime():
+  ''' Returns the clock_gettime function of the C library or None.'''
+  for name in [ctypes.util.find_library('rt'),
+               ctypes.util.find_library('c')]:
+    if not name:
+      continue
+    try:
+      function = ctypes.CDLL(name, use_errno=True).clock_gettime
+    except (OSError, AttributeError):
+      continue
+    function.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+    return function
+  return None
+
+_clock_gettime = _LoadClockGettime()
+
+def Monotonic():
+  ''' Monotonic returns the current monotonic time in seconds.
+
+  Returns:
+    Seconds as a float. The reference point is arbitrary, so only
+    differences between two values are meaningful.
+  '''
+  if _clock_gettime is None:
+    # Not on Linux. Good enough for development machines.
+    return time.time()
+  return _GetTime(CLOCK_MONOTONIC)
+
+def ThreadCpuTime():
+  ''' ThreadCpuTime returns the CPU time used by the calling thread.
+
+  Returns:
+    Seconds as a float, or the process CPU time where not supported.
+  '''
+  if _clock_gettime is None:
+    return time.clock()
+  return _GetTime(CLOCK_THREAD_CPUTIME_ID)
+
+def _GetTime(clock_id):
+  # Use a fresh struct per call, we are called from several threads.
+  timespec = _Timespec()
+  _clock_gettime(clock_id, ctypes.byref(timespec))
+  return timespec.tv_sec + timespec.tv_nsec * 1e-9
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+#
+# Fleet analysis of dial wear from GPIO traces.
+#
+# Reads the traces phone_io records with --trace (see gpio_trace.py),
+# one per unit, and measures how each dial actually runs:
+#  - pulse rate and break ratio, nominally 10 pulses/s and 60% break,
+#  - contact bounce: how many pulse contact transitions bounce, with how
+#    many extra edges, and how long the bursts last,
+#  - skew of the idle contact: the time from the start of the last
+#    pulse until it closes, nominally the break time,
+#  - pauses between the digits of a number.
+# From these it recommends a noise window (min_signal_dist of
+# GpioSignal) and a dial timeout per unit, and lists the dials due for
+# servicing first.
+#
+# The traces are memory mapped, and all statistics are computed by
+# numpy on whole arrays, so millions of edges take well under a second.
+#
+# Usage: dial_analysis.py [--phone PINS] [--csv] <trace> ...
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import collections
+import csv
+import os
+import sys
+
+import numpy
+
+import gpio_backend
+import gpio_signal
+import gpio_trace
+import phone_io
+import pulse_decoder
+
+# A trace record, see gpio_trace.py.
+TRACE_DTYPE = numpy.dtype([('timestamp', '<u8'), ('pin', 'u1'),
+                           ('level', 'u1')])
+assert TRACE_DTYPE.itemsize == gpio_trace.RECORD_SIZE
+
+# Edges of a pin closer than this in seconds belong to one bounce burst.
+# Breaks and makes of a working dial are much longer.
+BURST_GAP = 0.01
+
+# A pause between two digits longer than this in seconds ends the number.
+MAX_PAUSE = 10
+
+# Dials running outside these limits are due for servicing.
+MIN_RATE = 9
+MAX_RATE = 11
+MIN_BREAK_RATIO = 0.55
+MAX_BREAK_RATIO = 0.7
+# Fraction of the digits with a pulse interval deviating more than
+# pulse_decoder.MAX_INTERVAL_DEVIATION from the digit's mean.
+MAX_IRREGULAR = 0.02
+
+# Digits a unit must have dialed for a verdict.
+MIN_DIGITS = 20
+
+# phony.DIAL_TIMEOUT, which the dial timeout is never recommended below.
+DIAL_TIMEOUT = 2
+# Margin of the dial timeout over the 99th percentile of the pauses.
+TIMEOUT_MARGIN = 1.25
+
+# Statistics of one dial. Times are in seconds, None without data.
+DialStats = collections.namedtuple('DialStats', [
+  'unit', 'edges', 'digits', 'rate', 'break_ratio', 'bouncing', 'bounces',
+  'burst', 'shortest', 'skew', 'pause', 'irregular'])
+
+# What to do about a dial. reasons is empty if it is fine.
+Recommendation = collections.namedtuple('Recommendation', [
+  'min_signal_dist', 'dial_timeout', 'reasons'])
+
+# Level changes of a pin with the bounce bursts collapsed, as arrays.
+Transitions = collections.namedtuple('Transitions', [
+  'time', 'level', 'segment'])
+
+def MapTrace(path):
+  ''' MapTrace returns the files of a trace as read-only memory mapped
+  arrays of TRACE_DTYPE, oldest first.'''
+  maps = []
+  for name in gpio_trace.TraceFiles(path):
+    count = os.path.getsize(name) // gpio_trace.RECORD_SIZE
+    if count:
+      maps.append(numpy.memmap(name, TRACE_DTYPE, 'r', shape=(count,)))
+  return maps
+
+def SelectEdges(maps, pins):
+  ''' Returns the records of pins in maps as arrays (time, pin, level,
+  segment). Time is in seconds since the first record, segment counts
+  the starts of phone_io before a record.'''
+  parts = []
+  base = None
+  segments = 0
+  for records in maps:
+    pin = records['pin']
+    segment = numpy.cumsum(pin == gpio_trace.START_PIN) + segments
+    segments = segment[-1]
+    mine = numpy.in1d(pin, pins)
+    timestamp = records['timestamp'][mine].astype(numpy.int64)
+    if base is None:
+      base = int(records['timestamp'][0])
+    parts.append(((timestamp - base) / 1e9, pin[mine], records['level'][mine],
+                  segment[mine]))
+  if not parts:
+    return (numpy.zeros(0), numpy.zeros(0, numpy.uint8),
+            numpy.zeros(0, numpy.uint8), numpy.zeros(0, numpy.int64))
+  return tuple(numpy.concatenate(column) for column in zip(*parts))
+
+def PinEdges(edges, port):
+  ''' Returns the edges of port as arrays (time, level, segment), without
+  the level phone_io found at its start.'''
+  time, pin, level, segment = edges
+  mine = pin == port
+  time, level, segment = time[mine], level[mine], segment[mine]
+  first = numpy.ones(len(time), bool)
+  first[1:] = segment[1:] != segment[:-1]
+  edge = ~(first & (segment > 0))
+  return time[edge], level[edge], segment[edge]
+
+def Bursts(time, level, segment):
+  ''' Collapse the bounce bursts of a pin.
+
+  Returns:
+    A tuple (transitions, durations, bounces). transitions holds the
+    start and settled level of every burst changing the level. durations
+    and bounces hold the length and extra edges of every burst.
+  '''
+  count = len(time)
+  new = numpy.ones(count, bool)
+  new[1:] = (numpy.diff(time) >= BURST_GAP) | (segment[1:] != segment[:-1])
+  starts = numpy.flatnonzero(new)
+  ends = numpy.append(starts[1:], count) - 1
+  settled = level[ends]
+  burst_segment = segment[starts]
+  changed = numpy.ones(len(starts), bool)
+  changed[1:] = ((settled[1:] != settled[:-1]) |
+                 (burst_segment[1:] != burst_segment[:-1]))
+  transitions = Transitions(time[starts][changed], settled[changed],
+                            burst_segment[changed])
+  return transitions, time[ends] - time[starts], ends - starts
+
+def _Percentile(values, q):
+  if not len(values):
+    return None
+  return float(numpy.percentile(values, q))
+
+def _Median(values):
+  return _Percentile(values, 50)
+
+def Analyze(edges, pins, unit):
+  ''' Analyze computes the DialStats of a dial.
+
+  Args:
+    edges: The edges of a trace, see SelectEdges.
+    pins: The phone_io.PhonePins of the dial.
+    unit: Name of the dial in the report.
+  '''
+  pulse, pulse_durations, pulse_bounces = Bursts(*PinEdges(edges,
+                                                           pins.pulse))
+  idle, idle_durations, _ = Bursts(*PinEdges(edges, pins.idle))
+
+  # The dial is off normal from the idle contact opening (low) until it
+  # closes again. Pulses start when the pulse contact opens (high).
+  before = numpy.searchsorted(idle.time, pulse.time, 'right') - 1
+  opened = numpy.maximum(before, 0)
+  inside = ((before >= 0) & (idle.level[opened] == gpio_backend.LOW) &
+            (idle.segment[opened] == pulse.segment))
+  starts = numpy.flatnonzero(inside & (pulse.level == gpio_backend.HIGH))
+  # Digits are identified by the idle transition they started with.
+  digit = before[starts]
+
+  # Transitions alternate, so a pulse start is followed by its end.
+  ended = starts[(starts + 1 < len(pulse.time))]
+  ended = ended[pulse.segment[ended + 1] == pulse.segment[ended]]
+  breaks = pulse.time[ended + 1] - pulse.time[ended]
+  same = digit[1:] == digit[:-1]
+  periods = numpy.diff(pulse.time[starts])[same]
+  following = starts[1:][same]
+  makes = pulse.time[following] - pulse.time[following - 1]
+
+  ids, first, counts = numpy.unique(digit, return_index=True,
+                                    return_counts=True)
+  last = first + counts - 1
+  # Pulse intervals far off the mean interval of their digit.
+  index = numpy.searchsorted(ids, digit[1:][same])
+  sums = numpy.bincount(index, periods, minlength=len(ids))
+  intervals = numpy.bincount(index, minlength=len(ids))
+  mean = sums / numpy.maximum(intervals, 1)
+  deviating = (numpy.abs(periods / numpy.maximum(mean[index], 1e-9) - 1) >
+               pulse_decoder.MAX_INTERVAL_DEVIATION)
+  irregular = len(numpy.unique(index[deviating]))
+
+  # The idle contact closes with the next idle transition and opens
+  # again for the next digit with the one after.
+  closed = ids + 1
+  closed = closed[closed < len(idle.time)]
+  has_close = idle.segment[closed] == idle.segment[closed - 1]
+  skews = (idle.time[closed[has_close]] -
+           pulse.time[starts[last[:len(closed)][has_close]]])
+  reopened = closed[(closed + 1 < len(idle.time))]
+  reopened = reopened[idle.segment[reopened + 1] == idle.segment[reopened]]
+  pauses = idle.time[reopened + 1] - idle.time[reopened]
+  pauses = pauses[pauses < MAX_PAUSE]
+
+  bouncing = pulse_bounces > 0
+  durations = numpy.concatenate([pulse_durations, idle_durations])
+  durations = durations[durations > 0]
+  shortest = [_Percentile(values, 1) for values in [breaks, makes]
+              if len(values)]
+  rate = break_ratio = None
+  if len(periods):
+    rate = 1 / _Median(periods)
+    break_ratio = _Median(breaks) * rate
+  return DialStats(
+    unit=unit, edges=len(pulse_durations) + len(idle_durations),
+    digits=len(ids), rate=rate, break_ratio=break_ratio,
+    bouncing=float(numpy.mean(bouncing)) if len(bouncing) else None,
+    bounces=(float(numpy.mean(pulse_bounces[bouncing]))
+             if bouncing.any() else 0),
+    burst=_Percentile(durations, 99) or 0,
+    shortest=min(shortest) if shortest else None,
+    skew=_Median(skews), pause=_Percentile(pauses, 99),
+    irregular=irregular / len(ids) if len(ids) else None)
+
+def Recommend(stats):
+  ''' Recommend returns the Recommendation for a dial's DialStats.'''
+  if stats.digits < MIN_DIGITS:
+    return Recommendation(None, None, ['only %d digits' % stats.digits])
+  reasons = []
+  # Cover the bursts like pulse_decoder.AdaptiveDecoder widens its
+  # window, rounded up to half a millisecond.
+  window = max(gpio_signal.DEFAULT_SIGNAL_DIST,
+               numpy.ceil(stats.burst * pulse_decoder.WINDOW_MARGIN * 2000) /
+               2000)
+  limit = pulse_decoder.MAX_WINDOW
+  if stats.shortest:
+    limit = min(limit, pulse_decoder.WINDOW_FRACTION * stats.shortest)
+  if window > limit:
+    reasons.append('bounce %.1fms' % (stats.burst * 1000))
+    window = max(gpio_signal.DEFAULT_SIGNAL_DIST,
+                 numpy.floor(limit * 2000 + 1e-6) / 2000)
+  if stats.rate is not None and stats.rate < MIN_RATE:
+    reasons.append('slow %.1f/s' % stats.rate)
+  elif stats.rate is not None and stats.rate > MAX_RATE:
+    reasons.append('fast %.1f/s' % stats.rate)
+  if stats.break_ratio is not None and not (
+      MIN_BREAK_RATIO <= stats.break_ratio <= MAX_BREAK_RATIO):
+    reasons.append('break %.0f%%' % (stats.break_ratio * 100))
+  if stats.irregular > MAX_IRREGULAR:
+    reasons.append('irregular %.0f%%' % (stats.irregular * 100))
+  timeout = DIAL_TIMEOUT
+  if stats.pause is not None:
+    timeout = max(timeout, numpy.ceil(stats.pause * TIMEOUT_MARGIN * 10) / 10)
+  return Recommendation(float(window), float(timeout), reasons)
+
+def AnalyzeFleet(paths, phones=None):
+  ''' AnalyzeFleet returns (DialStats, Recommendation) for the dials of
+  all traces in paths, the ones due for servicing first.
+
+  Args:
+    paths: Trace files, one per unit. The unit is named after the file.
+    phones: List of phone_io.PhonePins of the phones of every unit.
+      Defaults to a single phone on phone_io.DEFAULT_PINS.
+  '''
+  phones = phones or [phone_io.DEFAULT_PINS]
+  pins = sorted(set(p for pins in phones for p in [pins.pulse, pins.idle]))
+  results = []
+  for path in paths:
+    unit = os.path.splitext(os.path.basename(path))[0]
+    edges = SelectEdges(MapTrace(path), pins)
+    for i, phone in enumerate(phones):
+      name = unit if len(phones) == 1 else '%s/%d' % (unit, i)
+      stats = Analyze(edges, phone, name)
+      results.append((stats, Recommend(stats)))
+  results.sort(key=lambda r: (r[1].min_signal_dist is None,
+                              -len(r[1].reasons), -r[0].burst))
+  return results
+
+COLUMNS = ['unit', 'digits', 'rate/s', 'break', 'bouncing', 'bounces',
+           'burst99', 'skew', 'pause99', 'window', 'timeout', 'service']
+
+def _Format(value, format, scale=1):
+  if value is None:
+    return '-'
+  return format % (value * scale)
+
+def Row(stats, recommendation):
+  ''' Row returns the report columns of a dial as strings.'''
+  return [stats.unit, str(stats.digits),
+          _Format(stats.rate, '%.1f'),
+          _Format(stats.break_ratio, '%.0f%%', 100),
+          _Format(stats.bouncing, '%.0f%%', 100),
+          _Format(stats.bounces, '%.1f'),
+          _Format(stats.burst, '%.1fms', 1000),
+          _Format(stats.skew, '%.0fms', 1000),
+          _Format(stats.pause, '%.1fs'),
+          _Format(recommendation.min_signal_dist, '%.1fms', 1000),
+          _Format(recommendation.dial_timeout, '%.1fs'),
+          ', '.join(recommendation.reasons) or 'ok']
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Analyze dial wear from the GPIO traces of many units.')
+  parser.add_argument('traces', nargs='+', metavar='trace',
+                      help='Trace file of a unit, rotated files are '
+                      'included.')
+  parser.add_argument('--phone', action='append', default=[],
+                      type=phone_io.ParsePins,
+                      help='Pins of a phone as for phone_io.py, the same '
+                      'on every unit.')
+  parser.add_argument('--csv', action='store_true',
+                      help='Write the report as CSV.')
+  args = parser.parse_args()
+
+  rows = [Row(*result) for result in AnalyzeFleet(args.traces, args.phone)]
+  if args.csv:
+    writer = csv.writer(sys.stdout)
+    writer.writerow(COLUMNS)
+    writer.writerows(rows)
+    return
+  widths = [max(len(row[i]) for row in rows + [COLUMNS])
+            for i in range(len(COLUMNS) - 1)]
+  for row in [COLUMNS] + rows:
+    print('  '.join([row[0].ljust(widths[0])] +
+                    [c.rjust(w) for c, w in zip(row[1:-1], widths[1:])] +
+                    [row[-1]]))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# Benchmark of the dial fleet analysis.
+#
+# Writes GPIO traces for a fleet of units whose dials have aged
+# differently (pulse rate, break ratio, contact bounce, pauses between
+# digits drawn at random per unit), analyzes them with dial_analysis.py
+# and prints the report and the analysis throughput. For comparison, the
+# traces are also loaded record by record with gpio_trace.ReadTrace.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import dial_analysis
+import gpio_backend
+import gpio_simulator
+import gpio_trace
+import phone_io
+
+def WriteFleet(directory, units, numbers, seed):
+  ''' Write a trace per unit, returns their paths and the edge count.'''
+  rng = random.Random(seed)
+  paths = []
+  count = 0
+  for unit in range(units):
+    path = os.path.join(directory, 'unit%03d.trace' % unit)
+    worn = rng.random() < 0.3
+    period = rng.uniform(0.085, 0.13 if worn else 0.11)
+    break_ratio = rng.uniform(0.55, 0.75 if worn else 0.65)
+    bounces = rng.randint(0, 4 if worn else 2)
+    bounce_time = rng.uniform(0.0003, 0.005 if worn else 0.001)
+    trace = gpio_trace.TraceWriter(path)
+    trace.Start(0)
+    trace.Edge(0, phone_io.PORT_PULSE, gpio_backend.LOW)
+    trace.Edge(0, phone_io.PORT_IDLE, gpio_backend.HIGH)
+    start = 1.0
+    for _ in range(numbers):
+      number = ''.join(rng.choice('0123456789') for _ in range(10))
+      edges, end = gpio_simulator.DialEdges(
+        number, start, phone_io.PORT_PULSE, phone_io.PORT_IDLE,
+        pulse_period=period, break_ratio=break_ratio,
+        digit_pause=rng.uniform(0.3, 1.5), bounces=bounces,
+        bounce_time=bounce_time)
+      for edge_time, port, level in sorted(edges):
+        trace.Edge(edge_time, port, level)
+      trace.Flush()
+      count += len(edges)
+      start = end + rng.uniform(30, 3600)
+    trace.Close()
+    paths.append(path)
+  return paths, count
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Benchmark of the dial fleet analysis.')
+  parser.add_argument('--units', type=int, default=20)
+  parser.add_argument('--numbers', type=int, default=200)
+  parser.add_argument('--seed', type=int, default=1)
+  args = parser.parse_args()
+
+  directory = tempfile.mkdtemp()
+  try:
+    paths, count = WriteFleet(directory, args.units, args.numbers,
+                              args.seed)
+    start = time.time()
+    results = dial_analysis.AnalyzeFleet(paths)
+    analysis = time.time() - start
+    for row in [dial_analysis.COLUMNS] + [dial_analysis.Row(*r)
+                                          for r in results]:
+      print(' '.join(c.rjust(9) for c in row[:-1]) + ' ' + row[-1])
+    print('')
+    print('analysis: %d edges of %d units in %.3fs, %.1fM edges/s' % (
+      count, args.units, analysis, count / analysis / 1e6))
+    start = time.time()
+    for path in paths:
+      gpio_trace.ReadTrace(path)
+    read = time.time() - start
+    print('ReadTrace alone: %.3fs, %.1fM edges/s' % (
+      read, count / read / 1e6))
+  finally:
+    shutil.rmtree(directory)
+
+if __name__ == '__main__':
+  main()
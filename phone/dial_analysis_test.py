@@ -0,0 +1,79 @@
+import dial_analysis
+import gpio_backend
+import gpio_simulator
+import gpio_trace
+import os
+import phone_io
+import shutil
+import tempfile
+import unittest
+
+class TestDialAnalysis(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def writeTrace(self, unit, numbers=3, **kwargs):
+    ''' Record dialing numbers numbers of 10 digits in a trace.'''
+    path = os.path.join(self.dir, unit + '.trace')
+    trace = gpio_trace.TraceWriter(path)
+    trace.Start(0)
+    trace.Edge(0, phone_io.PORT_PULSE, gpio_backend.LOW)
+    trace.Edge(0, phone_io.PORT_IDLE, gpio_backend.HIGH)
+    edges = []
+    start = 1.0
+    for _ in range(numbers):
+      number_edges, end = gpio_simulator.DialEdges(
+        '1234567890', start, phone_io.PORT_PULSE, phone_io.PORT_IDLE,
+        **kwargs)
+      edges += number_edges
+      start = end + 20
+    for time, port, level in sorted(edges):
+      trace.Edge(time, port, level)
+    trace.Close()
+    return path
+
+  def test_Nominal(self):
+    path = self.writeTrace('hallway', pulse_period=0.1, break_ratio=0.6,
+                           digit_pause=0.8, idle_skew=0.05, bounces=2,
+                           bounce_time=0.001)
+    [(stats, recommendation)] = dial_analysis.AnalyzeFleet([path])
+    self.assertEqual('hallway', stats.unit)
+    self.assertEqual(30, stats.digits)
+    self.assertAlmostEqual(10, stats.rate, places=3)
+    self.assertAlmostEqual(0.6, stats.break_ratio, places=3)
+    self.assertEqual(1, stats.bouncing)
+    self.assertEqual(4, stats.bounces)
+    self.assertAlmostEqual(0.004, stats.burst, places=6)
+    self.assertAlmostEqual(0.05, stats.skew, places=6)
+    # From the idle contact closing 50ms into the last break.
+    self.assertAlmostEqual(0.85, stats.pause, places=6)
+    self.assertEqual(0, stats.irregular)
+    self.assertEqual([], recommendation.reasons)
+    self.assertAlmostEqual(0.005, recommendation.min_signal_dist)
+    self.assertEqual(2, recommendation.dial_timeout)
+
+  def test_Worn(self):
+    worn = self.writeTrace('attic', pulse_period=0.125, break_ratio=0.72,
+                           digit_pause=1.8, bounces=3, bounce_time=0.004)
+    fine = self.writeTrace('hallway')
+    results = dial_analysis.AnalyzeFleet([fine, worn])
+    stats, recommendation = results[0]
+    self.assertEqual('attic', stats.unit)
+    self.assertEqual(['bounce 24.0ms', 'slow 8.0/s', 'break 72%'],
+                     recommendation.reasons)
+    # Half the 35ms make, a window covering the bursts would be too wide.
+    self.assertAlmostEqual(0.0175, recommendation.min_signal_dist)
+    self.assertAlmostEqual(2.3, recommendation.dial_timeout)
+    self.assertEqual([], results[1][1].reasons)
+
+  def test_NotEnoughDigits(self):
+    path = self.writeTrace('cellar', numbers=1)
+    [(_, recommendation)] = dial_analysis.AnalyzeFleet([path])
+    self.assertEqual(['only 10 digits'], recommendation.reasons)
+    self.assertIsNone(recommendation.min_signal_dist)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,159 @@
+# Dial plan.
+#
+# Decides after every digit whether the number dialed so far is
+# complete, needs more digits or can't be dialed at all, so calls to
+# numbers of known length go out without waiting for the dial timeout.
+#
+# A dial plan is a list of patterns made of
+#   '0' - '9': That digit.
+#   'X':       Any digit.
+#   '.':       At the end only: any number of further digits, including
+#              none. Such numbers are complete when the timeout expires.
+# e.g. '110', '112', '2XX' for internal extensions or '0.' for anything
+# starting with 0. Every pattern can have its own timeout and gateway.
+#
+# Patterns are compiled into a prefix trie whose edges are digits or
+# 'X'. Dialing walks the trie one digit at a time, keeping the set of
+# nodes the digits so far lead to, which is a handful even for large
+# plans.
+#
+# coding=utf-8
+
+import collections
+
+# Results of Classify.
+DIAL_COMPLETE = 'complete' # Dial now.
+DIAL_MORE = 'more'         # Wait for more digits or the timeout.
+DIAL_INVALID = 'invalid'   # No pattern can match anymore.
+
+# A pattern of the plan. timeout and gateway are None for the defaults
+# of the caller. index is the position in the plan, the first matching
+# pattern wins.
+Pattern = collections.namedtuple('Pattern', ['pattern', 'timeout',
+                                             'gateway', 'index'])
+
+# The outcome of the digits dialed so far. pattern is the pattern the
+# number matches, None if it doesn't match yet.
+Result = collections.namedtuple('Result', ['status', 'pattern'])
+
+# A plan accepting everything, complete after the caller's timeout.
+OPEN_PLAN = ['.']
+
+class _Node:
+  ''' A trie node: the digits dialed so far match a prefix of the
+  patterns passing through it.'''
+
+  def __init__(self):
+    # {digit or 'X': _Node}
+    self.children_ = {}
+    # Pattern matching exactly the digits leading here, or None.
+    self.complete_ = None
+    # Pattern matching the digits leading here followed by any digits.
+    self.open_ = None
+
+class DialPlan:
+  ''' DialPlan is a compiled set of patterns.'''
+
+  def __init__(self, patterns=None):
+    ''' Construct DialPlan instance.
+
+    Args:
+      patterns: Patterns as strings or (pattern, timeout, gateway)
+                tuples. See Add.
+    '''
+    self.root_ = _Node()
+    self.count_ = 0
+    for p in patterns or []:
+      if isinstance(p, basestring):
+        self.Add(p)
+      else:
+        self.Add(*p)
+
+  def Add(self, pattern, timeout=None, gateway=None):
+    ''' Add a pattern.
+
+    Args:
+      pattern: See above. Case doesn't matter.
+      timeout: Seconds after the last digit a matching number is
+               complete at, unless the number can't be any longer.
+      gateway: Gateway to call matching numbers through.
+
+    Raises:
+      ValueError: pattern is malformed.
+    '''
+    spec = pattern.upper()
+    is_open = spec.endswith('.')
+    if is_open:
+      spec = spec[:-1]
+    if not (spec or is_open) or not all(c.isdigit() or c == 'X'
+                                        for c in spec):
+      raise ValueError('Invalid dial plan pattern %r' % pattern)
+    p = Pattern(pattern, timeout, gateway, self.count_)
+    self.count_ += 1
+    node = self.root_
+    for c in spec:
+      node = node.children_.setdefault(c, _Node())
+    if is_open:
+      if node.open_ is None:
+        node.open_ = p
+    elif node.complete_ is None:
+      node.complete_ = p
+
+  def Start(self):
+    ''' Start returns the state before the first digit.'''
+    return (self.root_,)
+
+  def Step(self, state, digit):
+    ''' Step returns the state after dialing digit in state.'''
+    nodes = []
+    for node in state:
+      for key in (digit, 'X'):
+        child = node.children_.get(key)
+        if child is not None and child not in nodes:
+          nodes.append(child)
+      # Open patterns take any further digits.
+      if node.open_ is not None and node not in nodes:
+        nodes.append(node)
+    return tuple(nodes)
+
+  def Classify(self, state):
+    ''' Classify returns the Result of the digits leading to state.'''
+    if not state:
+      return Result(DIAL_INVALID, None)
+    match = None
+    more = False
+    for node in state:
+      for p in (node.complete_, node.open_):
+        if p is not None and (match is None or p.index < match.index):
+          match = p
+      if node.children_ or node.open_ is not None:
+        more = True
+    if match is not None and not more:
+      return Result(DIAL_COMPLETE, match)
+    return Result(DIAL_MORE, match)
+
+  def Match(self, number):
+    ''' Match returns the Result of dialing number.'''
+    state = self.Start()
+    for digit in number:
+      state = self.Step(state, digit)
+    return self.Classify(state)
+
+def ParseOptions(value):
+  ''' Returns (timeout, gateway) of the options of a pattern in the
+  config, e.g. 'timeout=0.5 gateway=sip.example.com'.
+
+  Raises:
+    ValueError: value is malformed.
+  '''
+  timeout = None
+  gateway = None
+  for item in value.split():
+    key, _, option = item.partition('=')
+    if key == 'timeout':
+      timeout = float(option)
+    elif key == 'gateway' and option:
+      gateway = option
+    else:
+      raise ValueError('Invalid dial plan option %r' % item)
+  return timeout, gateway
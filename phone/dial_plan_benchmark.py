@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# Post-dial delay benchmark of the dial plan.
+#
+# Dials numbers of known length through BenchmarkPhony (see
+# phony_benchmark.py), once without a dial plan, where every number
+# waits for DIAL_TIMEOUT, and once with a plan knowing their lengths.
+# The post-dial delay is the time from the last pulse to the INVITE.
+# We also report how long classifying a digit takes.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import ConfigParser
+import logging
+import threading
+import timeit
+
+# Installs fake_linphone, so it must come before phony.
+import phony_benchmark
+import dial_plan
+import phony
+
+# Patterns of the plan and numbers dialed.
+PLAN = [('110', ''), ('112', ''), ('2XX', ''), ('0XXXXXXXXX', ''),
+        ('00.', 'timeout=3')]
+NUMBERS = ['112', '250', '0301234567']
+
+def RunDialing(with_plan, iterations):
+  ''' Returns {number: [post-dial delays]} of dialing NUMBERS.'''
+  config = ConfigParser.ConfigParser()
+  config.add_section(phony_benchmark.USERNAME)
+  for option, value in [('Username', phony_benchmark.USERNAME),
+                        ('Password', 'secret'), ('Gateway', 'example.com')]:
+    config.set(phony_benchmark.USERNAME, option, value)
+  if with_plan:
+    config.add_section(phony.DIAL_PLAN_SECTION)
+    for pattern, options in PLAN:
+      config.set(phony.DIAL_PLAN_SECTION, pattern, options)
+  instance = phony_benchmark.BenchmarkPhony(config)
+  delays = {}
+  errors = []
+  def Play():
+    try:
+      for _ in range(iterations):
+        for number in NUMBERS:
+          scenario = phony_benchmark.Scenario(instance)
+          scenario.Outbound(number)
+          delays.setdefault(number, []).extend(
+            scenario.latencies_['last_pulse_to_invite'])
+    except Exception as e:
+      errors.append(e)
+    finally:
+      instance.loop_.Stop()
+  player = threading.Thread(target=Play)
+  player.start()
+  instance.Run()
+  player.join()
+  if errors:
+    raise errors[0]
+  return delays
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Post-dial delay benchmark of the dial plan.')
+  parser.add_argument('--iterations', type=int, default=2)
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.WARNING)
+  without = RunDialing(False, args.iterations)
+  with_plan = RunDialing(True, args.iterations)
+  print('%-12s %16s %16s' % ('number', 'no plan', 'dial plan'))
+  for number in NUMBERS:
+    print('%-12s %14.1fms %14.1fms' % (
+      number, 1000 * sum(without[number]) / len(without[number]),
+      1000 * sum(with_plan[number]) / len(with_plan[number])))
+
+  plan = dial_plan.DialPlan([p for p, _ in PLAN])
+  repeat = 10000
+  step = timeit.timeit(lambda: plan.Classify(plan.Step(plan.Start(), '0')),
+                       number=repeat) / repeat
+  print('Step + Classify: %.1fus per digit' % (step * 1e6))
+
+if __name__ == '__main__':
+  main()
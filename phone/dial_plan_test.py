@@ -0,0 +1,58 @@
+import dial_plan
+import unittest
+
+class TestDialPlan(unittest.TestCase):
+  def setUp(self):
+    self.plan = dial_plan.DialPlan([
+      '110', '112',
+      ('2XX', None, 'pbx.example.com'),
+      ('0XXXXXXXXX', None, None),
+      ('00.', 3, 'intl.example.com'),
+      '11833'])
+
+  def status(self, number):
+    return self.plan.Match(number).status
+
+  def test_Complete(self):
+    for number in ['110', '112', '250', '0301234567', '11833']:
+      self.assertEqual(dial_plan.DIAL_COMPLETE, self.status(number))
+    self.assertEqual('pbx.example.com',
+                     self.plan.Match('250').pattern.gateway)
+
+  def test_More(self):
+    result = self.plan.Match('11')
+    self.assertEqual(dial_plan.DIAL_MORE, result.status)
+    self.assertIsNone(result.pattern)
+    self.assertEqual(dial_plan.DIAL_MORE, self.status('030'))
+
+  def test_OpenPattern(self):
+    for number in ['00', '0044', '00441234567890']:
+      result = self.plan.Match(number)
+      self.assertEqual(dial_plan.DIAL_MORE, result.status)
+      self.assertEqual('00.', result.pattern.pattern)
+      self.assertEqual(3, result.pattern.timeout)
+
+  def test_Invalid(self):
+    for number in ['3', '113', '2501', '03012345678']:
+      self.assertEqual(dial_plan.DIAL_INVALID, self.status(number))
+
+  def test_FirstPatternWins(self):
+    plan = dial_plan.DialPlan([('1X', 1, 'a'), ('12', 2, 'b')])
+    self.assertEqual('a', plan.Match('12').pattern.gateway)
+
+  def test_OpenPlan(self):
+    plan = dial_plan.DialPlan(dial_plan.OPEN_PLAN)
+    result = plan.Match('0301234567')
+    self.assertEqual(dial_plan.DIAL_MORE, result.status)
+    self.assertIsNone(result.pattern.timeout)
+
+  def test_Errors(self):
+    for pattern in ['', '1.2', 'abc', '1*']:
+      self.assertRaises(ValueError, dial_plan.DialPlan, [pattern])
+    self.assertEqual((0.5, 'gw'),
+                     dial_plan.ParseOptions('timeout=0.5 gateway=gw'))
+    self.assertEqual((None, None), dial_plan.ParseOptions(''))
+    self.assertRaises(ValueError, dial_plan.ParseOptions, 'speed=1')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,158 @@
+# Event loop
+#
+# A small select based event loop. It multiplexes readable file
+# descriptors and timers, and sleeps until either a descriptor becomes
+# readable or the earliest timer is due. Nothing is polled.
+#
+# Other threads hand work to the loop with CallFromThread, which wakes
+# it through a pipe.
+#
+# coding=utf-8
+
+import collections
+import errno
+import heapq
+import os
+import select
+import threading
+
+import clock
+
+class Timer:
+  ''' Timer is the handle of a scheduled callback.
+
+  Timers are returned by EventLoop.CallAt and EventLoop.CallLater and
+  can be cancelled until they fire.
+  '''
+
+  def __init__(self, deadline, callback):
+    self.deadline_ = deadline
+    self.callback_ = callback
+    self.cancelled_ = False
+
+  def Cancel(self):
+    ''' Cancel the timer. Cancelling a timer that already fired is a no-op.'''
+    self.cancelled_ = True
+
+  def GetDeadline(self):
+    ''' GetDeadline returns the monotonic time the timer fires at.'''
+    return self.deadline_
+
+class EventLoop:
+  ''' EventLoop dispatches callbacks for readable file descriptors
+  and expired timers.
+
+  All callbacks run on the thread calling Run, so they never race
+  with each other. Only CallFromThread may be called from other threads.
+  '''
+
+  def __init__(self):
+    # {fd: callback}
+    self.readers_ = {}
+    # Min-heap of (deadline, sequence, timer). The sequence number keeps
+    # timers with the same deadline in scheduling order.
+    self.timers_ = []
+    self.sequence_ = 0
+    self.quit_ = False
+    # Callbacks passed in by other threads, and the pipe waking us up for
+    # them.
+    self.lock_ = threading.Lock()
+    self.calls_ = collections.deque()
+    self.wakeup_ = os.pipe()
+    self.readers_[self.wakeup_[0]] = self.runCalls_
+
+  def AddReader(self, fd, callback):
+    ''' Call callback() whenever fd becomes readable.
+
+    Args:
+      fd: A file descriptor or an object with a fileno() method.
+      callback: Function without arguments.
+    '''
+    if hasattr(fd, 'fileno'):
+      fd = fd.fileno()
+    self.readers_[fd] = callback
+
+  def RemoveReader(self, fd):
+    ''' Stop watching fd. Unknown descriptors are ignored.'''
+    if hasattr(fd, 'fileno'):
+      fd = fd.fileno()
+    self.readers_.pop(fd, None)
+
+  def CallAt(self, deadline, callback):
+    ''' Schedule callback() at the specified monotonic time.
+
+    Args:
+      deadline: Monotonic time in seconds, see clock.Monotonic.
+      callback: Function without arguments.
+    Returns:
+      A Timer that can be used to cancel the callback.
+    '''
+    timer = Timer(deadline, callback)
+    self.sequence_ += 1
+    heapq.heappush(self.timers_, (deadline, self.sequence_, timer))
+    return timer
+
+  def CallLater(self, delay, callback):
+    ''' Schedule callback() delay seconds from now. See CallAt.'''
+    return self.CallAt(clock.Monotonic() + delay, callback)
+
+  def CallFromThread(self, callback):
+    ''' Schedule callback() as soon as possible. Unlike the other
+    methods, this may be called from any thread.'''
+    with self.lock_:
+      self.calls_.append(callback)
+      os.write(self.wakeup_[1], b'c')
+
+  def NextDeadline(self):
+    ''' NextDeadline returns the deadline of the earliest pending timer,
+    or None if there is none.'''
+    while self.timers_ and self.timers_[0][2].cancelled_:
+      heapq.heappop(self.timers_)
+    if not self.timers_:
+      return None
+    return self.timers_[0][0]
+
+  def RunOnce(self):
+    ''' Wait for the next event and dispatch all callbacks that are due.'''
+    deadline = self.NextDeadline()
+    timeout = None
+    if deadline is not None:
+      timeout = max(0, deadline - clock.Monotonic())
+    try:
+      readable, _, _ = select.select(list(self.readers_), [], [], timeout)
+    except select.error as e:
+      # A signal handler ran. Let the caller check whether we should quit.
+      if e.args[0] != errno.EINTR:
+        raise
+      return
+    for fd in readable:
+      # A previous callback might have removed the reader.
+      callback = self.readers_.get(fd)
+      if callback:
+        callback()
+    self.runTimers_(clock.Monotonic())
+
+  def Run(self):
+    ''' Run dispatches events until Stop is called.'''
+    self.quit_ = False
+    while not self.quit_:
+      self.RunOnce()
+
+  def Stop(self):
+    ''' Stop makes Run return. Safe to call from signal handlers.'''
+    self.quit_ = True
+
+  def runCalls_(self):
+    ''' Run the callbacks passed in with CallFromThread.'''
+    os.read(self.wakeup_[0], 4096)
+    while self.calls_:
+      self.calls_.popleft()()
+
+  def runTimers_(self, now):
+    ''' Fire all timers that are due at time now.'''
+    while self.timers_ and self.timers_[0][0] <= now:
+      _, _, timer = heapq.heappop(self.timers_)
+      if not timer.cancelled_:
+        # Mark as done, so a late Cancel() is harmless.
+        timer.cancelled_ = True
+        timer.callback_()
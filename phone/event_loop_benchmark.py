@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#
+# Compares the original sleep polling main loop of Phony with the
+# select based event loop.
+#
+# Two numbers are measured for both variants:
+#  - CPU time used while the phone is idle, as a percentage of one core.
+#  - Latency from a byte being written to the phone_io pipe until the
+#    input callback sees it.
+#
+# The linphone core is replaced by a no-op, so the numbers describe the
+# loop itself and not the SIP stack.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import fcntl
+import os
+import random
+import threading
+import time
+
+import clock
+import event_loop
+
+# Sleep time of the original polling loop.
+POLL_SLEEP_TIME = 0.03
+
+# Mirrors phony.CORE_IDLE_ITERATE_INTERVAL. We can't import phony here,
+# because it requires linphone.
+CORE_IDLE_ITERATE_INTERVAL = 0.1
+
+def RunPolling(read_fd, on_input, duration):
+  ''' The original Phony.Run loop with a no-op core.'''
+  stop_time = clock.Monotonic() + duration
+  while clock.Monotonic() < stop_time:
+    # core_.iterate() would go here.
+    try:
+      data = os.read(read_fd, 4096)
+    except OSError:
+      data = ''
+    for i in data:
+      on_input(i)
+    time.sleep(POLL_SLEEP_TIME)
+
+def RunEventLoop(read_fd, on_input, duration):
+  ''' The event loop with a no-op core iterated at the idle cadence.'''
+  loop = event_loop.EventLoop()
+
+  def Iterate():
+    # core_.iterate() would go here.
+    loop.CallLater(CORE_IDLE_ITERATE_INTERVAL, Iterate)
+
+  def Read():
+    for i in os.read(read_fd, 4096):
+      on_input(i)
+
+  loop.AddReader(read_fd, Read)
+  loop.CallLater(duration, loop.Stop)
+  Iterate()
+  loop.Run()
+
+def MeasureIdleCpu(runner, duration):
+  ''' Returns CPU usage in percent of one core while no input arrives.'''
+  read_fd, write_fd = os.pipe()
+  SetNonBlocking(read_fd)
+  start = os.times()
+  runner(read_fd, lambda i: None, duration)
+  end = os.times()
+  os.close(read_fd)
+  os.close(write_fd)
+  cpu = (end[0] - start[0]) + (end[1] - start[1])
+  return 100 * cpu / duration
+
+def MeasureLatency(runner, samples):
+  ''' Returns a sorted list of input to callback latencies in seconds.'''
+  read_fd, write_fd = os.pipe()
+  SetNonBlocking(read_fd)
+  sent = []
+  latencies = []
+
+  def OnInput(i):
+    latencies.append(clock.Monotonic() - sent[len(latencies)])
+
+  def Writer():
+    for _ in range(samples):
+      # Random spacing, so we sample all phases of the polling cycle.
+      time.sleep(random.uniform(0.02, 0.07))
+      sent.append(clock.Monotonic())
+      os.write(write_fd, 'p')
+
+  writer = threading.Thread(target=Writer)
+  writer.start()
+  runner(read_fd, OnInput, samples * 0.07 + 0.5)
+  writer.join()
+  os.close(read_fd)
+  os.close(write_fd)
+  return sorted(latencies)
+
+def SetNonBlocking(fd):
+  ''' Make reads from fd return immediately, as Phony does.'''
+  flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+  fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+def Percentile(values, p):
+  ''' Returns the p-th percentile of the sorted list values.'''
+  if not values:
+    return float('nan')
+  return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Compare idle CPU and input latency of the main loops.')
+  parser.add_argument('--idle_seconds', type=float, default=10)
+  parser.add_argument('--samples', type=int, default=200)
+  args = parser.parse_args()
+
+  for name, runner in [('polling', RunPolling),
+                       ('event_loop', RunEventLoop)]:
+    cpu = MeasureIdleCpu(runner, args.idle_seconds)
+    latencies = MeasureLatency(runner, args.samples)
+    print('%-10s idle_cpu=%.3f%% latency_ms p50=%.3f p90=%.3f p99=%.3f '
+          'max=%.3f' % (name, cpu,
+                        Percentile(latencies, 50) * 1000,
+                        Percentile(latencies, 90) * 1000,
+                        Percentile(latencies, 99) * 1000,
+                        latencies[-1] * 1000))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,57 @@
+import event_loop
+import mock
+import os
+import threading
+import unittest
+
+class TestEventLoop(unittest.TestCase):
+  def test_TimerOrder(self):
+    m = mock.Mock()
+    loop = event_loop.EventLoop()
+    loop.CallLater(0.02, m.second)
+    loop.CallLater(0.01, m.first)
+    cancelled = loop.CallLater(0.01, m.cancelled)
+    cancelled.Cancel()
+    loop.CallLater(0.03, loop.Stop)
+    loop.Run()
+    self.assertEqual([mock.call.first(), mock.call.second()], m.mock_calls)
+    self.assertEqual(None, loop.NextDeadline())
+
+  def test_Reader(self):
+    m = mock.Mock()
+    loop = event_loop.EventLoop()
+    read_fd, write_fd = os.pipe()
+
+    def Read():
+      m.read(os.read(read_fd, 10))
+      loop.RemoveReader(read_fd)
+      loop.Stop()
+
+    loop.AddReader(read_fd, Read)
+    os.write(write_fd, b'p')
+    # Must not be reached, the reader stops the loop first.
+    timeout = loop.CallLater(10, m.timeout)
+    loop.Run()
+    m.read.assert_called_once_with(b'p')
+    m.timeout.assert_not_called()
+    self.assertEqual(timeout.GetDeadline(), loop.NextDeadline())
+    os.close(read_fd)
+    os.close(write_fd)
+
+  def test_CallFromThread(self):
+    m = mock.Mock()
+    loop = event_loop.EventLoop()
+    def Call():
+      m.call()
+      loop.Stop()
+    thread = threading.Thread(target=lambda: loop.CallFromThread(Call))
+    # Must not be reached, the call wakes up the loop.
+    loop.CallLater(10, m.timeout)
+    thread.start()
+    loop.Run()
+    thread.join()
+    m.call.assert_called_once_with()
+    m.timeout.assert_not_called()
+
+if __name__ == '__main__':
+  unittest.main()
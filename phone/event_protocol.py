@@ -0,0 +1,202 @@
+# Event protocol between phone_io.py and phony.py.
+#
+# phone_io reports events in one of two formats:
+#
+#  chars:  The original protocol. Every event is a single character,
+#          see phone_io.py for the symbols. No timing information and
+#          only a single phone.
+#  framed: Fixed-size little endian records of RECORD_SIZE bytes:
+#            magic     uint8   FRAME_MAGIC, used to detect misalignment.
+#            symbol    uint8   The character of the chars protocol.
+#            pin       uint8   BCM number of the pin causing the event.
+#            phone     uint8   Index of the phone, see --phone of
+#                              phone_io.py. Zero if there is just one.
+#            sequence  uint32  Incremented per event, wraps around.
+#            timestamp uint64  Capture time in nanoseconds on the
+#                              CLOCK_MONOTONIC time base.
+#
+# Records are fixed-size, so a single read() returns many events that
+# can be split without any parsing state other than a partial record.
+#
+# When phone_io runs on a thread of Phony (see phone_io.PhoneIOThread),
+# QueueWriter hands the Events over as they are, without encoding.
+#
+# coding=utf-8
+
+import collections
+import logging
+import struct
+
+import clock
+
+PROTOCOL_CHARS = 'chars'
+PROTOCOL_FRAMED = 'framed'
+PROTOCOLS = [PROTOCOL_CHARS, PROTOCOL_FRAMED]
+
+FRAME_MAGIC = 0xA5
+
+_RECORD = struct.Struct('<BBBBIQ')
+RECORD_SIZE = _RECORD.size
+
+# Sequence numbers wrap around at this value.
+SEQUENCE_MODULO = 1 << 32
+
+# A decoded event. The timestamp is in seconds, see clock.Monotonic.
+Event = collections.namedtuple('Event', ['symbol', 'pin', 'sequence',
+                                         'timestamp', 'phone'])
+
+class FrameWriter:
+  ''' FrameWriter encodes events as framed records.
+
+  Events are buffered until Flush, so all events of one update leave
+  in a single write.
+  '''
+
+  def __init__(self, write):
+    ''' Construct a writer.
+
+    Args:
+      write: Function called with the encoded bytes on Flush.
+    '''
+    self.write_ = write
+    self.sequence_ = 0
+    self.buffer_ = []
+
+  def Write(self, symbol, pin, timestamp, phone=0):
+    ''' Queue an event.
+
+    Args:
+      symbol: The event character.
+      pin: The pin the event originates from.
+      timestamp: Capture time in seconds, see clock.Monotonic.
+      phone: Index of the phone the event originates from.
+    '''
+    self.buffer_.append(_RECORD.pack(FRAME_MAGIC, ord(symbol), pin, phone,
+                                     self.sequence_,
+                                     int(timestamp * 1e9)))
+    self.sequence_ = (self.sequence_ + 1) % SEQUENCE_MODULO
+
+  def Flush(self):
+    ''' Write all queued events.'''
+    if self.buffer_:
+      data = b''.join(self.buffer_)
+      self.buffer_ = []
+      self.write_(data)
+
+class CharWriter:
+  ''' CharWriter encodes events in the original character protocol.'''
+
+  def __init__(self, write):
+    self.write_ = write
+    self.buffer_ = []
+
+  def Write(self, symbol, pin, timestamp, phone=0):
+    self.buffer_.append(symbol)
+
+  def Flush(self):
+    if self.buffer_:
+      data = ''.join(self.buffer_)
+      self.buffer_ = []
+      self.write_(data)
+
+class QueueWriter:
+  ''' QueueWriter passes Events on within the process.'''
+
+  def __init__(self, deliver):
+    ''' Construct a writer.
+
+    Args:
+      deliver: Function called with the list of Events on Flush.
+    '''
+    self.deliver_ = deliver
+    self.sequence_ = 0
+    self.buffer_ = []
+
+  def Write(self, symbol, pin, timestamp, phone=0):
+    self.buffer_.append(Event(symbol, pin, self.sequence_, timestamp, phone))
+    self.sequence_ = (self.sequence_ + 1) % SEQUENCE_MODULO
+
+  def Flush(self):
+    if self.buffer_:
+      events = self.buffer_
+      self.buffer_ = []
+      self.deliver_(events)
+
+class FrameReader:
+  ''' FrameReader decodes framed records.'''
+
+  def __init__(self):
+    # Bytes of an incomplete record.
+    self.pending_ = b''
+    self.next_sequence_ = None
+    self.lost_events_ = 0
+
+  def Feed(self, data):
+    ''' Decode the events contained in data.
+
+    Args:
+      data: Bytes read from phone_io. Records may span several calls.
+    Returns:
+      A list of Events.
+    '''
+    data = self.pending_ + data
+    events = []
+    offset = 0
+    skipped = 0
+    while len(data) - offset >= RECORD_SIZE:
+      magic, symbol, pin, phone, sequence, timestamp = _RECORD.unpack_from(
+        data, offset)
+      if magic != FRAME_MAGIC:
+        # We lost alignment. Skip ahead to the next magic byte.
+        offset += 1
+        skipped += 1
+        continue
+      offset += RECORD_SIZE
+      if self.next_sequence_ is not None and sequence != self.next_sequence_:
+        lost = (sequence - self.next_sequence_) % SEQUENCE_MODULO
+        self.lost_events_ += lost
+        logging.warning('Lost %d events from phone_io.' % lost)
+      self.next_sequence_ = (sequence + 1) % SEQUENCE_MODULO
+      events.append(Event(chr(symbol), pin, sequence, timestamp * 1e-9,
+                          phone))
+    if skipped:
+      logging.warning('Skipped %d bytes of misaligned event data.' % skipped)
+    self.pending_ = data[offset:]
+    return events
+
+  def GetLostEvents(self):
+    ''' GetLostEvents returns the number of events missing in the stream.'''
+    return self.lost_events_
+
+class CharReader:
+  ''' CharReader decodes the original character protocol.
+
+  The protocol has no timing information, so events are stamped with
+  the time they are decoded at.
+  '''
+
+  def __init__(self):
+    self.sequence_ = 0
+
+  def Feed(self, data):
+    timestamp = clock.Monotonic()
+    events = []
+    for i in data:
+      events.append(Event(i, 0, self.sequence_, timestamp, 0))
+      self.sequence_ = (self.sequence_ + 1) % SEQUENCE_MODULO
+    return events
+
+  def GetLostEvents(self):
+    return 0
+
+def CreateWriter(protocol, write):
+  ''' Returns a writer for protocol, see FrameWriter.'''
+  if protocol == PROTOCOL_FRAMED:
+    return FrameWriter(write)
+  return CharWriter(write)
+
+def CreateReader(protocol):
+  ''' Returns a reader for protocol, see FrameReader.'''
+  if protocol == PROTOCOL_FRAMED:
+    return FrameReader()
+  return CharReader()
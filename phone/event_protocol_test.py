@@ -0,0 +1,74 @@
+import event_protocol
+import logging
+import unittest
+
+class TestEventProtocol(unittest.TestCase):
+  def setUp(self):
+    logging.basicConfig(level=logging.INFO)
+
+  def test_FramedRoundTrip(self):
+    output = []
+    writer = event_protocol.FrameWriter(output.append)
+    writer.Write('l', 27, 1.5)
+    writer.Write('p', 4, 2.25)
+    writer.Write('7', 17, 3.0)
+    self.assertEqual([], output)
+    writer.Flush()
+    # All events of an update leave in a single write.
+    self.assertEqual(1, len(output))
+    self.assertEqual(3 * event_protocol.RECORD_SIZE, len(output[0]))
+
+    reader = event_protocol.FrameReader()
+    events = reader.Feed(output[0])
+    self.assertEqual(['l', 'p', '7'], [e.symbol for e in events])
+    self.assertEqual([27, 4, 17], [e.pin for e in events])
+    self.assertEqual([0, 1, 2], [e.sequence for e in events])
+    self.assertEqual([1.5, 2.25, 3.0], [e.timestamp for e in events])
+    self.assertEqual([0, 0, 0], [e.phone for e in events])
+    self.assertEqual(0, reader.GetLostEvents())
+
+  def test_FramedPhone(self):
+    output = []
+    writer = event_protocol.FrameWriter(output.append)
+    writer.Write('l', 27, 1.0, phone=2)
+    writer.Flush()
+    events = event_protocol.FrameReader().Feed(output[0])
+    self.assertEqual([2], [e.phone for e in events])
+
+  def test_FramedPartialRecords(self):
+    output = []
+    writer = event_protocol.FrameWriter(output.append)
+    writer.Write('s', 17, 1.0)
+    writer.Write('e', 17, 2.0)
+    writer.Flush()
+    reader = event_protocol.FrameReader()
+    split = event_protocol.RECORD_SIZE + 3
+    self.assertEqual(['s'], [e.symbol for e in reader.Feed(output[0][:split])])
+    self.assertEqual(['e'], [e.symbol for e in reader.Feed(output[0][split:])])
+
+  def test_FramedLostAndMisaligned(self):
+    output = []
+    writer = event_protocol.FrameWriter(output.append)
+    for i in range(3):
+      writer.Write('p', 4, i)
+    writer.Flush()
+    data = output[0]
+    reader = event_protocol.FrameReader()
+    # Drop the second record and put garbage in front of the third.
+    events = reader.Feed(data[:event_protocol.RECORD_SIZE] + b'xy' +
+                         data[2 * event_protocol.RECORD_SIZE:])
+    self.assertEqual([0, 2], [e.sequence for e in events])
+    self.assertEqual(1, reader.GetLostEvents())
+
+  def test_Chars(self):
+    output = []
+    writer = event_protocol.CharWriter(output.append)
+    writer.Write('l', 27, 1.0)
+    writer.Write('s', 17, 2.0)
+    writer.Flush()
+    self.assertEqual(['ls'], output)
+    events = event_protocol.CharReader().Feed(output[0])
+    self.assertEqual(['l', 's'], [e.symbol for e in events])
+
+if __name__ == '__main__':
+  unittest.main()
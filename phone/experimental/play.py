@@ -1,3 +1,5 @@
+# Superseded by bell_audio.py, which rings audio files in real time.
+#
 # coding=utf-8
 
 from __future__ import division
@@ -0,0 +1,82 @@
+# A stand-in for a SIP gateway.
+#
+# FakeGateway answers SIP OPTIONS on a local UDP port, after a
+# configurable delay or not at all, so sip_options.OptionsPinger can be
+# tested and benchmarked without a SIP server. Calls are faked by
+# fake_linphone.
+#
+# coding=utf-8
+
+import socket
+import threading
+import time
+
+import sip_options
+
+RESPONSE = ('SIP/2.0 200 OK\r\n'
+            '{headers}'
+            'Allow: INVITE, ACK, CANCEL, OPTIONS, BYE\r\n'
+            'Content-Length: 0\r\n\r\n')
+
+# Headers copied from the request into the response.
+COPIED_HEADERS = [('Via', 'v'), ('From', 'f'), ('To', 't'),
+                  ('Call-ID', 'i'), ('CSeq', None)]
+
+class FakeGateway:
+  ''' FakeGateway answers OPTIONS on its own thread.'''
+
+  def __init__(self, host='127.0.0.1', delay=0):
+    ''' Construct FakeGateway instance and start answering.
+
+    Args:
+      host: Address to listen on, on a free port.
+      delay: Seconds to wait before answering.
+    '''
+    self.delay_ = delay
+    self.down_ = False
+    self.requests_ = 0
+    self.sock_ = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.sock_.bind((host, 0))
+    self.thread_ = threading.Thread(target=self.serve_, name='gateway')
+    self.thread_.daemon = True
+    self.thread_.start()
+
+  def GetGateway(self):
+    ''' GetGateway returns the gateway as configured in phony.conf.'''
+    return '%s:%d' % self.sock_.getsockname()
+
+  def GetRequests(self):
+    ''' GetRequests returns the number of requests received.'''
+    return self.requests_
+
+  def SetDelay(self, delay):
+    ''' Answer delay seconds after a request.'''
+    self.delay_ = delay
+
+  def SetDown(self, down):
+    ''' Stop (or resume) answering.'''
+    self.down_ = down
+
+  def Close(self):
+    self.sock_.close()
+
+  def serve_(self):
+    while True:
+      try:
+        request, address = self.sock_.recvfrom(65536)
+      except socket.error:
+        # Closed.
+        return
+      self.requests_ += 1
+      if self.down_ or not request.startswith('OPTIONS '):
+        continue
+      headers = ''
+      for name, short_name in COPIED_HEADERS:
+        value = sip_options.GetHeader(request, name, short_name)
+        if value is not None:
+          headers += '%s: %s\r\n' % (name, value)
+      time.sleep(self.delay_)
+      try:
+        self.sock_.sendto(RESPONSE.format(headers=headers), address)
+      except socket.error:
+        return
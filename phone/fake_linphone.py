@@ -0,0 +1,327 @@
+# A stand-in for the linphone Python module.
+#
+# It implements the parts of the linphone API that Phony uses. Every call
+# into the core is recorded with a timestamp, and scripted SIP events
+# (incoming calls, the remote side answering) are delivered from
+# iterate(), just like linphone delivers its callbacks.
+#
+# To use it, install it before importing phony:
+#   sys.modules['linphone'] = fake_linphone
+#
+# coding=utf-8
+
+import collections
+import threading
+import time
+
+import clock
+
+class CallState:
+  Idle = 0
+  IncomingReceived = 1
+  OutgoingInit = 2
+  OutgoingProgress = 3
+  OutgoingRinging = 4
+  Connected = 6
+  StreamsRunning = 7
+  Error = 12
+  End = 13
+  Released = 18
+  # Aliases used by older wrapper versions.
+  CallConnected = Connected
+  CallError = Error
+  CallEnd = End
+
+class RegistrationState:
+  None_ = 0
+  Progress = 1
+  Ok = 2
+  Cleared = 3
+  Failed = 4
+
+class Reason:
+  NoResponse = 1
+  Declined = 3
+  NotFound = 4
+  Busy = 6
+
+# A recorded call into the core.
+Record = collections.namedtuple('Record', ['timestamp', 'method', 'args'])
+
+_log_handler = None
+
+def set_log_handler(handler):
+  global _log_handler
+  _log_handler = handler
+
+class Address:
+  def __init__(self, uri):
+    self.uri_ = uri
+    user_part = uri.split(':', 1)[-1]
+    self.username = user_part.split('@')[0] if '@' in user_part else ''
+    self.domain = user_part.split('@')[-1]
+
+  def as_string(self):
+    return self.uri_
+
+class CallLog:
+  def __init__(self, to_address):
+    self.to_address = to_address
+
+class Call:
+  def __init__(self, to_uri, from_uri='sip:anonymous@example.com'):
+    self.call_log = CallLog(Address(to_uri))
+    self.remote_address = Address(from_uri)
+    self.state = CallState.Idle
+    self.reason = None
+
+class NatPolicy:
+  def __init__(self):
+    self.stun_server = None
+    self.ice_enabled = False
+
+class ProxyConfig:
+  def __init__(self):
+    self.identity_address = None
+    self.server_addr = None
+    self.register_enabled = False
+    self.state = RegistrationState.None_
+    # The core the config was added to.
+    self.core_ = None
+
+  def edit(self):
+    pass
+
+  def done(self):
+    return 0
+
+  def refresh_register(self):
+    self.core_.record_('refresh_register', self)
+    self.core_.register_(self)
+
+class AuthInfo:
+  def __init__(self, username, userid, passwd, ha1, realm, domain):
+    self.username = username
+    self.userid = userid
+    self.passwd = passwd
+    self.domain = domain
+
+class CoreCbs:
+  def __init__(self):
+    self.call_state_changed = None
+    self.registration_state_changed = None
+
+class Core:
+  ''' Core records all calls and delivers scripted events on iterate().'''
+
+  def __init__(self, cbs, registration_delay=0):
+    ''' Construct Core instance.
+
+    Args:
+      cbs: The CoreCbs.
+      registration_delay: Seconds until a registration succeeds.
+    '''
+    self.cbs_ = cbs
+    self.registration_delay_ = registration_delay
+    self.records_ = []
+    # Scripted events as (due time, function), protected by lock_ because
+    # benchmarks script events from another thread.
+    self.lock_ = threading.Lock()
+    self.pending_ = []
+    # Seconds until an outbound call is answered, None to never answer.
+    self.answer_delay_ = 0.1
+    # {gateway: seconds} until outbound calls through gateway fail.
+    self.gateway_failures_ = {}
+    self.calls_ = []
+    self.proxy_config_list = []
+    self.auth_info_list = []
+    self.default_proxy_config = None
+    self.nat_policy = NatPolicy()
+    self.max_calls = 0
+    self.echo_cancellation_enabled = True
+    self.video_capture_enabled = True
+    self.video_display_enabled = True
+    self.remote_ringback_tone = None
+    self.ringback = None
+
+  # Scripting and inspection, not part of the linphone API.
+
+  def GetRecords(self, method=None):
+    ''' GetRecords returns recorded calls, optionally only of one method.'''
+    with self.lock_:
+      return [r for r in self.records_ if method is None or r.method == method]
+
+  def SetAnswerDelay(self, delay):
+    ''' Outbound calls are answered delay seconds after the INVITE.'''
+    self.answer_delay_ = delay
+
+  def SetGatewayFailure(self, gateway, delay=0):
+    ''' Outbound calls through gateway fail delay seconds after the
+    INVITE, as if it didn't respond. None to let them succeed again.'''
+    if delay is None:
+      self.gateway_failures_.pop(gateway, None)
+    else:
+      self.gateway_failures_[gateway] = delay
+
+  def ScheduleIncomingCall(self, username, delay=0, caller='anonymous'):
+    ''' Deliver an incoming call from caller for username on the first
+    iterate() at least delay seconds from now. Returns the call.'''
+    call = Call('sip:{username}@example.com'.format(username=username),
+                'sip:{caller}@example.com'.format(caller=caller))
+    self.schedule_(delay, lambda: self.setCallState_(
+      call, CallState.IncomingReceived, 'Incoming call'))
+    return call
+
+  def ScheduleCallEnd(self, call, delay=0):
+    ''' Let the remote side hang up call.'''
+    self.schedule_(delay, lambda: self.setCallState_(
+      call, CallState.End, 'Call ended'))
+
+  # linphone API.
+
+  def iterate(self):
+    self.record_('iterate')
+    now = clock.Monotonic()
+    with self.lock_:
+      due = [p for p in self.pending_ if p[0] <= now]
+      self.pending_ = [p for p in self.pending_ if p[0] > now]
+    for _, function in sorted(due, key=lambda p: p[0]):
+      function()
+
+  def play_local(self, audiofile):
+    self.record_('play_local', audiofile)
+    return 0
+
+  def invite(self, url):
+    self.record_('invite', url)
+    call = Call('sip:' + url)
+    self.calls_.append(call)
+    failure = self.gateway_failures_.get(call.call_log.to_address.domain)
+    if failure is not None:
+      call.reason = Reason.NoResponse
+      self.schedule_(failure, lambda: self.setCallState_(
+        call, CallState.Error, 'Request timeout'))
+    elif self.answer_delay_ is not None:
+      self.schedule_(self.answer_delay_, lambda: self.setCallState_(
+        call, CallState.Connected, 'Connected'))
+    return call
+
+  def terminate_all_calls(self):
+    self.record_('terminate_all_calls')
+    calls = self.calls_
+    self.calls_ = []
+    for call in calls:
+      self.schedule_(0, lambda call=call: self.setCallState_(
+        call, CallState.End, 'Call terminated'))
+    return 0
+
+  def terminate_call(self, call):
+    self.record_('terminate_call', call)
+    if call in self.calls_:
+      self.calls_.remove(call)
+    self.schedule_(0, lambda: self.setCallState_(
+      call, CallState.End, 'Call terminated'))
+    return 0
+
+  def decline_call(self, call, reason):
+    self.record_('decline_call', call, reason)
+    return 0
+
+  def create_call_params(self, call):
+    return object()
+
+  def accept_call_with_params(self, call, params):
+    self.record_('accept_call_with_params', call)
+    self.calls_.append(call)
+    self.schedule_(0, lambda: self.setCallState_(
+      call, CallState.Connected, 'Connected'))
+    return 0
+
+  def create_proxy_config(self):
+    return ProxyConfig()
+
+  def create_address(self, uri):
+    return Address(uri)
+
+  def add_proxy_config(self, proxy_config):
+    self.record_('add_proxy_config', proxy_config)
+    self.proxy_config_list.append(proxy_config)
+    proxy_config.core_ = self
+    if proxy_config.register_enabled:
+      self.register_(proxy_config)
+    return 0
+
+  def remove_proxy_config(self, proxy_config):
+    self.record_('remove_proxy_config', proxy_config)
+    self.proxy_config_list.remove(proxy_config)
+    if self.default_proxy_config is proxy_config:
+      self.default_proxy_config = None
+    self.schedule_(0, lambda: self.setRegistrationState_(
+      proxy_config, RegistrationState.Cleared, 'Unregistration done'))
+
+  def create_auth_info(self, username, userid, passwd, ha1, realm, domain):
+    return AuthInfo(username, userid, passwd, ha1, realm, domain)
+
+  def add_auth_info(self, auth_info):
+    self.record_('add_auth_info', auth_info)
+    self.auth_info_list.append(auth_info)
+
+  def remove_auth_info(self, auth_info):
+    self.record_('remove_auth_info', auth_info)
+    self.auth_info_list.remove(auth_info)
+
+  def register_(self, proxy_config):
+    self.schedule_(0, lambda: self.setRegistrationState_(
+      proxy_config, RegistrationState.Progress, 'Registration in progress'))
+    self.schedule_(self.registration_delay_,
+                   lambda: self.setRegistrationState_(
+                     proxy_config, RegistrationState.Ok,
+                     'Registration successful'))
+
+  def record_(self, method, *args):
+    with self.lock_:
+      self.records_.append(Record(clock.Monotonic(), method, args))
+
+  def schedule_(self, delay, function):
+    with self.lock_:
+      self.pending_.append((clock.Monotonic() + delay, function))
+
+  def setRegistrationState_(self, proxy_config, state, message):
+    proxy_config.state = state
+    self.record_('registration_state', proxy_config, state)
+    if self.cbs_.registration_state_changed:
+      self.cbs_.registration_state_changed(self, proxy_config, state, message)
+
+  def setCallState_(self, call, state, message):
+    call.state = state
+    if self.cbs_.call_state_changed:
+      self.cbs_.call_state_changed(self, call, state, message)
+
+class Factory:
+  _instance = None
+
+  def __init__(self):
+    self.create_delay_ = 0
+    self.registration_delay_ = 0
+
+  # Scripting, not part of the linphone API.
+
+  def SetDelays(self, create=0, registration=0):
+    ''' Cores take create seconds to create, blocking the creating thread
+    like a real core loading its configuration and sound cards, and
+    registrations take registration seconds to succeed.'''
+    self.create_delay_ = create
+    self.registration_delay_ = registration
+
+  @staticmethod
+  def get():
+    if Factory._instance is None:
+      Factory._instance = Factory()
+    return Factory._instance
+
+  def create_core_cbs(self):
+    return CoreCbs()
+
+  def create_core(self, cbs, config_path, factory_config_path):
+    time.sleep(self.create_delay_)
+    return Core(cbs, self.registration_delay_)
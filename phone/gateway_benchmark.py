@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+# Gateway selection benchmark of Phony.
+#
+# Runs BenchmarkPhony (see phony_benchmark.py) with two providers whose
+# gateways are FakeGateways answering OPTIONS locally, and places calls
+# while the default gateway misbehaves:
+#  - calls fail: INVITEs through it time out (fake_linphone), it still
+#    answers OPTIONS.
+#  - down: INVITEs time out, and it doesn't answer OPTIONS either.
+# Phony routing every call through the default gateway is compared to
+# Phony ranking the gateways by health and failing over. We report the
+# calls answered and the time from the last digit to the answer.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import ConfigParser
+import logging
+import threading
+import time
+
+import clock
+# Installs fake_linphone, so it must come before phony.
+import phony_benchmark
+import fake_gateway
+import phony
+
+NUMBER = '112'
+
+# Seconds until an INVITE through a failing gateway times out.
+FAILURE_DELAY = 0.5
+
+# Seconds between two pings, and until a ping is lost.
+OPTIONS_INTERVAL = 0.1
+
+class DefaultGatewayPhony(phony_benchmark.BenchmarkPhony):
+  ''' Dials out through the default gateway only, as Phony did before
+  it tracked the health of the gateways.'''
+
+  def RankGateways(self, number):
+    return [self.standard_gateway_]
+
+def CreateConfig(gateways):
+  ''' Returns a config with a provider per gateway, the first one being
+  the default.'''
+  config = ConfigParser.ConfigParser()
+  for i, gateway in enumerate(gateways):
+    section = 'provider%d' % i
+    config.add_section(section)
+    for option, value in [('Username', 'user%d' % i), ('Password', 'secret'),
+                          ('Gateway', gateway)]:
+      config.set(section, option, value)
+  config.add_section(phony.SETTINGS_SECTION)
+  config.set(phony.SETTINGS_SECTION, 'options_interval',
+             str(OPTIONS_INTERVAL))
+  config.add_section(phony.DIAL_PLAN_SECTION)
+  config.set(phony.DIAL_PLAN_SECTION, NUMBER, '')
+  return config
+
+def RunCalls(cls, scenario, calls):
+  ''' Place calls calls through Phony of class cls while scenario
+  applies. Returns the seconds from the last digit to the answer of
+  the calls answered.'''
+  gateways = [fake_gateway.FakeGateway(), fake_gateway.FakeGateway()]
+  instance = cls(CreateConfig([g.GetGateway() for g in gateways]))
+  phone = instance.phones_[0]
+  answered = []
+  errors = []
+
+  def State():
+    return phone.phone_state_.GetCurrentState()
+
+  def Play():
+    try:
+      bad = gateways[0].GetGateway()
+      instance.core_.SetGatewayFailure(bad, FAILURE_DELAY)
+      if scenario == 'down':
+        gateways[0].SetDown(True)
+      # Let the pings notice.
+      time.sleep(OPTIONS_INTERVAL * 5)
+      player = phony_benchmark.Scenario(instance)
+      for _ in range(calls):
+        player.send('l', phony_benchmark.PIN_HOOK)
+        for digit in NUMBER:
+          player.send('s', phony_benchmark.PIN_IDLE)
+          for _ in range(int(digit) or 10):
+            player.send('p', phony_benchmark.PIN_PULSE)
+          player.send('e', phony_benchmark.PIN_IDLE)
+          dialed = player.send(digit, phony_benchmark.PIN_IDLE)
+        player.waitFor(lambda: State() in [phony.PS_TALKING,
+                                           phony.PS_BUSY] or None)
+        if State() == phony.PS_TALKING:
+          answered.append(clock.Monotonic() - dialed)
+        player.send('d', phony_benchmark.PIN_HOOK)
+        player.waitFor(lambda: State() == phony.PS_READY or None)
+    except Exception as e:
+      errors.append(e)
+    finally:
+      instance.loop_.Stop()
+
+  player = threading.Thread(target=Play)
+  player.start()
+  instance.Run()
+  player.join()
+  for gateway in gateways:
+    gateway.Close()
+  if errors:
+    raise errors[0]
+  return answered
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Gateway selection benchmark of Phony.')
+  parser.add_argument('--calls', type=int, default=10)
+  args = parser.parse_args()
+
+  # Keep Phony's logging from dominating the measurement.
+  logging.basicConfig(level=logging.WARNING)
+  print('%-12s %-14s %8s %10s %10s' % ('scenario', 'routing', 'answered',
+                                       'p50', 'max'))
+  for scenario in ['calls fail', 'down']:
+    for name, cls in [('default only', DefaultGatewayPhony),
+                      ('health', phony_benchmark.BenchmarkPhony)]:
+      answered = sorted(RunCalls(cls, scenario, args.calls))
+      if answered:
+        times = '%8.1fms %8.1fms' % (answered[len(answered) // 2] * 1000,
+                                     answered[-1] * 1000)
+      else:
+        times = '%10s %10s' % ('-', '-')
+      print('%-12s %-14s %4d/%-3d %s' % (scenario, name, len(answered),
+                                         args.calls, times))
+
+if __name__ == '__main__':
+  main()
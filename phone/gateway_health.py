@@ -0,0 +1,175 @@
+# Health of the SIP gateways Phony dials out through.
+#
+# HealthTracker keeps, for every gateway, whether it is registered, the
+# round trip time of SIP OPTIONS pings (see sip_options.py) and the
+# setup times of recent calls (INVITE to ringing or answered). Calls
+# that fail before the remote side rings put the gateway on a cooldown
+# that grows with every consecutive failure.
+#
+# Rank orders the gateways a call can go through: healthy ones first,
+# by their score (round trip plus median setup time), the others as a
+# last resort. The preferred gateway (the default provider) stays first
+# unless another one is better by PREFERENCE_MARGIN.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import collections
+
+import clock
+
+# Weight of a new round trip in the running average.
+RTT_ALPHA = 0.3
+
+# Call setup times kept per gateway.
+SETUP_SAMPLES = 5
+
+# A gateway not answering this many pings in a row is unhealthy.
+MAX_PING_TIMEOUTS = 2
+
+# Seconds a gateway is avoided after a failed call, times the number of
+# consecutive failures, up to MAX_COOLDOWN.
+FAILURE_COOLDOWN = 30
+MAX_COOLDOWN = 300
+
+# Seconds another gateway must score better than the preferred one to
+# be chosen over it.
+PREFERENCE_MARGIN = 0.1
+
+class GatewayHealth:
+  ''' GatewayHealth is what we know about one gateway.'''
+
+  def __init__(self, gateway):
+    self.gateway_ = gateway
+    # True or False once the core reported the registration, None for
+    # gateways we don't register with or don't know about yet.
+    self.registered_ = None
+    # Running average of the ping round trips, None before the first.
+    self.rtt_ = None
+    self.ping_timeouts_ = 0
+    self.setups_ = collections.deque(maxlen=SETUP_SAMPLES)
+    self.failures_ = 0
+    self.failed_until_ = None
+
+  def GetGateway(self):
+    ''' GetGateway returns the gateway.'''
+    return self.gateway_
+
+  def GetRtt(self):
+    ''' GetRtt returns the average ping round trip in seconds, None if
+    unknown.'''
+    return self.rtt_
+
+  def GetSetupTime(self):
+    ''' GetSetupTime returns the median of the recent call setup times
+    in seconds, None if unknown.'''
+    if not self.setups_:
+      return None
+    return sorted(self.setups_)[len(self.setups_) // 2]
+
+  def IsHealthy(self, now):
+    ''' IsHealthy returns whether calls should go through the gateway
+    at time now.'''
+    return (self.registered_ is not False and
+            self.ping_timeouts_ < MAX_PING_TIMEOUTS and
+            (self.failed_until_ is None or now >= self.failed_until_))
+
+  def Score(self):
+    ''' Score returns the expected seconds until a call rings, lower is
+    better. Unknown parts count as zero.'''
+    return (self.rtt_ or 0) + (self.GetSetupTime() or 0)
+
+  def Describe(self, now):
+    ''' Describe returns a summary for the logs.'''
+    parts = []
+    if self.registered_ is False:
+      parts.append('unregistered')
+    if self.ping_timeouts_:
+      parts.append('%d pings lost' % self.ping_timeouts_)
+    if self.failed_until_ is not None and now < self.failed_until_:
+      parts.append('%d failed calls, cooling down %.0fs' % (
+        self.failures_, self.failed_until_ - now))
+    if self.rtt_ is not None:
+      parts.append('rtt %.1fms' % (self.rtt_ * 1000))
+    if self.setups_:
+      parts.append('setup %.0fms' % (self.GetSetupTime() * 1000))
+    return '{gateway} ({parts})'.format(gateway=self.gateway_,
+                                        parts=', '.join(parts) or 'no data')
+
+class HealthTracker:
+  ''' HealthTracker keeps the GatewayHealth of all gateways.'''
+
+  def __init__(self, time_function=clock.Monotonic):
+    ''' Construct HealthTracker instance.
+
+    Args:
+      time_function: Returns the current time in seconds.
+    '''
+    self.time_function_ = time_function
+    self.gateways_ = {}
+
+  def Get(self, gateway):
+    ''' Get returns the GatewayHealth of gateway.'''
+    if gateway not in self.gateways_:
+      self.gateways_[gateway] = GatewayHealth(gateway)
+    return self.gateways_[gateway]
+
+  def SetRegistered(self, gateway, registered):
+    ''' The core reported the registration with gateway.
+
+    Args:
+      gateway: The gateway.
+      registered: True if registered, False if it failed, None while it
+        is in progress or once it is cleared.
+    '''
+    self.Get(gateway).registered_ = registered
+
+  def ObserveRtt(self, gateway, rtt):
+    ''' A ping to gateway was answered after rtt seconds.'''
+    health = self.Get(gateway)
+    health.ping_timeouts_ = 0
+    if health.rtt_ is None:
+      health.rtt_ = rtt
+    else:
+      health.rtt_ += RTT_ALPHA * (rtt - health.rtt_)
+
+  def ObservePingTimeout(self, gateway):
+    ''' A ping to gateway wasn't answered.'''
+    self.Get(gateway).ping_timeouts_ += 1
+
+  def ObserveSetup(self, gateway, seconds):
+    ''' A call through gateway rang after seconds.'''
+    health = self.Get(gateway)
+    health.setups_.append(seconds)
+    health.failures_ = 0
+    health.failed_until_ = None
+
+  def ObserveFailure(self, gateway):
+    ''' A call through gateway failed before it rang.'''
+    health = self.Get(gateway)
+    health.failures_ += 1
+    health.failed_until_ = self.time_function_() + min(
+      MAX_COOLDOWN, FAILURE_COOLDOWN * health.failures_)
+
+  def Rank(self, gateways, preferred=None):
+    ''' Returns gateways in the order calls should try them.
+
+    Args:
+      gateways: The gateways to choose from.
+      preferred: The gateway to use unless another one is clearly
+        better, or None.
+    '''
+    now = self.time_function_()
+    def Key(gateway):
+      health = self.Get(gateway)
+      score = health.Score()
+      if gateway == preferred:
+        score -= PREFERENCE_MARGIN
+      return (not health.IsHealthy(now), score)
+    return sorted(gateways, key=Key)
+
+  def Describe(self, gateways):
+    ''' Describe returns a summary of gateways for the logs.'''
+    now = self.time_function_()
+    return ', '.join(self.Get(g).Describe(now) for g in gateways)
@@ -0,0 +1,49 @@
+import gateway_health
+import unittest
+
+class TestHealthTracker(unittest.TestCase):
+  def setUp(self):
+    self.now = 100.0
+    self.tracker = gateway_health.HealthTracker(lambda: self.now)
+
+  def test_PrefersDefault(self):
+    self.tracker.ObserveRtt('a', 0.05)
+    self.tracker.ObserveRtt('b', 0.02)
+    # b isn't better by the margin.
+    self.assertEqual(['a', 'b'], self.tracker.Rank(['a', 'b'], 'a'))
+    self.assertEqual(['b', 'a'], self.tracker.Rank(['a', 'b']))
+    self.tracker.ObserveSetup('a', 0.5)
+    self.assertEqual(['b', 'a'], self.tracker.Rank(['a', 'b'], 'a'))
+
+  def test_Unhealthy(self):
+    self.tracker.SetRegistered('a', False)
+    self.assertEqual(['b', 'a'], self.tracker.Rank(['a', 'b'], 'a'))
+    self.tracker.SetRegistered('a', True)
+    for _ in range(gateway_health.MAX_PING_TIMEOUTS):
+      self.tracker.ObservePingTimeout('a')
+    self.assertEqual(['b', 'a'], self.tracker.Rank(['a', 'b'], 'a'))
+    self.tracker.ObserveRtt('a', 0.01)
+    self.assertEqual(['a', 'b'], self.tracker.Rank(['a', 'b'], 'a'))
+
+  def test_FailureCooldown(self):
+    self.tracker.ObserveFailure('a')
+    self.assertEqual(['b', 'a'], self.tracker.Rank(['a', 'b'], 'a'))
+    self.assertIn('1 failed calls', self.tracker.Describe(['a']))
+    self.now += gateway_health.FAILURE_COOLDOWN
+    self.assertEqual(['a', 'b'], self.tracker.Rank(['a', 'b'], 'a'))
+    # The cooldown grows with consecutive failures.
+    self.tracker.ObserveFailure('a')
+    self.now += gateway_health.FAILURE_COOLDOWN
+    self.assertEqual(['b', 'a'], self.tracker.Rank(['a', 'b'], 'a'))
+    self.tracker.ObserveSetup('a', 0.1)
+    self.assertEqual(['a', 'b'], self.tracker.Rank(['a', 'b'], 'a'))
+
+  def test_Describe(self):
+    self.tracker.ObserveRtt('a', 0.01)
+    self.tracker.ObserveRtt('a', 0.02)
+    self.tracker.ObserveSetup('a', 0.25)
+    self.assertEqual('a (rtt 13.0ms, setup 250ms), b (no data)',
+                     self.tracker.Describe(['a', 'b']))
+
+if __name__ == '__main__':
+  unittest.main()
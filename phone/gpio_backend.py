@@ -0,0 +1,123 @@
+# GPIO backends.
+#
+# The hardware layer talks to the pins through a backend, so it can run
+# on a Raspberry Pi (RpiBackend) as well as on an ordinary Linux box
+# (gpio_simulator.SimulatedBackend).
+#
+# The backend is selected with the PHONY_GPIO_BACKEND environment
+# variable, which Phony sets from the gpio_backend option in the
+# [phony] section of its config. When phone_io runs on a thread of
+# Phony, Phony creates it with CreateBackend instead.
+#
+# coding=utf-8
+
+import os
+
+import clock
+import gpio_chip
+
+# Environment variable selecting the backend: 'rpi' or 'sim'.
+BACKEND_ENV = 'PHONY_GPIO_BACKEND'
+
+# Environment variable with the path of a waveform script for the
+# simulator. See gpio_simulator.LoadScript.
+SCRIPT_ENV = 'PHONY_GPIO_SCRIPT'
+
+DEFAULT_BACKEND = 'rpi'
+
+# Pin levels.
+LOW = 0
+HIGH = 1
+
+class Backend:
+  ''' Backend is the base of all GPIO backends. Pins are identified by
+  their BCM number.
+
+  Backends implement:
+    SetupInput(port): Configure port as input with a pull-up resistor.
+    SetupOutput(port): Configure port as output.
+    Input(port): Returns the current level of an input port.
+    Output(port, level): Set the level of an output port to LOW or HIGH.
+  and, if SupportsEdgeEvents returns True:
+    OpenEdgeEvents(port): Request edge events for an input port. Returns
+      an object like gpio_chip.LineEvents with fileno(), GetValue(),
+      Read() and Close() methods.
+  The methods below have defaults for backends without edge events.
+  '''
+
+  def SupportsEdgeEvents(self):
+    ''' SupportsEdgeEvents returns True if OpenEdgeEvents can be used.'''
+    return False
+
+  def NextEdgeTime(self):
+    ''' NextEdgeTime returns the time the next edge event is known to
+    arrive at, or None. Real hardware makes its descriptors readable
+    instead, so only the simulator knows this in advance.'''
+    return None
+
+  def Now(self):
+    ''' Now returns the current time of the backend in seconds.'''
+    return clock.Monotonic()
+
+  def Cleanup(self):
+    ''' Release all pins.'''
+    pass
+
+class RpiBackend(Backend):
+  ''' RpiBackend drives the pins of a Raspberry Pi through RPi.GPIO and
+  the GPIO character device.'''
+
+  def __init__(self):
+    # Only import on demand, RPi.GPIO is not available off-Pi.
+    import RPi.GPIO
+    self.gpio_ = RPi.GPIO
+    self.gpio_.setmode(self.gpio_.BCM)
+
+  def SetupInput(self, port):
+    self.gpio_.setup(port, self.gpio_.IN, pull_up_down=self.gpio_.PUD_UP)
+
+  def SetupOutput(self, port):
+    self.gpio_.setup(port, self.gpio_.OUT)
+
+  def Input(self, port):
+    return self.gpio_.input(port)
+
+  def Output(self, port, level):
+    self.gpio_.output(port, self.gpio_.HIGH if level else self.gpio_.LOW)
+
+  def SupportsEdgeEvents(self):
+    return gpio_chip.IsAvailable()
+
+  def OpenEdgeEvents(self, port):
+    return gpio_chip.LineEvents(port)
+
+  def Cleanup(self):
+    self.gpio_.cleanup()
+
+_backend = None
+
+def GetBackend():
+  ''' GetBackend returns the process wide backend selected by the
+  environment. It is created on first use.'''
+  global _backend
+  if _backend is None:
+    _backend = CreateBackend(os.environ.get(BACKEND_ENV, DEFAULT_BACKEND),
+                             os.environ.get(SCRIPT_ENV))
+  return _backend
+
+def CreateBackend(name, script=None):
+  ''' Returns a new backend.
+
+  Args:
+    name: 'rpi' or 'sim'.
+    script: Waveform script played by the simulator, or None.
+  '''
+  if name == 'rpi':
+    return RpiBackend()
+  elif name == 'sim':
+    import gpio_simulator
+    backend = gpio_simulator.SimulatedBackend(realtime=True)
+    if script:
+      backend.AddEdges(gpio_simulator.LoadScript(script))
+    return backend
+  raise ValueError('Unknown GPIO backend %s' % name)
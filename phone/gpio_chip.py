@@ -0,0 +1,135 @@
+# Edge events from the Linux GPIO character device.
+#
+# The kernel captures a timestamp for each edge in its interrupt
+# handler and queues the events on a file descriptor. Unlike polling
+# GPIO.input, no edge is lost while we are busy and edge timing is not
+# quantized to our loop period. The descriptor is select()able, so the
+# reader can block until something happens.
+#
+# This uses the v1 ABI from linux/gpio.h, which is available on all
+# Raspbian kernels since 4.8.
+#
+# coding=utf-8
+
+import errno
+import fcntl
+import os
+import struct
+import time
+
+import clock
+
+# The GPIO chip the BCM pins live on. Line offsets equal BCM numbers.
+DEFAULT_CHIP = '/dev/gpiochip0'
+
+# struct gpioevent_request {
+#   __u32 lineoffset; __u32 handleflags; __u32 eventflags;
+#   char consumer_label[32]; int fd; };
+_EVENT_REQUEST = struct.Struct('=III32si')
+# struct gpiohandle_data { __u8 values[64]; };
+_HANDLE_DATA = struct.Struct('=64B')
+# struct gpioevent_data { __u64 timestamp; __u32 id; } padded to 8 bytes.
+_EVENT_DATA = struct.Struct('=QI4x')
+
+def _IOWR(type, nr, size):
+  return (3 << 30) | (size << 16) | (type << 8) | nr
+
+GPIO_GET_LINEEVENT_IOCTL = _IOWR(0xB4, 0x04, _EVENT_REQUEST.size)
+GPIOHANDLE_GET_LINE_VALUES_IOCTL = _IOWR(0xB4, 0x08, _HANDLE_DATA.size)
+
+GPIOHANDLE_REQUEST_INPUT = 1 << 0
+GPIOEVENT_REQUEST_BOTH_EDGES = 3
+GPIOEVENT_EVENT_RISING_EDGE = 1
+
+# Read this many events at once.
+_READ_EVENTS = 64
+
+def IsAvailable(chip=DEFAULT_CHIP):
+  ''' IsAvailable returns True if the GPIO character device exists.'''
+  return os.path.exists(chip)
+
+class LineEvents:
+  ''' LineEvents delivers the edges of a single input line.
+
+  Bias (pull-up) is not touched, configure it with GPIO.setup before.
+  '''
+
+  def __init__(self, line, chip=DEFAULT_CHIP, consumer='phony'):
+    ''' Request edge events for a line.
+
+    Args:
+      line: Line offset. For the Raspberry Pi, the BCM pin number.
+      chip: Path of the GPIO character device.
+      consumer: Label shown by tools like gpioinfo.
+    Raises:
+      IOError, OSError: If the kernel refused the request.
+    '''
+    chip_fd = os.open(chip, os.O_RDONLY)
+    try:
+      request = bytearray(_EVENT_REQUEST.pack(
+        line, GPIOHANDLE_REQUEST_INPUT, GPIOEVENT_REQUEST_BOTH_EDGES,
+        consumer.encode('ascii'), 0))
+      fcntl.ioctl(chip_fd, GPIO_GET_LINEEVENT_IOCTL, request, True)
+      self.fd_ = _EVENT_REQUEST.unpack(bytes(request))[4]
+    finally:
+      os.close(chip_fd)
+    flags = fcntl.fcntl(self.fd_, fcntl.F_GETFL)
+    fcntl.fcntl(self.fd_, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+  def fileno(self):
+    ''' The descriptor becomes readable when edges are queued.'''
+    return self.fd_
+
+  def GetValue(self):
+    ''' GetValue returns the current level of the line as a boolean.'''
+    data = bytearray(_HANDLE_DATA.size)
+    fcntl.ioctl(self.fd_, GPIOHANDLE_GET_LINE_VALUES_IOCTL, data, True)
+    return data[0] != 0
+
+  def Read(self):
+    ''' Read returns all queued edges without blocking.
+
+    Returns:
+      A list of (timestamp, level) tuples in capture order. The timestamp
+      is in seconds on the clock.Monotonic time base, level is the
+      boolean state of the line after the edge.
+    '''
+    edges = []
+    while True:
+      try:
+        data = os.read(self.fd_, _EVENT_DATA.size * _READ_EVENTS)
+      except OSError as e:
+        if e.errno in (errno.EAGAIN, errno.EINTR):
+          break
+        raise
+      if not data:
+        break
+      offset = _ClockOffset()
+      for i in range(0, len(data), _EVENT_DATA.size):
+        timestamp, id = _EVENT_DATA.unpack_from(data, i)
+        edges.append((timestamp * 1e-9 + offset,
+                      id == GPIOEVENT_EVENT_RISING_EDGE))
+      if len(data) < _EVENT_DATA.size * _READ_EVENTS:
+        break
+    return edges
+
+  def Close(self):
+    ''' Release the line.'''
+    os.close(self.fd_)
+
+def _KernelUsesRealtime():
+  ''' Kernels before 5.7 stamp events with CLOCK_REALTIME.'''
+  release = os.uname()[2].split('-')[0].split('.')
+  try:
+    version = (int(release[0]), int(release[1]))
+  except (IndexError, ValueError):
+    return False
+  return version < (5, 7)
+
+_REALTIME_TIMESTAMPS = _KernelUsesRealtime()
+
+def _ClockOffset():
+  ''' Returns the offset to add to kernel timestamps to get monotonic time.'''
+  if not _REALTIME_TIMESTAMPS:
+    return 0
+  return clock.Monotonic() - time.time()
@@ -2,26 +2,33 @@
 #
 # coding=utf-8
 
-import datetime
-import time
-import RPi.GPIO as GPIO
+import gpio_backend
 
 # Minimum distance between two edges in seconds.
 DEFAULT_SIGNAL_DIST = 0.005
 
 class GpioSignal:
   """ GpioSignal manages a single GPIO port.
-  
+
   This class has a pump method that will poll the assigned
   pin, do a few sanity checks and then signal to the call whether
   there was a state change. What this class does is very similar
   to the event callbacks of RPi.GPIO, but it has a noise filter.
+
+  In edge event mode, the pin is not polled. Instead, the kernel queues
+  every edge with its capture timestamp (see gpio_chip), and PumpEdges
+  applies the same noise filter to the queued timestamps.
+
+  The pin is accessed through a gpio_backend.Backend.
+
+  All times are monotonic seconds, see clock.Monotonic.
   """
-  
+
   def __init__(self, gpio_port, current_time,
-               min_signal_dist=DEFAULT_SIGNAL_DIST):
+               min_signal_dist=DEFAULT_SIGNAL_DIST, edge_events=False,
+               backend=None):
     """ Construct a signal object.
-    
+
     Args:
       gpio_port: The GPIO port to listen on. This port will be initialized
         with a pull-up resistor.
@@ -29,13 +36,76 @@ class GpioSignal:
         we don't poll current time outselves here is to ensure consistency
         among signals.
       min_signal_dist: Minimum distance between edges in seconds.
+      edge_events: Use edge events instead of polling. Raises IOError or
+        OSError if the kernel does not support them.
+      backend: The gpio_backend.Backend to use. Defaults to the backend
+        selected by the environment, see gpio_backend.GetBackend.
     """
     self.gpio_port_ = gpio_port
-    GPIO.setup(gpio_port, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-    self.previous_state_ = GPIO.input(gpio_port)
+    self.backend_ = backend or gpio_backend.GetBackend()
+    self.backend_.SetupInput(gpio_port)
+    self.line_events_ = None
+    if edge_events:
+      self.line_events_ = self.backend_.OpenEdgeEvents(gpio_port)
+      self.previous_state_ = self.line_events_.GetValue()
+    else:
+      self.previous_state_ = self.backend_.Input(gpio_port)
     self.previous_state_ts_ = current_time
     self.min_signal_dist_ = min_signal_dist
-         
+    # In edge event mode: The level of the last edge we rejected because
+    # it came too early, or None. Once the noise window has passed, it
+    # describes the settled state of the pin.
+    self.pending_state_ = None
+    # Accepted state changes, and edges (polls when polling) rejected by
+    # the noise filter. See metrics.py.
+    self.accepted_ = 0
+    self.rejected_ = 0
+    # Changes of the pin (edges, or polls seeing a change) closer than
+    # min_signal_dist to the one before form a burst. Start and last
+    # change of the current burst, and the longest since TakeBurst.
+    self.burst_start_ = None
+    self.burst_last_ = None
+    self.max_burst_ = 0.0
+
+  def GetPort(self):
+    """ GetPort returns the GPIO port of this signal."""
+    return self.gpio_port_
+
+  def GetState(self):
+    """ GetState returns the last accepted state of the pin."""
+    return self.previous_state_
+
+  def GetMinSignalDist(self):
+    """ GetMinSignalDist returns the noise filter window in seconds."""
+    return self.min_signal_dist_
+
+  def SetMinSignalDist(self, min_signal_dist):
+    """ SetMinSignalDist changes the noise filter window, from the next
+    edge on."""
+    self.min_signal_dist_ = min_signal_dist
+
+  def TakeBurst(self):
+    """ TakeBurst returns the longest burst of contact bounce since the
+    last call, in seconds from its first to its last change."""
+    burst = self.max_burst_
+    self.max_burst_ = 0.0
+    return burst
+
+  def GetAccepted(self):
+    """ GetAccepted returns the number of accepted state changes."""
+    return self.accepted_
+
+  def GetRejected(self):
+    """ GetRejected returns the number of edges rejected because they
+    came less than min_signal_dist after the last accepted change. When
+    polling, it counts the polls seeing such a change."""
+    return self.rejected_
+
+  def fileno(self):
+    """ In edge event mode, the descriptor is readable when edges are
+    queued."""
+    return self.line_events_.fileno()
+
   def Pump(self, current_time):
     """ Pump reads from its GPIO port and returns the current state.
 
@@ -45,13 +115,83 @@ class GpioSignal:
         among signals.
     Returns:
       A tuple state, age where state is a boolean and age specifies the
-      amount of time since the last update. An age of zero means that the
-      state just changed.
+      amount of time in seconds since the last update. An age of zero means
+      that the state just changed.
     """
     time_diff = current_time - self.previous_state_ts_
-    current_state = GPIO.input(self.gpio_port_)        
-    if (self.previous_state_ != current_state and
-        time_diff.total_seconds() > self.min_signal_dist_):
-      self.previous_state_ = current_state
-      self.previous_state_ts_ = current_time
+    current_state = self.backend_.Input(self.gpio_port_)
+    if self.previous_state_ != current_state:
+      self.noteChange_(current_time)
+      if time_diff > self.min_signal_dist_:
+        self.previous_state_ = current_state
+        self.previous_state_ts_ = current_time
+        self.accepted_ += 1
+      else:
+        self.rejected_ += 1
     return self.previous_state_, current_time - self.previous_state_ts_
+
+  def PumpEdges(self, current_time):
+    """ PumpEdges consumes the queued edges in edge event mode.
+
+    Every queued edge is treated like a Pump call at its capture time, so
+    an edge is accepted if it changes the state and is further than
+    min_signal_dist away from the last accepted change. Unlike Pump, no
+    state change is lost if we are called late.
+
+    Args:
+      current_time: The current time. Used to settle a rejected edge once
+        the noise window has passed.
+    Returns:
+      A list of (state, timestamp) tuples, one for each accepted state
+      change (age == 0 in terms of Pump), in capture order.
+    """
+    changes = []
+    for timestamp, state in self.line_events_.Read():
+      self.applyEdge_(timestamp, state, changes)
+    self.settle_(current_time, changes)
+    return changes
+
+  def NextDeadline(self):
+    """ NextDeadline returns the time PumpEdges must be called at to settle
+    a rejected edge, or None."""
+    if self.pending_state_ is None:
+      return None
+    return self.previous_state_ts_ + self.min_signal_dist_
+
+  def applyEdge_(self, timestamp, state, changes):
+    """ Apply the noise filter to a single edge."""
+    self.settle_(timestamp, changes)
+    self.noteChange_(timestamp)
+    if self.previous_state_ == state:
+      # Back at the accepted level, whatever bounced before was noise.
+      self.pending_state_ = None
+    elif timestamp - self.previous_state_ts_ > self.min_signal_dist_:
+      self.previous_state_ = state
+      self.previous_state_ts_ = timestamp
+      self.pending_state_ = None
+      self.accepted_ += 1
+      changes.append((state, timestamp))
+    else:
+      self.pending_state_ = state
+      self.rejected_ += 1
+
+  def noteChange_(self, timestamp):
+    """ Extend the current burst with a change, or start a new one."""
+    if (self.burst_last_ is not None and
+        timestamp - self.burst_last_ <= self.min_signal_dist_):
+      self.max_burst_ = max(self.max_burst_, timestamp - self.burst_start_)
+    else:
+      self.burst_start_ = timestamp
+    self.burst_last_ = timestamp
+
+  def settle_(self, current_time, changes):
+    """ Accept a rejected edge if the pin stayed at its level until the
+    noise window passed. The polling loop would have picked it up with
+    the first poll after the window."""
+    deadline = self.NextDeadline()
+    if deadline is not None and deadline <= current_time:
+      self.previous_state_ = self.pending_state_
+      self.previous_state_ts_ = deadline
+      self.pending_state_ = None
+      self.accepted_ += 1
+      changes.append((self.previous_state_, deadline))
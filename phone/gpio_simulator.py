@@ -0,0 +1,234 @@
+# In-memory GPIO simulator.
+#
+# SimulatedBackend plays scripted input waveforms and records all writes
+# to output pins. In its default mode it runs on a virtual clock that
+# only advances when told to, so the hardware layer can be driven
+# deterministically and much faster than real time.
+#
+# Waveforms are lists of (time, port, level) edges. The helpers at the
+# end of this file generate the waveforms of a W48 dial and hook.
+#
+# coding=utf-8
+
+import bisect
+import os
+
+import clock
+import gpio_backend
+
+class SimulatedLineEvents:
+  ''' Edge events of a simulated input port.'''
+
+  def __init__(self, backend, port):
+    self.backend_ = backend
+    self.port_ = port
+    # Index of the next edge to deliver.
+    self.next_ = bisect.bisect_right(backend.times_.get(port, []),
+                                     backend.Now())
+    # Never becomes readable. The simulator announces edges through
+    # Backend.NextEdgeTime instead.
+    self.fd_, self.write_fd_ = os.pipe()
+
+  def fileno(self):
+    return self.fd_
+
+  def GetValue(self):
+    return self.backend_.Input(self.port_) != gpio_backend.LOW
+
+  def Read(self):
+    times = self.backend_.times_.get(self.port_, [])
+    levels = self.backend_.levels_.get(self.port_, [])
+    end = bisect.bisect_right(times, self.backend_.Now())
+    edges = [(times[i], levels[i] != gpio_backend.LOW)
+             for i in range(self.next_, end)]
+    self.next_ = max(self.next_, end)
+    return edges
+
+  def NextEdgeTime(self):
+    times = self.backend_.times_.get(self.port_, [])
+    if self.next_ < len(times):
+      return times[self.next_]
+    return None
+
+  def Close(self):
+    os.close(self.fd_)
+    os.close(self.write_fd_)
+
+class SimulatedBackend(gpio_backend.Backend):
+  ''' SimulatedBackend is a deterministic in-memory GPIO backend.'''
+
+  def __init__(self, realtime=False, initial_level=gpio_backend.HIGH):
+    ''' Construct a simulator.
+
+    Args:
+      realtime: If True, time follows the monotonic clock and the times of
+        scripted edges are relative to the construction of the simulator.
+        Otherwise, time starts at zero and only advances with SetTime.
+      initial_level: Level of inputs before their first edge. Inputs have
+        pull-up resistors, so they read high if nothing is connected.
+    '''
+    self.realtime_ = realtime
+    # Offset added to the time of scripted edges.
+    self.time_offset_ = clock.Monotonic() if realtime else 0.0
+    self.time_ = 0.0
+    self.initial_level_ = initial_level
+    # {port: level} for ports that don't start at initial_level.
+    self.initial_levels_ = {}
+    # {port: [time]} and {port: [level]} of all scripted input edges.
+    self.times_ = {}
+    self.levels_ = {}
+    # All output writes as (time, port, level).
+    self.outputs_ = []
+    self.inputs_ = set()
+    self.line_events_ = []
+
+  def AddEdges(self, edges):
+    ''' Add edges to the input waveforms.
+
+    Args:
+      edges: A list of (time, port, level) tuples.
+    '''
+    for time, port, level in sorted(edges):
+      time += self.time_offset_
+      times = self.times_.setdefault(port, [])
+      levels = self.levels_.setdefault(port, [])
+      index = bisect.bisect_right(times, time)
+      times.insert(index, time)
+      levels.insert(index, level)
+
+  def SetInitialLevel(self, port, level):
+    ''' Set the level of an input before its first edge.'''
+    self.initial_levels_[port] = level
+
+  def SetTime(self, time):
+    ''' Advance the virtual clock. Time never goes backwards.'''
+    self.time_ = max(self.time_, time)
+
+  def GetOutputs(self):
+    ''' GetOutputs returns all output writes as (time, port, level).'''
+    return self.outputs_
+
+  def SetupInput(self, port):
+    self.inputs_.add(port)
+
+  def SetupOutput(self, port):
+    pass
+
+  def Input(self, port):
+    times = self.times_.get(port, [])
+    index = bisect.bisect_right(times, self.Now())
+    if index == 0:
+      return self.initial_levels_.get(port, self.initial_level_)
+    return self.levels_[port][index - 1]
+
+  def Output(self, port, level):
+    self.outputs_.append((self.Now(), port, level))
+
+  def SupportsEdgeEvents(self):
+    return True
+
+  def OpenEdgeEvents(self, port):
+    line_events = SimulatedLineEvents(self, port)
+    self.line_events_.append(line_events)
+    return line_events
+
+  def NextEdgeTime(self):
+    times = [l.NextEdgeTime() for l in self.line_events_]
+    times = [t for t in times if t is not None]
+    if not times:
+      return None
+    return min(times)
+
+  def Now(self):
+    if self.realtime_:
+      return clock.Monotonic()
+    return self.time_
+
+  def Cleanup(self):
+    for line_events in self.line_events_:
+      line_events.Close()
+    self.line_events_ = []
+
+def LoadScript(path):
+  ''' Load a waveform script.
+
+  Each line holds one edge as "<time> <port> <level>", with time in
+  seconds since start. Empty lines and lines starting with # are ignored.
+
+  Returns:
+    A list of (time, port, level) tuples.
+  '''
+  edges = []
+  with open(path) as script:
+    for line in script:
+      line = line.strip()
+      if not line or line.startswith('#'):
+        continue
+      time, port, level = line.split()
+      edges.append((float(time), int(port), int(level)))
+  return edges
+
+def Bounce(time, port, level, bounces, bounce_time):
+  ''' Returns the edges of a bouncing contact settling at level.
+
+  Args:
+    time: Time of the first edge.
+    port: The port the contact is connected to.
+    level: The final level.
+    bounces: Number of times the contact falls back to the previous level
+      before it settles.
+    bounce_time: Time between two edges while bouncing.
+  '''
+  edges = [(time, port, level)]
+  for i in range(bounces):
+    edges.append((time + (2 * i + 1) * bounce_time, port, 1 - level))
+    edges.append((time + (2 * i + 2) * bounce_time, port, level))
+  return edges
+
+def DialEdges(number, start, pulse_port, idle_port, pulse_period=0.1,
+              break_ratio=0.6, windup_time=0.3, digit_pause=0.5,
+              idle_skew=0.0, bounces=0, bounce_time=0.0005):
+  ''' Returns the edges of dialing a number.
+
+  Moving the dial off its rest position pulls the idle contact low.
+  While the dial runs back, the pulse contact opens (high) once per
+  pulse. The idle contact closes again around the last pulse.
+
+  Args:
+    number: The digits to dial as a string.
+    start: Time the dial starts moving for the first digit.
+    pulse_port, idle_port: The ports of the dial contacts.
+    pulse_period: Time per pulse. Nominally 0.1 seconds (10 pulses/s).
+    break_ratio: Fraction of the pulse period the contact is open.
+    windup_time: Time between leaving the rest position and the
+      first pulse.
+    digit_pause: Time between the end of a digit and the next one.
+    idle_skew: Time from the start of the last pulse's break until the
+      idle contact closes. If zero, it closes at the end of the break.
+    bounces, bounce_time: See Bounce. Applied to every pulse edge.
+  Returns:
+    A tuple (edges, end) with a list of (time, port, level) edges and
+    the time the last digit completed.
+  '''
+  edges = []
+  time = start
+  break_time = pulse_period * break_ratio
+  for digit in number:
+    pulses = int(digit) or 10
+    edges.append((time, idle_port, gpio_backend.LOW))
+    time += windup_time
+    for i in range(pulses):
+      edges += Bounce(time, pulse_port, gpio_backend.HIGH, bounces,
+                      bounce_time)
+      edges += Bounce(time + break_time, pulse_port, gpio_backend.LOW,
+                      bounces, bounce_time)
+      if i == pulses - 1:
+        edges.append((time + (idle_skew or break_time), idle_port,
+                      gpio_backend.HIGH))
+      time += pulse_period
+    time += digit_pause
+  return edges, time
+
+def HookEdges(time, hook_port, lifted):
+  ''' Returns the edge of lifting (lifted=True) or dropping the handset.'''
+  return [(time, hook_port, gpio_backend.LOW if lifted else gpio_backend.HIGH)]
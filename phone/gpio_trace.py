@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+#
+# Capture and replay of the raw GPIO edges of phone_io.
+#
+# With --trace, phone_io records every level change of its input pins
+# as it reads them, before the noise filter, along with the events it
+# decoded from them. Replaying a trace feeds the edges through
+# GpioSignal and the decoder again on the simulator, as fast as
+# possible or at a multiple of real time, and compares the decoded
+# events with the recorded ones. A change of the decoder can so be
+# checked against every dial captured before:
+#
+#   gpio_trace.py [--adaptive] [--speed N] /var/lib/phony/gpio.trace
+#
+# A trace is a sequence of fixed-size little endian records of
+# RECORD_SIZE bytes:
+#   timestamp uint64  Capture time in nanoseconds on the CLOCK_MONOTONIC
+#                     time base.
+#   pin       uint8   Below SYMBOL_PIN: BCM number of an input pin that
+#                     changed to level.
+#                     SYMBOL_PIN + phone: phone_io decoded an event of
+#                     that phone, level is its character.
+#                     START_PIN: phone_io started. The first record of
+#                     every pin after it holds the level it started at.
+#   level     uint8   See pin.
+#
+# Traces are rotated by size like log files. Records are never split,
+# so the files of a rotated trace read as one, see ReadTrace.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import difflib
+import os
+import struct
+import sys
+
+import event_protocol
+import gpio_backend
+import gpio_simulator
+import log_pipeline
+
+_RECORD = struct.Struct('<QBB')
+RECORD_SIZE = _RECORD.size
+
+SYMBOL_PIN = 0x80
+START_PIN = 0xFF
+
+DEFAULT_MAX_BYTES = 16 << 20
+DEFAULT_BACKUPS = 3
+
+# Simulated seconds before the first edge of a trace that doesn't start
+# with phone_io, so the edge isn't taken for the initial level.
+LEAD_TIME = 0.1
+
+# Simulated seconds replayed after the last record, so the signals
+# settle and the last digit is decoded.
+SETTLE_TIME = 1.0
+
+class TraceWriter:
+  ''' TraceWriter appends records to a trace file rotated by size.
+
+  Records are packed into a buffer until Flush, so all records of one
+  update leave in a single write.
+  '''
+
+  def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES,
+               backups=DEFAULT_BACKUPS):
+    self.file_ = log_pipeline.RotatingFile(path, max_bytes, backups)
+    self.buffer_ = bytearray()
+
+  def Start(self, timestamp):
+    ''' Record the start of phone_io at timestamp in seconds.'''
+    self.buffer_ += _RECORD.pack(int(timestamp * 1e9), START_PIN, 0)
+
+  def Edge(self, timestamp, pin, level):
+    ''' Record a change of pin to level at timestamp in seconds.'''
+    self.buffer_ += _RECORD.pack(int(timestamp * 1e9), pin, level)
+
+  def Symbol(self, timestamp, symbol, phone=0):
+    ''' Record a decoded event of phone at timestamp in seconds.'''
+    self.buffer_ += _RECORD.pack(int(timestamp * 1e9), SYMBOL_PIN + phone,
+                                 ord(symbol))
+
+  def Flush(self):
+    ''' Write all buffered records.'''
+    if self.buffer_:
+      self.file_.write(bytes(self.buffer_))
+      self.file_.flush()
+      del self.buffer_[:]
+
+  def Close(self):
+    self.Flush()
+    self.file_.close()
+
+class TracingLineEvents:
+  ''' Edge events of a port, recorded by a TracingBackend.'''
+
+  def __init__(self, backend, port, line_events):
+    self.backend_ = backend
+    self.port_ = port
+    self.line_events_ = line_events
+
+  def fileno(self):
+    return self.line_events_.fileno()
+
+  def GetValue(self):
+    value = self.line_events_.GetValue()
+    self.backend_.Note(self.port_, value, self.backend_.Now())
+    return value
+
+  def Read(self):
+    edges = self.line_events_.Read()
+    for timestamp, state in edges:
+      self.backend_.Note(self.port_, state, timestamp)
+    return edges
+
+  def Close(self):
+    self.line_events_.Close()
+
+class TracingBackend(gpio_backend.Backend):
+  ''' TracingBackend records the input levels read from another backend
+  in a trace.'''
+
+  def __init__(self, backend, trace):
+    ''' Construct TracingBackend and record the start.
+
+    Args:
+      backend: The gpio_backend.Backend to read from.
+      trace: The TraceWriter to record in.
+    '''
+    self.backend_ = backend
+    self.trace_ = trace
+    # {port: level} last recorded.
+    self.levels_ = {}
+    trace.Start(backend.Now())
+
+  def Note(self, port, level, timestamp):
+    ''' Record level of port unless it's the last one recorded.'''
+    level = int(level != gpio_backend.LOW)
+    if self.levels_.get(port) != level:
+      self.levels_[port] = level
+      self.trace_.Edge(timestamp, port, level)
+
+  def SetupInput(self, port):
+    self.backend_.SetupInput(port)
+
+  def SetupOutput(self, port):
+    self.backend_.SetupOutput(port)
+
+  def Input(self, port):
+    level = self.backend_.Input(port)
+    if self.levels_.get(port) != int(level != gpio_backend.LOW):
+      self.Note(port, level, self.backend_.Now())
+    return level
+
+  def Output(self, port, level):
+    self.backend_.Output(port, level)
+
+  def SupportsEdgeEvents(self):
+    return self.backend_.SupportsEdgeEvents()
+
+  def OpenEdgeEvents(self, port):
+    return TracingLineEvents(self, port, self.backend_.OpenEdgeEvents(port))
+
+  def NextEdgeTime(self):
+    return self.backend_.NextEdgeTime()
+
+  def Now(self):
+    return self.backend_.Now()
+
+  def Cleanup(self):
+    self.backend_.Cleanup()
+
+def TraceFiles(path):
+  ''' TraceFiles returns the files of a trace, its rotated files first,
+  oldest first.'''
+  paths = []
+  i = 1
+  while os.path.exists('%s.%d' % (path, i)):
+    paths.insert(0, '%s.%d' % (path, i))
+    i += 1
+  paths.append(path)
+  return paths
+
+def ReadTrace(path):
+  ''' ReadTrace returns the records of a trace, including its rotated
+  files, as (timestamp, pin, level) tuples in the order written.
+  Timestamps are in nanoseconds.'''
+  records = []
+  for name in TraceFiles(path):
+    with open(name, 'rb') as trace:
+      data = trace.read()
+    # Ignore a record cut short by a crash.
+    for offset in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+      records.append(_RECORD.unpack_from(data, offset))
+  return records
+
+def Segments(records):
+  ''' Segments splits records at every start of phone_io. Each segment
+  is replayed on its own, see Replay.'''
+  segments = []
+  for record in records:
+    if record[1] == START_PIN or not segments:
+      segments.append([])
+    segments[-1].append(record)
+  return segments
+
+def Symbols(records):
+  ''' Symbols returns the decoded events recorded in records as
+  event_protocol.Events. Their pin is unknown and zero.'''
+  return [event_protocol.Event(chr(level), 0, i, timestamp / 1e9,
+                               pin - SYMBOL_PIN)
+          for i, (timestamp, pin, level) in enumerate(
+            r for r in records if SYMBOL_PIN <= r[1] < START_PIN)]
+
+def Replay(records, phones=None, adaptive=False, speed=None):
+  ''' Replay the edges of a segment and return the events decoded.
+
+  Args:
+    records: The records of a segment, see Segments.
+    phones: List of phone_io.PhonePins the trace was captured with.
+      Defaults to a single phone on phone_io.DEFAULT_PINS.
+    adaptive: Decode with a pulse_decoder.AdaptiveDecoder.
+    speed: Replay at this multiple of real time, None for as fast as
+      possible.
+  Returns:
+    The list of event_protocol.Events decoded, their timestamps on the
+    time base of the trace.
+  '''
+  # phone_io records traces with our help, so import it on demand.
+  import phone_io
+  if not records:
+    return []
+  origin = records[0][0]
+  started = records[0][1] == START_PIN
+  if not started:
+    origin -= int(LEAD_TIME * 1e9)
+  backend = gpio_simulator.SimulatedBackend()
+  edges = []
+  pins = set()
+  for timestamp, pin, level in records:
+    if pin >= SYMBOL_PIN:
+      continue
+    if pin not in pins:
+      pins.add(pin)
+      if started:
+        backend.SetInitialLevel(pin, level)
+        continue
+      # Without the start, the first record already is a change.
+      backend.SetInitialLevel(pin, 1 - level)
+    edges.append(((timestamp - origin) / 1e9, pin, level))
+  backend.AddEdges(edges)
+
+  events = []
+  decoder = phone_io.PhoneIO(
+    backend, event_protocol.QueueWriter(events.extend), edge_events=True,
+    phones=phones, adaptive=adaptive)
+  phone_io.Simulate(decoder, backend,
+                    (records[-1][0] - origin) / 1e9 + SETTLE_TIME, speed)
+  decoder.Close()
+  return [e._replace(timestamp=e.timestamp + origin / 1e9) for e in events]
+
+def Compare(expected, actual):
+  ''' Compare returns the unified diff of the symbols of two lists of
+  events, one line per event, or an empty list if they match.'''
+  def Lines(events):
+    return ['%d %s' % (e.phone, e.symbol) for e in events]
+  return list(difflib.unified_diff(Lines(expected), Lines(actual),
+                                   'recorded', 'replayed', lineterm=''))
+
+def main():
+  import phone_io
+  parser = argparse.ArgumentParser(
+    description='Replay GPIO traces of phone_io and compare the events '
+    'decoded with the recorded ones.')
+  parser.add_argument('traces', nargs='+', metavar='trace',
+                      help='Trace file, rotated files are included.')
+  parser.add_argument('--phone', action='append', default=[],
+                      type=phone_io.ParsePins,
+                      help='Pins of a phone as for phone_io.py, in the '
+                      'order of the capture.')
+  parser.add_argument('--adaptive', action='store_true',
+                      help='Decode with the adaptive decoder.')
+  parser.add_argument('--speed', type=float,
+                      help='Replay at this multiple of real time instead '
+                      'of as fast as possible.')
+  args = parser.parse_args()
+
+  differences = 0
+  for path in args.traces:
+    records = ReadTrace(path)
+    segments = Segments(records)
+    events = 0
+    for segment in segments:
+      expected = Symbols(segment)
+      diff = Compare(expected, Replay(segment, args.phone, args.adaptive,
+                                      args.speed))
+      events += len(expected)
+      if diff:
+        differences += 1
+        print('%s: segment starting at %.3fs differs:' % (
+          path, segment[0][0] / 1e9))
+        print('\n'.join(diff))
+    print('%s: %d segments, %d records, %d events' % (
+      path, len(segments), len(records), events))
+  if differences:
+    print('%d segments differ.' % differences)
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
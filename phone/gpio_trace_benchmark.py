@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# Benchmark of GPIO trace capture and replay.
+#
+# Dials random numbers on worn dials (see phone_io_benchmark.py) on the
+# GPIO simulator, once plainly and once recording a trace, to measure
+# what capturing costs and how compact the trace is. The trace is then
+# replayed as fast as possible with the decoder it was captured with,
+# which must decode the same events, and with the adaptive decoder, to
+# show how a decoder change shows up.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import event_protocol
+import gpio_backend
+import gpio_simulator
+import gpio_trace
+import phone_io
+
+def Capture(path, numbers, bounces, seed):
+  ''' Dial numbers, recording a trace in path unless it's None.
+
+  Returns:
+    A tuple (output, simulated, wall) of the decoded events and simulated
+    and wall clock seconds.
+  '''
+  rng = random.Random(seed)
+  backend = gpio_simulator.SimulatedBackend()
+  backend.SetInitialLevel(phone_io.PORT_PULSE, gpio_backend.LOW)
+  start = 1.0
+  for _ in range(numbers):
+    number = ''.join(rng.choice('0123456789') for _ in range(10))
+    edges, start = gpio_simulator.DialEdges(
+      number, start, phone_io.PORT_PULSE, phone_io.PORT_IDLE,
+      pulse_period=rng.uniform(0.09, 0.11),
+      break_ratio=rng.uniform(0.55, 0.7), bounces=bounces)
+    backend.AddEdges(edges)
+
+  output = []
+  trace = None
+  io_backend = backend
+  if path:
+    trace = gpio_trace.TraceWriter(path)
+    io_backend = gpio_trace.TracingBackend(backend, trace)
+  io = phone_io.PhoneIO(io_backend, event_protocol.CharWriter(output.append),
+                        edge_events=True, trace=trace)
+  wall_start = time.time()
+  phone_io.Simulate(io, backend, start + 1)
+  io.Close()
+  return ''.join(output), start + 1, time.time() - wall_start
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Benchmark of GPIO trace capture and replay.')
+  parser.add_argument('--numbers', type=int, default=200)
+  parser.add_argument('--bounces', type=int, default=2)
+  parser.add_argument('--seed', type=int, default=1)
+  args = parser.parse_args()
+
+  directory = tempfile.mkdtemp()
+  try:
+    path = os.path.join(directory, 'gpio.trace')
+    output, simulated, plain = Capture(None, args.numbers, args.bounces,
+                                       args.seed)
+    _, _, traced = Capture(path, args.numbers, args.bounces, args.seed)
+    digits = sum(1 for c in output if c.isdigit())
+    size = os.path.getsize(path)
+    count = size // gpio_trace.RECORD_SIZE
+    print('capture: %d digits in %.0fs simulated, %.2fs plain, %.2fs '
+          'traced, %.1fus per record' % (digits, simulated, plain, traced,
+                                        (traced - plain) / count * 1e6))
+    print('trace:   %d bytes, %d records, %.0f bytes per digit' % (
+      size, count, size / digits))
+
+    wall_start = time.time()
+    records = gpio_trace.ReadTrace(path)
+    read = time.time() - wall_start
+    print('read:    %.3fs, %.0f records/s' % (read, len(records) / read))
+    for name, adaptive in [('plain', False), ('adaptive', True)]:
+      differences = events = 0
+      wall_start = time.time()
+      for segment in gpio_trace.Segments(records):
+        expected = gpio_trace.Symbols(segment)
+        diff = gpio_trace.Compare(
+          expected, gpio_trace.Replay(segment, adaptive=adaptive))
+        events += len(expected)
+        differences += sum(1 for line in diff[2:] if line[0] in '+-')
+      wall = time.time() - wall_start
+      print('replay %-8s %.2fs, %.0fx real time, %.0f digits/s, %d of %d '
+            'events differ' % (name + ':', wall, simulated / wall,
+                               digits / wall, differences, events))
+  finally:
+    shutil.rmtree(directory)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,110 @@
+import event_protocol
+import gpio_backend
+import gpio_simulator
+import gpio_trace
+import os
+import phone_io
+import shutil
+import tempfile
+import unittest
+
+class TestTraceWriter(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'gpio.trace')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_Rotation(self):
+    trace = gpio_trace.TraceWriter(self.path,
+                                   max_bytes=4 * gpio_trace.RECORD_SIZE)
+    trace.Start(1.0)
+    for i in range(9):
+      trace.Edge(1.0 + i, phone_io.PORT_PULSE, i % 2)
+      # Every update is written on its own.
+      trace.Flush()
+    trace.Symbol(10.0, 'p', 1)
+    trace.Close()
+    self.assertTrue(os.path.exists(self.path + '.2'))
+    records = gpio_trace.ReadTrace(self.path)
+    self.assertEqual(11, len(records))
+    self.assertEqual((1000000000, gpio_trace.START_PIN, 0), records[0])
+    self.assertEqual([0, 1], [level for _, _, level in records[1:3]])
+    self.assertEqual('p', gpio_trace.Symbols(records)[0].symbol)
+    self.assertEqual(1, gpio_trace.Symbols(records)[0].phone)
+
+class TestReplay(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'gpio.trace')
+    self.backend = gpio_simulator.SimulatedBackend()
+    self.backend.SetInitialLevel(phone_io.PORT_PULSE, gpio_backend.LOW)
+    self.backend.AddEdges(gpio_simulator.HookEdges(0.5, phone_io.PORT_HOOK,
+                                                   True))
+    edges, end = gpio_simulator.DialEdges(
+      '4096', 1.0, phone_io.PORT_PULSE, phone_io.PORT_IDLE, bounces=2)
+    self.backend.AddEdges(edges)
+    self.backend.AddEdges(gpio_simulator.HookEdges(end, phone_io.PORT_HOOK,
+                                                   False))
+    self.end = end + 1
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def capture(self, edge_events):
+    output = []
+    trace = gpio_trace.TraceWriter(self.path)
+    phone = phone_io.PhoneIO(
+      gpio_trace.TracingBackend(self.backend, trace),
+      event_protocol.CharWriter(output.append), edge_events=edge_events,
+      trace=trace)
+    phone_io.Simulate(phone, self.backend, self.end)
+    phone.Close()
+    return ''.join(output)
+
+  def test_EdgeEvents(self):
+    output = self.capture(True)
+    self.assertEqual('4096', ''.join(c for c in output if c.isdigit()))
+    segments = gpio_trace.Segments(gpio_trace.ReadTrace(self.path))
+    self.assertEqual(1, len(segments))
+    expected = gpio_trace.Symbols(segments[0])
+    self.assertEqual(output, ''.join(e.symbol for e in expected))
+    replayed = gpio_trace.Replay(segments[0])
+    self.assertEqual([], gpio_trace.Compare(expected, replayed))
+    for e, r in zip(expected, replayed):
+      self.assertAlmostEqual(e.timestamp, r.timestamp, places=6)
+
+  def test_Polling(self):
+    output = self.capture(False)
+    self.assertIn('4', output)
+    segment = gpio_trace.Segments(gpio_trace.ReadTrace(self.path))[0]
+    self.assertEqual([], gpio_trace.Compare(gpio_trace.Symbols(segment),
+                                            gpio_trace.Replay(segment)))
+
+  def test_Difference(self):
+    self.capture(True)
+    segment = gpio_trace.Segments(gpio_trace.ReadTrace(self.path))[0]
+    # Lose the pulses of the first digit, between the first two idle
+    # edges.
+    idle = [r[0] for r in segment if r[1] == phone_io.PORT_IDLE]
+    segment = [r for r in segment if r[1] != phone_io.PORT_PULSE or
+               not idle[1] < r[0] < idle[2]]
+    diff = gpio_trace.Compare(gpio_trace.Symbols(segment),
+                              gpio_trace.Replay(segment))
+    self.assertIn('-0 4', diff)
+    self.assertNotIn('-0 9', diff)
+
+  def test_WithoutStart(self):
+    self.capture(True)
+    records = gpio_trace.ReadTrace(self.path)
+    # The beginning of a trace went with a rotated file. Replay from the
+    # idle edge of the first digit.
+    start = [i for i, r in enumerate(records)
+             if r[1] == phone_io.PORT_IDLE][1]
+    records = records[start:]
+    self.assertEqual([], gpio_trace.Compare(gpio_trace.Symbols(records),
+                                            gpio_trace.Replay(records)))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#
+# Logging benchmark.
+#
+# Logs a burst of linphone debug output interleaved with state
+# transitions to a file on a simulated slow SD card, whose writes stall
+# for a while now and then. We compare logging.StreamHandler, which
+# writes on the logging thread, with log_pipeline.QueueHandler with and
+# without rate limiting, and report how long the logging calls take on
+# the main loop's thread.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import logging
+import time
+
+import clock
+import log_pipeline
+
+class SlowFile:
+  ''' A file whose writes stall for stall seconds every stall_every
+  writes, like flash memory erasing a block.'''
+
+  def __init__(self, stall, stall_every):
+    self.stall_ = stall
+    self.stall_every_ = stall_every
+    self.writes_ = 0
+    self.bytes_ = 0
+
+  def write(self, data):
+    self.writes_ += 1
+    self.bytes_ += len(data)
+    if self.writes_ % self.stall_every_ == 0:
+      time.sleep(self.stall_)
+
+  def flush(self):
+    pass
+
+def Run(handler, records, interval):
+  ''' Log records linphone records and a transition every tenth, one
+  every interval seconds. Returns the seconds taken by each call.'''
+  linphone = logging.getLogger('linphone')
+  phony = logging.getLogger('phony')
+  for logger in [linphone, phony]:
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.handlers = [handler]
+  durations = []
+  for i in range(records):
+    start = clock.Monotonic()
+    if i % 10:
+      linphone.info('ICE candidate %d: host 192.168.1.2:%d typ host', i,
+                    7078 + i)
+    else:
+      phony.info('TR: (%s, %s): %s', 'p', 2, 2)
+    durations.append(clock.Monotonic() - start)
+    time.sleep(interval)
+  return durations
+
+def main():
+  parser = argparse.ArgumentParser(description='Logging benchmark.')
+  parser.add_argument('--records', type=int, default=5000)
+  parser.add_argument('--interval', type=float, default=0.0002,
+                      help='Seconds between two records.')
+  parser.add_argument('--stall', type=float, default=0.05,
+                      help='Seconds a stalling write takes.')
+  parser.add_argument('--stall-every', type=int, default=50,
+                      help='Writes between two stalls.')
+  args = parser.parse_args()
+
+  print('%-18s %10s %10s %10s %8s %10s %8s' % (
+    'handler', 'p50', 'p99', 'max', 'writes', 'suppressed', 'dropped'))
+  for name in ['sync', 'pipeline', 'pipeline no limit']:
+    stream = SlowFile(args.stall, args.stall_every)
+    if name == 'sync':
+      handler = logging.StreamHandler(stream)
+    elif name == 'pipeline':
+      handler = log_pipeline.QueueHandler(stream)
+    else:
+      handler = log_pipeline.QueueHandler(stream, rate=1e9, burst=1e9)
+    durations = sorted(Run(handler, args.records, args.interval))
+    suppressed = dropped = 0
+    if name != 'sync':
+      handler.Stop()
+      suppressed = handler.GetSuppressed()
+      dropped = handler.GetDropped()
+    print('%-18s %8.3fms %8.3fms %8.3fms %8d %10d %8d' % (
+      name, durations[len(durations) // 2] * 1000,
+      durations[int(len(durations) * 0.99)] * 1000, durations[-1] * 1000,
+      stream.writes_, suppressed, dropped))
+
+if __name__ == '__main__':
+  main()
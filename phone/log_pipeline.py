@@ -0,0 +1,279 @@
+# Asynchronous logging pipeline.
+#
+# Phony logs every state transition, and linphone can produce bursts of
+# SIP and ICE debug output. Written synchronously to a log file on the
+# SD card, a slow flash write stalls the main loop and with it pulse
+# intake. QueueHandler takes the place of the usual logging handlers:
+#  - Records below the level configured for their source (the logger
+#    name, e.g. 'linphone') are discarded right away.
+#  - Every source has a token bucket. Records beyond its rate are
+#    suppressed, except warnings and errors.
+#  - The rest go into a bounded queue. If it is full, the record is
+#    dropped instead of waiting.
+# A writer thread takes the records off the queue in batches, formats
+# them, writes every batch with a single write and rotates the file
+# when it exceeds a size. Suppressed and dropped records are counted
+# and reported in the log itself.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import atexit
+import collections
+import logging
+import os
+import Queue
+import sys
+import threading
+
+import clock
+
+# Records queued at most.
+DEFAULT_QUEUE_SIZE = 1000
+
+# Records per second and burst allowed per source.
+DEFAULT_RATE = 50
+DEFAULT_BURST = 200
+
+# Records written with one write at most.
+BATCH_SIZE = 100
+
+# Rotate the log file when it exceeds this many bytes, keeping this
+# many old files.
+DEFAULT_MAX_BYTES = 1 << 20
+DEFAULT_BACKUPS = 3
+
+# Seconds between two reports of suppressed and dropped records.
+REPORT_INTERVAL = 10
+
+FORMAT = '%(asctime)s %(levelname)s:%(name)s:%(message)s'
+
+class TokenBucket:
+  ''' TokenBucket allows rate events per second on average, and burst
+  at once.'''
+
+  def __init__(self, rate, burst, now):
+    self.rate_ = rate
+    self.burst_ = burst
+    self.tokens_ = burst
+    self.last_ = now
+
+  def Allow(self, now):
+    ''' Allow returns whether an event at time now is within the rate.'''
+    self.tokens_ = min(self.burst_,
+                       self.tokens_ + (now - self.last_) * self.rate_)
+    self.last_ = now
+    if self.tokens_ < 1:
+      return False
+    self.tokens_ -= 1
+    return True
+
+class RotatingFile:
+  ''' RotatingFile appends to path and rotates it by size, like
+  logging.handlers.RotatingFileHandler.'''
+
+  def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES,
+               backups=DEFAULT_BACKUPS):
+    self.path_ = path
+    self.max_bytes_ = max_bytes
+    self.backups_ = backups
+    self.file_ = open(path, 'a')
+    self.size_ = self.file_.tell()
+
+  def write(self, data):
+    if self.max_bytes_ and self.size_ and (
+        self.size_ + len(data) > self.max_bytes_):
+      self.rotate_()
+    self.file_.write(data)
+    self.size_ += len(data)
+
+  def flush(self):
+    self.file_.flush()
+
+  def close(self):
+    self.file_.close()
+
+  def rotate_(self):
+    self.file_.close()
+    for i in range(self.backups_ - 1, 0, -1):
+      source = '%s.%d' % (self.path_, i)
+      if os.path.exists(source):
+        os.rename(source, '%s.%d' % (self.path_, i + 1))
+    if self.backups_:
+      os.rename(self.path_, self.path_ + '.1')
+    else:
+      os.remove(self.path_)
+    self.file_ = open(self.path_, 'a')
+    self.size_ = 0
+
+class FlushRequest:
+  ''' Queued by Flush, done is set once everything before is written.'''
+
+  def __init__(self):
+    self.done = threading.Event()
+
+class QueueHandler(logging.Handler):
+  ''' QueueHandler hands records to a writer thread, see above.'''
+
+  def __init__(self, stream, levels=None, rate=DEFAULT_RATE,
+               burst=DEFAULT_BURST, queue_size=DEFAULT_QUEUE_SIZE,
+               time_function=clock.Monotonic):
+    ''' Construct QueueHandler instance and start its writer.
+
+    Args:
+      stream: File-like object the writer writes to, e.g. a
+        RotatingFile. Only the writer thread touches it.
+      levels: {source: level} of the minimum level per logger name.
+        Sources not listed pass everything the logger passes.
+      rate, burst: Records per second and burst allowed per source.
+      queue_size: Records queued at most.
+      time_function: Returns the current time in seconds.
+    '''
+    logging.Handler.__init__(self)
+    self.setFormatter(logging.Formatter(FORMAT))
+    self.stream_ = stream
+    self.levels_ = levels or {}
+    self.rate_ = rate
+    self.burst_ = burst
+    self.time_function_ = time_function
+    self.queue_ = Queue.Queue(queue_size)
+    self.buckets_ = {}
+    # {source: records} suppressed and dropped since the last report,
+    # and in total. Protected by counts_lock_.
+    self.counts_lock_ = threading.Lock()
+    self.suppressed_ = collections.Counter()
+    self.dropped_ = collections.Counter()
+    self.total_suppressed_ = 0
+    self.total_dropped_ = 0
+    self.last_report_ = time_function()
+    self.writer_ = threading.Thread(target=self.write_, name='log')
+    self.writer_.daemon = True
+    self.writer_.start()
+    # Python 2 tears down module globals under running daemon threads.
+    atexit.register(self.Stop)
+
+  def GetSuppressed(self):
+    ''' GetSuppressed returns the records suppressed by rate limiting.'''
+    return self.total_suppressed_
+
+  def GetDropped(self):
+    ''' GetDropped returns the records dropped because the queue was
+    full.'''
+    return self.total_dropped_
+
+  def emit(self, record):
+    source = record.name
+    if record.levelno < self.levels_.get(source, logging.NOTSET):
+      return
+    now = self.time_function_()
+    bucket = self.buckets_.get(source)
+    if bucket is None:
+      bucket = TokenBucket(self.rate_, self.burst_, now)
+      self.buckets_[source] = bucket
+    if not bucket.Allow(now) and record.levelno < logging.WARNING:
+      self.count_(source, suppressed=True)
+      return
+    try:
+      self.queue_.put_nowait(record)
+    except Queue.Full:
+      self.count_(source, suppressed=False)
+
+  def Flush(self, timeout=None):
+    ''' Wait until the queued records are written.'''
+    request = FlushRequest()
+    try:
+      self.queue_.put(request, timeout=timeout)
+    except Queue.Full:
+      return
+    request.done.wait(timeout)
+
+  def Stop(self, timeout=1):
+    ''' Write the queued records and stop the writer.'''
+    try:
+      self.queue_.put(None, timeout=timeout)
+    except Queue.Full:
+      return
+    self.writer_.join(timeout)
+
+  def close(self):
+    self.Flush(1)
+    logging.Handler.close(self)
+
+  def count_(self, source, suppressed):
+    with self.counts_lock_:
+      if suppressed:
+        self.suppressed_[source] += 1
+        self.total_suppressed_ += 1
+      else:
+        self.dropped_[source] += 1
+        self.total_dropped_ += 1
+
+  def write_(self):
+    ''' The writer thread.'''
+    empty = Queue.Empty
+    stopped = False
+    while not stopped:
+      try:
+        # Wake up for the report even if nothing is logged.
+        batch = [self.queue_.get(timeout=REPORT_INTERVAL)]
+      except empty:
+        batch = []
+      while len(batch) < BATCH_SIZE:
+        try:
+          batch.append(self.queue_.get_nowait())
+        except empty:
+          break
+      lines = []
+      flushes = []
+      for item in batch:
+        if item is None:
+          # Stop, after writing the batch.
+          stopped = True
+          continue
+        if isinstance(item, FlushRequest):
+          flushes.append(item.done)
+          continue
+        try:
+          lines.append(self.format(item) + '\n')
+        except Exception:
+          self.handleError(item)
+      report = self.report_()
+      if report:
+        lines.append(report)
+      if lines:
+        try:
+          self.stream_.write(''.join(lines))
+          self.stream_.flush()
+        except (IOError, OSError) as e:
+          # There's nowhere left to log to, don't take the process down.
+          sys.stderr.write('Log write failed: %s\n' % e)
+      for done in flushes:
+        done.set()
+
+  def report_(self):
+    ''' Returns a log line reporting the records suppressed and dropped
+    since the last report, if it is due and there are any.'''
+    now = self.time_function_()
+    if now - self.last_report_ < REPORT_INTERVAL:
+      return None
+    with self.counts_lock_:
+      suppressed, self.suppressed_ = self.suppressed_, collections.Counter()
+      dropped, self.dropped_ = self.dropped_, collections.Counter()
+    self.last_report_ = now
+    if not suppressed and not dropped:
+      return None
+    def Describe(counter):
+      return ', '.join('%s: %d' % (source, count)
+                       for source, count in sorted(counter.items())) or '-'
+    record = logging.LogRecord(
+      'log', logging.WARNING, __file__, 0,
+      'Suppressed records (rate limit) %s, dropped records (queue full) %s',
+      (Describe(suppressed), Describe(dropped)), None)
+    return self.format(record) + '\n'
+
+def Install(handler, level=logging.INFO):
+  ''' Route all logging through handler.'''
+  root = logging.getLogger()
+  root.addHandler(handler)
+  root.setLevel(level)
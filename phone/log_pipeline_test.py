@@ -0,0 +1,101 @@
+import log_pipeline
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+class BlockingStream:
+  ''' Collects writes, blocking them until released.'''
+
+  def __init__(self):
+    self.data = ''
+    self.writing = threading.Event()
+    self.released = threading.Event()
+
+  def write(self, data):
+    self.writing.set()
+    self.released.wait()
+    self.data += data
+
+  def flush(self):
+    pass
+
+class TestQueueHandler(unittest.TestCase):
+  def setUp(self):
+    self.now = 0.0
+    self.stream = BlockingStream()
+    self.stream.released.set()
+
+  def createLogger(self, name, handler):
+    logger = logging.getLogger('log_pipeline_test.' + name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.handlers = [handler]
+    return logger
+
+  def test_LevelAndRate(self):
+    handler = log_pipeline.QueueHandler(
+      self.stream, levels={'log_pipeline_test.linphone': logging.WARNING},
+      rate=10, burst=5, time_function=lambda: self.now)
+    linphone = self.createLogger('linphone', handler)
+    phony = self.createLogger('phony', handler)
+    linphone.info('filtered')
+    linphone.warning('kept')
+    for i in range(10):
+      phony.info('burst %d', i)
+    phony.error('errors are never suppressed')
+    self.now += 0.1
+    phony.info('one more after 100ms')
+    handler.Flush()
+    lines = self.stream.data.splitlines()
+    self.assertEqual(8, len(lines))
+    self.assertIn('WARNING:log_pipeline_test.linphone:kept', lines[0])
+    self.assertIn('burst 3', lines[4])
+    self.assertIn('errors are never suppressed', lines[6])
+    self.assertIn('one more after 100ms', lines[7])
+    self.assertEqual(5, handler.GetSuppressed())
+    self.assertEqual(0, handler.GetDropped())
+
+  def test_QueueFull(self):
+    self.stream.released.clear()
+    handler = log_pipeline.QueueHandler(self.stream, queue_size=3,
+                                        time_function=lambda: self.now)
+    logger = self.createLogger('full', handler)
+    # The writer takes one record and blocks writing it, three more fit
+    # into the queue.
+    logger.info('first')
+    self.stream.writing.wait()
+    for i in range(10):
+      logger.info('queued %d', i)
+    self.assertEqual(7, handler.GetDropped())
+    self.stream.released.set()
+    handler.Flush()
+    self.now += log_pipeline.REPORT_INTERVAL
+    logger.info('last')
+    handler.Flush()
+    self.assertIn('dropped records (queue full) log_pipeline_test.full: 7',
+                  self.stream.data)
+    self.assertEqual(6, len(self.stream.data.splitlines()))
+
+class TestRotatingFile(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_Rotate(self):
+    path = os.path.join(self.dir, 'phony.log')
+    log = log_pipeline.RotatingFile(path, max_bytes=10, backups=2)
+    for data in ['aaaaaa\n', 'bbbbbb\n', 'cccccc\n', 'dddddd\n']:
+      log.write(data)
+    log.close()
+    self.assertEqual('dddddd\n', open(path).read())
+    self.assertEqual('cccccc\n', open(path + '.1').read())
+    self.assertEqual('bbbbbb\n', open(path + '.2').read())
+    self.assertFalse(os.path.exists(path + '.3'))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,208 @@
+# Metrics in the Prometheus text format.
+#
+# The hot paths only bump plain counters and fixed-bucket Histograms,
+# which are preallocated. A Registry knows how to collect them and
+# renders a snapshot only when it is scraped, so the cost of naming and
+# formatting is paid per scrape, not per edge.
+#
+# MetricsServer serves the snapshot over HTTP on a TCP port or a Unix
+# socket, e.g.
+#   curl --unix-socket /run/phony-metrics.sock http://localhost/metrics
+# It doesn't have a thread of its own: its sockets are polled by the
+# owner's loop, so collecting needs no locks.
+#
+# coding=utf-8
+
+import bisect
+import errno
+import os
+import socket
+
+# Seconds a scrape may take to send its request.
+REQUEST_TIMEOUT = 0.5
+
+# Prefix of Unix socket addresses, see MetricsServer.
+UNIX_PREFIX = 'unix:'
+
+class Histogram:
+  ''' Histogram counts observations in fixed buckets.'''
+
+  def __init__(self, buckets):
+    ''' Construct Histogram instance.
+
+    Args:
+      buckets: Sorted upper bounds of the buckets. Observations above
+               the last bound are only counted in the implicit +Inf
+               bucket.
+    '''
+    self.buckets_ = tuple(buckets)
+    self.counts_ = [0] * (len(self.buckets_) + 1)
+    self.sum_ = 0.0
+
+  def Observe(self, value):
+    # bisect_left puts a value equal to a bound into that bound's bucket,
+    # which matches the le semantics of Prometheus.
+    self.counts_[bisect.bisect_left(self.buckets_, value)] += 1
+    self.sum_ += value
+
+  def GetBuckets(self):
+    return self.buckets_
+
+  def GetCounts(self):
+    ''' GetCounts returns the (non-cumulative) count per bucket, the last
+    one being +Inf.'''
+    return self.counts_
+
+  def GetCount(self):
+    return sum(self.counts_)
+
+  def GetSum(self):
+    return self.sum_
+
+def _Labels(labels, extra=None):
+  ''' Returns labels formatted as {a="1",b="2"}, empty without labels.'''
+  items = sorted(labels.items())
+  if extra:
+    items.append(extra)
+  if not items:
+    return ''
+  return '{%s}' % ','.join(
+    '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+    for k, v in items)
+
+def _Value(value):
+  if isinstance(value, float):
+    return repr(value)
+  return str(value)
+
+class Registry:
+  ''' Registry holds the metrics to render and how to collect them.'''
+
+  def __init__(self):
+    # [(name, type, help, collect)]
+    self.metrics_ = []
+
+  def AddCounter(self, name, help, collect):
+    ''' Add a counter.
+
+    Args:
+      name: Metric name, should end in _total.
+      help: One line of documentation.
+      collect: Function returning [(labels dict, value)].
+    '''
+    self.metrics_.append((name, 'counter', help, collect))
+
+  def AddGauge(self, name, help, collect):
+    ''' Add a gauge, see AddCounter.'''
+    self.metrics_.append((name, 'gauge', help, collect))
+
+  def AddHistogram(self, name, help, collect):
+    ''' Add a histogram.
+
+    Args:
+      name: Metric name.
+      help: One line of documentation.
+      collect: Function returning [(labels dict, Histogram)].
+    '''
+    self.metrics_.append((name, 'histogram', help, collect))
+
+  def Render(self):
+    ''' Render returns a snapshot of all metrics in the text format.'''
+    lines = []
+    for name, kind, help, collect in self.metrics_:
+      lines.append('# HELP %s %s' % (name, help))
+      lines.append('# TYPE %s %s' % (name, kind))
+      for labels, value in collect():
+        if kind != 'histogram':
+          lines.append('%s%s %s' % (name, _Labels(labels), _Value(value)))
+          continue
+        total = 0
+        for bound, count in zip(value.GetBuckets() + ('+Inf',),
+                                value.GetCounts()):
+          total += count
+          lines.append('%s_bucket%s %d' % (
+            name, _Labels(labels, ('le', _Value(bound))), total))
+        lines.append('%s_sum%s %r' % (name, _Labels(labels),
+                                      value.GetSum()))
+        lines.append('%s_count%s %d' % (name, _Labels(labels), total))
+    return '\n'.join(lines) + '\n'
+
+def _Listen(address):
+  ''' Returns a listening socket for address, see MetricsServer.'''
+  if address.startswith(UNIX_PREFIX):
+    path = address[len(UNIX_PREFIX):]
+    try:
+      os.unlink(path)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+  else:
+    host, _, port = address.rpartition(':')
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host or '127.0.0.1', int(port)))
+  sock.listen(4)
+  sock.setblocking(False)
+  return sock
+
+class MetricsServer:
+  ''' MetricsServer answers every HTTP request with a snapshot of a
+  Registry.'''
+
+  def __init__(self, registry, address):
+    ''' Construct MetricsServer instance and start listening.
+
+    Args:
+      registry: The Registry to render.
+      address: unix:<path> for a Unix socket, otherwise [host:]port.
+               The host defaults to localhost.
+
+    Raises:
+      socket.error, OSError: We can't listen on address.
+    '''
+    self.registry_ = registry
+    self.address_ = address
+    self.socket_ = _Listen(address)
+
+  def fileno(self):
+    ''' The descriptor is readable when a scrape is waiting.'''
+    return self.socket_.fileno()
+
+  def GetAddress(self):
+    ''' GetAddress returns the address actually listened on.'''
+    return self.socket_.getsockname()
+
+  def Process(self):
+    ''' Answer all waiting scrapes.'''
+    while True:
+      try:
+        connection, _ = self.socket_.accept()
+      except socket.error as e:
+        if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+          return
+        raise
+      try:
+        connection.settimeout(REQUEST_TIMEOUT)
+        # We serve the same document for every path, the request only
+        # needs to be read.
+        connection.recv(4096)
+        body = self.registry_.Render()
+        connection.sendall(
+          'HTTP/1.0 200 OK\r\n'
+          'Content-Type: text/plain; version=0.0.4\r\n'
+          'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+      except socket.error:
+        # The scraper went away, it will try again.
+        pass
+      finally:
+        connection.close()
+
+  def Close(self):
+    self.socket_.close()
+    if self.address_.startswith(UNIX_PREFIX):
+      try:
+        os.unlink(self.address_[len(UNIX_PREFIX):])
+      except OSError:
+        pass
@@ -0,0 +1,55 @@
+import metrics
+import os
+import socket
+import tempfile
+import unittest
+
+class TestMetrics(unittest.TestCase):
+  def test_Histogram(self):
+    h = metrics.Histogram([0.1, 0.2])
+    for value in [0.05, 0.1, 0.15, 0.5]:
+      h.Observe(value)
+    self.assertEqual([2, 1, 1], h.GetCounts())
+    self.assertEqual(4, h.GetCount())
+    self.assertAlmostEqual(0.8, h.GetSum())
+
+  def test_Render(self):
+    h = metrics.Histogram([0.1])
+    h.Observe(0.05)
+    h.Observe(1)
+    registry = metrics.Registry()
+    registry.AddCounter('edges_total', 'Edges.',
+                        lambda: [({'port': 4}, 3), ({'port': 17}, 0)])
+    registry.AddHistogram('width_seconds', 'Width.',
+                          lambda: [({'phone': 0}, h)])
+    self.assertEqual(
+      '# HELP edges_total Edges.\n'
+      '# TYPE edges_total counter\n'
+      'edges_total{port="4"} 3\n'
+      'edges_total{port="17"} 0\n'
+      '# HELP width_seconds Width.\n'
+      '# TYPE width_seconds histogram\n'
+      'width_seconds_bucket{phone="0",le="0.1"} 1\n'
+      'width_seconds_bucket{phone="0",le="+Inf"} 2\n'
+      'width_seconds_sum{phone="0"} 1.05\n'
+      'width_seconds_count{phone="0"} 2\n',
+      registry.Render())
+
+  def test_UnixSocketServer(self):
+    registry = metrics.Registry()
+    registry.AddGauge('up', 'Up.', lambda: [({}, 1)])
+    path = os.path.join(tempfile.mkdtemp(), 'metrics.sock')
+    server = metrics.MetricsServer(registry, metrics.UNIX_PREFIX + path)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    client.sendall('GET /metrics HTTP/1.0\r\n\r\n')
+    server.Process()
+    response = client.recv(4096)
+    client.close()
+    server.Close()
+    self.assertTrue(response.startswith('HTTP/1.0 200 OK'))
+    self.assertTrue(response.endswith('\nup 1\n'))
+    self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -12,166 +12,795 @@
 #  's': Dial has been moved from idle position
 #  'e': Dial has reached idle position
 #  'p': A single dial pulse has been received
+#  'x': The pulse timing of the digit just reported was inconsistent,
+#       see --adaptive
+#  'h': Heartbeat, written every --heartbeat seconds so Phony can tell
+#       a stalled phone_io from a quiet phone
+#
+# The output is written in the protocol selected with --protocol, see
+# event_protocol.py. By default, each event is a single character.
 #
 # Input:
+#  '0' - '9': Select the cadence of the following ring sequences, an
+#             index into the --cadence arguments (1 for the first). '0'
+#             selects the default cadence.
 #  's': Start (the configured) ring sequence.
 #  'e': End ring sequence.
+#  'q': Report the hook of the phone as 'l' or 'd' and the dial as 'e'
+#       (at rest) or 's' (off normal), whichever they are. Phony asks
+#       after restarting phone_io to resynchronize.
+#  'P' followed by '0' - '9': Apply the following commands to the phone
+#             with that index, see below. Phone 0 is selected initially.
+#
+# phone_io can drive several phones, one per --phone argument, each
+# with its own set of pins. Their events are told apart by the phone
+# field of the framed protocol, which is the index of the --phone
+# argument. Without --phone, a single phone on the default pins is used.
 #
 # While l and d can always be triggered, the other outputs
 # form a sequence matching this regular expression:
-# sp*e[0-9]?
+# sp*e([0-9]x?)?
 # If you get any other reading from this routine after filtering
 # out 'l' and 'd', you are probably dealing with a hardware problem.
 #
+# With --adaptive, the pulses are decoded by pulse_decoder.AdaptiveDecoder,
+# which learns the timing of each dial, discards contact bounce outlasting
+# the noise filter and flags digits with irregular pulses.
+#
+# With --metrics, pulse timing, noise filter, loop and bell statistics
+# are served in the Prometheus text format, see metrics.py.
+#
+# With --trace, every level change of the input pins and every event
+# decoded from them is recorded in a compact binary trace, which
+# gpio_trace.py replays through the decoder to check changes of it.
+#
+# The pins are accessed through a gpio_backend.Backend, selected with
+# the PHONY_GPIO_BACKEND environment variable. With the simulator, this
+# runs on any Linux box.
+#
+# Phony can also run PhoneIO on a thread of its own process instead of
+# this daemon, see PhoneIOThread. Events and commands then stay in
+# memory.
+#
 # coding=utf-8
 
-import datetime
+import argparse
+import collections
+import errno
+import event_protocol
 import fcntl
 import os
+import select
 import sys
+import threading
 import time
-import RPi.GPIO as GPIO
+import traceback
 
+import bell
+import clock
+import gpio_backend
 import gpio_signal
+import gpio_trace
+import metrics
+import pulse_decoder
 
 # After DIGIT_TIMEOUT seconds of being in low state, we
 # consider one digit to be done.
 DIGIT_TIMEOUT = 0.5
 
-# Sleep time in seconds between state polling iterations.
+# Sleep time in seconds between state polling iterations. Only used if
+# edge events are not available.
 LOOP_SLEEP_TIME = 0.01
 
+# Set this environment variable to 0 to poll the input pins instead of
+# using edge events.
+EDGE_EVENTS_ENV = 'PHONY_EDGE_EVENTS'
+
 # Input ports:
 PORT_PULSE = 4 # Receives pulses while dialing a digit.
 PORT_IDLE = 17 # Receives dial idle signal.
 PORT_HOOK = 27 # Receices the hook signal.
 
-# Output ports:
-PORT_RING_ENABLE = 25 # Enable / disable ring magnet.
-PORT_RING_LEFT = 24   # Enable / disable left bell.
-PORT_RING_RIGHT = 23  # Enable / disable right bell.
+# The bell's output ports are defined in bell.py.
+
+# The pins of a phone, in --phone order.
+PhonePins = collections.namedtuple('PhonePins', [
+  'pulse', 'idle', 'hook', 'ring_enable', 'ring_left', 'ring_right'])
+
+DEFAULT_PINS = PhonePins(PORT_PULSE, PORT_IDLE, PORT_HOOK,
+                         *bell.DEFAULT_RING_PINS)
 
-# Expresses the frequency of the ring signal:
-# Frequency = 1 / (2 * RING_PULSE).
-RING_PULSE_TIME = 0.05
+# At most this many phones can be addressed with the 'P' command.
+MAX_PHONES = 10
 
-# Sleep time in seconds between ring sequences.
-RING_SLEEP_TIME = 2
+# Buckets in seconds of the pulse width and gap histograms. A dial
+# produces 10 pulses per second, about 60ms break and 40ms make.
+PULSE_BUCKETS = [0.01, 0.02, 0.03, 0.04, 0.05, 0.06, 0.07, 0.08, 0.1, 0.15,
+                 0.2]
 
-# Active time of the bell in seconds.
-RING_ACTIVE_TIME = 1
+# Buckets in seconds of how late loop iterations wake up after their
+# deadline.
+LATE_BUCKETS = [0.0001, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1]
 
-def GetRingState(time_diff):
-  ''' GetRingState calculates the status of the bell.
+# The simulated clock advances at least this far per step, so floating
+# point rounding can't make the simulation stall.
+SIMULATION_MIN_STEP = 1e-6
+
+def ParsePins(spec):
+  ''' Returns the PhonePins described by spec.
 
   Args:
-    time_diff: The timestamp to use to do the calculation.
-  Returns:
-    One of three status values:
-      0: Bell is off
-      1: Left bell
-      2: Right bell
+    spec: Comma separated BCM pin numbers in PhonePins order, e.g.
+          '4,17,27,25,24,23' for the default pins.
+
+  Raises:
+    ValueError: spec is malformed.
   '''
-  sequence_duration = RING_ACTIVE_TIME + RING_SLEEP_TIME 
-  time_in_seq = time_diff.total_seconds() % sequence_duration
-  if time_in_seq > RING_ACTIVE_TIME:
-    # Exceeded the active time of the cycle. Bell is off.
-    return 0
-  # We alternate between 1 and 2 with every ring pulse.
-  return int(time_in_seq / RING_PULSE_TIME) % 2 + 1
-
-try:
-  GPIO.setmode(GPIO.BCM)
-
-  # Setup out pins for bell.
-  GPIO.setup(PORT_RING_ENABLE, GPIO.OUT)
-  GPIO.setup(PORT_RING_LEFT, GPIO.OUT)
-  GPIO.setup(PORT_RING_RIGHT, GPIO.OUT)
-
-  # Create file objects without buffering, so all I/O we produce
-  # or receive is effective immediately. Also set char_in to non-blocking,
-  # so we can poll it just like the other inputs.
-  char_out = os.fdopen(sys.stdout.fileno(), 'wb', 0)
-  char_in = os.fdopen(sys.stdin.fileno(), 'rb', 0)
-  char_in_flags = fcntl.fcntl(sys.stdin.fileno(), fcntl.F_GETFL)
-  fcntl.fcntl(sys.stdin.fileno(), fcntl.F_SETFL, char_in_flags | os.O_NONBLOCK)
-  
-  current_number = 0
-  start_time = datetime.datetime.now()
-  
-  pulse_signal = gpio_signal.GpioSignal(PORT_PULSE, start_time)
-  idle_signal = gpio_signal.GpioSignal(PORT_IDLE, start_time)
-  hook_signal = gpio_signal.GpioSignal(PORT_HOOK, start_time)
-
-  # Start with the bell off.
-  previous_bell_state = 0
-
-  # Bell is not rining by default.
-  bell_ringing = False
-  
-  while True:
-    new_time = datetime.datetime.now()
+  try:
+    pins = [int(p) for p in spec.split(',')]
+  except ValueError:
+    raise ValueError('Invalid pins %r' % spec)
+  if len(pins) != len(PhonePins._fields):
+    raise ValueError('Expected %d pins, got %r' %
+                     (len(PhonePins._fields), spec))
+  return PhonePins(*pins)
 
-    input = []
-    try:
-      input = char_in.read()
-    except:
-      pass
-    for i in input:
-      if i == 's':
-        bell_ringing = True
+class Handset:
+  ''' Handset holds the signals, bell and decoding state of one phone.'''
+
+  def __init__(self, index, pins, backend, start_time, edge_events,
+               cadences, adaptive):
+    self.index_ = index
+    self.bell_ = bell.Bell(backend, cadences, bell.RingPins(
+      pins.ring_enable, pins.ring_left, pins.ring_right))
+    # Cadence index used by the next ring sequence.
+    self.cadence_ = 0
+    self.current_number_ = 0
+    # Start of the current pulse and end of the previous one of the digit
+    # being dialed, None if unknown.
+    self.pulse_start_ = None
+    self.pulse_end_ = None
+    self.pulse_width_ = metrics.Histogram(PULSE_BUCKETS)
+    self.pulse_gap_ = metrics.Histogram(PULSE_BUCKETS)
+    # Number of digits decoded, by digit.
+    self.digits_ = [0] * 10
+    self.signals_ = [
+      gpio_signal.GpioSignal(port, start_time, edge_events=edge_events,
+                             backend=backend)
+      for port in [pins.pulse, pins.idle, pins.hook]]
+    self.pulse_signal_, self.idle_signal_, self.hook_signal_ = self.signals_
+    # The dial was off normal when we started, so we missed the start of
+    # the digit being dialed and must not report it.
+    self.partial_digit_ = not self.idle_signal_.GetState()
+    # pulse_decoder.AdaptiveDecoder, None when decoding plainly.
+    self.decoder_ = None
+    if adaptive:
+      self.decoder_ = pulse_decoder.AdaptiveDecoder(
+        self.pulse_signal_.GetMinSignalDist(), self.pulse_width_,
+        self.pulse_gap_)
+
+class PhoneIO:
+  ''' PhoneIO decodes the phone's inputs and drives its bell.
+
+  Decoded events are passed to a writer (see event_protocol), commands
+  are passed in with ProcessCommands. Time is taken from the backend, so a
+  simulated backend can drive PhoneIO faster than real time.
+  '''
+
+  def __init__(self, backend, writer, edge_events=False, cadences=None,
+               bell_thread=False, phones=None, adaptive=False,
+               heartbeat=None, trace=None):
+    ''' Construct PhoneIO and set up the pins.
+
+    Args:
+      backend: The gpio_backend.Backend to use.
+      writer: Receives the produced events, see event_protocol.FrameWriter.
+      edge_events: Use edge events instead of polling the input pins.
+        Raises IOError or OSError if they are not available.
+      cadences: List of bell.Cadence selectable with the commands '1'
+                to '9'.
+      bell_thread: Drive the bells from a single thread of their own
+                   rather than from Update. Needs a backend running in
+                   real time.
+      phones: List of PhonePins, one per phone. Defaults to a single
+              phone on DEFAULT_PINS.
+      adaptive: Decode pulses with a pulse_decoder.AdaptiveDecoder per
+                phone.
+      heartbeat: Seconds between two heartbeat events, None for none.
+      trace: gpio_trace.TraceWriter the decoded events are recorded in,
+             next to the edges recorded by a gpio_trace.TracingBackend.
+             Closed by Close.
+    '''
+    self.backend_ = backend
+    self.writer_ = writer
+    self.trace_ = trace
+    self.edge_events_ = edge_events
+    self.start_time_ = backend.Now()
+
+    phones = phones or [DEFAULT_PINS]
+    if len(phones) > MAX_PHONES:
+      raise ValueError('At most %d phones are supported' % MAX_PHONES)
+    self.handsets_ = [
+      Handset(i, pins, backend, self.start_time_, edge_events, cadences,
+              adaptive)
+      for i, pins in enumerate(phones)]
+    # All signals and their handsets, polled and selected on together.
+    self.signals_ = []
+    self.signal_handsets_ = []
+    for handset in self.handsets_:
+      self.signals_ += handset.signals_
+      self.signal_handsets_ += [handset] * len(handset.signals_)
+
+    self.bell_thread_ = None
+    if bell_thread:
+      self.bell_thread_ = bell.BellThread(
+        [h.bell_ for h in self.handsets_], backend)
+    # Handset the commands apply to, and whether the next digit selects it.
+    self.handset_ = self.handsets_[0]
+    self.selecting_ = False
+    # How late Run wakes up after its deadlines.
+    self.late_ = metrics.Histogram(LATE_BUCKETS)
+    self.iterations_ = 0
+    self.heartbeat_ = heartbeat
+    self.next_heartbeat_ = None
+    if heartbeat:
+      self.next_heartbeat_ = self.start_time_
+
+  def GetSignals(self):
+    ''' GetSignals returns the pulse, idle and hook signal of every
+    phone.'''
+    return self.signals_
+
+  def GetBellStats(self, phone=0):
+    ''' GetBellStats returns the timing statistics of the bell of phone.'''
+    return self.handsets_[phone].bell_.GetStats()
+
+  def RegisterMetrics(self, registry):
+    ''' Add the statistics of the signals, the decoder, the loop and the
+    bells to the metrics.Registry registry.'''
+    def Signals(get):
+      return lambda: [
+        ({'phone': h.index_, 'port': s.GetPort()}, get(s))
+        for h in self.handsets_ for s in h.signals_]
+    def Handsets(get):
+      return lambda: [({'phone': h.index_}, get(h)) for h in self.handsets_]
+    registry.AddCounter(
+      'phony_gpio_edges_accepted_total',
+      'State changes accepted by the noise filter.',
+      Signals(lambda s: s.GetAccepted()))
+    registry.AddCounter(
+      'phony_gpio_edges_rejected_total',
+      'Edges rejected by the noise filter (polls, when polling).',
+      Signals(lambda s: s.GetRejected()))
+    registry.AddHistogram(
+      'phony_pulse_width_seconds', 'Width of dial pulses.',
+      Handsets(lambda h: h.pulse_width_))
+    registry.AddHistogram(
+      'phony_pulse_gap_seconds', 'Gap between the pulses of a digit.',
+      Handsets(lambda h: h.pulse_gap_))
+    registry.AddCounter(
+      'phony_digits_decoded_total', 'Digits decoded from the dial.',
+      lambda: [({'phone': h.index_, 'digit': d}, h.digits_[d])
+               for h in self.handsets_ for d in range(10)])
+    adaptive = [h for h in self.handsets_ if h.decoder_]
+    if adaptive:
+      def Decoders(get):
+        return lambda: [({'phone': h.index_}, get(h.decoder_))
+                        for h in adaptive]
+      registry.AddCounter(
+        'phony_pulse_glitches_total',
+        'Pulses and gaps too short for the dial, discarded as bounce.',
+        Decoders(lambda d: d.GetGlitches()))
+      registry.AddCounter(
+        'phony_digits_flagged_total',
+        'Digits with inconsistent pulse timing.',
+        Decoders(lambda d: d.GetFlagged()))
+      registry.AddGauge(
+        'phony_dial_period_seconds', 'Estimated time per dial pulse.',
+        Decoders(lambda d: d.GetPeriod()))
+      registry.AddGauge(
+        'phony_dial_break_ratio',
+        'Estimated fraction of the pulse period the contact is open.',
+        Decoders(lambda d: d.GetBreakRatio()))
+      registry.AddGauge(
+        'phony_pulse_debounce_seconds',
+        'Noise filter window of the pulse contact.',
+        Decoders(lambda d: d.GetWindow()))
+    registry.AddCounter(
+      'phony_loop_iterations_total', 'Iterations of the phone_io loop.',
+      lambda: [({}, self.iterations_)])
+    registry.AddHistogram(
+      'phony_loop_late_seconds',
+      'How late the phone_io loop woke up after its deadline.',
+      lambda: [({}, self.late_)])
+    registry.AddHistogram(
+      'phony_bell_error_seconds',
+      'How late bell half-cycles were applied.',
+      Handsets(lambda h: h.bell_.GetStats().GetErrors()))
+
+  def Close(self):
+    ''' Switch the bell off, stop its thread and close the trace.'''
+    if self.bell_thread_:
+      self.bell_thread_.Close()
+    if self.trace_:
+      self.trace_.Close()
+
+  def ProcessCommands(self, commands):
+    ''' Process commands received from Phony.
+
+    Args:
+      commands: A string of command characters.
+    '''
+    for i in commands:
+      handset = self.handset_
+      if self.selecting_:
+        self.selecting_ = False
+        if i.isdigit() and int(i) < len(self.handsets_):
+          self.handset_ = self.handsets_[int(i)]
+          continue
+        sys.stderr.write('Ignoring selection of unknown phone %r\n' % i)
+      if i == 'P':
+        self.selecting_ = True
+      elif i.isdigit():
+        handset.cadence_ = int(i)
+      elif i == 's':
+        if self.bell_thread_:
+          self.bell_thread_.Start(handset.cadence_, handset.index_)
+        else:
+          handset.bell_.Start(handset.cadence_, self.backend_.Now())
       elif i == 'e':
-        bell_ringing = False
+        if self.bell_thread_:
+          self.bell_thread_.Stop(handset.index_)
+        else:
+          handset.bell_.Stop(self.backend_.Now())
+      elif i == 'q':
+        now = self.backend_.Now()
+        self.writer_.Write(
+          'd' if handset.hook_signal_.GetState() else 'l',
+          handset.hook_signal_.GetPort(), now, handset.index_)
+        self.writer_.Write(
+          'e' if handset.idle_signal_.GetState() else 's',
+          handset.idle_signal_.GetPort(), now, handset.index_)
 
-    if bell_ringing:     
-      new_bell_state = GetRingState(new_time - start_time)
-    else:
-      new_bell_state = 0
-      
-    if new_bell_state != previous_bell_state:
-      previous_bell_state = new_bell_state
-
-      # Reconfigure the bell.
-      GPIO.output(PORT_RING_ENABLE, GPIO.LOW)
-      GPIO.output(PORT_RING_LEFT, GPIO.LOW if new_bell_state == 1 else GPIO.HIGH)
-      GPIO.output(PORT_RING_RIGHT, GPIO.HIGH if new_bell_state == 1 else GPIO.LOW)
-      GPIO.output(PORT_RING_ENABLE, GPIO.HIGH)
-      
-    # Check whether we have a complete number and update it upon
-    # receiving a new pulse.
-    pulse_state, age = pulse_signal.Pump(new_time)    
-    if pulse_state == True and age.total_seconds() == 0:
+  def NextDeadline(self, now):
+    ''' NextDeadline returns the time Update must be called at next.
+
+    In edge event mode, this is None if we can wait for the next edge or
+    command. Otherwise it's the next polling time.
+    '''
+    if not self.edge_events_:
+      return now + LOOP_SLEEP_TIME
+    # Wake up when we need to update the bell or settle a noisy signal.
+    deadlines = [s.NextDeadline() for s in self.signals_]
+    deadlines.append(self.backend_.NextEdgeTime())
+    deadlines.append(self.next_heartbeat_)
+    if not self.bell_thread_:
+      deadlines += [h.bell_.NextDeadline() for h in self.handsets_]
+    deadlines = [d for d in deadlines if d is not None]
+    if not deadlines:
+      return None
+    return min(deadlines)
+
+  def Update(self, now):
+    ''' Update the bell and process the inputs up to time now.'''
+    if not self.bell_thread_:
+      for handset in self.handsets_:
+        handset.bell_.Update(now)
+
+    # Collect state changes as (timestamp, signal index, state). In edge
+    # event mode, we might see several changes per signal, so process them
+    # in the order they were captured.
+    changes = []
+    for index, signal in enumerate(self.signals_):
+      if self.edge_events_:
+        for state, timestamp in signal.PumpEdges(now):
+          changes.append((timestamp, index, state))
+      else:
+        state, age = signal.Pump(now)
+        if age == 0:
+          changes.append((now, index, state))
+    changes.sort()
+
+    for timestamp, index, state in changes:
+      self.processChange_(self.signal_handsets_[index], self.signals_[index],
+                          state, timestamp)
+    if self.next_heartbeat_ is not None and now >= self.next_heartbeat_:
+      self.writer_.Write('h', 0, now)
+      self.next_heartbeat_ = now + self.heartbeat_
+    self.writer_.Flush()
+    if self.trace_:
+      self.trace_.Flush()
+
+  def Run(self, char_in, metrics_server=None):
+    ''' Run reads commands from char_in and updates the phone until
+    char_in is closed.
+
+    Args:
+      char_in: Non-blocking file object commands are read from.
+      metrics_server: Optional metrics.MetricsServer answered in between.
+    '''
+    servers = [metrics_server] if metrics_server else []
+    while True:
+      readable = []
+      now = self.backend_.Now()
+      deadline = self.NextDeadline(now)
+      timeout = None
+      if deadline is not None:
+        timeout = max(0, deadline - now)
+      if self.edge_events_:
+        # Sleep until we receive a command, an edge or a deadline passes.
+        try:
+          readable, _, _ = select.select(
+            [char_in] + self.signals_ + servers, [], [], timeout)
+        except select.error:
+          # Interrupted by a signal. Just process what we have.
+          pass
+      elif servers:
+        try:
+          readable, _, _ = select.select(servers, [], [], timeout)
+        except select.error:
+          pass
+      else:
+        time.sleep(timeout)
+      self.iterations_ += 1
+      if deadline is not None:
+        late = self.backend_.Now() - deadline
+        if late >= 0:
+          self.late_.Observe(late)
+      if metrics_server in readable:
+        metrics_server.Process()
+
+      try:
+        commands = char_in.read()
+        if not commands:
+          # End of file. Phony is gone, so there is nobody to talk to.
+          return
+        self.ProcessCommands(commands)
+      except (IOError, OSError):
+        pass
+
+      self.Update(self.backend_.Now())
+
+  def processChange_(self, handset, signal, state, timestamp):
+    ''' Produce output for an accepted state change of a signal of
+    handset.'''
+    port = signal.GetPort()
+    phone = handset.index_
+    if handset.decoder_:
+      self.processAdaptive_(handset, signal, state, timestamp)
+    elif signal is handset.pulse_signal_:
+      # Check whether we have a complete number and update it upon
+      # receiving a new pulse.
+      if state == True:
         # The signal state just changed to high, so we are looking
         # at the beginning of a pulse. Increase digit.
         # We use the beginning of a pulse here because the end of
         # the last pulse doesn't align well with the idle signal,
         # which tends to come in quite a bit earlier than the end
         # of the last pulse.
-        current_number = current_number + 1
-        char_out.write('p')
-
-    # Check whether we are still idle.
-    idle_state, age = idle_signal.Pump(new_time)
-    if age.total_seconds() == 0:
-      if idle_state == True:
-        char_out.write('e')
-        if current_number != 0:
+        handset.current_number_ = handset.current_number_ + 1
+        self.emit_('p', port, timestamp, phone)
+        if handset.pulse_end_ is not None:
+          handset.pulse_gap_.Observe(timestamp - handset.pulse_end_)
+        handset.pulse_start_ = timestamp
+      elif handset.pulse_start_ is not None:
+        handset.pulse_width_.Observe(timestamp - handset.pulse_start_)
+        handset.pulse_start_ = None
+        handset.pulse_end_ = timestamp
+
+    elif signal is handset.idle_signal_:
+      # Check whether we are still idle.
+      if state == True:
+        self.emit_('e', port, timestamp, phone)
+        if handset.partial_digit_:
+          handset.partial_digit_ = False
+          handset.current_number_ = 0
+        elif handset.current_number_ != 0:
           # The idle turned to high again, so we know we are done
           # with the current number.
-          char_out.write('%d' % (current_number % 10))          
-          current_number = 0
+          digit = handset.current_number_ % 10
+          self.emit_('%d' % digit, port, timestamp, phone)
+          handset.digits_[digit] += 1
+          handset.current_number_ = 0
+        handset.pulse_end_ = None
+      else:
+        self.emit_('s', port, timestamp, phone)
+        handset.pulse_start_ = None
+        handset.pulse_end_ = None
+
+    else:
+      # Check hook status.
+      if state == True:
+        self.emit_('d', port, timestamp, phone)
       else:
-        char_out.write('s')
+        self.emit_('l', port, timestamp, phone)
 
-    # Check hook status.
-    hook_state, age = hook_signal.Pump(new_time)
-    if age.total_seconds() == 0:
-      if hook_state == True:
-        char_out.write('d')
+  def processAdaptive_(self, handset, signal, state, timestamp):
+    ''' processChange_ for handsets decoded by an AdaptiveDecoder.'''
+    port = signal.GetPort()
+    phone = handset.index_
+    decoder = handset.decoder_
+    if signal is handset.pulse_signal_:
+      if decoder.Pulse(state, timestamp):
+        self.emit_('p', port, timestamp, phone)
+    elif signal is handset.idle_signal_:
+      if state == True:
+        self.emit_('e', port, timestamp, phone)
+        pulses, consistent = decoder.Finish(
+          handset.pulse_signal_.TakeBurst())
+        if handset.partial_digit_:
+          handset.partial_digit_ = False
+        elif pulses != 0:
+          digit = pulses % 10
+          self.emit_('%d' % digit, port, timestamp, phone)
+          handset.digits_[digit] += 1
+          if not consistent:
+            self.emit_('x', port, timestamp, phone)
+        # Takes effect from the next digit on, so a digit is decoded
+        # with one window.
+        handset.pulse_signal_.SetMinSignalDist(decoder.GetWindow())
       else:
-        char_out.write('l')    
+        self.emit_('s', port, timestamp, phone)
+        decoder.Start()
+    elif state == True:
+      self.emit_('d', port, timestamp, phone)
+    else:
+      self.emit_('l', port, timestamp, phone)
+
+  def emit_(self, symbol, port, timestamp, phone):
+    ''' Write a decoded event, and record it in the trace.'''
+    self.writer_.Write(symbol, port, timestamp, phone)
+    if self.trace_:
+      self.trace_.Symbol(timestamp, symbol, phone)
+
+class CommandQueue:
+  ''' CommandQueue takes the place of stdin for a PhoneIO running on a
+  thread, see PhoneIOThread. Like a non-blocking pipe, read raises
+  IOError while there are no commands and returns '' once closed. Its
+  file descriptor becomes readable when commands arrive, for select.'''
+
+  def __init__(self):
+    self.read_fd_, self.write_fd_ = os.pipe()
+    flags = fcntl.fcntl(self.read_fd_, fcntl.F_GETFL)
+    fcntl.fcntl(self.read_fd_, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    self.lock_ = threading.Lock()
+    self.commands_ = []
+    self.closed_ = False
+
+  def fileno(self):
+    return self.read_fd_
+
+  def write(self, commands):
+    with self.lock_:
+      if self.closed_:
+        raise ValueError('Command queue closed')
+      if not self.commands_:
+        os.write(self.write_fd_, 'c')
+      self.commands_.append(commands)
+
+  def read(self):
+    try:
+      os.read(self.read_fd_, 4096)
+    except OSError as e:
+      if e.errno != errno.EAGAIN:
+        raise
+    with self.lock_:
+      commands = ''.join(self.commands_)
+      self.commands_ = []
+      closed = self.closed_
+    if commands or closed:
+      return commands
+    raise IOError(errno.EAGAIN, 'No commands')
+
+  def close(self):
+    with self.lock_:
+      if not self.closed_:
+        self.closed_ = True
+        os.write(self.write_fd_, 'c')
+
+  def release(self):
+    ''' Close the file descriptors, once the reader is done.'''
+    with self.lock_:
+      self.closed_ = True
+      os.close(self.read_fd_)
+      os.close(self.write_fd_)
+
+class PhoneIOThread:
+  ''' PhoneIOThread runs a PhoneIO on a thread of the calling process.
+
+  It has the parts of the subprocess.Popen interface Phony uses for the
+  daemon: commands are written to stdin, send_signal and kill stop it.
+  '''
+
+  def __init__(self, backend, deliver, cadences=None, phones=None,
+               adaptive=False, metrics_address=None, trace=None):
+    ''' Construct PhoneIOThread and start its PhoneIO.
 
-    time.sleep(LOOP_SLEEP_TIME)
+    Args:
+      backend: The gpio_backend.Backend to use.
+      deliver: Called on the thread with every list of event_protocol
+        Events, and with None once the PhoneIO stopped.
+      cadences: Cadence specs as for --cadence, see bell.ParseCadence.
+        They are parsed on the thread, so decoding an audio cadence
+        doesn't hold up the caller.
+      phones, adaptive: See PhoneIO.
+      metrics_address: Serve metrics on this address, see --metrics.
+      trace: gpio_trace.TraceWriter to record in, see --trace.
+    '''
+    self.deliver_ = deliver
+    self.backend_ = backend
+    self.cadences_ = cadences or []
+    self.phones_ = phones
+    self.adaptive_ = adaptive
+    self.metrics_address_ = metrics_address
+    self.trace_ = trace
+    self.phone_io_ = None
+    self.metrics_server_ = None
+    self.stdin = CommandQueue()
+    self.returncode = None
+    self.thread_ = threading.Thread(target=self.run_, name='phone_io')
+    self.thread_.daemon = True
+    self.thread_.start()
+
+  def poll(self):
+    return self.returncode
+
+  def send_signal(self, signal):
+    self.stdin.close()
+
+  def kill(self):
+    self.stdin.close()
+
+  def wait(self):
+    self.thread_.join()
+    return self.returncode
+
+  def run_(self):
+    try:
+      self.phone_io_ = CreatePhoneIO(
+        self.backend_, event_protocol.QueueWriter(self.deliver_),
+        [bell.ParseCadence(c) for c in self.cadences_], self.phones_,
+        self.adaptive_, trace=self.trace_)
+      if self.metrics_address_:
+        registry = metrics.Registry()
+        self.phone_io_.RegisterMetrics(registry)
+        self.metrics_server_ = metrics.MetricsServer(registry,
+                                                     self.metrics_address_)
+      self.phone_io_.Run(self.stdin, self.metrics_server_)
+      self.returncode = 0
+    except Exception:
+      traceback.print_exc()
+      self.returncode = 1
+    finally:
+      if self.metrics_server_:
+        self.metrics_server_.Close()
+      if self.phone_io_:
+        self.phone_io_.Close()
+      elif self.trace_:
+        self.trace_.Close()
+      self.backend_.Cleanup()
+      self.stdin.release()
+      self.deliver_(None)
+
+def Simulate(phone_io, backend, end_time, speed=None):
+  ''' Drive phone_io on a simulated backend until end_time.
+
+  The virtual clock jumps from deadline to deadline, so by default this
+  runs as fast as the decoding itself allows.
+
+  Args:
+    phone_io: A PhoneIO instance using backend.
+    backend: A gpio_simulator.SimulatedBackend with a virtual clock.
+    end_time: Simulated time to stop at.
+    speed: Hold the virtual clock to this multiple of real time, None
+      to run as fast as possible.
+  '''
+  start = backend.Now()
+  real_start = clock.Monotonic()
+  def Advance(to):
+    if speed:
+      delay = real_start + (to - start) / speed - clock.Monotonic()
+      if delay > 0:
+        time.sleep(delay)
+    backend.SetTime(to)
+
+  # Apply commands passed in since the last update. Like on real hardware,
+  # some time passes between two updates.
+  Advance(backend.Now() + SIMULATION_MIN_STEP)
+  phone_io.Update(backend.Now())
+  while True:
+    now = backend.Now()
+    deadline = phone_io.NextDeadline(now)
+    if deadline is None or deadline >= end_time:
+      break
+    Advance(max(deadline, now + SIMULATION_MIN_STEP))
+    phone_io.Update(backend.Now())
+  Advance(end_time)
+  phone_io.Update(end_time)
+
+def CreatePhoneIO(backend, writer, cadences=None, phones=None,
+                  adaptive=False, heartbeat=None, trace=None):
+  ''' Create PhoneIO with a bell thread, using edge events if they are
+  available. With a gpio_trace.TraceWriter for trace, the inputs and
+  decoded events are recorded in it.'''
+  if trace:
+    backend = gpio_trace.TracingBackend(backend, trace)
+  edge_events = (os.environ.get(EDGE_EVENTS_ENV, '1') != '0' and
+                 backend.SupportsEdgeEvents())
+  if edge_events:
+    try:
+      return PhoneIO(backend, writer, edge_events=True, cadences=cadences,
+                     bell_thread=True, phones=phones, adaptive=adaptive,
+                     heartbeat=heartbeat, trace=trace)
+    except (IOError, OSError) as e:
+      sys.stderr.write('Edge events unavailable, polling instead: %s\n' % e)
+  return PhoneIO(backend, writer, cadences=cadences, bell_thread=True,
+                 phones=phones, adaptive=adaptive, heartbeat=heartbeat,
+                 trace=trace)
+
+def main():
+  parser = argparse.ArgumentParser(description='Phone hardware I/O.')
+  parser.add_argument('--protocol', choices=event_protocol.PROTOCOLS,
+                      default=event_protocol.PROTOCOL_CHARS,
+                      help='Format of the events written to stdout.')
+  parser.add_argument('--cadence', action='append', default=[],
+                      type=bell.ParseCadence,
+                      help='Ring cadence, see bell.ParseCadence. Selected '
+                      'by index, starting at 1 for the first one.')
+  parser.add_argument('--phone', action='append', default=[],
+                      type=ParsePins,
+                      help='Pins of a phone: pulse, idle, hook, ring enable, '
+                      'ring left, ring right, e.g. 4,17,27,25,24,23. Repeat '
+                      'for every phone, phone indices follow the order.')
+  parser.add_argument('--adaptive', action='store_true',
+                      help='Learn the timing of each dial to tell pulses '
+                      'from contact bounce, and flag irregular digits.')
+  parser.add_argument('--heartbeat', type=float,
+                      help='Write a heartbeat event every this many '
+                      'seconds.')
+  parser.add_argument('--metrics',
+                      help='Serve metrics in the Prometheus text format on '
+                      'unix:<path> or [host:]port.')
+  parser.add_argument('--trace',
+                      help='Record the input edges and decoded events in '
+                      'this file, see gpio_trace.py.')
+  parser.add_argument('--trace-max-bytes', type=int,
+                      default=gpio_trace.DEFAULT_MAX_BYTES,
+                      help='Rotate the trace when it exceeds this size.')
+  args = parser.parse_args()
+
+  backend = gpio_backend.GetBackend()
+  try:
+    # Create file objects without buffering, so all I/O we produce
+    # or receive is effective immediately. Also set char_in to non-blocking,
+    # so we can poll it just like the other inputs.
+    char_out = os.fdopen(sys.stdout.fileno(), 'wb', 0)
+    char_in = os.fdopen(sys.stdin.fileno(), 'rb', 0)
+    char_in_flags = fcntl.fcntl(sys.stdin.fileno(), fcntl.F_GETFL)
+    fcntl.fcntl(sys.stdin.fileno(), fcntl.F_SETFL,
+                char_in_flags | os.O_NONBLOCK)
+
+    writer = event_protocol.CreateWriter(args.protocol, char_out.write)
+    trace = None
+    if args.trace:
+      trace = gpio_trace.TraceWriter(args.trace, args.trace_max_bytes)
+    phone_io = CreatePhoneIO(backend, writer, args.cadence, args.phone,
+                             args.adaptive, args.heartbeat, trace)
+    metrics_server = None
+    if args.metrics:
+      registry = metrics.Registry()
+      phone_io.RegisterMetrics(registry)
+      metrics_server = metrics.MetricsServer(registry, args.metrics)
+    try:
+      phone_io.Run(char_in, metrics_server)
+    finally:
+      if metrics_server:
+        metrics_server.Close()
+      phone_io.Close()
+      for i in range(len(args.phone) or 1):
+        sys.stderr.write('Bell %d: %s\n' % (i, phone_io.GetBellStats(i)))
+  finally:
+    backend.Cleanup()
 
-finally:
- GPIO.cleanup()
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+# Load test of the pulse decoder and the bell driver of phone_io on the
+# GPIO simulator. Runs on any Linux box, much faster than real time.
+#
+# The bell thread is also run in real time, while the main thread keeps
+# decoding dialed numbers, to measure its timing error under load.
+#
+# The plain and the adaptive pulse decoder (see pulse_decoder.py) are
+# compared on worn dials: contacts bouncing longer than the noise window,
+# and pulse rates and break ratios away from the nominal ones.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import random
+import time
+import timeit
+
+import bell
+import event_protocol
+import gpio_backend
+import gpio_simulator
+import metrics
+import phone_io
+
+def RunDialing(edge_events, numbers, bounces, seed, ios=None,
+               adaptive=False, bounce_time=0.0005, periods=(0.09, 0.11),
+               break_ratios=(0.55, 0.7)):
+  ''' Dial random numbers.
+
+  Args:
+    ios: Optional list the PhoneIO is appended to.
+    adaptive: Decode with the adaptive decoder.
+    bounce_time: Seconds between bounces, see gpio_simulator.Bounce.
+    periods, break_ratios: Ranges the timing of each number is drawn
+                           from.
+
+  Returns:
+    A tuple (correct, decoded, total, simulated, wall) of digit counts and
+    simulated and wall clock seconds.
+  '''
+  rng = random.Random(seed)
+  backend = gpio_simulator.SimulatedBackend()
+  backend.SetInitialLevel(phone_io.PORT_PULSE, gpio_backend.LOW)
+  expected = []
+  start = 1.0
+  for _ in range(numbers):
+    number = ''.join(rng.choice('0123456789') for _ in range(10))
+    expected.append(number)
+    edges, start = gpio_simulator.DialEdges(
+      number, start, phone_io.PORT_PULSE, phone_io.PORT_IDLE,
+      pulse_period=rng.uniform(*periods),
+      break_ratio=rng.uniform(*break_ratios),
+      bounces=bounces, bounce_time=bounce_time)
+    backend.AddEdges(edges)
+
+  output = []
+  io = phone_io.PhoneIO(backend, event_protocol.CharWriter(output.append),
+                        edge_events=edge_events, adaptive=adaptive)
+  if ios is not None:
+    ios.append(io)
+  wall_start = time.time()
+  phone_io.Simulate(io, backend, start + 1)
+  wall = time.time() - wall_start
+
+  digits = ''.join(c for c in ''.join(output) if c.isdigit())
+  dialed = ''.join(expected)
+  correct = sum(1 for a, b in zip(digits, dialed) if a == b)
+  return correct, len(digits), len(dialed), start + 1, wall
+
+def RunBell(edge_events, seconds):
+  ''' Ring the bell and return (its BellStats, simulated, wall).'''
+  backend = gpio_simulator.SimulatedBackend()
+  io = phone_io.PhoneIO(backend, event_protocol.CharWriter(lambda s: None),
+                        edge_events=edge_events)
+  io.ProcessCommands('s')
+  wall_start = time.time()
+  phone_io.Simulate(io, backend, seconds)
+  wall = time.time() - wall_start
+  return io.GetBellStats(), seconds, wall
+
+def RunBellThread(seconds, numbers, bounces, seed):
+  ''' Ring the bell from its thread in real time while dialing numbers.
+
+  Returns:
+    The BellStats of the bell.
+  '''
+  backend = gpio_simulator.SimulatedBackend(realtime=True)
+  b = bell.Bell(backend)
+  thread = bell.BellThread(b, backend)
+  thread.Start(0)
+  end = time.time() + seconds
+  while time.time() < end:
+    RunDialing(True, numbers, bounces, seed)
+  thread.Close()
+  return b.GetStats()
+
+def RunMetricsOverhead(numbers, bounces, seed):
+  ''' Estimate the share of decoding time spent on metrics.
+
+  Every accepted or rejected edge bumps a counter, and pulses and
+  digits update a histogram or counter. We count these updates during a
+  dialing run and price them with their measured unit cost. The
+  simulation doesn't sleep, so the decoding time is pure CPU time.
+
+  Returns:
+    A tuple (overhead in percent of decoding time, updates, seconds per
+    Render).
+  '''
+  ios = []
+  _, _, _, _, wall = RunDialing(True, numbers, bounces, seed, ios)
+  io = ios[0]
+  handset = io.handsets_[0]
+  counts = (sum(s.GetAccepted() + s.GetRejected() for s in io.signals_) +
+            sum(handset.digits_))
+  observations = (handset.pulse_width_.GetCount() +
+                  handset.pulse_gap_.GetCount())
+  repeat = 100000
+  setup = ('import metrics, phone_io\n'
+           'h = metrics.Histogram(phone_io.PULSE_BUCKETS)\n'
+           'h.n = 0')
+  count = timeit.timeit('h.n += 1', number=repeat, setup=setup) / repeat
+  observe = timeit.timeit('h.Observe(0.042)', number=repeat,
+                          setup=setup) / repeat
+  registry = metrics.Registry()
+  io.RegisterMetrics(registry)
+  render = timeit.timeit(registry.Render, number=100) / 100
+  return (100 * (counts * count + observations * observe) / wall,
+          counts + observations, render)
+
+# (name, RunDialing keyword arguments) of the worn dials compared.
+WORN_DIALS = [
+  ('nominal', {}),
+  ('long bounce', {'bounces': 3, 'bounce_time': 0.003}),
+  ('drifting', {'periods': (0.08, 0.125), 'break_ratios': (0.5, 0.72)}),
+  ('both', {'bounces': 3, 'bounce_time': 0.003, 'periods': (0.08, 0.125),
+            'break_ratios': (0.5, 0.72)}),
+]
+
+def RunWornDials(numbers, bounces, seed):
+  ''' Compare the plain and the adaptive decoder on WORN_DIALS.
+
+  Returns:
+    A list of (name, adaptive, correct, decoded, total, seconds of wall
+    time per digit, flagged digits).
+  '''
+  results = []
+  for name, kwargs in WORN_DIALS:
+    kwargs = dict(kwargs)
+    kwargs.setdefault('bounces', bounces)
+    for adaptive in (False, True):
+      ios = []
+      correct, decoded, total, _, wall = RunDialing(
+        True, numbers, seed=seed, ios=ios, adaptive=adaptive, **kwargs)
+      flagged = sum(h.decoder_.GetFlagged() for h in ios[0].handsets_
+                    if h.decoder_)
+      results.append((name, adaptive, correct, decoded, total,
+                      wall / total, flagged))
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Load test phone_io on the GPIO simulator.')
+  parser.add_argument('--numbers', type=int, default=100,
+                      help='Number of 10 digit numbers to dial.')
+  parser.add_argument('--bounces', type=int, default=2,
+                      help='Contact bounces per pulse edge.')
+  parser.add_argument('--ring_seconds', type=float, default=600)
+  parser.add_argument('--thread_seconds', type=float, default=5,
+                      help='Real time to run the bell thread for.')
+  parser.add_argument('--seed', type=int, default=1)
+  args = parser.parse_args()
+
+  for name, edge_events in [('polling', False), ('edge_events', True)]:
+    correct, decoded, total, simulated, wall = RunDialing(
+      edge_events, args.numbers, args.bounces, args.seed)
+    print('%-11s dial: %d/%d digits correct, %d decoded, %.0fs simulated '
+          'in %.2fs (%.0fx)' % (name, correct, total, decoded, simulated,
+                                wall, simulated / wall))
+    stats, simulated, wall = RunBell(edge_events, args.ring_seconds)
+    print('%-11s bell: %s, %.0fs simulated in %.2fs (%.0fx)' %
+          (name, stats, simulated, wall, simulated / wall))
+  stats = RunBellThread(args.thread_seconds, 1, args.bounces, args.seed)
+  print('bell thread, dialing concurrently: %s' % stats)
+  for (name, adaptive, correct, decoded, total, per_digit,
+       flagged) in RunWornDials(args.numbers, args.bounces, args.seed):
+    print('%-11s %-8s: %d/%d digits correct, %d decoded, %d flagged, '
+          '%.1fus per digit' % (name, 'adaptive' if adaptive else 'plain',
+                                correct, total, decoded, flagged,
+                                per_digit * 1e6))
+  overhead, updates, render = RunMetricsOverhead(args.numbers, args.bounces,
+                                                 args.seed)
+  print('metrics: %d updates, %.2f%% of decoding time, %.2fms per '
+        'scrape' % (updates, overhead, render * 1000))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+# Benchmark of the phone_io modes of Phony.
+#
+# Runs Phony against fake_linphone (see phony_benchmark.py) with phone_io
+# on the GPIO simulator, once as a subprocess and once on a thread (the
+# phone_io setting). The simulator plays a lift, a dialed number and a
+# hang up. We report the event latency, from the capture time of an
+# event to Phony processing it, and the resident memory of Phony plus
+# its phone_io subprocess. Every mode runs in a fresh interpreter, so
+# their memory doesn't mix.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+def ReadMemory(pid):
+  ''' Returns RSS and PSS of process pid in kB, PSS None if unknown.'''
+  rss = pss = None
+  with open('/proc/%d/status' % pid) as status:
+    for line in status:
+      if line.startswith('VmRSS:'):
+        rss = int(line.split()[1])
+  try:
+    with open('/proc/%d/smaps_rollup' % pid) as smaps:
+      for line in smaps:
+        if line.startswith('Pss:'):
+          pss = int(line.split()[1])
+  except IOError:
+    pass
+  return rss, pss
+
+def WriteScript(path, number):
+  ''' Write a simulator script of a call to number, returns its end.'''
+  import gpio_simulator
+  import phone_io
+  edges = [(0.5, phone_io.PORT_PULSE, 0)]
+  edges += gpio_simulator.HookEdges(1.0, phone_io.PORT_HOOK, True)
+  dial, end = gpio_simulator.DialEdges(
+    number, 1.5, phone_io.PORT_PULSE, phone_io.PORT_IDLE, pulse_period=0.06,
+    windup_time=0.1, digit_pause=0.2)
+  edges += dial
+  edges += gpio_simulator.HookEdges(end + 0.5, phone_io.PORT_HOOK, False)
+  with open(path, 'w') as script:
+    for time, port, level in sorted(edges):
+      script.write('%f %d %d\n' % (time, port, level))
+  return end + 0.5
+
+def RunMode(mode, script, duration):
+  ''' Run Phony with phone_io in mode and return the measurements.'''
+  import ConfigParser
+  import logging
+  import clock
+  # Installs fake_linphone, so it must come before phony.
+  import phony_benchmark
+  import phony
+
+  class MeasuredPhony(phony_benchmark.BenchmarkPhony):
+    initPhoneIO = phony.Phony.initPhoneIO
+
+    def processPhoneEvents(self, events):
+      now = clock.Monotonic()
+      latencies.extend(now - e.timestamp for e in events if e.symbol != 'h')
+      phony.Phony.processPhoneEvents(self, events)
+
+  logging.basicConfig(level=logging.ERROR)
+  latencies = []
+  memory = {}
+  config = ConfigParser.ConfigParser()
+  username = phony_benchmark.USERNAME
+  config.add_section(username)
+  config.set(username, 'Username', username)
+  config.set(username, 'Password', 'secret')
+  config.set(username, 'Gateway', 'example.com')
+  config.add_section(phony.SETTINGS_SECTION)
+  for option, value in [('gpio_backend', 'sim'), ('gpio_script', script),
+                        ('phone_io', mode)]:
+    config.set(phony.SETTINGS_SECTION, option, value)
+  instance = MeasuredPhony(config)
+
+  def Finish():
+    memory['phony'] = ReadMemory(os.getpid())
+    if mode == phony.PHONE_IO_PROCESS:
+      memory['phone_io'] = ReadMemory(instance.phone_IO_.pid)
+      instance.phone_io_supervisor_.Close()
+    instance.phone_IO_.kill()
+    instance.loop_.Stop()
+
+  instance.loop_.CallLater(duration + 1, Finish)
+  instance.Run()
+  return {'latencies': latencies, 'memory': memory}
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Benchmark of the phone_io modes of Phony.')
+  parser.add_argument('--number', default='1234567890')
+  parser.add_argument('--mode', help=argparse.SUPPRESS)
+  parser.add_argument('--script', help=argparse.SUPPRESS)
+  parser.add_argument('--duration', type=float, help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.mode:
+    # We are the child running one mode. The result goes last, after
+    # whatever Phony prints.
+    print(json.dumps(RunMode(args.mode, args.script, args.duration)))
+    return
+
+  script = tempfile.NamedTemporaryFile(suffix='.gpio', delete=False)
+  try:
+    duration = WriteScript(script.name, args.number)
+    print('%-8s %7s %9s %9s %9s %11s %11s' % (
+      'mode', 'events', 'p50', 'p99', 'max', 'RSS', 'PSS'))
+    for mode in ['process', 'thread']:
+      output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--mode', mode,
+         '--script', script.name, '--duration', str(duration)])
+      result = json.loads(output.strip().splitlines()[-1])
+      latencies = sorted(result['latencies'])
+      rss = sum(m[0] for m in result['memory'].values())
+      pss = sum(m[1] or 0 for m in result['memory'].values())
+      print('%-8s %7d %7.3fms %7.3fms %7.3fms %9dkB %9dkB' % (
+        mode, len(latencies), latencies[len(latencies) // 2] * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000, latencies[-1] * 1000,
+        rss, pss))
+  finally:
+    os.remove(script.name)
+
+if __name__ == '__main__':
+  main()
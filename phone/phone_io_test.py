@@ -0,0 +1,186 @@
+import bell
+import event_protocol
+import gpio_backend
+import gpio_simulator
+import metrics
+import phone_io
+import threading
+import time
+import unittest
+
+class TestPhoneIO(unittest.TestCase):
+  def setUp(self):
+    self.backend = gpio_simulator.SimulatedBackend()
+    # The pulse contact is closed (low) at rest.
+    self.backend.SetInitialLevel(phone_io.PORT_PULSE, gpio_backend.LOW)
+    self.output = []
+
+  def createPhoneIO(self, edge_events, adaptive=False):
+    return phone_io.PhoneIO(
+      self.backend, event_protocol.CharWriter(self.output.append),
+      edge_events=edge_events, adaptive=adaptive)
+
+  def dial(self, number, **kwargs):
+    self.backend.AddEdges(gpio_simulator.HookEdges(0.5, phone_io.PORT_HOOK,
+                                                   True))
+    edges, end = gpio_simulator.DialEdges(number, 1.0, phone_io.PORT_PULSE,
+                                          phone_io.PORT_IDLE, **kwargs)
+    self.backend.AddEdges(edges)
+    self.backend.AddEdges(gpio_simulator.HookEdges(end, phone_io.PORT_HOOK,
+                                                   False))
+    return end + 1
+
+  def test_PollingDial(self):
+    end = self.dial('109')
+    phone_io.Simulate(self.createPhoneIO(False), self.backend, end)
+    self.assertEqual('lspe1s' + 'p' * 10 + 'e0s' + 'p' * 9 + 'e9d',
+                     ''.join(self.output))
+
+  def test_EdgeEventsDial(self):
+    end = self.dial('109')
+    phone_io.Simulate(self.createPhoneIO(True), self.backend, end)
+    self.assertEqual('lspe1s' + 'p' * 10 + 'e0s' + 'p' * 9 + 'e9d',
+                     ''.join(self.output))
+
+  def test_EdgeEventsBounce(self):
+    # Contact bounce within the noise window must not produce pulses.
+    end = self.dial('42', bounces=3, bounce_time=0.0005)
+    io = self.createPhoneIO(True)
+    phone_io.Simulate(io, self.backend, end)
+    self.assertEqual('lsppppe4sppe2d', ''.join(self.output))
+    registry = metrics.Registry()
+    io.RegisterMetrics(registry)
+    text = registry.Render()
+    # Each of the 12 pulse edges bounces 3 times.
+    self.assertIn('phony_gpio_edges_rejected_total{phone="0",port="4"} 36\n',
+                  text)
+    self.assertIn('phony_pulse_width_seconds_count{phone="0"} 6\n', text)
+    self.assertIn('phony_pulse_gap_seconds_count{phone="0"} 4\n', text)
+    self.assertIn('phony_digits_decoded_total{digit="4",phone="0"} 1\n',
+                  text)
+
+  def test_AdaptiveLongBounce(self):
+    # Bounce outlasting the noise window is discarded, and the window
+    # grows to cover it.
+    end = self.dial('42', bounces=3, bounce_time=0.002)
+    io = self.createPhoneIO(True, adaptive=True)
+    phone_io.Simulate(io, self.backend, end)
+    self.assertEqual('lsppppe4sppe2d', ''.join(self.output))
+    self.assertGreater(io.GetSignals()[0].GetMinSignalDist(), 0.006)
+    registry = metrics.Registry()
+    io.RegisterMetrics(registry)
+    self.assertIn('phony_digits_flagged_total{phone="0"} 0\n',
+                  registry.Render())
+
+  def test_AdaptiveFlagsIrregularDigit(self):
+    edges, _ = gpio_simulator.DialEdges('3', 1.0, phone_io.PORT_PULSE,
+                                        phone_io.PORT_IDLE)
+    # Lose the second pulse, as a dirty contact would.
+    edges = [e for e in edges if not 1.39 < e[0] < 1.47]
+    self.backend.AddEdges(edges)
+    io = self.createPhoneIO(True, adaptive=True)
+    phone_io.Simulate(io, self.backend, 3.0)
+    self.assertEqual('sppe2x', ''.join(self.output))
+
+  def test_Bell(self):
+    io = self.createPhoneIO(True)
+    io.ProcessCommands('s')
+    phone_io.Simulate(io, self.backend, bell.RING_ACTIVE_TIME + 0.5)
+    io.ProcessCommands('e')
+    phone_io.Simulate(io, self.backend, 5)
+    enables = [t for t, port, level in self.backend.GetOutputs()
+               if port == bell.PORT_RING_ENABLE and level]
+    # One toggle per ring pulse, plus switching the bell off.
+    self.assertEqual(
+      bell.RING_ACTIVE_TIME / bell.RING_PULSE_TIME + 1, len(enables))
+    for i, t in enumerate(enables[:-1]):
+      self.assertAlmostEqual(i * bell.RING_PULSE_TIME, t, places=5)
+    self.assertEqual(0, io.GetBellStats().GetLate())
+
+  def test_BellCadence(self):
+    io = phone_io.PhoneIO(
+      self.backend, event_protocol.CharWriter(self.output.append),
+      edge_events=True, cadences=[bell.ParseCadence('0.1 0.2')])
+    io.ProcessCommands('1s')
+    phone_io.Simulate(io, self.backend, 0.65)
+    enables = [t for t, port, level in self.backend.GetOutputs()
+               if port == bell.PORT_RING_ENABLE and level]
+    # Two half-cycles and off, twice, then the third burst begins.
+    expected = [0, 0.05, 0.1, 0.3, 0.35, 0.4, 0.6]
+    self.assertEqual(len(expected), len(enables))
+    for e, t in zip(expected, enables):
+      self.assertAlmostEqual(e, t, places=5)
+
+  def test_MultiplePhones(self):
+    second = phone_io.PhonePins(5, 6, 13, 19, 26, 21)
+    self.backend.SetInitialLevel(second.pulse, gpio_backend.LOW)
+    io = phone_io.PhoneIO(
+      self.backend, event_protocol.FrameWriter(self.output.append),
+      edge_events=True, phones=[phone_io.DEFAULT_PINS, second])
+    self.backend.AddEdges(gpio_simulator.HookEdges(0.5, second.hook, True))
+    edges, end = gpio_simulator.DialEdges('2', 1.0, second.pulse,
+                                          second.idle)
+    self.backend.AddEdges(edges)
+    io.ProcessCommands('P1s')
+    phone_io.Simulate(io, self.backend, end + 1)
+    events = event_protocol.FrameReader().Feed(''.join(self.output))
+    self.assertEqual('lsppe2', ''.join(e.symbol for e in events))
+    self.assertEqual([1] * 6, [e.phone for e in events])
+    # Only the bell of the second phone rings.
+    ports = set(port for _, port, level in self.backend.GetOutputs()
+                if level)
+    self.assertIn(second.ring_enable, ports)
+    self.assertNotIn(bell.PORT_RING_ENABLE, ports)
+
+  def test_RestartMidDial(self):
+    # phone_io (re)starts with the handset lifted and the dial running
+    # back from a 5.
+    self.backend.SetInitialLevel(phone_io.PORT_HOOK, gpio_backend.LOW)
+    self.backend.SetInitialLevel(phone_io.PORT_IDLE, gpio_backend.LOW)
+    edges, end = gpio_simulator.DialEdges('53', 0.0, phone_io.PORT_PULSE,
+                                          phone_io.PORT_IDLE)
+    self.backend.AddEdges(edges[1:])
+    io = phone_io.PhoneIO(
+      self.backend, event_protocol.CharWriter(self.output.append),
+      edge_events=True, heartbeat=1)
+    io.ProcessCommands('q')
+    phone_io.Simulate(io, self.backend, end)
+    output = ''.join(self.output)
+    # The query reports the dial off normal. The partial digit isn't
+    # reported, the next one is.
+    self.assertEqual('lspppppespppe3', output.replace('h', ''))
+    self.assertEqual(int(end) + 1, output.count('h'))
+
+  def test_Thread(self):
+    backend = gpio_simulator.SimulatedBackend(realtime=True)
+    backend.AddEdges(gpio_simulator.HookEdges(0.01, phone_io.PORT_HOOK,
+                                              True))
+    stopped = threading.Event()
+    def Deliver(events):
+      if events is None:
+        stopped.set()
+      else:
+        self.output.extend(e.symbol for e in events)
+    def WaitFor(symbols):
+      deadline = time.time() + 2
+      while ''.join(self.output) != symbols and time.time() < deadline:
+        time.sleep(0.001)
+      self.assertEqual(symbols, ''.join(self.output))
+    io = phone_io.PhoneIOThread(backend, Deliver)
+    WaitFor('l')
+    io.stdin.write('q')
+    WaitFor('lle')
+    self.assertIsNone(io.poll())
+    io.kill()
+    self.assertTrue(stopped.wait(2))
+    self.assertEqual(0, io.wait())
+    self.assertRaises(ValueError, io.stdin.write, 's')
+
+  def test_ParsePins(self):
+    self.assertEqual(phone_io.DEFAULT_PINS,
+                     phone_io.ParsePins('4,17,27,25,24,23'))
+    self.assertRaises(ValueError, phone_io.ParsePins, '4,17')
+    self.assertRaises(ValueError, phone_io.ParsePins, '4,17,x,25,24,23')
+
+if __name__ == '__main__':
+  unittest.main()
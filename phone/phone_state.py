@@ -3,8 +3,14 @@
 # A simple state machine supporting callbacks for state changes.
 #
 
+import clock
+import heapq
 import logging
 
+# Input symbols are single characters, so a table row has one entry per
+# possible character code.
+_SYMBOLS = 256
+
 class PhoneState:
   ''' PhoneState is a simple state machine. It is configured with
     - a set of states
@@ -12,11 +18,24 @@ class PhoneState:
       {(input, previous_state) : next_state}.
     - Callbacks that are triggered during state
       transitions: {(previous_state, next_state) : [callbacks]}.
+    - Optional timeouts: {state : (seconds, input)}. If the state machine
+      stays in state for seconds, input is processed as if it had been
+      received. The timeout starts over with every transition into state,
+      including transitions from state to itself.
+
+  Pending timeouts are kept in a min-heap. NextDeadline tells the main
+  loop when to call ProcessTimeouts next, so nobody needs to poll.
+
+  At construction, transitions and callbacks are compiled into a dense
+  table indexed by state and input symbol, so processing an input is a
+  single list lookup. An optional profiler.Profiler is compiled into the
+  table as well, so there is no cost without one.
   '''
-  
-  def __init__(self, initial_state, transitions, callbacks):
+
+  def __init__(self, initial_state, transitions, callbacks, timeouts=None,
+               time_function=clock.Monotonic, profiler=None):
     ''' Construct PhoneState instance
-   
+
     Args:
       initial_state: The initial state the state
                      machine should be in.
@@ -25,18 +44,58 @@ class PhoneState:
                      which will cause the described state
                      transition.
       callbacks:     {(previous_state, next_state) : [callbacks]}.
-                     Signature: callback(previous, next, input).                     
+                     Signature: callback(previous, next, input).
+      timeouts:      {state : (seconds, input)}, see above.
+      time_function: Returns the time an input was received at, which
+                     is when a timeout starts. Defaults to now.
+      profiler:      Optional profiler.Profiler timing the callbacks and
+                     the time spent in each state.
     '''
-    self.current_state_ = initial_state
-    self.transitions_ = {}
-    for t in transitions.items():
+    timeouts = timeouts or {}
+    # Number the states, so we can use them as table indices.
+    self.states_ = [initial_state]
+    self.state_index_ = {initial_state: 0}
+    for (symbols, previous_state), next_state in transitions.items():
+      for state in [previous_state, next_state]:
+        if state not in self.state_index_:
+          self.state_index_[state] = len(self.states_)
+          self.states_.append(state)
+
+    # table_[state index][symbol code] is None if the input doesn't cause
+    # a transition. Otherwise, it's a tuple of next state index, next state,
+    # the callbacks to call and the timeout of the next state (or None).
+    self.table_ = [[None] * _SYMBOLS for _ in self.states_]
+    for (symbols, previous_state), next_state in transitions.items():
       # Create a separate entry for all permitted inputs.
       # This effectively disassembles the key of the input
-      # dictionary and creates a separate key for each
+      # dictionary and creates a separate entry for each
       # possible input symbol.
-      for i in t[0][0]:
-        self.transitions_[(i,t[0][1])] = t[1]
-    self.callbacks_ = callbacks    
+      key = (previous_state, next_state)
+      transition_callbacks = tuple(callbacks.get(key, []))
+      if profiler:
+        transition_callbacks = profiler.Wrap(key, transition_callbacks)
+      entry = (self.state_index_[next_state], next_state,
+               transition_callbacks, timeouts.get(next_state))
+      row = self.table_[self.state_index_[previous_state]]
+      for i in symbols:
+        row[ord(i)] = entry
+    self.current_ = 0
+    self.current_state_ = initial_state
+    if profiler:
+      profiler.Start(initial_state)
+
+    self.time_function_ = time_function
+    # Heap of pending timeouts as (deadline, transition count, input).
+    # Timeouts are not removed when their state is left. Instead, the
+    # number of transitions made when they were armed tells whether they
+    # are still valid.
+    self.timers_ = []
+    self.transition_count_ = 0
+    # Deadline of the timeout being processed, it's the time timeouts
+    # armed by the resulting transition start at.
+    self.timeout_ts_ = None
+    if initial_state in timeouts:
+      self.armTimeout_(timeouts[initial_state])
 
   def ProcessInput(self, input):
     ''' ProcessInput performs state transitions according to
@@ -47,23 +106,103 @@ class PhoneState:
        input: The input symbol to be processed.
     '''
     try:
+      entry = self.table_[self.current_][ord(input)]
+    except (IndexError, TypeError):
+      # Not a symbol we could have a transition for.
+      return
+    if entry is None:
+      # We don't have a transition for the combination of input and
+      # state. This is not an error.
+      return
+    previous_state = self.current_state_
+    self.current_, self.current_state_, callbacks, timeout = entry
+    self.transition_count_ += 1
+    if timeout:
+      self.armTimeout_(timeout)
+    if logging.root.isEnabledFor(logging.INFO):
+      logging.info('TR: (%s, %s): %s', input, previous_state,
+                   self.current_state_)
+    for c in callbacks:
+      c(previous_state, self.current_state_, input)
+
+  def ProcessInputs(self, inputs):
+    ''' ProcessInputs processes a sequence of input symbols, as if
+    ProcessInput had been called for each of them.
+
+     Args:
+       inputs: An iterable of input symbols, e.g. a string read from
+               phone_io.
+    '''
+    table = self.table_
+    log = logging.root.isEnabledFor(logging.INFO)
+    for input in inputs:
+      try:
+        entry = table[self.current_][ord(input)]
+      except (IndexError, TypeError):
+        continue
+      if entry is None:
+        continue
       previous_state = self.current_state_
-      # Apply the new state. If we don't have a transition for the
-      # combination of input and symbol, we just fall through with
-      # a KeyError. No point in calling any callbacks then.
-      self.current_state_ = self.transitions_[(input,previous_state)]
-      logging.info('TR: ({input}, {prev}): {next}'.format(
-        input=input, prev=previous_state, next=self.current_state_))
-
-      callbacks = self.callbacks_[(previous_state, self.current_state_)]
+      self.current_, self.current_state_, callbacks, timeout = entry
+      self.transition_count_ += 1
+      if timeout:
+        self.armTimeout_(timeout)
+      if log:
+        logging.info('TR: (%s, %s): %s', input, previous_state,
+                     self.current_state_)
       for c in callbacks:
         c(previous_state, self.current_state_, input)
-    except KeyError:
-      # Simply fall through if either we don't have a state transition
-      # or a list of callbacks. This is not an error.
-      pass
 
   def GetCurrentState(self):
     ''' GetCurrentState returns the current state of the state machine.'''
     return self.current_state_
 
+  def NextDeadline(self):
+    ''' NextDeadline returns the time the next timeout is due at, or None
+    if no timeout is pending in the current state.'''
+    timers = self.timers_
+    # Drop timeouts of states we have left since.
+    while timers and timers[0][1] != self.transition_count_:
+      heapq.heappop(timers)
+    if timers:
+      return timers[0][0]
+    return None
+
+  def SetTimeout(self, seconds, input):
+    ''' SetTimeout replaces the timeout of the current state until the
+    next transition. Callbacks can use it to pick a timeout depending on
+    more than the state.
+
+     Args:
+       seconds: Seconds from time_function (or the deadline of the
+                timeout being processed) until input is processed.
+       input: The input symbol of the timeout.
+    '''
+    # Count this as a transition, so pending timeouts become stale.
+    self.transition_count_ += 1
+    self.armTimeout_((seconds, input))
+
+  def ProcessTimeouts(self, now):
+    ''' ProcessTimeouts processes the inputs of all timeouts due at now.
+
+     Args:
+       now: The current time, in the clock of time_function.
+    '''
+    deadline = self.NextDeadline()
+    while deadline is not None and deadline <= now:
+      _, _, input = heapq.heappop(self.timers_)
+      self.timeout_ts_ = deadline
+      try:
+        self.ProcessInput(input)
+      finally:
+        self.timeout_ts_ = None
+      deadline = self.NextDeadline()
+
+  def armTimeout_(self, timeout):
+    ''' Start timeout for the state we just entered.'''
+    seconds, input = timeout
+    start = self.timeout_ts_
+    if start is None:
+      start = self.time_function_()
+    heapq.heappush(self.timers_,
+                   (start + seconds, self.transition_count_, input))
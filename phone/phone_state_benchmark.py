@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# Throughput benchmark of PhoneState.
+#
+# Feeds the input stream of dialing numbers through Phony's state
+# machine (with no-op callbacks) and reports symbols per second for
+#  - legacy: the former tuple keyed dictionary implementation,
+#  - ProcessInput: one call per symbol,
+#  - ProcessInputs: one call per buffer read from phone_io.
+#  - profiled: ProcessInputs with a profiler.Profiler compiled in.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import logging
+import time
+
+import phone_state
+import profiler
+
+# Phony's states, see phony.py.
+PS_READY, PS_DIAL_TONE, PS_DIAL_MOVING, PS_DIALING = 0, 1, 2, 3
+PS_REMOTE_RINGING, PS_BUSY, PS_RINGING, PS_TALKING = 4, 5, 6, 7
+
+TRANSITIONS = {
+  ('l', PS_READY): PS_DIAL_TONE,
+  ('l', PS_RINGING): PS_TALKING,
+  ('d', PS_DIAL_TONE): PS_READY,
+  ('d', PS_DIALING): PS_READY,
+  ('d', PS_DIAL_MOVING): PS_READY,
+  ('d', PS_REMOTE_RINGING): PS_READY,
+  ('d', PS_BUSY): PS_READY,
+  ('d', PS_TALKING): PS_READY,
+  ('s', PS_DIAL_TONE): PS_DIAL_MOVING,
+  ('s', PS_DIALING): PS_DIAL_MOVING,
+  ('1234567890', PS_DIAL_MOVING): PS_DIALING,
+  ('p', PS_DIAL_MOVING): PS_DIAL_MOVING,
+  ('a', PS_READY): PS_RINGING,
+  ('a', PS_REMOTE_RINGING): PS_TALKING,
+  ('c', PS_REMOTE_RINGING): PS_BUSY,
+  ('c', PS_RINGING): PS_READY,
+  ('c', PS_TALKING): PS_BUSY,
+  ('o', PS_DIALING): PS_REMOTE_RINGING}
+
+def Callback(previous_state, next_state, input):
+  pass
+
+CALLBACKS = dict(((previous_state, next_state), [Callback])
+                 for (_, previous_state), next_state in TRANSITIONS.items())
+
+class LegacyPhoneState:
+  ''' The PhoneState implementation before the transition table.'''
+
+  def __init__(self, initial_state, transitions, callbacks):
+    self.current_state_ = initial_state
+    self.transitions_ = {}
+    for t in transitions.items():
+      for i in t[0][0]:
+        self.transitions_[(i,t[0][1])] = t[1]
+    self.callbacks_ = callbacks
+
+  def ProcessInput(self, input):
+    try:
+      previous_state = self.current_state_
+      self.current_state_ = self.transitions_[(input,previous_state)]
+      logging.info('TR: ({input}, {prev}): {next}'.format(
+        input=input, prev=previous_state, next=self.current_state_))
+      callbacks = self.callbacks_[(previous_state, self.current_state_)]
+      for c in callbacks:
+        c(previous_state, self.current_state_, input)
+    except KeyError:
+      pass
+
+def DialBuffers(number):
+  ''' Returns the buffers phone_io produces while a number is dialed.'''
+  buffers = ['l']
+  for digit in number:
+    buffers.append('s')
+    buffers += ['p'] * (int(digit) or 10)
+    buffers.append('e' + digit)
+  buffers += ['o', 'a', 'd']
+  return buffers
+
+def Measure(function, buffers, repetitions):
+  ''' Returns symbols per second of function applied to all buffers.'''
+  symbols = sum(len(b) for b in buffers) * repetitions
+  start = time.time()
+  for _ in range(repetitions):
+    function(buffers)
+  return symbols / (time.time() - start)
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Throughput benchmark of PhoneState.')
+  parser.add_argument('--repetitions', type=int, default=2000)
+  parser.add_argument('--log_level', default='WARNING',
+                      help='Logging level, INFO logs every transition.')
+  args = parser.parse_args()
+
+  logging.basicConfig(level=getattr(logging, args.log_level),
+                      filename='/dev/null')
+  buffers = DialBuffers('0301234567')
+  # phone_io flushes once per update, so pulses arrive one per read.
+  joined = [''.join(buffers)]
+
+  legacy = LegacyPhoneState(PS_READY, TRANSITIONS, CALLBACKS)
+  def Legacy(buffers):
+    for b in buffers:
+      for i in b:
+        legacy.ProcessInput(i)
+
+  state = phone_state.PhoneState(PS_READY, TRANSITIONS, CALLBACKS)
+  def Single(buffers):
+    for b in buffers:
+      for i in b:
+        state.ProcessInput(i)
+
+  def Batch(buffers):
+    for b in buffers:
+      state.ProcessInputs(b)
+
+  profiled = phone_state.PhoneState(PS_READY, TRANSITIONS, CALLBACKS,
+                                    profiler=profiler.Profiler())
+  def Profiled(buffers):
+    for b in buffers:
+      profiled.ProcessInputs(b)
+
+  for name, function, input in [
+      ('legacy', Legacy, buffers),
+      ('ProcessInput', Single, buffers),
+      ('ProcessInputs', Batch, buffers),
+      ('ProcessInputs, one buffer', Batch, joined),
+      ('profiled', Profiled, buffers)]:
+    print('%-26s %10.0f symbols/s' %
+          (name, Measure(function, input, args.repetitions)))
+
+if __name__ == '__main__':
+  main()
@@ -1,6 +1,7 @@
 import logging
 import mock
 import phone_state
+import profiler
 import unittest
 
 class TestPhoneState(unittest.TestCase):
@@ -62,6 +63,102 @@ class TestPhoneState(unittest.TestCase):
     m.callback20.assert_called_once_with(2, 0, 'f')
     self.assertEqual(0, state_machine.GetCurrentState())    
 
+  def test_ProcessInputs(self):
+    m = mock.Mock()
+    state_machine = phone_state.PhoneState(
+      0, {('a', 0): 1, ('p', 1): 1, ('b', 1): 0},
+      {(0, 1): [m.callback01],
+       (1, 1): [m.callback11],
+       (1, 0): [m.callback10]})
+
+    # Unknown symbols are skipped, just like with ProcessInput.
+    state_machine.ProcessInputs('xapp\xffb')
+    self.assertEqual([mock.call.callback01(0, 1, 'a'),
+                      mock.call.callback11(1, 1, 'p'),
+                      mock.call.callback11(1, 1, 'p'),
+                      mock.call.callback10(1, 0, 'b')], m.mock_calls)
+    self.assertEqual(0, state_machine.GetCurrentState())
+
+    # Any iterable of symbols works.
+    state_machine.ProcessInputs(iter(['a']))
+    self.assertEqual(1, state_machine.GetCurrentState())
+
+  def test_Timeouts(self):
+    m = mock.Mock()
+    now = [10.0]
+    state_machine = phone_state.PhoneState(
+      0, {('a', 0): 1, ('p', 1): 1, ('t', 1): 2, ('t', 2): 0, ('b', 2): 0},
+      {(1, 2): [m.callback12],
+       (2, 0): [m.callback20]},
+      timeouts={1: (2, 't'), 2: (5, 't')},
+      time_function=lambda: now[0])
+    self.assertIsNone(state_machine.NextDeadline())
+
+    state_machine.ProcessInput('a')
+    self.assertEqual(12.0, state_machine.NextDeadline())
+    # Transitions into the same state start the timeout over.
+    now[0] = 11.0
+    state_machine.ProcessInput('p')
+    self.assertEqual(13.0, state_machine.NextDeadline())
+
+    state_machine.ProcessTimeouts(12.9)
+    self.assertEqual(1, state_machine.GetCurrentState())
+    m.callback12.assert_not_called()
+
+    # Timeouts armed by a timeout start at its deadline, so both fire if
+    # we are late enough.
+    state_machine.ProcessTimeouts(18.0)
+    self.assertEqual([mock.call.callback12(1, 2, 't'),
+                      mock.call.callback20(2, 0, 't')], m.mock_calls)
+    self.assertEqual(0, state_machine.GetCurrentState())
+    self.assertIsNone(state_machine.NextDeadline())
+
+  def test_TimeoutCancelledByInput(self):
+    m = mock.Mock()
+    now = [0.0]
+    state_machine = phone_state.PhoneState(
+      0, {('a', 0): 1, ('b', 1): 0, ('t', 1): 0},
+      {(1, 0): [m.callback10]},
+      timeouts={1: (1, 't')},
+      time_function=lambda: now[0])
+    state_machine.ProcessInputs('ab')
+    self.assertIsNone(state_machine.NextDeadline())
+    state_machine.ProcessTimeouts(5.0)
+    m.callback10.assert_called_once_with(1, 0, 'b')
+
+  def test_SetTimeout(self):
+    now = [10.0]
+    state_machine = phone_state.PhoneState(
+      0, {('a', 0): 1, ('t', 1): 0, ('u', 1): 2},
+      {}, timeouts={1: (5, 't')}, time_function=lambda: now[0])
+    state_machine.ProcessInput('a')
+    state_machine.SetTimeout(1, 'u')
+    # The timeout of the state is replaced.
+    self.assertEqual(11.0, state_machine.NextDeadline())
+    state_machine.ProcessTimeouts(20.0)
+    self.assertEqual(2, state_machine.GetCurrentState())
+
+  def test_Profiler(self):
+    now = [0.0]
+    def Slow(previous, next, input):
+      now[0] += 0.5
+    p = profiler.Profiler('test', budget=0.1, time_function=lambda: now[0])
+    state_machine = phone_state.PhoneState(
+      0, {('a', 0): 1, ('b', 1): 0}, {(0, 1): [Slow]}, profiler=p)
+    now[0] = 2.0
+    with mock.patch('logging.warning') as warning:
+      state_machine.ProcessInput('a')
+    self.assertEqual(1, warning.call_count)
+    self.assertIn((0, 1), warning.call_args[0])
+    now[0] = 3.0
+    state_machine.ProcessInput('b')
+    self.assertEqual([0.5], p.GetCallbackTimes((0, 1)))
+    self.assertEqual([0.0], p.GetCallbackTimes((1, 0)))
+    self.assertEqual([2.0], p.GetDwellTimes(0))
+    self.assertEqual([1.0], p.GetDwellTimes(1))
+    self.assertEqual(1, p.GetSlow())
+    self.assertIn('(0, 1)', p.Summary())
+
 if __name__ == '__main__':
   unittest.main()
 
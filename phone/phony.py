@@ -7,25 +7,127 @@
 from __future__ import division
 
 import ConfigParser
-import datetime
+import bell
+import call_records
+import clock
+import collections
+import dial_plan
+import errno
+import event_loop
+import event_protocol
 import fcntl
+import gateway_health
+import gpio_backend
+import gpio_trace
+import itertools
 import linphone
+import log_pipeline
 import logging
 import os
+import phone_io
 import phone_state
+import profiler
 import signal
+import sip_options
+import sqlite3
 import subprocess
+import supervisor
 import sys
-import time
+import threading
+import tones
 
 # The dial timeout determines the number of seconds to wait
-# until a number is presumed to be complete.
+# until a number is presumed to be complete, unless the dial plan
+# knows better. See dial_plan.py.
 DIAL_TIMEOUT = 2
 
+# Config section holding the dial plan: '<pattern> = [timeout=<seconds>]
+# [gateway=<gateway>]' per line. Without it, every number is complete
+# after DIAL_TIMEOUT.
+DIAL_PLAN_SECTION = 'dialplan'
+
+# Seconds to play the dial tone if the handset is lifted but nothing is
+# dialed, after which we switch to the busy tone.
+OFF_HOOK_TIMEOUT = 30
+
+# Seconds the dial may be off normal without a pulse. Past it, the digit
+# is lost and we signal busy. phone_io doesn't report a digit it saw
+# only part of, see Phone.Resync.
+DIAL_MOVING_TIMEOUT = 5
+
+# Seconds to play the busy tone before falling silent.
+BUSY_TIMEOUT = 60
+
+# Seconds to ring the bell before giving up on an incoming call.
+RING_TIMEOUT = 60
+
+# Seconds between two calls to core_.iterate() while the phone is in use
+# (tones, dialing, calls). Linphone recommends 20ms for call processing.
+CORE_ITERATE_INTERVAL = 0.02
+
+# Seconds between two calls to core_.iterate() while the phone is idle.
+# This bounds how late we notice incoming calls and registration updates.
+CORE_IDLE_ITERATE_INTERVAL = 0.1
+
+# Seconds a number dialed before its provider finished registering waits
+# for the registration, counted from the core being created. After that,
+# it is dialed anyway.
+REGISTRATION_WAIT = 10
+
+# Registration states after which we stop waiting for a provider.
+REGISTRATION_SETTLED = (linphone.RegistrationState.Ok,
+                        linphone.RegistrationState.Failed)
+
+# Reloading the config (SIGHUP) only touches the providers that changed
+# and never waits for the network. We warn if it takes longer than this
+# many seconds anyway.
+RELOAD_BUDGET = 0.05
+
+# Default location of the config, reread on SIGHUP.
+CONFIG_FILE = '/etc/phony.conf'
+
+# Call failures reported with these reasons come from the remote side,
+# the gateway did its job.
+CALLEE_REASONS = (linphone.Reason.Busy, linphone.Reason.Declined,
+                  linphone.Reason.NotFound)
+
+# Where phone_io runs: as a supervised subprocess (default), or on a
+# thread of Phony, see initPhoneIO.
+PHONE_IO_PROCESS = 'process'
+PHONE_IO_THREAD = 'thread'
+
+# Logger of the linphone log lines, see log_handler.
+LINPHONE_LOGGER = 'linphone'
+
+# phone_io selects cadences with a single digit, 0 being the default.
+MAX_CADENCES = 9
+
+# Config section holding settings of Phony itself. Sections named
+# '<PHONE_SECTION_PREFIX><name>' describe phones, all other sections
+# SIP providers.
+SETTINGS_SECTION = 'phony'
+PHONE_SECTION_PREFIX = 'phone '
+
+# The settings of a provider section. default is True for the
+# provider dialed out through, user_id and cadence are None if not set.
+Provider = collections.namedtuple('Provider', [
+  'username', 'user_id', 'password', 'gateway', 'default', 'cadence'])
+
+# Our own sounds are installed next to this file.
+SOUND_DIR = os.path.dirname(os.path.abspath(__file__))
+
 # Use the ring back sound from linphone.
-# TODO(aeckleder): Make this configurable.
 RING_BACK = '/usr/local/lib/python2.7/dist-packages/linphone/share/sounds/linphone/ringback.wav'
 
+# Tones and the WAV files they are read from unless a tone profile is
+# configured. See tones.PROFILES.
+TONE_FILES = [('dial_tone', os.path.join(SOUND_DIR, 'dial_tone.wav')),
+              ('busy_tone', os.path.join(SOUND_DIR, 'busy_tone.wav')),
+              ('ringback_tone', RING_BACK)]
+
+# The click played for each pulse of the dial.
+PULSE_FILE = os.path.join(SOUND_DIR, 'pulse.wav')
+
 # The following defines phone states:
 PS_READY = 0           # The phone is idle and ready to be used.
 PS_DIAL_TONE = 1       # The phone is ready to dial (dial tone).
@@ -35,6 +137,7 @@ PS_REMOTE_RINGING = 4  # The remote side is ringing.
 PS_BUSY = 5            # The phone is signalling busy / error.
 PS_RINGING = 6         # The phone is ringing.
 PS_TALKING = 7         # The phone is connected to the remote.
+PS_OFF_HOOK = 8        # The handset is off hook and nothing happens.
 
 # Note that in addition to the symbols produced by phone_io.py,
 # we introduce a few more symbols to drive our state machine.
@@ -43,16 +146,63 @@ PS_TALKING = 7         # The phone is connected to the remote.
 #  'a': Remote side calling / accepting to talk.
 #  'c': Remote side cancelling / rejecting the call.
 #  'o': Dialing complete. Triggered when INVITE is sent.
+#  'i': The number dialed is not in the dial plan.
+#  't': Timeout of the current state.
 
-class Phony:
-  def __init__(self, config):
-    ''' Construct Phony instance.
+class Phone:
+  ''' Phone is a single handset: its state machine, the number being
+  dialed, its call and its tones. Phony multiplexes all phones over one
+  linphone core and one phone_io process.'''
+
+  def __init__(self, phony, index, name, tone_engine, provider=None,
+               state_profiler=None):
+    ''' Construct Phone instance.
 
     Args:
-      config: config file as an instance of ConfigParser
+      phony: The Phony instance owning the core and phone_io.
+      index: Index of the phone in phone_io, see its --phone argument.
+      name: Name of the phone, used for logging.
+      tone_engine: The tones.ToneEngine playing the phone's tones.
+      provider: (username, gateway) of the phone's provider, or None to
+                ring for all providers and dial out through the default
+                gateway.
+      state_profiler: Optional profiler.Profiler of the state machine.
     '''
-    self.quit_ = False
-    self.config_ = config
+    self.phony_ = phony
+    self.index_ = index
+    self.name_ = name
+    self.tones_ = tone_engine
+    self.username_, self.gateway_ = provider or (None, None)
+    # Pending state timeout, None if not scheduled.
+    self.timeout_timer_ = None
+    # Capture time of the input currently processed by the state machine.
+    self.input_ts_ = clock.Monotonic()
+    # Capture times of the pulses of the digit being dialed.
+    self.pulse_ts_ = []
+    self.current_number_ = ''
+    # Last digit phone_io reported, which an 'x' refers to.
+    self.last_digit_ = None
+    # Dial plan state of current_number_, and the gateway it is dialed
+    # through (None for the phone's default).
+    self.dial_state_ = None
+    self.dial_gateway_ = None
+    # The call of this phone, None if there is none.
+    self.current_call_ = None
+    # URI of the number dialed, and the gateway it waits for while
+    # queued (None if not queued), see dialNumber.
+    self.dial_uri_ = None
+    self.dial_queued_ = None
+    # Gateways to fail over to if the call fails early, best first.
+    self.dial_candidates_ = []
+    # Gateway and INVITE time of the outbound call, and whether it rang.
+    self.call_gateway_ = None
+    self.invite_ts_ = None
+    self.call_rang_ = False
+    # Username an incoming call is for.
+    self.ring_username_ = None
+    # call_records.Call of the current call, None if there is none.
+    self.call_record_ = None
+    self.profiler_ = state_profiler
 
     self.phone_state_ = phone_state.PhoneState(PS_READY,
       # Possible state transitions and their triggers.
@@ -65,6 +215,7 @@ class Phony:
        ('d', PS_REMOTE_RINGING): PS_READY,
        ('d', PS_BUSY): PS_READY,
        ('d', PS_TALKING): PS_READY,
+       ('d', PS_OFF_HOOK): PS_READY,
 
        ('s', PS_DIAL_TONE): PS_DIAL_MOVING, # Dial moved from idle.
        ('s', PS_DIALING): PS_DIAL_MOVING,
@@ -81,144 +232,1095 @@ class Phony:
        ('c', PS_RINGING): PS_READY,
        ('c', PS_TALKING): PS_BUSY,
 
-       ('o', PS_DIALING): PS_REMOTE_RINGING},
+       ('o', PS_DIALING): PS_REMOTE_RINGING,
+       ('i', PS_DIALING): PS_BUSY,
+       ('i', PS_DIAL_MOVING): PS_BUSY, # Digit lost.
+
+       ('t', PS_DIAL_TONE): PS_BUSY, # Nothing dialed.
+       ('t', PS_BUSY): PS_OFF_HOOK,
+       ('t', PS_RINGING): PS_READY}, # Nobody answers.
       {(PS_READY, PS_DIAL_TONE): [self.startDialTone],
        (PS_READY, PS_RINGING): [self.startBell],
-       
-       (PS_DIAL_TONE, PS_DIAL_MOVING): [self.startDialing],
+
+       (PS_DIAL_TONE, PS_READY): [self.stopTone],
+       (PS_DIAL_TONE, PS_DIAL_MOVING): [self.stopTone,
+                                        self.startDialing],
        (PS_DIAL_MOVING, PS_DIALING): [self.processDigit],
        (PS_DIAL_MOVING, PS_DIAL_MOVING): [self.playPulse],
        (PS_DIALING, PS_REMOTE_RINGING): [self.dialNumber],
+       (PS_DIALING, PS_BUSY): [self.startBusyTone],
+       (PS_DIAL_MOVING, PS_BUSY): [self.startBusyTone],
        
        (PS_REMOTE_RINGING, PS_READY): [self.cancelCall],
        (PS_REMOTE_RINGING, PS_BUSY): [self.startBusyTone],
        
        (PS_RINGING, PS_TALKING): [self.stopBell,
                                   self.acceptCall],
-       (PS_RINGING, PS_READY): [self.stopBell],
+       (PS_RINGING, PS_READY): [self.stopBell,
+                                self.missCall],
        
        (PS_TALKING, PS_READY): [self.cancelCall],
-       (PS_TALKING, PS_BUSY): [self.startBusyTone]
-      })
+       (PS_TALKING, PS_BUSY): [self.startBusyTone],
+
+       (PS_DIAL_TONE, PS_BUSY): [self.startBusyTone],
+       (PS_BUSY, PS_READY): [self.stopTone],
+       (PS_BUSY, PS_OFF_HOOK): [self.stopTone]
+      },
+      # Timeouts and the input they produce. Timeouts of states entered
+      # because of phone_io events start at the capture time of the event.
+      {PS_DIALING: (DIAL_TIMEOUT, 'o'), # See processDigit.
+       PS_DIAL_MOVING: (DIAL_MOVING_TIMEOUT, 'i'),
+       PS_DIAL_TONE: (OFF_HOOK_TIMEOUT, 't'),
+       PS_BUSY: (BUSY_TIMEOUT, 't'),
+       PS_RINGING: (RING_TIMEOUT, 't')},
+      lambda: self.input_ts_, state_profiler)
+
+  def GetProfiler(self):
+    ''' GetProfiler returns the profiler.Profiler of the state machine,
+    None if profiling is off.'''
+    return self.profiler_
+
+  def IsIdle(self):
+    ''' IsIdle returns whether the phone is ready and has no call.'''
+    return (self.phone_state_.GetCurrentState() == PS_READY and
+            not self.current_call_)
+
+  def SetProvider(self, provider):
+    ''' SetProvider changes the provider of the phone.
+
+    Args:
+      provider: (username, gateway) as passed to the constructor.
+    '''
+    self.username_, self.gateway_ = provider or (None, None)
+
+  def Accepts(self, username):
+    ''' Accepts returns whether incoming calls to username ring this
+    phone.'''
+    return self.username_ is None or self.username_ == username
+
+  def ProcessEvents(self, events):
+    ''' Feed events from phone_io into the state machine.
+
+    The events go into the state machine at once, callbacks find the
+    capture time of the event they are called for in input_ts_.
+    '''
+    self.phone_state_.ProcessInputs(self.timestampedSymbols(events))
+    self.scheduleTimeout()
+
+  def ProcessInput(self, input, timestamp=None):
+    ''' Feed an input symbol into the state machine.
+
+    Args:
+      input: The input symbol.
+      timestamp: Time the input was captured at, see clock.Monotonic.
+                 Defaults to now. Callbacks can read it from input_ts_.
+    '''
+    self.input_ts_ = timestamp or clock.Monotonic()
+    self.phone_state_.ProcessInput(input)
+    self.scheduleTimeout()
+
+  def timestampedSymbols(self, events):
+    ''' Yields the symbols of events, updating input_ts_ as we go.
+
+    'x' only flags the digit before it, see phone_io.py, so it's logged
+    rather than passed on.'''
+    for event in events:
+      self.input_ts_ = event.timestamp
+      symbol = event.symbol
+      if symbol == 'x':
+        logging.warning(
+          'Phone {name}: inconsistent pulse timing of digit {digit} '
+          '(number so far {number}), it may be misdialed.'.format(
+            name=self.name_, digit=self.last_digit_,
+            number=self.current_number_))
+        continue
+      if symbol.isdigit():
+        self.last_digit_ = symbol
+      yield symbol
+
+  def scheduleTimeout(self):
+    ''' Make sure we wake up for the next timeout of the state machine.'''
+    deadline = self.phone_state_.NextDeadline()
+    if self.timeout_timer_:
+      if self.timeout_timer_.GetDeadline() == deadline:
+        return
+      self.timeout_timer_.Cancel()
+      self.timeout_timer_ = None
+    if deadline is not None:
+      self.timeout_timer_ = self.phony_.loop_.CallAt(deadline,
+                                                     self.processTimeouts)
+
+  def processTimeouts(self):
+    ''' Feed due timeouts into the state machine.'''
+    self.timeout_timer_ = None
+    now = clock.Monotonic()
+    self.input_ts_ = now
+    self.phone_state_.ProcessTimeouts(now)
+    self.scheduleTimeout()
+    self.phony_.scheduleIterate()
+
+  def sendCommands(self, commands):
+    ''' Send commands for this phone to phone_io.'''
+    self.phony_.writePhoneIO('P%d%s' % (self.index_, commands))
+
+  def Resync(self):
+    ''' phone_io restarted. Ask it for the hook and dial, which brings
+    the state machine up to date, and ring the bell again if we are
+    ringing.
+
+    The new phone_io doesn't report the digit it missed the start of, so
+    a digit being dialed is lost and we signal busy. If the dial is
+    still off normal, phone_io reports 's' and we time out of
+    PS_DIAL_MOVING, see DIAL_MOVING_TIMEOUT.'''
+    if self.phone_state_.GetCurrentState() == PS_DIAL_MOVING:
+      self.pulse_ts_ = []
+      self.ProcessInput('i')
+    commands = 'q'
+    if self.phone_state_.GetCurrentState() == PS_RINGING:
+      commands += self.ringCommands()
+    self.sendCommands(commands)
+
+  def processTone(self, tone):
+    ''' Process a tone (e.g. dial tone, busy tone).
+
+    Args:
+      tone: Name of the tone to play in a loop until stopped or
+            replaced, see TONE_FILES.
+    '''
+    self.tones_.Play(tone)
+
+  def startDialTone(self, previous_state, next_state, input):
+    ''' Start playing the dial tone.'''
+    self.processTone('dial_tone')
+
+  def startBusyTone(self, previous_state, next_state, input):
+    ''' Start playing the busy tone.'''
+    self.processTone('busy_tone')
+
+  def playPulse(self, previous_state, next_state, input):
+    ''' Play a single dialing pulse.'''
+    self.pulse_ts_.append(self.input_ts_)
+    # The click is timed by the capture time of the pulse, not by when
+    # we got around to process it.
+    self.tones_.Click('pulse', self.input_ts_)
+
+  def startDialing(self, previous_state, next_state, input):
+    self.current_number_ = ''
+    self.dial_state_ = self.phony_.dial_plan_.Start()
+    self.dial_gateway_ = None
+    self.pulse_ts_ = []
     
-    logging.basicConfig(level=logging.INFO)
+  def stopTone(self, previous_state, next_state, input):
+    ''' Stop the current tone.'''
+    self.tones_.Stop()
+
+  def startBell(self, previous_state, next_state, input):
+    ''' Start ringing the bell with the cadence of the called username.'''
+    self.sendCommands(self.ringCommands())
+
+  def ringCommands(self):
+    ''' Returns the phone_io commands ringing the bell.'''
+    return '%ds' % self.phony_.username_cadence_.get(self.ring_username_, 0)
+
+  def stopBell(self, previous_state, next_state, input):
+    ''' Stop ringing the bell.'''
+    self.sendCommands('e')
+
+  def dialNumber(self, previous_state, next_state, input):
+    ''' Dial the current number, or queue it until the core is created
+    and the provider registered.'''
+    fixed_gateway = self.dial_gateway_ or self.gateway_
+    if fixed_gateway:
+      # The dial plan or the phone's provider chose.
+      candidates = [fixed_gateway]
+    else:
+      candidates = self.phony_.RankGateways(self.current_number_)
+    gateway = candidates[0]
+    self.dial_candidates_ = candidates[1:]
+    self.call_record_ = call_records.Call(
+      call_records.OUTBOUND, self.name_, self.current_number_, gateway)
+    self.dial_uri_ = '{number}@{sip_gateway}'.format(
+      number=self.current_number_, sip_gateway=gateway)
+    if not self.phony_.CanDial(gateway):
+      logging.info('Phone {name} queueing {number} until {gateway} is '
+                   'registered'.format(name=self.name_,
+                                       number=self.current_number_,
+                                       gateway=gateway))
+      self.dial_queued_ = gateway
+      return
+    self.invite()
+
+  def GetQueuedGateway(self):
+    ''' GetQueuedGateway returns the gateway a queued number waits for,
+    None if no number is queued.'''
+    return self.dial_queued_
+
+  def invite(self):
+    ''' Call the number dialed, see dialNumber.'''
+    self.dial_queued_ = None
+    logging.info('Phone {name} dialing outbound number {number}'.format(
+      name=self.name_, number=self.current_number_))
+    # Linphone picks the proxy config whose domain matches the gateway,
+    # so the call goes out with the identity of the phone's provider.
+    self.call_gateway_ = self.dial_uri_.split('@', 1)[1]
+    if self.call_record_:
+      self.call_record_.provider = self.call_gateway_
+    self.invite_ts_ = clock.Monotonic()
+    self.call_rang_ = False
+    self.current_call_ = self.phony_.core_.invite(self.dial_uri_)
+
+  def Failover(self):
+    ''' Call the number through the next gateway after the call failed
+    before it rang. Returns False if there is no gateway left, or the
+    caller gave up already.'''
+    if (not self.dial_candidates_ or
+        self.phone_state_.GetCurrentState() != PS_REMOTE_RINGING):
+      return False
+    gateway = self.dial_candidates_.pop(0)
+    logging.info('Phone {name}: call via {failed} failed, failing over to '
+                 '{gateway}'.format(name=self.name_,
+                                    failed=self.call_gateway_,
+                                    gateway=gateway))
+    self.dial_uri_ = '{number}@{sip_gateway}'.format(
+      number=self.current_number_, sip_gateway=gateway)
+    self.invite()
+    return True
+    
+  def FinishRecord(self, reason):
+    ''' The current call ended for reason, record it.'''
+    if self.call_record_:
+      self.phony_.AddRecord(self.call_record_.Finish(reason))
+      self.call_record_ = None
+
+  def cancelCall(self, previous_state, next_state, input):
+    ''' Cancel the call of this phone.'''
+    logging.info('Phone %s cancelling its call.' % self.name_)
+    if self.call_record_ and self.call_record_.IsAnswered():
+      self.FinishRecord(call_records.REASON_HANGUP)
+    elif self.call_record_:
+      self.FinishRecord(
+        call_records.REASON_MISSED
+        if self.call_record_.direction == call_records.INBOUND
+        else call_records.REASON_CANCELLED)
+    self.dial_queued_ = None
+    self.dial_candidates_ = []
+    self.call_gateway_ = None
+    if self.current_call_:
+      self.phony_.core_.terminate_call(self.current_call_)
+    self.current_call_ = None
+
+  def missCall(self, previous_state, next_state, input):
+    ''' The call ringing this phone went unanswered. Record it as missed
+    and hang up, unless the caller did already ('c').'''
+    self.FinishRecord(call_records.REASON_MISSED)
+    if input != 'c':
+      self.cancelCall(previous_state, next_state, input)
+
+  def acceptCall(self, previous_state, next_state, input):
+    ''' Accept incoming call.'''
+    logging.info('Phone %s accepting incoming call.' % self.name_)
+    core = self.phony_.core_
+    if self.current_call_:
+      # An incoming call is already waiting. Accept it.
+      params = core.create_call_params(self.current_call_)
+      core.accept_call_with_params(self.current_call_, params)
+    else:
+      logging.warning('acceptCall in wrong state ignored.')
+
+  def processDigit(self, previous_state, next_state, input):
+    ''' A new digit has been completed.
+    Add it to the current phone number and ask the dial plan whether it
+    is complete. If it is, the number is dialed right away. If it may
+    be complete, it is dialed after the timeout of the matching pattern.
+    If it can't match anymore, or still doesn't match at the timeout,
+    we signal busy.'''
+    self.current_number_ = self.current_number_ + input
+    plan = self.phony_.dial_plan_
+    self.dial_state_ = plan.Step(self.dial_state_, input)
+    status, pattern = plan.Classify(self.dial_state_)
+    if status == dial_plan.DIAL_INVALID:
+      logging.info('Number %s is not in the dial plan.' %
+                   self.current_number_)
+      self.phone_state_.SetTimeout(0, 'i')
+    elif pattern is None:
+      self.phone_state_.SetTimeout(DIAL_TIMEOUT, 'i')
+    else:
+      self.dial_gateway_ = pattern.gateway
+      if status == dial_plan.DIAL_COMPLETE:
+        self.phone_state_.SetTimeout(0, 'o')
+      elif pattern.timeout is not None:
+        self.phone_state_.SetTimeout(pattern.timeout, 'o')
+    if len(self.pulse_ts_) > 1:
+      logging.info('Digit {digit}: {rate:.1f} pulses/s'.format(
+        digit=input,
+        rate=(len(self.pulse_ts_) - 1) /
+             (self.pulse_ts_[-1] - self.pulse_ts_[0])))
+    self.pulse_ts_ = []
+
+class Phony:
+  def __init__(self, config, config_file=None):
+    ''' Construct Phony instance.
+
+    Args:
+      config: config file as an instance of ConfigParser
+      config_file: Path config was read from, reread on SIGHUP. None
+        to ignore SIGHUP.
+    '''
+    self.config_ = config
+    self.config_file_ = config_file
+    self.loop_ = event_loop.EventLoop()
+    # Pending core iteration, None if not scheduled.
+    self.iterate_timer_ = None
+    
+    self.initLogging()
+    self.initCallRecords()
 
     signal.signal(signal.SIGINT, self.signal_handler)
+    signal.signal(signal.SIGUSR1, self.profile_handler)
+    signal.signal(signal.SIGHUP, self.reload_handler)
 
-    self.initLinphone()
+    # The hardware comes first, so the handset is usable as early as
+    # possible. Creating the core and registering takes much longer and
+    # happens on a thread of its own, see startCore.
+    self.core_ = None
+    self.phone_io_supervisor_ = None
+    self.initProviders()
     self.initPhoneIO()
+    self.initTones()
+    self.initPhones()
+    self.startCore()
 
   def Run(self):
-    ''' Run executes the main loop until quit. '''
-    while not self.quit_:
-      self.core_.iterate()
-      input_seq = ''
+    ''' Run executes the main loop until quit.
+
+    The loop sleeps until the phone_io pipe becomes readable or the
+    next timer (core iteration, state timeout, tone repeat) is due.
+    '''
+    self.loop_.Run()
+    # The first phone's engine owns the tone files the others share.
+    for phone in reversed(self.phones_):
+      phone.tones_.Close()
+    if self.call_records_:
+      self.call_records_.Close()
+    if self.log_queue_:
+      self.log_queue_.Flush(1)
+
+  def initLogging(self):
+    ''' Log through log_pipeline, so logging never blocks on the disk.'''
+    self.log_queue_ = None
+    if logging.getLogger().handlers:
+      # Our caller set up logging, e.g. a benchmark.
+      return
+    log_file = self.getSetting('log_file')
+    stream = sys.stderr
+    if log_file:
+      stream = log_pipeline.RotatingFile(
+        log_file,
+        int(self.getSetting('log_max_bytes', log_pipeline.DEFAULT_MAX_BYTES)),
+        int(self.getSetting('log_backups', log_pipeline.DEFAULT_BACKUPS)))
+    levels = {LINPHONE_LOGGER: logging.getLevelName(
+      self.getSetting('linphone_log_level', 'INFO').upper())}
+    self.log_queue_ = log_pipeline.QueueHandler(
+      stream, levels,
+      rate=float(self.getSetting('log_rate', log_pipeline.DEFAULT_RATE)))
+    log_pipeline.Install(self.log_queue_, logging.getLevelName(
+      self.getSetting('log_level', 'INFO').upper()))
+
+  def initCallRecords(self):
+    ''' Record calls to the database configured as call_records, if
+    any.'''
+    self.call_records_ = None
+    path = self.getSetting('call_records')
+    if not path:
+      return
+    try:
+      self.call_records_ = call_records.RecordStore(path)
+    except (sqlite3.Error, EnvironmentError) as e:
+      logging.error('Not recording calls, can\'t open %s: %s' % (path, e))
+
+  def AddRecord(self, record):
+    ''' Store the call_records.Record of a finished call.'''
+    if self.call_records_:
+      self.call_records_.Add(record)
+
+  def iterateCore(self):
+    ''' Let linphone do its work and schedule the next iteration.'''
+    self.iterate_timer_ = None
+    self.core_.iterate()
+    self.scheduleIterate()
+
+  def scheduleIterate(self):
+    ''' (Re)schedule the next core iteration according to the phone states.
+
+    The core is iterated at a slower cadence while all phones are idle.
+    As soon as a phone is in use, a pending idle iteration is brought
+    forward.
+    '''
+    if self.core_ is None:
+      # coreReady starts iterating.
+      return
+    interval = CORE_IDLE_ITERATE_INTERVAL
+    for phone in self.phones_:
+      if not phone.IsIdle():
+        interval = CORE_ITERATE_INTERVAL
+        break
+    deadline = clock.Monotonic() + interval
+    if self.iterate_timer_:
+      if self.iterate_timer_.GetDeadline() <= deadline:
+        return
+      self.iterate_timer_.Cancel()
+    self.iterate_timer_ = self.loop_.CallAt(deadline, self.iterateCore)
+
+  def readPhoneControls(self):
+    ''' Process input from phone_io once the pipe becomes readable.'''
+    try:
+      input_seq = os.read(self.phone_controls_.fileno(), 4096)
+    except OSError as e:
+      if e.errno in (errno.EAGAIN, errno.EINTR):
+        return
+      if not self.phone_io_supervisor_:
+        raise
+      self.phone_io_supervisor_.Failed('failed to read (%s)' % e)
+      return
+    if not input_seq:
+      # End of file. phone_io died.
+      if self.phone_io_supervisor_:
+        self.phone_io_supervisor_.Failed('closed its output')
+      else:
+        logging.error('phone_io closed its output.')
+        self.loop_.RemoveReader(self.phone_controls_)
+      return
+    if self.phone_io_supervisor_:
+      self.phone_io_supervisor_.Alive()
+    self.processPhoneEvents(self.event_reader_.Feed(input_seq))
+
+  def phoneIOThreadEvents(self, events):
+    ''' Process events from the phone_io thread, see startPhoneIOThread.
+    None once it stopped.'''
+    if events is None:
+      if self.phone_IO_.poll():
+        logging.error('phone_io failed, stopping.')
+      self.loop_.Stop()
+      return
+    self.processPhoneEvents(events)
+
+  def processPhoneEvents(self, events):
+    ''' Keep the state machines up to date, passing each run of events
+    of the same phone at once.'''
+    for index, phone_events in itertools.groupby(events,
+                                                 lambda e: e.phone):
+      if index < len(self.phones_):
+        self.phones_[index].ProcessEvents(phone_events)
+      else:
+        logging.warning('Event for unknown phone %d ignored.' % index)
+    # A phone might have left the idle state.
+    self.scheduleIterate()
+
+  def initProviders(self):
+    ''' Read the SIP providers from the config. The core is set up with
+    them later, see createCore.'''
+    # Ring cadences passed to phone_io, and the index of the cadence
+    # (starting at 1) to ring for each username. Unlisted usernames ring
+    # with the default cadence.
+    self.cadences_ = []
+    self.username_cadence_ = {}
+    # Registration state by gateway, filled in as the core reports it.
+    self.registrations_ = {}
+    # (proxy config, auth info) by provider section, filled in by
+    # createCore.
+    self.proxies_ = {}
+    # A config read while the core was created, applied by coreReady.
+    self.pending_config_ = None
+    # Health of the gateways, see RankGateways.
+    self.health_ = gateway_health.HealthTracker()
+    self.pinger_ = None
+    interval = float(self.getSetting('options_interval',
+                                     sip_options.DEFAULT_INTERVAL))
+    if interval:
+      # A ping is lost at the latest when the next one goes out.
+      self.pinger_ = sip_options.OptionsPinger(
+        self.loop_, self.health_, interval,
+        min(sip_options.DEFAULT_TIMEOUT, interval))
+    self.setProviders(*self.readProviders(self.config_))
+
+  def readProviders(self, config):
+    ''' Returns the providers of config as {section: Provider} in config
+    order, and the gateway of the default provider.'''
+    providers = collections.OrderedDict()
+    standard_gateway = ''
+    for section in self.providerSections(config):
+      is_default = False
       try:
-        # See if the user used a control of the phone
-        input_seq = self.phone_controls_.read()
+        is_default = config.getboolean(section, 'default')
       except:
         pass
-      for i in input_seq:
-        # Keep the state machine up to date.
-        self.phone_state_.ProcessInput(i)
-
-      # Dialing mode has a timeout. We don't model timeouts in our state machine,
-      # so we have to keep track of time manually here.
-      if self.phone_state_.GetCurrentState() == PS_DIALING:
-        time_since_last_digit = datetime.datetime.now() - self.current_number_ts_
-        if time_since_last_digit.total_seconds() > DIAL_TIMEOUT:
-          # Update state machine to say we are done dialing.
-          self.phone_state_.ProcessInput('o')
-
-      elif self.phone_state_.GetCurrentState() in [PS_DIAL_TONE, PS_BUSY]:
-        # Keep active dial tone going, but don't start a new one.
-        self.processTone()
-                
-      time.sleep(0.03)
-    
-  def initLinphone(self):      
+      user_id = None
+      try:
+        user_id = config.get(section, 'Userid')
+      except:
+        pass
+      cadence = None
+      try:
+        cadence = config.get(section, 'Cadence')
+      except:
+        pass
+      if cadence:
+        # Fail at startup rather than in phone_io. Only the syntax is
+        # checked, decoding audio cadences would block the loop.
+        bell.ValidateCadence(cadence)
+      provider = Provider(config.get(section, 'Username'), user_id,
+                          config.get(section, 'Password'),
+                          config.get(section, 'Gateway'), is_default,
+                          cadence)
+      providers[section] = provider
+      if is_default or not standard_gateway:
+        # If we have a default, use it. Otherwise, just pick the first one.
+        standard_gateway = provider.gateway
+    return providers, standard_gateway
+
+  def setProviders(self, providers, standard_gateway, new_cadences=True):
+    ''' Use providers and dial out through standard_gateway.
+
+    Args:
+      providers: {section: Provider}, see readProviders.
+      standard_gateway: The gateway of the default provider.
+      new_cadences: Whether cadences phone_io doesn't know yet can be
+        added, which is only the case before it is started.
+    '''
+    self.providers_ = providers
+    self.standard_gateway_ = standard_gateway
+    # We keep track of usernames configured for the various gateways,
+    # and accept incoming calls only if there is a match.
+    self.accepted_usernames_ = set(p.username for p in providers.values())
+    self.username_cadence_ = {}
+    for provider in providers.values():
+      if provider.cadence:
+        self.addCadence(provider.username, provider.cadence, new_cadences)
+    if self.pinger_:
+      self.pinger_.SetGateways(self.providerGateways())
+
+  def providerGateways(self):
+    ''' Returns the gateways of the providers, each once.'''
+    gateways = []
+    for provider in self.providers_.values():
+      if provider.gateway not in gateways:
+        gateways.append(provider.gateway)
+    return gateways
+
+  def RankGateways(self, number):
+    ''' Returns the gateways to call number through, best first. See
+    gateway_health.HealthTracker.Rank.'''
+    gateways = self.providerGateways()
+    ranked = self.health_.Rank(gateways, self.standard_gateway_)
+    if ranked:
+      logging.info('Routing {number} via {gateway}: {health}'.format(
+        number=number, gateway=ranked[0],
+        health=self.health_.Describe(ranked)))
+    return ranked or [self.standard_gateway_]
+
+  def startCore(self):
+    ''' Create the linphone core and register with the providers on a
+    thread of its own, while the main loop already serves the phones.
+
+    The core isn't touched by the main loop before coreReady hands it
+    over, and not by the thread afterwards.
+    '''
+    linphone.set_log_handler(self.log_handler)
+    # Files are written by the main thread only.
+    ringback = self.tones_.GetFile('ringback_tone')
+    self.core_wait_timer_ = None
+    def Create():
+      try:
+        core = self.createCore(ringback)
+      except Exception as e:
+        # Fail in the main loop, just like a failure at startup.
+        def Fail(e=e):
+          raise e
+        self.loop_.CallFromThread(Fail)
+        return
+      self.loop_.CallFromThread(lambda: self.coreReady(core))
+    self.core_thread_ = threading.Thread(target=Create, name='core')
+    self.core_thread_.daemon = True
+    self.core_thread_.start()
+
+  def createCore(self, ringback):
+    ''' Returns a new linphone core registering with all providers.
+
+    Runs on the core thread, see startCore.
+
+    Args:
+      ringback: Path of the ringback tone.
+    '''
     callbacks = linphone.Factory().get().create_core_cbs()
     callbacks.call_state_changed = self.call_state_changed
+    callbacks.registration_state_changed = self.registration_state_changed
 
-    linphone.set_log_handler(self.log_handler)
-    self.core_ = linphone.Factory().get().create_core(callbacks,
-                                                      None, None)
-    self.core_.max_calls = 1
-    self.core_.echo_cancellation_enabled = False
-    self.core_.video_capture_enabled = False
-    self.core_.video_display_enabled = False
+    core = linphone.Factory().get().create_core(callbacks, None, None)
+    core.echo_cancellation_enabled = False
+    core.video_capture_enabled = False
+    core.video_display_enabled = False
     # STUN server should be independent of provider, so we
     # hardcode it here.
-    self.core_.nat_policy.stun_server = 'stun.linphone.org'
-    self.core_.nat_policy.ice_enabled = True
-
+    core.nat_policy.stun_server = 'stun.linphone.org'
+    core.nat_policy.ice_enabled = True
     # Manually configure ringback tone, so we can be sure that
     # it is found.
-    self.core_.remote_ringback_tone = RING_BACK
-    self.core_.ringback = RING_BACK
+    core.remote_ringback_tone = ringback
+    core.ringback = ringback
+    core.max_calls = len(self.phoneSections())
 
     logging.info('Setting up SIP configuration.')
-    self.standard_gateway_ = ''
-    # We keep track of usernames configured for the various gateways,
-    # and accept incoming calls only if there is a match.
-    self.accepted_usernames_ = set()
+    for section in self.providerSections():
+      self.addProxy(core, section, self.providers_[section])
+    return core
 
-    for provider in self.config_.sections():
-      username = self.config_.get(provider, 'Username')
-      self.accepted_usernames_.add(username)
+  def addProxy(self, core, section, provider):
+    ''' Register with provider.
 
-      password = self.config_.get(provider, 'Password')
-      sip_gateway = self.config_.get(provider, 'Gateway')
-      is_default = False
-      try:
-        is_default = self.config_.getboolean(provider, 'default')
-      except:
-        pass
-      user_id = None
-      try:
-        user_id = self.config_.get(provider, 'Userid')
-      except:
-        pass
+    Args:
+      core: The linphone core.
+      section: The config section of provider.
+      provider: The Provider.
+    '''
+    proxy_config = core.create_proxy_config()
+    proxy_config.identity_address = core.create_address(
+      'sip:{username}@{sip_gateway}'.format(username=provider.username,
+                                            sip_gateway=provider.gateway))
+    proxy_config.server_addr = 'sip:{sip_gateway}'.format(
+      sip_gateway=provider.gateway)
+    proxy_config.register_enabled = True
+    core.add_proxy_config(proxy_config)
 
-      proxy_config = self.core_.create_proxy_config()
-      proxy_config.identity_address = self.core_.create_address(
-      'sip:{username}@{sip_gateway}'.format(username=username,
-                                            sip_gateway=sip_gateway))
-      
-      proxy_config.server_addr = 'sip:{sip_gateway}'.format(sip_gateway=sip_gateway)
-      proxy_config.register_enabled = True
-      self.core_.add_proxy_config(proxy_config)
-
-      logging.info('Registering {username}@{sip_gateway},default={is_default}'.format(
-        username=username,
-        sip_gateway=sip_gateway,
-        is_default=is_default))
-   
-      if is_default or not self.standard_gateway_:
-        # If we have a default, use it. Otherwise, just pick the first one.
-        self.core_.default_proxy_config = proxy_config
-        self.standard_gateway_ = sip_gateway
+    is_default = provider.gateway == self.standard_gateway_
+    logging.info('Registering {username}@{sip_gateway},default={is_default}'.format(
+      username=provider.username,
+      sip_gateway=provider.gateway,
+      is_default=is_default))
+    if is_default:
+      core.default_proxy_config = proxy_config
 
-      auth_info = self.core_.create_auth_info(username, user_id, password,
-                                              None, None, sip_gateway)
-      self.core_.add_auth_info(auth_info)
+    auth_info = core.create_auth_info(provider.username, provider.user_id,
+                                      provider.password, None, None,
+                                      provider.gateway)
+    core.add_auth_info(auth_info)
+    self.proxies_[section] = (proxy_config, auth_info)
 
-    # No prospective call yet.
-    self.current_call_ = None
+  def removeProxy(self, section, provider):
+    ''' Unregister from provider, see addProxy.'''
+    logging.info('Unregistering {username}@{sip_gateway}'.format(
+      username=provider.username, sip_gateway=provider.gateway))
+    proxy_config, auth_info = self.proxies_.pop(section)
+    self.core_.remove_proxy_config(proxy_config)
+    self.core_.remove_auth_info(auth_info)
+    if not any(p.gateway == provider.gateway
+               for p in self.providers_.values()):
+      self.registrations_.pop(provider.gateway, None)
+
+  def updateCredentials(self, section, provider):
+    ''' Replace the credentials of provider and register again with
+    them, leaving the proxy config in place.'''
+    logging.info('Updating credentials of {username}@{sip_gateway}'.format(
+      username=provider.username, sip_gateway=provider.gateway))
+    proxy_config, auth_info = self.proxies_[section]
+    self.core_.remove_auth_info(auth_info)
+    auth_info = self.core_.create_auth_info(
+      provider.username, provider.user_id, provider.password, None, None,
+      provider.gateway)
+    self.core_.add_auth_info(auth_info)
+    self.proxies_[section] = (proxy_config, auth_info)
+    proxy_config.refresh_register()
+
+  def coreReady(self, core):
+    ''' Start using the core created by the core thread.'''
+    logging.info('Core ready.')
+    self.core_ = core
+    for sink in self.linphone_sinks_:
+      sink.SetCore(core)
+    for gateway in set(p.gateway for p in self.providers_.values()):
+      self.registrations_.setdefault(gateway,
+                                     linphone.RegistrationState.None_)
+    # Don't wait for registrations forever.
+    self.core_wait_timer_ = self.loop_.CallLater(
+      REGISTRATION_WAIT, lambda: self.dialQueued(True))
+    self.dialQueued()
+    self.iterateCore()
+    if self.pending_config_:
+      config, self.pending_config_ = self.pending_config_, None
+      self.Reload(config)
+
+  def Reload(self, config):
+    ''' Apply the providers of config, touching only the registrations
+    of providers that changed. Calls in progress are left alone.
+
+    Other changes (phones, settings, dial plan) take effect on restart.
+    If config is invalid, the running one is kept.
+    '''
+    if self.core_ is None:
+      # The core thread is still reading the providers.
+      logging.info('Reloading the config once the core is ready.')
+      self.pending_config_ = config
+      return
+    start = clock.Monotonic()
+    try:
+      providers, standard_gateway = self.readProviders(config)
+      phone_providers = self.readPhoneProviders(config, providers)
+    except (ConfigParser.Error, ValueError) as e:
+      logging.error('Not reloading the config: %s' % e)
+      return
+    for section in [SETTINGS_SECTION, DIAL_PLAN_SECTION] + [
+        s for s in self.phoneSections() if s]:
+      if self.sectionItems(config, section) != self.sectionItems(
+          self.config_, section):
+        logging.warning('Changes to [%s] take effect on restart.' % section)
+
+    old_providers = self.providers_
+    self.config_ = config
+    self.setProviders(providers, standard_gateway, new_cadences=False)
+    added, removed, updated = [], [], []
+    for section, provider in old_providers.items():
+      new = providers.get(section)
+      if not new or (new.username, new.gateway) != (provider.username,
+                                                    provider.gateway):
+        # The identity changed, which needs a new registration anyway.
+        self.removeProxy(section, provider)
+        removed.append(section)
+    for section, provider in providers.items():
+      old = old_providers.get(section)
+      if section not in self.proxies_:
+        self.addProxy(self.core_, section, provider)
+        self.registrations_[provider.gateway] = (
+          linphone.RegistrationState.None_)
+        added.append(section)
+      elif (old.user_id, old.password) != (provider.user_id,
+                                           provider.password):
+        self.updateCredentials(section, provider)
+        updated.append(section)
+      if (provider.gateway == standard_gateway and
+          self.core_.default_proxy_config is not self.proxies_[section][0]):
+        logging.info('Dialing out through %s' % provider.gateway)
+        self.core_.default_proxy_config = self.proxies_[section][0]
+    for phone, provider in zip(self.phones_, phone_providers):
+      phone.SetProvider(provider)
+
+    duration = clock.Monotonic() - start
+    message = ('Reloaded the config in {ms:.1f}ms: added {added}, removed '
+               '{removed}, updated {updated}.').format(
+                 ms=duration * 1000, added=added, removed=removed,
+                 updated=updated)
+    if duration > RELOAD_BUDGET:
+      logging.warning(message)
+    else:
+      logging.info(message)
+    self.dialQueued()
+
+  def CanDial(self, gateway):
+    ''' CanDial returns whether a number can be dialed through gateway
+    right away: the core is ready and the gateway registered, or it
+    isn't one of our providers.'''
+    if self.core_ is None:
+      return False
+    if self.core_wait_timer_ is None:
+      # Waited long enough.
+      return True
+    return self.registrations_.get(
+      gateway, linphone.RegistrationState.Ok) in REGISTRATION_SETTLED
+
+  def IsRegistered(self):
+    ''' IsRegistered returns whether all providers are registered.'''
+    return self.core_ is not None and all(
+      state == linphone.RegistrationState.Ok
+      for state in self.registrations_.values())
 
+  def dialQueued(self, timeout=False):
+    ''' Dial the queued numbers that can be dialed now.
+
+    Args:
+      timeout: REGISTRATION_WAIT passed, dial all of them.
+    '''
+    if timeout:
+      self.core_wait_timer_ = None
+    for phone in self.phones_:
+      gateway = phone.GetQueuedGateway()
+      if gateway is not None and self.CanDial(gateway):
+        phone.invite()
+    self.scheduleIterate()
+
+  def initTones(self):
+    ''' Decode or synthesize all tones, so playing them is cheap.
+
+    The tones are played by the first phone's engine. The engines of the
+    other phones share them, see initPhones.
+    '''
+    profile = self.getSetting('tone_profile')
+    self.linphone_sinks_ = []
+    self.tones_ = tones.ToneEngine(self.createSink(self.phoneSections()[0]))
+    for name, default_path in TONE_FILES:
+      # A profile replaces the default files, but not configured ones.
+      path = self.getSetting(name, None if profile else default_path)
+      self.tones_.AddTone(
+        tones.LoadTone(name, path, profile or tones.DEFAULT_PROFILE))
+      # Write the tone file now, so starting a tone never hits the disk.
+      self.tones_.GetFile(name)
+    self.tones_.AddSound(tones.LoadWav('pulse', PULSE_FILE))
+    self.tones_.GetFile('pulse')
+
+  def createSink(self, section):
+    ''' Returns the tone sink of the phone configured in section.'''
+    sink = tones.CreateSink(
+      self.getPhoneSetting(section, 'tone_output', 'auto'),
+      self.core_, self.loop_,
+      self.getPhoneSetting(section, 'tone_device', 'default'))
+    if isinstance(sink, tones.LinphoneSink):
+      # It plays once the core is created, see coreReady.
+      self.linphone_sinks_.append(sink)
+    return sink
+
+  def initPhones(self):
+    ''' Create a Phone per phone section, or a single one on the default
+    pins if there is none.'''
+    self.phones_ = []
+    phone_providers = self.readPhoneProviders(self.config_, self.providers_)
+    for index, section in enumerate(self.phoneSections()):
+      name = self.phoneName(section)
+      provider = phone_providers[index]
+      tone_engine = self.tones_
+      if index:
+        tone_engine = self.tones_.Fork(self.createSink(section))
+      state_profiler = None
+      budget = self.getSetting('callback_budget')
+      if budget:
+        state_profiler = profiler.Profiler(name, float(budget))
+      self.phones_.append(Phone(self, index, name, tone_engine, provider,
+                                state_profiler))
+      logging.info('Phone {name}: index {index}, provider {provider}'.format(
+        name=name, index=index, provider=provider))
+    self.dial_plan_ = self.createDialPlan()
+
+  def phoneName(self, section):
+    ''' Returns the name of the phone configured in section.'''
+    if not section:
+      return 'default'
+    return section[len(PHONE_SECTION_PREFIX):].strip()
+
+  def readPhoneProviders(self, config, providers):
+    ''' Returns the (username, gateway) of each phone's provider in
+    config, None for phones without one.
+
+    Args:
+      config: The config.
+      providers: The providers of config, see readProviders.
+    '''
+    phone_providers = []
+    for section in self.phoneSections():
+      provider = None
+      if section and config.has_option(section, 'provider'):
+        provider_section = config.get(section, 'provider')
+        if provider_section not in providers:
+          raise ValueError('Phone {name}: unknown provider {provider}'.format(
+            name=self.phoneName(section), provider=provider_section))
+        provider = (providers[provider_section].username,
+                    providers[provider_section].gateway)
+      phone_providers.append(provider)
+    return phone_providers
+
+  def phonePins(self):
+    ''' Returns the pins passed to phone_io, empty for its default single
+    phone.'''
+    pins = []
+    for section in self.phoneSections():
+      if section:
+        setting = self.getPhoneSetting(section, 'pins')
+        # Fail at startup rather than in phone_io.
+        pins.append(
+          phone_io.ParsePins(setting) if setting else phone_io.DEFAULT_PINS)
+    return pins
+
+  def createDialPlan(self):
+    ''' Returns the dial_plan.DialPlan of the config.'''
+    if not self.config_.has_section(DIAL_PLAN_SECTION):
+      return dial_plan.DialPlan(dial_plan.OPEN_PLAN)
+    plan = dial_plan.DialPlan()
+    for pattern, options in self.config_.items(DIAL_PLAN_SECTION):
+      timeout, gateway = dial_plan.ParseOptions(options)
+      plan.Add(pattern, timeout, gateway)
+    return plan
+
+  def addCadence(self, username, cadence, new_cadences=True):
+    ''' Ring the bell with cadence for calls to username.
+
+    Args:
+      username: The username calls are made to.
+      cadence: A cadence as understood by bell.ParseCadence.
+      new_cadences: Whether cadences phone_io doesn't know yet can be
+        added, see setProviders.
+    '''
+    if cadence not in self.cadences_:
+      if not new_cadences:
+        logging.warning('New cadences take effect on restart, {username} '
+                        'rings with the default cadence.'.format(
+                          username=username))
+        return
+      if len(self.cadences_) == MAX_CADENCES:
+        logging.warning('Too many cadences, {username} rings with the '
+                        'default cadence.'.format(username=username))
+        return
+      self.cadences_.append(cadence)
+    self.username_cadence_[username] = self.cadences_.index(cadence) + 1
+
+  def providerSections(self, config=None):
+    ''' Returns the sections of config (default: the current one)
+    describing SIP providers.'''
+    config = config or self.config_
+    return [s for s in config.sections()
+            if s not in (SETTINGS_SECTION, DIAL_PLAN_SECTION) and
+            not s.startswith(PHONE_SECTION_PREFIX)]
+
+  def phoneSections(self):
+    ''' Returns the config sections describing phones, in phone_io
+    order. [None] if there is none, which stands for the single phone on
+    the default pins.'''
+    return [s for s in self.config_.sections()
+            if s.startswith(PHONE_SECTION_PREFIX)] or [None]
+
+  def sectionItems(self, config, section):
+    ''' Returns the options of section in config, sorted, empty if there
+    is no such section.'''
+    if not config.has_section(section):
+      return []
+    return sorted(config.items(section))
+
+  def getSetting(self, option, default=None):
+    ''' Returns an option of the settings section or default if not set.'''
+    if self.config_.has_option(SETTINGS_SECTION, option):
+      return self.config_.get(SETTINGS_SECTION, option)
+    return default
+
+  def getPhoneSetting(self, section, option, default=None):
+    ''' Returns an option of the phone section, falling back to the
+    settings section and default.'''
+    if section and self.config_.has_option(section, option):
+      return self.config_.get(section, option)
+    return self.getSetting(option, default)
 
   def initPhoneIO(self):
+    ''' Start phone_io as a subprocess, which a supervisor.Supervisor
+    restarts if it dies or stops sending heartbeats. With phone_io=thread
+    it runs on a thread of our process instead.'''
+    mode = self.getSetting('phone_io', PHONE_IO_PROCESS)
+    if mode == PHONE_IO_THREAD:
+      self.startPhoneIOThread()
+      return
+    if mode != PHONE_IO_PROCESS:
+      raise ValueError('Unknown phone_io mode %s' % mode)
+    self.phone_io_supervisor_ = supervisor.Supervisor(
+      self.loop_, self.startPhoneIO, self.stopPhoneIO, 'phone_io')
+    self.phone_io_supervisor_.Start()
+
+  def startPhoneIO(self, restart):
+    ''' Start the phone_io subprocess and return it.
+
+    Args:
+      restart: phone_io ran before. Resynchronize the phones with it.
+    '''
     abs_path = os.path.abspath(sys.argv[0])
     io_binary = os.path.join(
       os.path.dirname(abs_path),
       'phone_io.py')
     print('io binary %s' % io_binary)
-    self.phone_IO_ = subprocess.Popen([io_binary],
+    # Framed events carry capture timestamps and the phone index. The
+    # character protocol is kept for compatibility with a single phone.
+    protocol = self.getSetting('protocol', event_protocol.PROTOCOL_FRAMED)
+    if (protocol != event_protocol.PROTOCOL_FRAMED and
+        len(self.phoneSections()) > 1):
+      raise ValueError('Several phones need the framed protocol.')
+    self.event_reader_ = event_protocol.CreateReader(protocol)
+    env = dict(os.environ)
+    for option, variable in [('gpio_backend', gpio_backend.BACKEND_ENV),
+                             ('gpio_script', gpio_backend.SCRIPT_ENV)]:
+      value = self.getSetting(option)
+      if value:
+        env[variable] = value
+    args = [io_binary, '--protocol', protocol,
+            '--heartbeat', str(supervisor.HEARTBEAT_INTERVAL)]
+    for cadence in self.cadences_:
+      args += ['--cadence', cadence]
+    for pins in self.phonePins():
+      args += ['--phone', ','.join(str(p) for p in pins)]
+    if self.adaptiveDial():
+      args.append('--adaptive')
+    metrics_address = self.getSetting('metrics')
+    if metrics_address:
+      args += ['--metrics', metrics_address]
+    trace = self.getSetting('gpio_trace')
+    if trace:
+      args += ['--trace', trace, '--trace-max-bytes',
+               self.getSetting('gpio_trace_max_bytes',
+                               str(gpio_trace.DEFAULT_MAX_BYTES))]
+    self.phone_IO_ = subprocess.Popen(args,
                                       stdin=subprocess.PIPE,
-                                      stdout=subprocess.PIPE)
-    self.phone_controls_ = os.fdopen(self.phone_IO_.stdout.fileno(), 'rb', 0)
+                                      stdout=subprocess.PIPE,
+                                      env=env)
+    # Popen's pipes are unbuffered, and we read with os.read anyway.
+    self.phone_controls_ = self.phone_IO_.stdout
     flags = fcntl.fcntl(self.phone_IO_.stdout.fileno(), fcntl.F_GETFL)
     fcntl.fcntl(self.phone_IO_.stdout, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    self.loop_.AddReader(self.phone_controls_, self.readPhoneControls)
+    if restart:
+      for phone in self.phones_:
+        phone.Resync()
+    return self.phone_IO_
+
+  def startPhoneIOThread(self):
+    ''' Run phone_io on a thread, see phone_io.PhoneIOThread. Events
+    reach the main loop without a pipe or a second interpreter. The
+    thread isn't supervised, if it fails we stop.'''
+    backend = gpio_backend.CreateBackend(
+      self.getSetting('gpio_backend', gpio_backend.DEFAULT_BACKEND),
+      self.getSetting('gpio_script'))
+    trace = None
+    if self.getSetting('gpio_trace'):
+      trace = gpio_trace.TraceWriter(
+        self.getSetting('gpio_trace'),
+        int(self.getSetting('gpio_trace_max_bytes',
+                            gpio_trace.DEFAULT_MAX_BYTES)))
+    self.phone_IO_ = phone_io.PhoneIOThread(
+      backend,
+      lambda events: self.loop_.CallFromThread(
+        lambda: self.phoneIOThreadEvents(events)),
+      self.cadences_, self.phonePins(),
+      self.adaptiveDial(), self.getSetting('metrics'), trace)
+
+  def adaptiveDial(self):
+    ''' Returns whether phone_io decodes the dials adaptively.'''
+    return (self.config_.has_option(SETTINGS_SECTION, 'adaptive_dial') and
+            self.config_.getboolean(SETTINGS_SECTION, 'adaptive_dial'))
+
+  def stopPhoneIO(self, process):
+    ''' Stop talking to a failed phone_io, see startPhoneIO.'''
+    self.loop_.RemoveReader(process.stdout)
+    for pipe in [process.stdout, process.stdin]:
+      try:
+        pipe.close()
+      except IOError:
+        # The buffered commands are lost, see Phone.Resync.
+        pass
+
+  def writePhoneIO(self, commands):
+    ''' Send commands to phone_io. While it restarts, they are dropped.'''
+    try:
+      self.phone_IO_.stdin.write(commands)
+    except (IOError, ValueError) as e:
+      # ValueError: Closed after it failed.
+      if not self.phone_io_supervisor_:
+        raise
+      self.phone_io_supervisor_.Failed('failed to write (%s)' % e)
+
+  def phoneOfCall(self, call):
+    ''' Returns the phone call belongs to, None if there is none.'''
+    for phone in self.phones_:
+      if phone.current_call_ is call:
+        return phone
+    return None
 
   def call_state_changed(self, core, call, state, message):
     ''' Linphone callback updating call state.
@@ -229,139 +1331,158 @@ class Phony:
       state: The new state.
       message: Message received.
     '''
-    if (state == linphone.CallState.IncomingReceived and
-        self.phone_state_.GetCurrentState() != PS_READY):
-      # Incoming call, but we are not in state ready.
-      # Tell the other side that we are busy and otherwise
-      # ignore the incoming call.
-      logging.info('Declining incoming call while busy.')      
-      self.core_.decline_call(call, linphone.Reason.Busy)
-      return
-
-    if (state == linphone.CallState.IncomingReceived and
-        not call.call_log.to_address.username in
-        self.accepted_usernames_):
-      # Incoming call, but not for one of the whitelisted
-      # usernames. Ignore the incoming call.
-      logging.info('Declining incoming call, unknown target %s' %
-                   call.call_log.to_address.username)
-      self.core_.decline_call(call, linphone.Reason.Busy)
-      return
-
+    if state == linphone.CallState.IncomingReceived:
+      username = call.call_log.to_address.username
+      caller = call.remote_address.username
+      if not username in self.accepted_usernames_:
+        # Incoming call, but not for one of the whitelisted
+        # usernames. Ignore the incoming call.
+        logging.info('Declining incoming call, unknown target %s' %
+                     username)
+        self.core_.decline_call(call, linphone.Reason.Busy)
+        self.AddRecord(call_records.Call(
+          call_records.INBOUND, None, caller, username).Finish(
+            'declined, unknown target'))
+        return
+      phone = None
+      for p in self.phones_:
+        if p.Accepts(username) and p.IsIdle():
+          phone = p
+          break
+      if not phone:
+        # Incoming call, but no phone of the username is in state
+        # ready. Tell the other side that we are busy and otherwise
+        # ignore the incoming call.
+        logging.info('Declining incoming call while busy.')
+        self.core_.decline_call(call, linphone.Reason.Busy)
+        self.AddRecord(call_records.Call(
+          call_records.INBOUND, None, caller, username).Finish(
+            'declined, busy'))
+        return
+      # Remember the call, so we can accept or decline it. startBell
+      # picks the cadence by the username called.
+      phone.current_call_ = call
+      phone.ring_username_ = username
+      phone.call_record_ = call_records.Call(
+        call_records.INBOUND, phone.name_, caller, username)
+    else:
+      phone = self.phoneOfCall(call)
+      if not phone:
+        # A call we declined or already cancelled.
+        return
+      if phone.call_gateway_ and not phone.call_rang_:
+        if state in [linphone.CallState.OutgoingRinging,
+                     linphone.CallState.CallConnected]:
+          phone.call_rang_ = True
+          self.health_.ObserveSetup(phone.call_gateway_,
+                                    clock.Monotonic() - phone.invite_ts_)
+        elif (state == linphone.CallState.CallError and
+              call.reason not in CALLEE_REASONS):
+          self.health_.ObserveFailure(phone.call_gateway_)
+          if phone.Failover():
+            self.scheduleIterate()
+            return
+      if phone.call_record_:
+        if state == linphone.CallState.OutgoingRinging:
+          phone.call_record_.Rang()
+        elif state == linphone.CallState.CallConnected:
+          phone.call_record_.Answered()
 
     if state in [linphone.CallState.IncomingReceived,
                  linphone.CallState.CallConnected]:
       # Update state machine to say we are seeing an
       # incoming call.
-      self.phone_state_.ProcessInput('a')
+      phone.ProcessInput('a')
 
     if state in [linphone.CallState.CallEnd,
                  linphone.CallState.CallError]:
       # Update state machine to say the remote side
-      # cancelled the call.
-      self.phone_state_.ProcessInput('c')
-    
-    # Call object management.
-    if state == linphone.CallState.IncomingReceived:
-      # Remember the call, so we can accept or decline it.
-      self.current_call_ = call
-    elif state in [linphone.CallState.CallEnd,
-                 linphone.CallState.CallError]:
+      # cancelled the call. It records a call that rang unanswered as
+      # missed, see missCall.
+      phone.ProcessInput('c')
+      phone.FinishRecord(call_records.REASON_REMOTE_HANGUP
+                         if state == linphone.CallState.CallEnd
+                         else message)
       # Clear the call object. We no longer need it.
-      self.current_call_ = None
-  
+      phone.current_call_ = None
+      phone.call_gateway_ = None
+    self.scheduleIterate()
+
+  def registration_state_changed(self, core, proxy_config, state, message):
+    ''' Linphone callback updating the registration state of a provider.'''
+    if not any(p is proxy_config for p, _ in self.proxies_.values()):
+      # The provider was removed by a reload.
+      return
+    gateway = proxy_config.server_addr.split(':', 1)[-1]
+    logging.info('Registration of {gateway}: {message}'.format(
+      gateway=gateway, message=message))
+    self.registrations_[gateway] = state
+    if state != linphone.RegistrationState.Progress:
+      self.health_.SetRegistered(gateway, {
+        linphone.RegistrationState.Ok: True,
+        linphone.RegistrationState.Failed: False}.get(state))
+    self.dialQueued()
 
   def log_handler(self, level, msg):
     # Just forward to the appropriate method of the logging
-    # framework.
-    method = getattr(logging, level)
+    # framework, see initLogging for the filtering.
+    method = getattr(logging.getLogger(LINPHONE_LOGGER), level)
     method(msg)
 
   def signal_handler(self, signal, frame):
-    self.core_.terminate_all_calls()
-    self.phone_IO_.send_signal(signal)
-    self.quit_ = True
+    if self.core_:
+      self.core_.terminate_all_calls()
+    if self.phone_io_supervisor_:
+      self.phone_io_supervisor_.Close()
+    try:
+      self.phone_IO_.send_signal(signal)
+    except OSError:
+      # phone_io died, and wasn't restarted yet.
+      pass
+    self.loop_.Stop()
 
-  def processTone(self, tone_file=None):
-    ''' Process a tone (e.g. dial tone, busy tone).
+  def profile_handler(self, signal, frame):
+    # Don't log from the signal handler, it might have interrupted the
+    # logging module.
+    self.loop_.CallLater(0, self.logProfiles)
 
-    Args:
-      tone_file: Tone to play. Can be None for repeated
-                 calls to repeat the tone. Must be a 16 bit
-                 8kHz Mono WAV file.
-    '''
-    current = datetime.datetime.now()
-    if tone_file:
-      self.tone_start_ = current
-      self.tone_file_ = tone_file
-      s = os.stat(tone_file)
-      self.tone_duration_ = s.st_size / (8000 * 2)
-
-    diff = current - self.tone_start_
-    if tone_file or diff.total_seconds() > self.tone_duration_:
-        self.core_.play_local(self.tone_file_)
-        self.tone_start_ = current
+  def reload_handler(self, signal, frame):
+    # Reload from the main loop, like profile_handler.
+    self.loop_.CallLater(0, self.reloadConfigFile)
 
-  def startDialTone(self, previous_state, next_state, input):
-    ''' Start playing the dial tone.'''
-    self.processTone('/home/pi/coding/phony/phone/dial_tone.wav')
-
-  def startBusyTone(self, previous_state, next_state, input):
-    ''' Start playing the busy tone.'''
-    self.processTone('/home/pi/coding/phony/phone/busy_tone.wav')
-
-  def playPulse(self, previous_state, next_state, input):
-    ''' Play a single dialing pulse.'''
-    self.core_.play_local('/home/pi/coding/phony/phone/pulse.wav')    
-
-  def startDialing(self, previous_state, next_state, input):
-    self.current_number_ = ''
-    self.current_number_ts_ = datetime.datetime.now()
-    
-  def startBell(self, previous_state, next_state, input):
-    ''' Start ringing the bell.'''
-    self.phone_IO_.stdin.write('s')
-
-  def stopBell(self, previous_state, next_state, input):
-    ''' Stop ringing the bell.'''
-    self.phone_IO_.stdin.write('e')
-
-  def dialNumber(self, previous_state, next_state, input):
-    ''' Dial the current number.'''
-    logging.info('Dialing outbound number %s' % self.current_number_)
-    self.current_call_ = self.core_.invite(
-      '{number}@{sip_gateway}'.format(number=self.current_number_,
-                                      sip_gateway=self.standard_gateway_))
-    
-  def cancelCall(self, previous_state, next_state, input):
-    ''' Cancel all active calls.'''
-    logging.info('Cancelling active calls.')
-    # Just terminate all calls. We don't want any nasty surprises with
-    # connections being kept open in the background.    
-    self.core_.terminate_all_calls()
-    self.current_call_ = None
-
-  def acceptCall(self, previous_state, next_state, input):
-    ''' Accept incoming call.'''
-    logging.info('Accepting incoming call.')
-    if self.current_call_:
-      # An incoming call is already waiting. Accept it.
-      params = self.core_.create_call_params(self.current_call_)
-      self.core_.accept_call_with_params(self.current_call_, params)
-    else:
-      logging.warning('acceptCall in wrong state ignored.')
+  def reloadConfigFile(self):
+    ''' Reread the config file and apply it, see Reload.'''
+    if not self.config_file_:
+      logging.warning('No config file to reload.')
+      return
+    config = ConfigParser.ConfigParser()
+    try:
+      read = config.read(self.config_file_)
+    except ConfigParser.Error as e:
+      logging.error('Not reloading the config: %s' % e)
+      return
+    if not read:
+      logging.error('Not reloading the config, can\'t read %s' %
+                    self.config_file_)
+      return
+    logging.info('Reloading %s' % self.config_file_)
+    self.Reload(config)
 
-  def processDigit(self, previous_state, next_state, input):
-    ''' A new digit has been completed.
-    Add it to the current phone number and update the timestamp.'''
-    self.current_number_ = self.current_number_ + input
-    self.current_number_ts_ = datetime.datetime.now()
+  def logProfiles(self):
+    ''' Log the callback and dwell time summaries of all phones.'''
+    for phone in self.phones_:
+      if phone.GetProfiler():
+        logging.warning(phone.GetProfiler().Summary())
+      else:
+        logging.warning('Phone %s: profiling is off, set callback_budget.' %
+                        phone.name_)
 
 
 def main():
   config = ConfigParser.ConfigParser()
-  config.read('/etc/phony.conf')
-  phony = Phony(config)
+  config.read(CONFIG_FILE)
+  phony = Phony(config, CONFIG_FILE)
   phony.Run()
 
-main()
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+#
+# End-to-end latency benchmark of Phony.
+#
+# Phony runs its real main loop against fake_linphone, which records
+# every call into the core with a timestamp. A scenario thread plays
+# scripted phone_io event streams into Phony's event pipe:
+#  - outbound: lift, dial a 10 digit number, talk, hang up.
+#  - inbound: incoming call rings the bell, lift to answer, hang up.
+# The latency of every transition is measured from the capture time of
+# the triggering event to the recorded core call (or bell command).
+#
+# Results are printed as a table, and with --json as a machine-readable
+# document for regression checks.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import ConfigParser
+import fcntl
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import clock
+import event_protocol
+import fake_linphone
+
+sys.modules['linphone'] = fake_linphone
+import phony
+
+# Pins reported with the scripted events.
+PIN_PULSE = 4
+PIN_IDLE = 17
+PIN_HOOK = 27
+
+USERNAME = 'benchmark'
+
+# Time between two scripted pulses. Much faster than a real dial, which
+# doesn't matter to Phony but keeps the benchmark short.
+PULSE_INTERVAL = 0.002
+
+# Give up waiting for Phony after this many seconds.
+WAIT_TIMEOUT = 10
+
+class FakeStdin:
+  ''' Records the bell commands Phony writes to phone_io.'''
+
+  def __init__(self):
+    self.commands_ = []
+
+  def write(self, data):
+    for c in data:
+      self.commands_.append((clock.Monotonic(), c))
+
+  def flush(self):
+    pass
+
+class FakePhoneIOProcess:
+  ''' Takes the place of the phone_io subprocess.'''
+
+  def __init__(self):
+    self.stdin = FakeStdin()
+
+  def send_signal(self, signal):
+    pass
+
+class BenchmarkPhony(phony.Phony):
+  ''' Phony reading its events from a pipe fed by the benchmark.'''
+
+  def __init__(self, config, wait_for_core=True):
+    ''' Construct BenchmarkPhony instance.
+
+    Args:
+      config: config file as an instance of ConfigParser
+      wait_for_core: Return only once the core is created, so scenarios
+        can script it.
+    '''
+    if not config.has_section(phony.SETTINGS_SECTION):
+      config.add_section(phony.SETTINGS_SECTION)
+    if not config.has_option(phony.SETTINGS_SECTION, 'options_interval'):
+      # Don't ping the gateways of the benchmark configs.
+      config.set(phony.SETTINGS_SECTION, 'options_interval', '0')
+    if not config.has_option(phony.SETTINGS_SECTION, 'tone_output'):
+      # Play tones through the fake core rather than a sound card.
+      config.set(phony.SETTINGS_SECTION, 'tone_output', 'linphone')
+    phony.Phony.__init__(self, config)
+    if wait_for_core:
+      self.WaitForCore()
+
+  def WaitForCore(self):
+    ''' Run the main loop until the core is created.'''
+    deadline = clock.Monotonic() + WAIT_TIMEOUT
+    while self.core_ is None:
+      if clock.Monotonic() > deadline:
+        raise RuntimeError('Timeout waiting for the core.')
+      self.loop_.RunOnce()
+
+  def initPhoneIO(self):
+    read_fd, write_fd = os.pipe()
+    flags = fcntl.fcntl(read_fd, fcntl.F_GETFL)
+    fcntl.fcntl(read_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    self.phone_controls_ = os.fdopen(read_fd, 'rb', 0)
+    self.event_reader_ = event_protocol.FrameReader()
+    self.phone_IO_ = FakePhoneIOProcess()
+    self.event_writer_ = event_protocol.FrameWriter(
+      lambda data: os.write(write_fd, data))
+    # Scenarios of several phones share the writer.
+    self.event_lock_ = threading.Lock()
+    self.loop_.AddReader(self.phone_controls_, self.readPhoneControls)
+
+class Timed:
+  ''' Wraps a function and records the duration of each call.'''
+
+  def __init__(self, function, durations):
+    self.function_ = function
+    self.durations_ = durations
+
+  def __call__(self, *args, **kwargs):
+    start = clock.Monotonic()
+    try:
+      return self.function_(*args, **kwargs)
+    finally:
+      self.durations_.append(clock.Monotonic() - start)
+
+class Scenario:
+  ''' Plays scripted events into a BenchmarkPhony and collects latencies.'''
+
+  def __init__(self, phony_instance, phone=0, username=USERNAME):
+    ''' Construct Scenario instance.
+
+    Args:
+      phony_instance: The BenchmarkPhony to play events into.
+      phone: Index of the phone the events are for.
+      username: Username incoming calls are made to.
+    '''
+    self.phony_ = phony_instance
+    self.core_ = phony_instance.core_
+    self.phone_ = phone
+    self.username_ = username
+    # {transition name: [latency in seconds]}
+    self.latencies_ = {}
+
+  def send(self, symbol, pin):
+    ''' Send an event captured now, returns the capture time.'''
+    with self.phony_.event_lock_:
+      timestamp = clock.Monotonic()
+      self.phony_.event_writer_.Write(symbol, pin, timestamp, self.phone_)
+      self.phony_.event_writer_.Flush()
+    return timestamp
+
+  def waitFor(self, find):
+    ''' Wait until find() returns something other than None.'''
+    deadline = clock.Monotonic() + WAIT_TIMEOUT
+    while clock.Monotonic() < deadline:
+      result = find()
+      if result is not None:
+        return result
+      time.sleep(0.001)
+    raise RuntimeError('Timeout waiting for Phony.')
+
+  def record(self, name, start, find):
+    ''' Wait for the event found by find and record its latency.'''
+    self.latencies_.setdefault(name, []).append(self.waitFor(find) - start)
+
+  def coreCall(self, method, after, match=''):
+    ''' Returns a function finding the first call of method after time.'''
+    def Find():
+      for r in self.core_.GetRecords(method):
+        if r.timestamp >= after and match in str(r.args):
+          return r.timestamp
+      return None
+    return Find
+
+  def bellCommand(self, command, after):
+    ''' Returns a function finding the first bell command after time.'''
+    def Find():
+      for timestamp, c in self.phony_.phone_IO_.stdin.commands_:
+        if timestamp >= after and c == command:
+          return timestamp
+      return None
+    return Find
+
+  def Outbound(self, number):
+    ''' Lift, dial number, talk and hang up.'''
+    lift = self.send('l', PIN_HOOK)
+    self.record('lift_to_dial_tone', lift,
+                self.coreCall('play_local', lift, 'dial_tone'))
+    time.sleep(0.1)
+    for digit in number:
+      self.send('s', PIN_IDLE)
+      for _ in range(int(digit) or 10):
+        time.sleep(PULSE_INTERVAL)
+        last_pulse = self.send('p', PIN_PULSE)
+        self.record('pulse_to_click', last_pulse,
+                    self.coreCall('play_local', last_pulse, 'pulse'))
+      self.send('e', PIN_IDLE)
+      self.send(digit, PIN_IDLE)
+      time.sleep(0.05)
+    self.record('last_pulse_to_invite', last_pulse,
+                self.coreCall('invite', last_pulse))
+    # Wait for the remote side to answer.
+    time.sleep(self.core_.answer_delay_ + 0.1)
+    hangup = self.send('d', PIN_HOOK)
+    self.record('hangup_to_terminate', hangup,
+                self.coreCall('terminate_call', hangup))
+    time.sleep(0.2)
+
+  def Inbound(self):
+    ''' Receive a call, answer it and hang up.'''
+    incoming = clock.Monotonic()
+    self.core_.ScheduleIncomingCall(self.username_)
+    self.record('incoming_to_bell', incoming,
+                self.bellCommand('s', incoming))
+    time.sleep(0.2)
+    lift = self.send('l', PIN_HOOK)
+    self.record('lift_to_accept', lift,
+                self.coreCall('accept_call_with_params', lift))
+    self.record('lift_to_bell_stop', lift, self.bellCommand('e', lift))
+    time.sleep(0.2)
+    hangup = self.send('d', PIN_HOOK)
+    self.record('hangup_to_terminate', hangup,
+                self.coreCall('terminate_call', hangup))
+    time.sleep(0.2)
+
+def Summarize(values):
+  ''' Returns count and percentiles in milliseconds of a list of seconds.'''
+  values = sorted(values)
+  def Percentile(p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))] * 1000
+  return {'count': len(values),
+          'p50_ms': Percentile(50),
+          'p90_ms': Percentile(90),
+          'p99_ms': Percentile(99),
+          'max_ms': values[-1] * 1000}
+
+def RunBenchmark(iterations, number):
+  ''' Run the scenarios and return the results as a dictionary.'''
+  config = ConfigParser.ConfigParser()
+  config.add_section(USERNAME)
+  config.set(USERNAME, 'Username', USERNAME)
+  config.set(USERNAME, 'Password', 'secret')
+  config.set(USERNAME, 'Gateway', 'example.com')
+  instance = BenchmarkPhony(config)
+
+  # Time the functions we want to catch regressions in.
+  durations = {'ProcessInput': [], 'ProcessInputs': [], 'processTone': []}
+  phone = instance.phones_[0]
+  for name in ['ProcessInput', 'ProcessInputs']:
+    setattr(phone.phone_state_, name,
+            Timed(getattr(phone.phone_state_, name), durations[name]))
+  phone.processTone = Timed(phone.processTone, durations['processTone'])
+
+  scenario = Scenario(instance)
+  errors = []
+  def Play():
+    try:
+      for _ in range(iterations):
+        scenario.Outbound(number)
+        scenario.Inbound()
+    except Exception as e:
+      errors.append(e)
+    finally:
+      instance.loop_.Stop()
+
+  player = threading.Thread(target=Play)
+  wall_start = clock.Monotonic()
+  cpu_start = clock.ThreadCpuTime()
+  player.start()
+  instance.Run()
+  cpu = clock.ThreadCpuTime() - cpu_start
+  wall = clock.Monotonic() - wall_start
+  player.join()
+  if errors:
+    raise errors[0]
+
+  results = {
+    'iterations': iterations,
+    'transitions': dict((name, Summarize(values))
+                        for name, values in scenario.latencies_.items()),
+    'functions': dict((name, Summarize(values))
+                      for name, values in durations.items() if values),
+    'main_loop': {'cpu_seconds': cpu, 'wall_seconds': wall,
+                  'cpu_percent': 100 * cpu / wall,
+                  'iterate_calls': len(instance.core_.GetRecords('iterate'))},
+  }
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='End-to-end latency benchmark of Phony.')
+  parser.add_argument('--iterations', type=int, default=5)
+  parser.add_argument('--number', default='0301234567',
+                      help='Number dialed in the outbound scenario.')
+  parser.add_argument('--json', help='Write results to this file, - for '
+                      'stdout.')
+  args = parser.parse_args()
+
+  # Keep Phony's logging from dominating the measurement.
+  logging.basicConfig(level=logging.WARNING)
+  results = RunBenchmark(args.iterations, args.number)
+
+  if args.json == '-':
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    print('')
+    return
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+
+  for section in ['transitions', 'functions']:
+    for name, s in sorted(results[section].items()):
+      print('%-22s n=%-4d p50=%8.3fms p90=%8.3fms p99=%8.3fms max=%8.3fms' %
+            (name, s['count'], s['p50_ms'], s['p90_ms'], s['p99_ms'],
+             s['max_ms']))
+  loop = results['main_loop']
+  print('main loop: %.3fs CPU in %.1fs (%.2f%%), %d core iterations' %
+        (loop['cpu_seconds'], loop['wall_seconds'], loop['cpu_percent'],
+         loop['iterate_calls']))
+
+if __name__ == '__main__':
+  main()
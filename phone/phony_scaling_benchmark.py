@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#
+# Scaling benchmark of Phony with several phones.
+#
+# For every phone count, a child process runs BenchmarkPhony (see
+# phony_benchmark.py) with that many [phone <name>] sections, each with
+# its own provider, against fake_linphone. The child measures
+#  - rss: resident memory after startup, and its peak after the load.
+#  - idle: CPU time of the main loop while all phones are on the hook.
+#  - load: CPU time of the main loop while every phone makes and
+#    receives a call at the same time.
+# These are compared with running one single-phone stack per phone,
+# which costs N times the figures of the one-phone child.
+#
+# fake_linphone is tiny compared to a real linphone core, so the memory
+# saved per phone is understated here.
+#
+# Usage: phony_scaling_benchmark.py [--phones 1,2,4,8] [--idle_seconds S]
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import ConfigParser
+import json
+import logging
+import subprocess
+import sys
+import threading
+import time
+
+import clock
+# Installs fake_linphone, so it must come before phony.
+import phony_benchmark
+import phony
+
+def ReadStatus(field):
+  ''' Returns a field of /proc/self/status in kB.'''
+  with open('/proc/self/status') as f:
+    for line in f:
+      if line.startswith(field + ':'):
+        return int(line.split()[1])
+  return 0
+
+def CreateConfig(phones):
+  ''' Returns a config with phones phones, each with its own provider.'''
+  config = ConfigParser.ConfigParser()
+  for i in range(phones):
+    provider = 'line%d' % i
+    config.add_section(provider)
+    config.set(provider, 'Username', '%s%d' % (phony_benchmark.USERNAME, i))
+    config.set(provider, 'Password', 'secret')
+    config.set(provider, 'Gateway', 'example.com')
+    section = '%s%d' % (phony.PHONE_SECTION_PREFIX, i)
+    config.add_section(section)
+    # phone_io isn't started, the pins only need to be distinct.
+    config.set(section, 'pins', ','.join(str(i * 6 + p) for p in range(6)))
+    config.set(section, 'provider', provider)
+  return config
+
+def RunPhases(instance, phases):
+  ''' Run the main loop once per phase and return its CPU time per phase.
+
+  Args:
+    instance: The BenchmarkPhony.
+    phases: Functions run on a separate thread while the main loop runs.
+            The loop stops when the function returns.
+  '''
+  cpu = []
+  errors = []
+  for phase in phases:
+    def Play(phase=phase):
+      try:
+        phase()
+      except Exception as e:
+        errors.append(e)
+      finally:
+        instance.loop_.Stop()
+    player = threading.Thread(target=Play)
+    start = clock.ThreadCpuTime()
+    player.start()
+    instance.loop_.Run()
+    cpu.append(clock.ThreadCpuTime() - start)
+    player.join()
+    if errors:
+      raise errors[0]
+  return cpu
+
+def RunChild(phones, idle_seconds, number):
+  ''' Measure Phony with phones phones, returns the results.'''
+  instance = phony_benchmark.BenchmarkPhony(CreateConfig(phones))
+  instance.iterateCore()
+  rss = ReadStatus('VmRSS')
+
+  scenarios = [phony_benchmark.Scenario(
+    instance, i, '%s%d' % (phony_benchmark.USERNAME, i))
+               for i in range(phones)]
+  def Load():
+    threads = []
+    for scenario in scenarios:
+      def Play(scenario=scenario):
+        scenario.Outbound(number)
+        scenario.Inbound()
+      threads.append(threading.Thread(target=Play))
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+
+  wall_start = clock.Monotonic()
+  idle_cpu, load_cpu = RunPhases(instance, [
+    lambda: time.sleep(idle_seconds), Load])
+  load_wall = clock.Monotonic() - wall_start - idle_seconds
+  for phone in reversed(instance.phones_):
+    phone.tones_.Close()
+  return {'phones': phones,
+          'rss_kb': rss,
+          'peak_rss_kb': ReadStatus('VmHWM'),
+          'idle_cpu_percent': 100 * idle_cpu / idle_seconds,
+          'load_cpu_seconds': load_cpu,
+          'load_wall_seconds': load_wall,
+          'invites': len(instance.core_.GetRecords('invite'))}
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Scaling benchmark of Phony with several phones.')
+  parser.add_argument('--phones', default='1,2,4,8',
+                      help='Comma separated phone counts.')
+  parser.add_argument('--idle_seconds', type=float, default=3)
+  parser.add_argument('--number', default='0301234567',
+                      help='Number dialed by every phone.')
+  parser.add_argument('--json', help='Write results to this file, - for '
+                      'stdout.')
+  parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  # Keep Phony's logging from dominating the measurement.
+  logging.basicConfig(level=logging.WARNING)
+  if args.child:
+    json.dump(RunChild(args.child, args.idle_seconds, args.number),
+              sys.stdout)
+    return
+
+  results = []
+  for phones in [int(p) for p in args.phones.split(',')]:
+    # A fresh process per count, so memory isn't shared between runs.
+    output = subprocess.check_output(
+      [sys.executable, __file__, '--child', str(phones),
+       '--idle_seconds', str(args.idle_seconds), '--number', args.number])
+    results.append(json.loads(output.splitlines()[-1]))
+
+  if args.json == '-':
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    print('')
+    return
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+
+  single = results[0]
+  print('%-7s %10s %10s %10s %10s %12s %12s' %
+        ('phones', 'rss MB', 'separate', 'idle CPU%', 'separate',
+         'load CPU s', 'separate'))
+  for r in results:
+    # N single-phone stacks, scaled from the first measurement.
+    factor = r['phones'] / single['phones']
+    print('%-7d %10.1f %10.1f %10.2f %10.2f %12.3f %12.3f' %
+          (r['phones'], r['rss_kb'] / 1024,
+           factor * single['rss_kb'] / 1024,
+           r['idle_cpu_percent'], factor * single['idle_cpu_percent'],
+           r['load_cpu_seconds'], factor * single['load_cpu_seconds']))
+  if len(results) > 1:
+    last = results[-1]
+    print('memory per additional phone: %.1f kB' %
+          ((last['rss_kb'] - single['rss_kb']) /
+           (last['phones'] - single['phones'])))
+
+if __name__ == '__main__':
+  main()
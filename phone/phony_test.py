@@ -0,0 +1,85 @@
+import call_records
+import clock
+import ConfigParser
+import event_protocol
+import logging
+import mock
+# Installs fake_linphone, so it must come before phony.
+import phony_benchmark
+import phony
+import unittest
+
+class TestPhone(unittest.TestCase):
+  def setUp(self):
+    # Keep Phony from installing its log pipeline.
+    logging.basicConfig(level=logging.ERROR)
+    config = ConfigParser.ConfigParser()
+    username = phony_benchmark.USERNAME
+    config.add_section(username)
+    config.set(username, 'Username', username)
+    config.set(username, 'Password', 'secret')
+    config.set(username, 'Gateway', 'example.com')
+    self.phony = phony_benchmark.BenchmarkPhony(config)
+    self.phone = self.phony.phones_[0]
+
+  def tearDown(self):
+    # Run cleans up once the loop stops.
+    self.phony.loop_.CallLater(0, self.phony.loop_.Stop)
+    self.phony.Run()
+
+  def commands(self):
+    return ''.join(c for _, c in self.phony.phone_IO_.stdin.commands_)
+
+  def test_ResyncMidDial(self):
+    for symbol in 'lsp':
+      self.phone.ProcessInput(symbol)
+    self.assertEqual(phony.PS_DIAL_MOVING,
+                     self.phone.phone_state_.GetCurrentState())
+    self.phone.Resync()
+    # The restarted phone_io doesn't report the digit, it's lost.
+    self.assertEqual(phony.PS_BUSY, self.phone.phone_state_.GetCurrentState())
+    self.assertTrue(self.commands().endswith('P0q'))
+
+  def test_DialMovingTimeout(self):
+    # The dial went off normal long ago, and no pulse came since.
+    start = clock.Monotonic() - phony.DIAL_MOVING_TIMEOUT - 1
+    self.phone.ProcessInput('l', start)
+    self.phone.ProcessInput('s', start)
+    self.phone.processTimeouts()
+    self.assertEqual(phony.PS_BUSY, self.phone.phone_state_.GetCurrentState())
+
+  def test_InconsistentDigit(self):
+    now = clock.Monotonic()
+    events = [event_protocol.Event(symbol, 0, i, now + i * 0.1, 0)
+              for i, symbol in enumerate('lspppe3x')]
+    with mock.patch('logging.warning') as warning:
+      self.phone.ProcessEvents(events)
+    self.assertEqual(1, warning.call_count)
+    message = warning.call_args[0][0]
+    self.assertIn('digit 3', message)
+    self.assertIn(self.phone.name_, message)
+    # The flag doesn't reach the state machine, the digit did.
+    self.assertEqual(phony.PS_DIALING,
+                     self.phone.phone_state_.GetCurrentState())
+    self.assertEqual('3', self.phone.current_number_)
+
+  def test_MissedIncomingCall(self):
+    records = []
+    self.phony.AddRecord = records.append
+    core = self.phony.core_
+    call = core.ScheduleIncomingCall(phony_benchmark.USERNAME, caller='alice')
+    core.iterate()
+    self.assertEqual(phony.PS_RINGING,
+                     self.phone.phone_state_.GetCurrentState())
+    # The caller gives up before the phone is lifted.
+    core.ScheduleCallEnd(call)
+    core.iterate()
+    self.assertEqual(phony.PS_READY, self.phone.phone_state_.GetCurrentState())
+    self.assertEqual([call_records.REASON_MISSED],
+                     [r.reason for r in records])
+    # The core ended the call, we only stop the bell.
+    self.assertEqual([], core.GetRecords('terminate_call'))
+    self.assertTrue(self.commands().endswith('e'))
+
+if __name__ == '__main__':
+  unittest.main()
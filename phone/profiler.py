@@ -0,0 +1,125 @@
+# Callback profiler for PhoneState.
+#
+# PhoneState calls its callbacks synchronously, so a slow one (a SIP
+# invite, a blocking pipe write) stalls the whole main loop, including
+# pulse intake. A Profiler passed to PhoneState times every callback,
+# warns about callbacks exceeding a budget and records how long the
+# state machine dwells in each state.
+#
+# PhoneState compiles the profiler into its transition table, so a state
+# machine without one doesn't pay anything.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import collections
+import logging
+
+import clock
+
+# Callbacks taking longer than this many seconds are logged.
+DEFAULT_BUDGET = 0.01
+
+# Durations kept per transition and state for the summary.
+HISTORY = 1000
+
+class Profiler:
+  ''' Profiler times the callbacks of a PhoneState.'''
+
+  def __init__(self, name='', budget=DEFAULT_BUDGET,
+               time_function=clock.Monotonic):
+    ''' Construct Profiler instance.
+
+    Args:
+      name: Name of the state machine, used in log messages.
+      budget: Seconds a callback may take before a warning is logged.
+      time_function: Returns the current time in seconds.
+    '''
+    self.name_ = name
+    self.budget_ = budget
+    self.time_function_ = time_function
+    # {(previous_state, next_state): deque of callback seconds}, all
+    # callbacks of a transition together.
+    self.callbacks_ = collections.OrderedDict()
+    # {state: deque of seconds spent in state}.
+    self.dwell_ = collections.OrderedDict()
+    self.state_ = None
+    self.state_ts_ = None
+    self.slow_ = 0
+
+  def Start(self, state):
+    ''' Start measuring the dwell time of the initial state.'''
+    self.state_ = state
+    self.state_ts_ = self.time_function_()
+
+  def Wrap(self, key, callbacks):
+    ''' Returns the callbacks of transition key, wrapped so they are
+    timed and the dwell time of the state left is recorded.
+
+    Args:
+      key: (previous_state, next_state) of the transition.
+      callbacks: The callbacks of the transition.
+    '''
+    durations = self.callbacks_.setdefault(
+      key, collections.deque(maxlen=HISTORY))
+    def Profiled(previous_state, next_state, input):
+      now = self.time_function_()
+      if self.state_ts_ is not None:
+        self.dwell_.setdefault(
+          self.state_, collections.deque(maxlen=HISTORY)).append(
+            now - self.state_ts_)
+      self.state_ = next_state
+      self.state_ts_ = now
+      for c in callbacks:
+        start = self.time_function_()
+        c(previous_state, next_state, input)
+        duration = self.time_function_() - start
+        if duration > self.budget_:
+          self.slow_ += 1
+          logging.warning(
+            '%sSlow callback %s for transition %s on %r: %.3fms',
+            self.prefix_(), getattr(c, '__name__', c), key, input,
+            duration * 1000)
+      durations.append(self.time_function_() - now)
+    return (Profiled,)
+
+  def GetSlow(self):
+    ''' GetSlow returns the number of callbacks that exceeded the
+    budget.'''
+    return self.slow_
+
+  def GetCallbackTimes(self, key):
+    ''' GetCallbackTimes returns the recent callback seconds of a
+    transition.'''
+    return list(self.callbacks_.get(key, []))
+
+  def GetDwellTimes(self, state):
+    ''' GetDwellTimes returns the recent seconds spent in state.'''
+    return list(self.dwell_.get(state, []))
+
+  def Summary(self):
+    ''' Summary returns per-transition callback and per-state dwell time
+    summaries, one per line.'''
+    lines = ['%scallbacks by transition, %d over budget:' %
+             (self.prefix_(), self.slow_)]
+    for key, durations in self.callbacks_.items():
+      if durations:
+        lines.append('  %-10s %s' % (key, _Summarize(durations)))
+    lines.append('%sdwell time by state:' % self.prefix_())
+    for state, durations in self.dwell_.items():
+      lines.append('  %-10s %s' % (state, _Summarize(durations)))
+    return '\n'.join(lines)
+
+  def prefix_(self):
+    if self.name_:
+      return '%s: ' % self.name_
+    return ''
+
+def _Summarize(durations):
+  values = sorted(durations)
+  def Percentile(p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))] * 1000
+  return 'n=%-4d p50=%9.3fms p90=%9.3fms p99=%9.3fms max=%9.3fms' % (
+    len(values), Percentile(50), Percentile(90), Percentile(99),
+    values[-1] * 1000)
@@ -0,0 +1,258 @@
+# Adaptive pulse decoder.
+#
+# W48 dials drift from the nominal 10 pulses/s and 60/40 break/make
+# ratio, and worn contacts bounce for longer than the noise filter of
+# GpioSignal suppresses. A bounce that outlasts the filter shows up as a
+# very short pulse or a very short gap, which the plain decoder counts
+# as an extra pulse.
+#
+# AdaptiveDecoder learns the period and break ratio of its dial from
+# plausible pulses (exponentially weighted averages), and judges every
+# pulse and gap against them:
+#  - A gap shorter than MIN_FRACTION of the expected make time joins the
+#    pulses around it.
+#  - A pulse shorter than MIN_FRACTION of the expected break time doesn't
+#    count, unless a short gap joins it with the next one.
+#  - A short gap followed by a short pulse after a plausible pulse is the
+#    contact bouncing at the end of that pulse.
+# It also widens the pulse signal's debounce window to swallow the
+# longest bounce burst seen (see GpioSignal.TakeBurst), if the dial's
+# timing allows, and flags digits
+# whose pulse intervals are irregular (e.g. a pulse lost to a dirty
+# contact looks like a double interval).
+#
+# Decisions are made edge by edge, so the digit is final as soon as the
+# idle contact closes, just like with the plain decoder.
+#
+# coding=utf-8
+
+from __future__ import division
+
+# Nominal dial timing.
+NOMINAL_PERIOD = 0.1
+NOMINAL_BREAK_RATIO = 0.6
+
+# Weight of a new observation in the running estimates.
+ALPHA = 0.2
+
+# Plausible dials run between these periods (about 7 to 14 pulses/s) and break
+# ratios. Estimates are clamped to them.
+MIN_PERIOD = 0.07
+MAX_PERIOD = 0.15
+MIN_BREAK_RATIO = 0.4
+MAX_BREAK_RATIO = 0.8
+
+# Pulses and gaps shorter than this fraction of the expected break and
+# make time are glitches.
+MIN_FRACTION = 0.35
+
+# Pulse intervals deviating more than this fraction from the median of
+# their digit make the digit inconsistent.
+MAX_INTERVAL_DEVIATION = 0.3
+
+# The debounce window grows to this multiple of the longest bounce
+# burst, if that stays below MAX_WINDOW and WINDOW_FRACTION of the
+# shorter of break and make time. A window shorter than the burst only
+# chops it into other glitches, so otherwise it is left alone.
+WINDOW_MARGIN = 1.2
+MAX_WINDOW = 0.025
+WINDOW_FRACTION = 0.5
+
+def _Clamp(value, low, high):
+  return max(low, min(high, value))
+
+class AdaptiveDecoder:
+  ''' AdaptiveDecoder counts the pulses of one dial.'''
+
+  def __init__(self, window, width_histogram=None, gap_histogram=None):
+    ''' Construct AdaptiveDecoder instance.
+
+    Args:
+      window: The initial debounce window of the pulse signal.
+      width_histogram, gap_histogram: Optional metrics.Histograms of the
+        accepted pulse widths and gaps.
+    '''
+    self.period_ = NOMINAL_PERIOD
+    self.break_ratio_ = NOMINAL_BREAK_RATIO
+    self.window_ = window
+    self.width_histogram_ = width_histogram
+    self.gap_histogram_ = gap_histogram
+    self.glitches_ = 0
+    self.flagged_ = 0
+    self.Start()
+
+  def Start(self):
+    ''' Start a new digit, the dial left its rest position.'''
+    self.reset_()
+    self.dialing_ = True
+
+  def GetPeriod(self):
+    ''' GetPeriod returns the estimated seconds per pulse.'''
+    return self.period_
+
+  def GetBreakRatio(self):
+    ''' GetBreakRatio returns the estimated fraction of the period the
+    pulse contact is open.'''
+    return self.break_ratio_
+
+  def GetWindow(self):
+    ''' GetWindow returns the debounce window for the pulse signal.'''
+    return self.window_
+
+  def GetGlitches(self):
+    ''' GetGlitches returns the number of pulses and gaps discarded as
+    too short.'''
+    return self.glitches_
+
+  def GetFlagged(self):
+    ''' GetFlagged returns the number of digits flagged as
+    inconsistent.'''
+    return self.flagged_
+
+  def Pulse(self, state, timestamp):
+    ''' Process an accepted change of the pulse signal.
+
+    Returns:
+      True if a new pulse started, which is when Phony clicks. A pulse
+      that turns out too short has been clicked already, the digit is
+      still correct.
+    '''
+    if not self.dialing_:
+      # Bounces of the last pulse after the idle contact closed.
+      return False
+    if state:
+      gap = None
+      if self.pulse_end_ is not None:
+        gap = timestamp - self.pulse_end_
+      if gap is not None and gap < self.minGap_():
+        # The contact bounced closed for a moment, it's still the same
+        # pulse. Unless this turns out to be a short pulse bouncing off
+        # the end of the previous one, see below.
+        self.glitches_ += 1
+        self.joined_ = (timestamp, self.pulse_end_, self.width_,
+                        self.counted_)
+        self.pulse_end_ = None
+        self.width_ = None
+        if not self.counted_:
+          self.countPulse_(self.pulse_start_)
+        return False
+      self.recordWidth_()
+      if gap is not None and self.gap_histogram_:
+        self.gap_histogram_.Observe(gap)
+      self.pulse_start_ = timestamp
+      self.pulse_end_ = None
+      self.joined_ = None
+      self.countPulse_(timestamp)
+      return True
+    if self.pulse_start_ is None or self.pulse_end_ is not None:
+      return False
+    if self.joined_:
+      joined_ts, end, width, counted = self.joined_
+      self.joined_ = None
+      if counted and timestamp - joined_ts < self.minWidth_():
+        # Both the gap and the pulse after it were short, after a
+        # plausible pulse: the contact bounced after the end of that
+        # pulse, which stays where it was.
+        self.glitches_ += 1
+        self.pulse_end_ = end
+        self.width_ = width
+        return False
+    width = timestamp - self.pulse_start_
+    self.pulse_end_ = timestamp
+    if width < self.minWidth_():
+      # Too short so far. It counts again if a short gap joins it with
+      # the next pulse.
+      self.glitches_ += 1
+      if self.counted_:
+        self.counted_ = False
+        self.pulses_ -= 1
+        self.starts_.pop()
+    else:
+      # Kept until the next pulse starts, a short gap may still extend
+      # this one.
+      self.width_ = width
+    return False
+
+  def Finish(self, burst=0.0):
+    ''' Finish the digit, the dial is back at its rest position.
+
+    Args:
+      burst: The longest contact bounce burst of the pulse signal during
+             the digit, see GpioSignal.TakeBurst.
+    Returns:
+      A tuple (pulses, consistent) of the pulses counted and whether
+      their timing was consistent.
+    '''
+    self.recordWidth_()
+    pulses = self.pulses_
+    consistent = self.learn_()
+    if not consistent:
+      self.flagged_ += 1
+    window = WINDOW_MARGIN * burst
+    if window > self.window_ and window <= min(
+        MAX_WINDOW, WINDOW_FRACTION * self.period_ *
+        min(self.break_ratio_, 1 - self.break_ratio_)):
+      self.window_ = window
+    self.reset_()
+    self.dialing_ = False
+    return pulses, consistent
+
+  def minWidth_(self):
+    return max(self.window_, MIN_FRACTION * self.period_ * self.break_ratio_)
+
+  def minGap_(self):
+    return max(self.window_,
+               MIN_FRACTION * self.period_ * (1 - self.break_ratio_))
+
+  def reset_(self):
+    self.pulses_ = 0
+    # Start of the current pulse, with glitches joined, and whether it
+    # counts. None between pulses.
+    self.pulse_start_ = None
+    self.counted_ = False
+    # End of the previous pulse, None before the first one.
+    self.pulse_end_ = None
+    # Start times of the counted pulses and their plausible widths.
+    self.starts_ = []
+    self.widths_ = []
+    # Width of the last pulse, if plausible and not yet recorded.
+    self.width_ = None
+    # (time, pulse_end_, width_, counted_) when the last short gap joined
+    # two pulses, None otherwise.
+    self.joined_ = None
+
+  def countPulse_(self, start):
+    self.pulses_ += 1
+    self.counted_ = True
+    self.starts_.append(start)
+
+  def recordWidth_(self):
+    if self.width_ is None:
+      return
+    self.widths_.append(self.width_)
+    if self.width_histogram_:
+      self.width_histogram_.Observe(self.width_)
+    self.width_ = None
+
+  def learn_(self):
+    ''' Update the estimates from the digit's pulses and return whether
+    their intervals were consistent.'''
+    starts = self.starts_
+    if len(starts) < 2:
+      return True
+    intervals = sorted(b - a for a, b in zip(starts, starts[1:]))
+    median = intervals[len(intervals) // 2]
+    if (intervals[0] < (1 - MAX_INTERVAL_DEVIATION) * median or
+        intervals[-1] > (1 + MAX_INTERVAL_DEVIATION) * median or
+        not MIN_PERIOD <= median <= MAX_PERIOD):
+      # Don't learn from a digit we don't trust.
+      return False
+    self.period_ = _Clamp(self.period_ + ALPHA * (median - self.period_),
+                          MIN_PERIOD, MAX_PERIOD)
+    if self.widths_:
+      widths = sorted(self.widths_)
+      ratio = widths[len(widths) // 2] / median
+      self.break_ratio_ = _Clamp(
+        self.break_ratio_ + ALPHA * (ratio - self.break_ratio_),
+        MIN_BREAK_RATIO, MAX_BREAK_RATIO)
+    return True
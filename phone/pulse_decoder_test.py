@@ -0,0 +1,84 @@
+import metrics
+import pulse_decoder
+import unittest
+
+class TestAdaptiveDecoder(unittest.TestCase):
+  def setUp(self):
+    self.width = metrics.Histogram([0.05, 0.1])
+    self.decoder = pulse_decoder.AdaptiveDecoder(0.005, self.width)
+
+  def dial(self, edges):
+    ''' Feed (time, state) edges of one digit, returns Finish().'''
+    self.clicks = 0
+    self.decoder.Start()
+    for timestamp, state in edges:
+      if self.decoder.Pulse(state, timestamp):
+        self.clicks += 1
+    return self.decoder.Finish()
+
+  def pulses(self, count, period=0.1, break_ratio=0.6):
+    edges = []
+    for i in range(count):
+      edges += [(i * period, True), (i * period + period * break_ratio, False)]
+    return edges
+
+  def test_Plain(self):
+    self.assertEqual((5, True), self.dial(self.pulses(5)))
+    self.assertEqual(5, self.clicks)
+    self.assertEqual(5, self.width.GetCount())
+    self.assertEqual(0, self.decoder.GetGlitches())
+
+  def test_ShortGapJoinsPulses(self):
+    edges = self.pulses(2)
+    # The contact closes for 6ms in the middle of the first break.
+    edges[1:1] = [(0.03, False), (0.036, True)]
+    self.assertEqual((2, True), self.dial(edges))
+    self.assertEqual(2, self.clicks)
+    self.assertEqual(1, self.decoder.GetGlitches())
+    self.assertEqual(2, self.width.GetCount())
+
+  def test_ShortPulseDiscarded(self):
+    edges = self.pulses(2)
+    # The contact opens for 6ms between the pulses.
+    edges[2:2] = [(0.08, True), (0.086, False)]
+    self.assertEqual((2, True), self.dial(edges))
+    # It was clicked before it turned out to be too short.
+    self.assertEqual(3, self.clicks)
+    self.assertEqual(1, self.decoder.GetGlitches())
+
+  def test_BounceAfterIdleIgnored(self):
+    self.dial(self.pulses(1))
+    self.assertFalse(self.decoder.Pulse(True, 0.066))
+    self.assertEqual((1, True), self.dial(self.pulses(1)))
+
+  def test_LearnsTiming(self):
+    for _ in range(20):
+      self.assertEqual((10, True),
+                       self.dial(self.pulses(10, period=0.125,
+                                             break_ratio=0.7)))
+    self.assertAlmostEqual(0.125, self.decoder.GetPeriod(), places=3)
+    self.assertAlmostEqual(0.7, self.decoder.GetBreakRatio(), places=2)
+
+  def test_WindowFollowsBursts(self):
+    self.decoder.Start()
+    self.decoder.Finish(0.015)
+    self.assertAlmostEqual(0.018, self.decoder.GetWindow())
+    # Never less than before.
+    self.decoder.Start()
+    self.decoder.Finish(0.001)
+    self.assertAlmostEqual(0.018, self.decoder.GetWindow())
+    # A window that can't swallow the burst is left alone, here more than
+    # half the make time.
+    self.decoder.Start()
+    self.decoder.Finish(0.02)
+    self.assertAlmostEqual(0.018, self.decoder.GetWindow())
+
+  def test_IrregularDigitFlagged(self):
+    edges = self.pulses(4)
+    del edges[2:4]
+    self.assertEqual((3, False), self.dial(edges))
+    self.assertEqual(1, self.decoder.GetFlagged())
+    self.assertEqual(0.1, self.decoder.GetPeriod())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# phone_io recovery benchmark of Phony.
+#
+# Runs Phony against fake_linphone (see phony_benchmark.py) with a real
+# phone_io subprocess on the GPIO simulator. An incoming call rings the
+# bell, then phone_io is killed, and later stopped (SIGSTOP) so it
+# stalls. We report how long Phony took to notice and to hear from the
+# restarted phone_io, and check the call still rings.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import ConfigParser
+import logging
+import os
+import signal
+import threading
+import time
+
+import clock
+# Installs fake_linphone, so it must come before phony.
+import phony_benchmark
+import phony
+
+class SupervisedPhony(phony_benchmark.BenchmarkPhony):
+  ''' BenchmarkPhony with the real, supervised phone_io.'''
+
+  initPhoneIO = phony.Phony.initPhoneIO
+
+def CreateConfig():
+  config = ConfigParser.ConfigParser()
+  username = phony_benchmark.USERNAME
+  config.add_section(username)
+  config.set(username, 'Username', username)
+  config.set(username, 'Password', 'secret')
+  config.set(username, 'Gateway', 'example.com')
+  config.add_section(phony.SETTINGS_SECTION)
+  config.set(phony.SETTINGS_SECTION, 'gpio_backend', 'sim')
+  return config
+
+def RunFailures(kills, stalls):
+  ''' Kill and stall phone_io, returns the recovery times by failure.'''
+  instance = SupervisedPhony(CreateConfig())
+  supervisor = instance.phone_io_supervisor_
+  phone = instance.phones_[0]
+  errors = []
+  results = {'kill': [], 'stall': []}
+
+  def WaitFor(condition):
+    deadline = clock.Monotonic() + phony_benchmark.WAIT_TIMEOUT
+    while not condition():
+      if clock.Monotonic() > deadline:
+        raise RuntimeError('Timeout waiting for Phony.')
+      time.sleep(0.001)
+
+  def Fail(kind, signal_number):
+    process = supervisor.GetProcess()
+    recoveries = len(supervisor.GetRecoveries())
+    start = clock.Monotonic()
+    os.kill(process.pid, signal_number)
+    WaitFor(lambda: len(supervisor.GetRecoveries()) > recoveries)
+    # Detection plus restart plus the first heartbeat of the new child.
+    results[kind].append(clock.Monotonic() - start)
+    if phone.phone_state_.GetCurrentState() != phony.PS_RINGING:
+      raise RuntimeError('The call stopped ringing.')
+
+  def Play():
+    try:
+      # Let phone_io come up.
+      WaitFor(lambda: supervisor.last_alive_ > supervisor.started_)
+      instance.core_.ScheduleIncomingCall(phony_benchmark.USERNAME)
+      WaitFor(lambda: phone.phone_state_.GetCurrentState() ==
+              phony.PS_RINGING)
+      for _ in range(kills):
+        Fail('kill', signal.SIGKILL)
+        # Count every kill as a first failure, without backoff.
+        supervisor.failures_ = 0
+      for _ in range(stalls):
+        Fail('stall', signal.SIGSTOP)
+        supervisor.failures_ = 0
+    except Exception as e:
+      errors.append(e)
+    finally:
+      instance.loop_.Stop()
+
+  player = threading.Thread(target=Play)
+  player.start()
+  instance.Run()
+  player.join()
+  supervisor.Close()
+  os.kill(supervisor.GetProcess().pid, signal.SIGKILL)
+  if errors:
+    raise errors[0]
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='phone_io recovery benchmark of Phony.')
+  parser.add_argument('--kills', type=int, default=10)
+  parser.add_argument('--stalls', type=int, default=2)
+  args = parser.parse_args()
+
+  # Keep Phony's logging from dominating the measurement.
+  logging.basicConfig(level=logging.ERROR)
+  results = RunFailures(args.kills, args.stalls)
+  for kind in ['kill', 'stall']:
+    times = sorted(results[kind])
+    if times:
+      print('%-6s %3d recoveries: p50=%.1fms max=%.1fms' % (
+        kind, len(times), times[len(times) // 2] * 1000, times[-1] * 1000))
+
+if __name__ == '__main__':
+  main()
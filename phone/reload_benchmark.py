@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# Config reload benchmark of Phony.
+#
+# Runs BenchmarkPhony (see phony_benchmark.py) with many providers and
+# a call in progress, and reloads the config alternating between two
+# versions. The second version changes one password, adds and removes a
+# provider and switches the default gateway. We report how long Reload
+# takes, and check that it only touched the providers that changed and
+# left the call alone.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import ConfigParser
+import logging
+import threading
+
+import clock
+# Installs fake_linphone, so it must come before phony.
+import phony_benchmark
+import phony
+
+NUMBER = '112'
+
+def CreateConfig(providers, changed):
+  ''' Returns a config with providers providers. If changed, provider 1
+  has a new password, provider 2 is replaced by a new one and provider 3
+  is the default.'''
+  config = ConfigParser.ConfigParser()
+  for i in range(providers):
+    if changed and i == 2:
+      i = providers
+    section = 'provider%d' % i
+    config.add_section(section)
+    password = 'new secret' if changed and i == 1 else 'secret'
+    for option, value in [('Username', 'user%d' % i), ('Password', password),
+                          ('Gateway', 'gw%d.example.com' % i)]:
+      config.set(section, option, value)
+    if changed and i == 3:
+      config.set(section, 'default', 'true')
+  config.add_section(phony.SETTINGS_SECTION)
+  config.set(phony.SETTINGS_SECTION, 'options_interval', '0')
+  config.add_section(phony.DIAL_PLAN_SECTION)
+  config.set(phony.DIAL_PLAN_SECTION, NUMBER, '')
+  return config
+
+def RunReloads(providers, reloads):
+  ''' Returns the durations of reloads reloads and the core records of
+  linphone methods called by them.'''
+  configs = [CreateConfig(providers, False), CreateConfig(providers, True)]
+  instance = phony_benchmark.BenchmarkPhony(configs[0])
+  durations = []
+  errors = []
+
+  def Reload(config, done):
+    start = clock.Monotonic()
+    instance.Reload(config)
+    durations.append(clock.Monotonic() - start)
+    done.set()
+
+  def Play():
+    try:
+      scenario = phony_benchmark.Scenario(instance)
+      scenario.waitFor(lambda: instance.IsRegistered() or None)
+      # Place a call, which must survive the reloads.
+      scenario.send('l', phony_benchmark.PIN_HOOK)
+      for digit in NUMBER:
+        scenario.send('s', phony_benchmark.PIN_IDLE)
+        for _ in range(int(digit) or 10):
+          scenario.send('p', phony_benchmark.PIN_PULSE)
+        scenario.send('e', phony_benchmark.PIN_IDLE)
+        scenario.send(digit, phony_benchmark.PIN_IDLE)
+      scenario.waitFor(lambda: instance.phones_[0].phone_state_.
+                       GetCurrentState() == phony.PS_TALKING or None)
+      for i in range(reloads):
+        done = threading.Event()
+        instance.loop_.CallFromThread(
+          lambda: Reload(configs[(i + 1) % 2], done))
+        done.wait(phony_benchmark.WAIT_TIMEOUT)
+      # Let the registrations settle.
+      scenario.waitFor(lambda: instance.IsRegistered() or None)
+      if instance.phones_[0].phone_state_.GetCurrentState() != (
+          phony.PS_TALKING):
+        raise RuntimeError('The call did not survive the reloads.')
+    except Exception as e:
+      errors.append(e)
+    finally:
+      instance.loop_.Stop()
+
+  player = threading.Thread(target=Play)
+  player.start()
+  instance.Run()
+  player.join()
+  if errors:
+    raise errors[0]
+  records = {}
+  for method in ['add_proxy_config', 'remove_proxy_config', 'add_auth_info',
+                 'remove_auth_info', 'refresh_register', 'terminate_call',
+                 'terminate_all_calls']:
+    records[method] = len(instance.core_.GetRecords(method))
+  return durations, records
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Config reload benchmark of Phony.')
+  parser.add_argument('--providers', type=int, default=50)
+  parser.add_argument('--reloads', type=int, default=100)
+  args = parser.parse_args()
+
+  # Keep Phony's logging from dominating the measurement.
+  logging.basicConfig(level=logging.WARNING)
+  durations, records = RunReloads(args.providers, args.reloads)
+  durations.sort()
+  print('%d reloads with %d providers: p50=%.3fms max=%.3fms' %
+        (len(durations), args.providers,
+         durations[len(durations) // 2] * 1000, durations[-1] * 1000))
+  # The initial registrations add one proxy config and auth info per
+  # provider, every reload one of each for the replaced provider and an
+  # auth info for the new password.
+  for method, count in sorted(records.items()):
+    print('%-22s %d' % (method, count))
+
+if __name__ == '__main__':
+  main()
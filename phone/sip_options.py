@@ -0,0 +1,204 @@
+# SIP OPTIONS pinger.
+#
+# Linphone only tells us whether a registration succeeded, which it
+# refreshes every few minutes. To notice a slow or dead gateway earlier,
+# OptionsPinger sends a SIP OPTIONS request to every gateway at a fixed
+# interval, and reports round trips and lost pings to a
+# gateway_health.HealthTracker. Any response counts, many gateways
+# answer OPTIONS from unknown parties with an error.
+#
+# Pings go out over UDP from the event loop, one connected socket per
+# gateway. Gateway names are resolved on a thread of their own, so a
+# slow DNS server doesn't stall the main loop.
+#
+# coding=utf-8
+
+import logging
+import random
+import socket
+import threading
+
+import clock
+
+# Seconds between two pings of a gateway.
+DEFAULT_INTERVAL = 30
+
+# Seconds a ping may take until it counts as lost.
+DEFAULT_TIMEOUT = 2
+
+DEFAULT_PORT = 5060
+
+OPTIONS = ('OPTIONS sip:{host} SIP/2.0\r\n'
+           'Via: SIP/2.0/UDP {local};branch=z9hG4bK{token};rport\r\n'
+           'Max-Forwards: 70\r\n'
+           'From: <sip:phony@{local}>;tag={token}\r\n'
+           'To: <sip:{host}>\r\n'
+           'Call-ID: {token}@phony\r\n'
+           'CSeq: 1 OPTIONS\r\n'
+           'Accept: application/sdp\r\n'
+           'Content-Length: 0\r\n\r\n')
+
+def SplitHostPort(gateway):
+  ''' Returns host and port of a gateway as configured, host, host:port
+  or [ipv6]:port.'''
+  if gateway.startswith('['):
+    host, _, rest = gateway[1:].partition(']')
+    port = rest[1:] if rest.startswith(':') else ''
+  elif gateway.count(':') == 1:
+    host, port = gateway.split(':')
+  else:
+    host, port = gateway, ''
+  return host, int(port) if port else DEFAULT_PORT
+
+def GetHeader(message, name, short_name=None):
+  ''' Returns the value of the first header name (or its compact form
+  short_name) of a SIP message, None if there is none.'''
+  names = (name.lower(), (short_name or name).lower())
+  for line in message.split('\r\n')[1:]:
+    if not line:
+      break
+    key, _, value = line.partition(':')
+    if key.strip().lower() in names:
+      return value.strip()
+  return None
+
+class Target:
+  ''' Target is a gateway being pinged.'''
+
+  def __init__(self, gateway):
+    self.gateway = gateway
+    self.host, self.port = SplitHostPort(gateway)
+    # Connected socket, None until the address is resolved.
+    self.sock = None
+    self.resolving = False
+    # {token: send time} of unanswered pings.
+    self.pending = {}
+    self.timer = None
+
+class OptionsPinger:
+  ''' OptionsPinger pings gateways with SIP OPTIONS.'''
+
+  def __init__(self, loop, tracker, interval=DEFAULT_INTERVAL,
+               timeout=DEFAULT_TIMEOUT, resolve=socket.getaddrinfo):
+    ''' Construct OptionsPinger instance.
+
+    Args:
+      loop: The event_loop.EventLoop to run on.
+      tracker: The gateway_health.HealthTracker to report to.
+      interval: Seconds between two pings of a gateway.
+      timeout: Seconds until a ping counts as lost.
+      resolve: Resolves host names like socket.getaddrinfo. Called on a
+        thread of its own.
+    '''
+    self.loop_ = loop
+    self.tracker_ = tracker
+    self.interval_ = interval
+    self.timeout_ = timeout
+    self.resolve_ = resolve
+    self.targets_ = {}
+
+  def SetGateways(self, gateways):
+    ''' Ping gateways from now on, and no others.'''
+    for gateway in list(self.targets_):
+      if gateway not in gateways:
+        self.close_(self.targets_.pop(gateway))
+    for gateway in gateways:
+      if gateway not in self.targets_:
+        target = Target(gateway)
+        self.targets_[gateway] = target
+        target.timer = self.loop_.CallLater(
+          0, lambda target=target: self.ping_(target))
+
+  def Close(self):
+    ''' Stop pinging.'''
+    self.SetGateways([])
+
+  def ping_(self, target):
+    target.timer = self.loop_.CallLater(self.interval_,
+                                        lambda: self.ping_(target))
+    if target.sock is None:
+      self.startResolve_(target)
+      return
+    token = '%016x' % random.getrandbits(64)
+    local_host, local_port = target.sock.getsockname()[:2]
+    local = ('[%s]:%d' if ':' in local_host else '%s:%d') % (local_host,
+                                                             local_port)
+    try:
+      target.sock.send(OPTIONS.format(host=target.host, local=local,
+                                      token=token))
+    except socket.error as e:
+      logging.info('Ping of %s failed: %s' % (target.gateway, e))
+      self.lost_(target)
+      return
+    target.pending[token] = clock.Monotonic()
+    self.loop_.CallLater(self.timeout_,
+                         lambda: self.expire_(target, token))
+
+  def startResolve_(self, target):
+    if target.resolving:
+      return
+    target.resolving = True
+    def Resolve():
+      try:
+        result = self.resolve_(target.host, target.port, 0,
+                               socket.SOCK_DGRAM)[0]
+      except (socket.error, IndexError) as e:
+        result = e
+      self.loop_.CallFromThread(lambda: self.resolved_(target, result))
+    thread = threading.Thread(target=Resolve, name='resolve')
+    thread.daemon = True
+    thread.start()
+
+  def resolved_(self, target, result):
+    target.resolving = False
+    if self.targets_.get(target.gateway) is not target:
+      # Removed meanwhile.
+      return
+    if isinstance(result, Exception):
+      logging.info('Can\'t resolve %s: %s' % (target.gateway, result))
+      self.tracker_.ObservePingTimeout(target.gateway)
+      return
+    family, socktype, proto, _, address = result
+    target.sock = socket.socket(family, socktype, proto)
+    target.sock.setblocking(False)
+    target.sock.connect(address)
+    self.loop_.AddReader(target.sock, lambda: self.read_(target))
+    target.timer.Cancel()
+    self.ping_(target)
+
+  def read_(self, target):
+    while True:
+      try:
+        message = target.sock.recv(65536)
+      except socket.error:
+        # Nothing left to read, or e.g. ECONNREFUSED from an ICMP port
+        # unreachable, in which case the ping times out.
+        return
+      if not message.startswith('SIP/2.0 '):
+        continue
+      call_id = GetHeader(message, 'Call-ID', 'i') or ''
+      sent = target.pending.pop(call_id.split('@')[0], None)
+      if sent is not None:
+        self.tracker_.ObserveRtt(target.gateway, clock.Monotonic() - sent)
+
+  def expire_(self, target, token):
+    if target.pending.pop(token, None) is not None:
+      self.lost_(target)
+
+  def lost_(self, target):
+    logging.info('Ping of %s lost.' % target.gateway)
+    self.tracker_.ObservePingTimeout(target.gateway)
+    if target.sock and not target.pending:
+      # Resolve again, the gateway might have moved.
+      self.closeSocket_(target)
+
+  def close_(self, target):
+    if target.timer:
+      target.timer.Cancel()
+    self.closeSocket_(target)
+
+  def closeSocket_(self, target):
+    if target.sock:
+      self.loop_.RemoveReader(target.sock)
+      target.sock.close()
+      target.sock = None
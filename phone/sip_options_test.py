@@ -0,0 +1,52 @@
+import event_loop
+import fake_gateway
+import gateway_health
+import sip_options
+import unittest
+
+class TestOptionsPinger(unittest.TestCase):
+  def setUp(self):
+    self.loop = event_loop.EventLoop()
+    self.tracker = gateway_health.HealthTracker()
+    self.pinger = sip_options.OptionsPinger(self.loop, self.tracker,
+                                            interval=0.05, timeout=0.03)
+
+  def run_(self, seconds):
+    self.loop.CallLater(seconds, self.loop.Stop)
+    self.loop.Run()
+
+  def test_Ping(self):
+    up = fake_gateway.FakeGateway(delay=0.005)
+    down = fake_gateway.FakeGateway()
+    down.SetDown(True)
+    self.pinger.SetGateways([up.GetGateway(), down.GetGateway()])
+    self.run_(0.2)
+    rtt = self.tracker.Get(up.GetGateway()).GetRtt()
+    self.assertGreaterEqual(rtt, 0.005)
+    self.assertLess(rtt, 0.03)
+    self.assertGreater(down.GetRequests(), 0)
+    self.assertIsNone(self.tracker.Get(down.GetGateway()).GetRtt())
+    self.assertEqual([up.GetGateway(), down.GetGateway()],
+                     self.tracker.Rank([down.GetGateway(), up.GetGateway()]))
+    self.pinger.Close()
+    requests = up.GetRequests()
+    self.run_(0.1)
+    self.assertEqual(requests, up.GetRequests())
+    up.Close()
+    down.Close()
+
+  def test_SplitHostPort(self):
+    self.assertEqual(('gw.example.com', 5060),
+                     sip_options.SplitHostPort('gw.example.com'))
+    self.assertEqual(('gw.example.com', 5070),
+                     sip_options.SplitHostPort('gw.example.com:5070'))
+    self.assertEqual(('::1', 5070), sip_options.SplitHostPort('[::1]:5070'))
+
+  def test_GetHeader(self):
+    message = 'SIP/2.0 200 OK\r\ni: abc@phony\r\nCSeq: 1 OPTIONS\r\n\r\n'
+    self.assertEqual('abc@phony',
+                     sip_options.GetHeader(message, 'Call-ID', 'i'))
+    self.assertIsNone(sip_options.GetHeader(message, 'Via', 'v'))
+
+if __name__ == '__main__':
+  unittest.main()
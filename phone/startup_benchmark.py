@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#
+# Startup benchmark of Phony.
+#
+# Starts BenchmarkPhony (see phony_benchmark.py) with fake_linphone
+# cores that take a while to create and to register, like a real core
+# loading its configuration and sound cards and talking to the
+# providers. The handset is lifted right away and 112 dialed as soon as
+# the dial tone state is reached. We measure from the start of Phony:
+#  - usable: the lift got the phone into the dial tone state.
+#  - core: the core is created. The dial tone of the linphone tone
+#    output plays from here on, the alsa and aplay outputs play it as
+#    soon as the phone is usable.
+#  - invite: the number went out, which waits for the registration.
+#  - registered: all providers are registered.
+# Phony is compared to a variant creating the core before phone_io, as
+# Phony did before the core got its own thread.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import argparse
+import ConfigParser
+import logging
+import threading
+import time
+
+import clock
+# Installs fake_linphone, so it must come before phony.
+import phony_benchmark
+import fake_linphone
+import phony
+
+NUMBER = '112'
+
+class SequentialPhony(phony_benchmark.BenchmarkPhony):
+  ''' Creates the core on the main thread before the hardware comes up.'''
+
+  def initProviders(self):
+    phony_benchmark.BenchmarkPhony.initProviders(self)
+    self.sequential_core_ = self.createCore(phony.RING_BACK)
+
+  def startCore(self):
+    self.coreReady(self.sequential_core_)
+
+def CreateConfig(providers):
+  ''' Returns a config with providers providers and a plan for NUMBER.'''
+  config = ConfigParser.ConfigParser()
+  for i in range(providers):
+    section = 'provider%d' % i
+    config.add_section(section)
+    for option, value in [('Username', 'user%d' % i), ('Password', 'secret'),
+                          ('Gateway', 'gw%d.example.com' % i)]:
+      config.set(section, option, value)
+  config.add_section(phony.DIAL_PLAN_SECTION)
+  config.set(phony.DIAL_PLAN_SECTION, NUMBER, '')
+  return config
+
+def RunStartup(cls, providers):
+  ''' Start Phony of class cls and return the times to the milestones.'''
+  start = clock.Monotonic()
+  instance = cls(CreateConfig(providers), wait_for_core=False)
+  times = {'constructed': clock.Monotonic() - start}
+  phone = instance.phones_[0]
+  errors = []
+
+  def WaitFor(condition):
+    deadline = clock.Monotonic() + phony_benchmark.WAIT_TIMEOUT
+    while not condition():
+      if clock.Monotonic() > deadline:
+        raise RuntimeError('Timeout waiting for Phony.')
+      time.sleep(0.001)
+    return clock.Monotonic() - start
+
+  def Invited():
+    return instance.core_ and instance.core_.GetRecords('invite')
+
+  def Play():
+    try:
+      scenario = phony_benchmark.Scenario(instance)
+      scenario.send('l', phony_benchmark.PIN_HOOK)
+      times['usable'] = WaitFor(
+        lambda: phone.phone_state_.GetCurrentState() == phony.PS_DIAL_TONE)
+      for digit in NUMBER:
+        scenario.send('s', phony_benchmark.PIN_IDLE)
+        for _ in range(int(digit) or 10):
+          time.sleep(phony_benchmark.PULSE_INTERVAL)
+          scenario.send('p', phony_benchmark.PIN_PULSE)
+        scenario.send('e', phony_benchmark.PIN_IDLE)
+        scenario.send(digit, phony_benchmark.PIN_IDLE)
+      times['core'] = WaitFor(lambda: instance.core_)
+      times['invite'] = WaitFor(Invited)
+      times['registered'] = WaitFor(instance.IsRegistered)
+    except Exception as e:
+      errors.append(e)
+    finally:
+      instance.loop_.Stop()
+
+  player = threading.Thread(target=Play)
+  player.start()
+  instance.Run()
+  player.join()
+  if errors:
+    raise errors[0]
+  return times
+
+def main():
+  parser = argparse.ArgumentParser(description='Startup benchmark of Phony.')
+  parser.add_argument('--providers', type=int, default=3)
+  parser.add_argument('--create-delay', type=float, default=1.0,
+                      help='Seconds it takes to create the core.')
+  parser.add_argument('--registration-delay', type=float, default=1.5,
+                      help='Seconds it takes to register with a provider.')
+  args = parser.parse_args()
+
+  # Keep Phony's logging from dominating the measurement.
+  logging.basicConfig(level=logging.WARNING)
+  fake_linphone.Factory.get().SetDelays(args.create_delay,
+                                        args.registration_delay)
+  milestones = ['constructed', 'usable', 'core', 'invite', 'registered']
+  print('%-12s' % '' + ''.join('%12s' % m for m in milestones))
+  for name, cls in [('sequential', SequentialPhony),
+                    ('threaded', phony_benchmark.BenchmarkPhony)]:
+    times = RunStartup(cls, args.providers)
+    print('%-12s' % name +
+          ''.join('%10.1fms' % (times[m] * 1000) for m in milestones))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,177 @@
+# Supervision of the phone_io subprocess.
+#
+# phone_io does all the talking to the hardware. If it dies (e.g. on a
+# GPIO exception) or hangs, Phony no longer hears the handset. Supervisor
+# notices both: the owner reports the end of the child's output with
+# Failed, and calls Alive for everything the child writes, including
+# the heartbeats phone_io writes every HEARTBEAT_INTERVAL (see its
+# --heartbeat). If nothing arrives for HEARTBEAT_TIMEOUT, the child
+# counts as stalled.
+#
+# A failed child is detached from, killed and started again, right away
+# the first time and with a growing backoff if it keeps failing. The
+# owner's start function resynchronizes the phones with the new child.
+# The time from noticing the failure to the first sign of life of the
+# new child is logged as the recovery time.
+#
+# coding=utf-8
+
+import logging
+import threading
+
+import clock
+
+# Seconds between two heartbeats of phone_io.
+HEARTBEAT_INTERVAL = 0.5
+
+# Seconds without any output after which phone_io counts as stalled.
+HEARTBEAT_TIMEOUT = 2
+
+# Seconds to wait before the second restart in a row, doubling with
+# every further one up to MAX_BACKOFF. The first restart is immediate.
+MIN_BACKOFF = 0.1
+MAX_BACKOFF = 5
+
+# Seconds a child must run before its failure counts as a first one
+# again.
+STABLE_TIME = 10
+
+class Supervisor:
+  ''' Supervisor keeps a child process running, see above.'''
+
+  def __init__(self, loop, start, stop, name, timeout=HEARTBEAT_TIMEOUT,
+               time_function=clock.Monotonic):
+    ''' Construct Supervisor instance.
+
+    Args:
+      loop: The event_loop.EventLoop to run on.
+      start: Starts the child and returns it as a subprocess.Popen, or
+        raises EnvironmentError. Called with True for restarts.
+      stop: Called with a failed child before it is killed, to stop
+        reading from it.
+      name: Name of the child, used for logging.
+      timeout: Seconds without a call to Alive until the child counts as
+        stalled, None to only watch for failures reported by the owner.
+      time_function: Returns the current time in seconds.
+    '''
+    self.loop_ = loop
+    self.start_ = start
+    self.stop_ = stop
+    self.name_ = name
+    self.timeout_ = timeout
+    self.time_function_ = time_function
+    self.process_ = None
+    self.started_ = None
+    self.last_alive_ = None
+    self.watchdog_ = None
+    self.restart_timer_ = None
+    self.failures_ = 0
+    self.closed_ = False
+    # Reason and time of the failure we are recovering from, None while
+    # the child is fine.
+    self.failure_ = None
+    self.failed_at_ = None
+    # Recovery times in seconds.
+    self.recoveries_ = []
+
+  def GetProcess(self):
+    ''' GetProcess returns the current child, None while restarting.'''
+    return self.process_
+
+  def GetRecoveries(self):
+    ''' GetRecoveries returns the recovery times in seconds.'''
+    return self.recoveries_
+
+  def IsRecovering(self):
+    ''' IsRecovering returns whether the child failed and hasn't shown
+    any sign of life since.'''
+    return self.failure_ is not None
+
+  def Start(self):
+    ''' Start the child for the first time. Exceptions of start are
+    passed on.'''
+    self.process_ = self.start_(False)
+    self.started_ = self.last_alive_ = self.time_function_()
+    self.armWatchdog_()
+
+  def Alive(self):
+    ''' The child wrote something. Cheap, called for every read.'''
+    self.last_alive_ = self.time_function_()
+    if self.failure_ is not None:
+      recovery = self.last_alive_ - self.failed_at_
+      self.recoveries_.append(recovery)
+      logging.warning('{name} recovered from {reason} in {ms:.0f}ms, '
+                      'restart {failures}.'.format(
+                        name=self.name_, reason=self.failure_,
+                        ms=recovery * 1000, failures=self.failures_))
+      self.failure_ = None
+
+  def Failed(self, reason):
+    ''' The child failed for reason, restart it. Does nothing while a
+    restart is pending or after Close.'''
+    if self.restart_timer_ or self.closed_:
+      return
+    now = self.time_function_()
+    if now - self.started_ >= STABLE_TIME:
+      self.failures_ = 0
+    self.failures_ += 1
+    if self.failure_ is None:
+      self.failure_ = reason
+      self.failed_at_ = now
+    if self.watchdog_:
+      self.watchdog_.Cancel()
+      self.watchdog_ = None
+    if self.process_:
+      self.stop_(self.process_)
+      self.kill_(self.process_)
+    self.process_ = None
+    backoff = 0
+    if self.failures_ > 1:
+      backoff = min(MAX_BACKOFF, MIN_BACKOFF * 2 ** (self.failures_ - 2))
+    logging.error('{name} {reason}, restarting in {backoff:.1f}s.'.format(
+      name=self.name_, reason=reason, backoff=backoff))
+    self.restart_timer_ = self.loop_.CallLater(backoff, self.restart_)
+
+  def Close(self):
+    ''' Stop supervising, leaving the child alone.'''
+    self.closed_ = True
+    for timer in [self.watchdog_, self.restart_timer_]:
+      if timer:
+        timer.Cancel()
+    self.watchdog_ = self.restart_timer_ = None
+
+  def restart_(self):
+    self.restart_timer_ = None
+    self.started_ = self.last_alive_ = self.time_function_()
+    try:
+      self.process_ = self.start_(True)
+    except EnvironmentError as e:
+      # Retry with the next backoff.
+      self.Failed('failed to start (%s)' % e)
+      return
+    self.armWatchdog_()
+
+  def armWatchdog_(self):
+    if self.timeout_ is None:
+      return
+    self.watchdog_ = self.loop_.CallAt(self.last_alive_ + self.timeout_,
+                                       self.checkAlive_)
+
+  def checkAlive_(self):
+    self.watchdog_ = None
+    if self.time_function_() - self.last_alive_ >= self.timeout_:
+      self.Failed('stalled')
+    else:
+      self.armWatchdog_()
+
+  def kill_(self, process):
+    ''' Kill process and reap it on a thread, so we don't wait for it.'''
+    if process.poll() is None:
+      try:
+        process.kill()
+      except OSError:
+        # Exited meanwhile.
+        pass
+    reaper = threading.Thread(target=process.wait, name='reaper')
+    reaper.daemon = True
+    reaper.start()
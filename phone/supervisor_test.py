@@ -0,0 +1,112 @@
+import supervisor
+import unittest
+
+class FakeTimer:
+  def __init__(self, deadline, callback):
+    self.deadline = deadline
+    self.callback = callback
+    self.cancelled = False
+
+  def Cancel(self):
+    self.cancelled = True
+
+class FakeLoop:
+  ''' Runs timers on the test's clock.'''
+
+  def __init__(self, test):
+    self.test_ = test
+    self.timers_ = []
+
+  def CallAt(self, deadline, callback):
+    timer = FakeTimer(deadline, callback)
+    self.timers_.append(timer)
+    return timer
+
+  def CallLater(self, delay, callback):
+    return self.CallAt(self.test_.now + delay, callback)
+
+  def RunDue(self):
+    while True:
+      due = [t for t in self.timers_
+             if not t.cancelled and t.deadline <= self.test_.now]
+      if not due:
+        return
+      timer = min(due, key=lambda t: t.deadline)
+      self.timers_.remove(timer)
+      timer.callback()
+
+class FakeProcess:
+  def __init__(self):
+    self.killed = False
+
+  def poll(self):
+    return -9 if self.killed else None
+
+  def kill(self):
+    self.killed = True
+
+  def wait(self):
+    return self.poll()
+
+class TestSupervisor(unittest.TestCase):
+  def setUp(self):
+    self.now = 0.0
+    self.loop = FakeLoop(self)
+    self.started = []
+    self.stopped = []
+    self.supervisor = supervisor.Supervisor(
+      self.loop, self.start, self.stopped.append, 'child', timeout=2,
+      time_function=lambda: self.now)
+
+  def start(self, restart):
+    process = FakeProcess()
+    self.started.append((process, restart))
+    return process
+
+  def test_RestartWithBackoff(self):
+    self.supervisor.Start()
+    first = self.supervisor.GetProcess()
+    self.now = 20.0
+    self.supervisor.Failed('exited')
+    self.assertTrue(first.killed)
+    self.assertEqual([first], self.stopped)
+    self.assertIsNone(self.supervisor.GetProcess())
+    # The first restart is immediate, the next ones back off.
+    self.loop.RunDue()
+    self.assertEqual(2, len(self.started))
+    self.assertTrue(self.started[-1][1])
+    self.supervisor.Failed('exited')
+    self.loop.RunDue()
+    self.assertEqual(2, len(self.started))
+    self.now += supervisor.MIN_BACKOFF
+    self.loop.RunDue()
+    self.assertEqual(3, len(self.started))
+    self.now += 0.05
+    self.supervisor.Alive()
+    self.assertFalse(self.supervisor.IsRecovering())
+    self.assertEqual(1, len(self.supervisor.GetRecoveries()))
+    self.assertAlmostEqual(supervisor.MIN_BACKOFF + 0.05,
+                           self.supervisor.GetRecoveries()[0])
+
+  def test_Stall(self):
+    self.supervisor.Start()
+    self.now = 1.5
+    self.supervisor.Alive()
+    self.now = 3.0
+    self.loop.RunDue()
+    self.assertEqual(1, len(self.started))
+    self.now = 3.5
+    self.loop.RunDue()
+    self.assertTrue(self.supervisor.IsRecovering())
+    self.assertEqual(2, len(self.started))
+
+  def test_Close(self):
+    self.supervisor.Start()
+    self.supervisor.Close()
+    self.supervisor.Failed('exited')
+    self.now = 10.0
+    self.loop.RunDue()
+    self.assertEqual(1, len(self.started))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,653 @@
+# Tone engine.
+#
+# Call progress tones (dial tone, busy tone, ring back) are decoded from
+# WAV files or synthesized from a national tone profile once, at startup,
+# into 16 bit mono PCM buffers. The engine loops the current tone through
+# a sink until told to stop:
+#  - AlsaSink and AplaySink feed a local audio stream from a Mixer on a
+#    thread, which is truly gapless. The stream is open only while
+#    something plays and for a few seconds after. Short sounds like
+#    the dial's pulse clicks are mixed in at the frame matching the
+#    capture time of their event. AlsaSink needs the alsaaudio module,
+#    AplaySink the aplay tool. One of them is used by default.
+#  - LinphoneSink plays through linphone's play_local, the fallback if
+#    there is neither. The tone is written to a cache file once and
+#    restarted on a fixed schedule, so repetitions don't drift. Every
+#    click is a play_local call of its own, so clicks lag behind the
+#    dial when Phony is busy.
+#
+# coding=utf-8
+
+from __future__ import division
+
+import array
+import audioop
+import distutils.spawn
+import fractions
+import logging
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import wave
+
+import clock
+
+# All tones are kept in this format, the one linphone's play_local wants.
+SAMPLE_RATE = 8000
+SAMPLE_WIDTH = 2
+
+# Peak amplitude of synthesized tones, relative to full scale.
+AMPLITUDE = 0.3
+
+# Seconds to fade in and out each burst of a cadence, avoiding clicks.
+RAMP_TIME = 0.005
+
+# Length in seconds of the buffer a continuous tone is synthesized into.
+CONTINUOUS_LENGTH = 1.0
+
+# Frames written to a stream at a time.
+PERIOD_FRAMES = 80
+
+# Tone profiles: {profile: {tone name: ([frequencies in Hz],
+# [(seconds on, seconds off)])}}. A cadence with nothing off is a
+# continuous tone.
+PROFILES = {
+  # 425 Hz tones as used in most of Europe (ETSI TR 101 041).
+  'de': {'dial_tone': ([425], [(1.0, 0.0)]),
+         'busy_tone': ([425], [(0.48, 0.48)]),
+         'ringback_tone': ([425], [(1.0, 4.0)])},
+  'cept': {'dial_tone': ([425], [(1.0, 0.0)]),
+           'busy_tone': ([425], [(0.5, 0.5)]),
+           'ringback_tone': ([425], [(1.0, 4.0)])},
+  'uk': {'dial_tone': ([350, 450], [(1.0, 0.0)]),
+         'busy_tone': ([400], [(0.375, 0.375)]),
+         'ringback_tone': ([400, 450], [(0.4, 0.2), (0.4, 2.0)])},
+  'us': {'dial_tone': ([350, 440], [(1.0, 0.0)]),
+         'busy_tone': ([480, 620], [(0.5, 0.5)]),
+         'ringback_tone': ([440, 480], [(2.0, 4.0)])},
+}
+
+DEFAULT_PROFILE = 'de'
+
+class Tone:
+  ''' Tone is a PCM buffer that is played in a loop.'''
+
+  def __init__(self, name, pcm, rate=SAMPLE_RATE):
+    self.name_ = name
+    self.pcm_ = pcm
+    self.rate_ = rate
+
+  def GetName(self):
+    return self.name_
+
+  def GetPCM(self):
+    ''' GetPCM returns the samples as a string of 16 bit native ints.'''
+    return self.pcm_
+
+  def GetRate(self):
+    return self.rate_
+
+  def GetDuration(self):
+    ''' GetDuration returns the seconds of one repetition.'''
+    return len(self.pcm_) / (SAMPLE_WIDTH * self.rate_)
+
+  def Save(self, path, min_duration=0):
+    ''' Write the tone to a WAV file.
+
+    Args:
+      path: File to write.
+      min_duration: The tone is repeated until the file is at least this
+                    many seconds long.
+    '''
+    repetitions = max(1, int(math.ceil(min_duration / self.GetDuration())))
+    w = wave.open(path, 'wb')
+    try:
+      w.setnchannels(1)
+      w.setsampwidth(SAMPLE_WIDTH)
+      w.setframerate(self.rate_)
+      w.writeframes(self.pcm_ * repetitions)
+    finally:
+      w.close()
+    return repetitions
+
+def LoadWav(name, path, rate=SAMPLE_RATE):
+  ''' Decode a WAV file into a Tone, converting it to 16 bit mono.
+
+  Raises:
+    IOError, wave.Error: The file can't be read.
+  '''
+  w = wave.open(path, 'rb')
+  try:
+    channels, width, file_rate, frames = w.getparams()[:4]
+    pcm = w.readframes(frames)
+  finally:
+    w.close()
+  if width != SAMPLE_WIDTH:
+    pcm = audioop.lin2lin(pcm, width, SAMPLE_WIDTH)
+  if channels == 2:
+    pcm = audioop.tomono(pcm, SAMPLE_WIDTH, 0.5, 0.5)
+  elif channels != 1:
+    raise wave.Error('%s: %d channels not supported' % (path, channels))
+  if file_rate != rate:
+    pcm, _ = audioop.ratecv(pcm, SAMPLE_WIDTH, 1, file_rate, rate, None)
+  return Tone(name, pcm, rate)
+
+def _CycleFrames(frequencies, rate):
+  ''' Returns the smallest number of frames holding a whole number of
+  cycles of all frequencies.'''
+  frames = 1
+  for f in frequencies:
+    period = rate // fractions.gcd(rate, f)
+    frames = frames * period // fractions.gcd(frames, period)
+  return frames
+
+def Synthesize(name, frequencies, cadence, rate=SAMPLE_RATE,
+               amplitude=AMPLITUDE):
+  ''' Synthesize a Tone.
+
+  Args:
+    name: Name of the tone.
+    frequencies: Frequencies in Hz (integers) that are mixed.
+    cadence: [(seconds on, seconds off)], played once per repetition.
+    rate: Sample rate.
+    amplitude: Peak amplitude relative to full scale.
+  '''
+  scale = amplitude * 32767 / len(frequencies)
+  steps = [2 * math.pi * f / rate for f in frequencies]
+  samples = array.array('h')
+  if len(cadence) == 1 and not cadence[0][1]:
+    # Continuous tone. Make the buffer hold whole cycles, so it loops
+    # without a discontinuity.
+    unit = _CycleFrames(frequencies, rate)
+    frames = max(1, int(round(CONTINUOUS_LENGTH * rate / unit))) * unit
+    for i in range(frames):
+      samples.append(int(round(scale * sum(math.sin(s * i) for s in steps))))
+    return Tone(name, samples.tostring(), rate)
+
+  ramp = int(RAMP_TIME * rate)
+  for on, off in cadence:
+    on_frames = int(round(on * rate))
+    for i in range(on_frames):
+      gain = min(1, (i + 1) / ramp, (on_frames - i) / ramp)
+      samples.append(int(round(
+        gain * scale * sum(math.sin(s * i) for s in steps))))
+    samples.extend([0] * int(round(off * rate)))
+  return Tone(name, samples.tostring(), rate)
+
+def LoadTone(name, path=None, profile=DEFAULT_PROFILE):
+  ''' Returns the tone name from path if given, otherwise from profile.
+
+  If path can't be read, we fall back to the profile rather than
+  leaving the phone silent.
+  '''
+  if path:
+    try:
+      return LoadWav(name, path)
+    except (IOError, EOFError, wave.Error) as e:
+      logging.warning('Synthesizing %s, can\'t read %s: %s', name, path, e)
+  frequencies, cadence = PROFILES[profile][name]
+  return Synthesize(name, frequencies, cadence)
+
+class LinphoneSink:
+  ''' LinphoneSink loops tones through linphone's play_local.
+
+  Restarts are scheduled relative to the start of the tone, so timing
+  errors of the event loop don't add up.
+
+  The sink can be created before the core, see SetCore. Until then, the
+  tone started last waits for the core and clicks are dropped.
+  '''
+
+  def __init__(self, core, loop):
+    self.core_ = core
+    self.loop_ = loop
+    self.timer_ = None
+    # (path, duration) of the tone waiting for the core.
+    self.waiting_ = None
+
+  def SetCore(self, core):
+    ''' Set the core once it is created and start the waiting tone.'''
+    self.core_ = core
+    if self.waiting_:
+      path, duration = self.waiting_
+      self.waiting_ = None
+      self.play_(path, duration, clock.Monotonic())
+
+  def Start(self, tone, path):
+    self.Stop()
+    if self.core_ is None:
+      self.waiting_ = (path, tone.GetDuration())
+      return
+    self.play_(path, tone.GetDuration(), clock.Monotonic())
+
+  def Stop(self):
+    self.waiting_ = None
+    if self.timer_:
+      self.timer_.Cancel()
+      self.timer_ = None
+
+  def Click(self, tone, path, timestamp):
+    ''' Play a short sound once. linphone can't mix it into the tone,
+    so it is played as soon as possible.'''
+    if self.core_ is not None:
+      self.core_.play_local(path)
+    return clock.Monotonic()
+
+  def Close(self):
+    self.Stop()
+
+  def play_(self, path, duration, start):
+    self.core_.play_local(path)
+    self.timer_ = self.loop_.CallAt(
+      start + duration, lambda: self.play_(path, duration, start + duration))
+
+class Mixer:
+  ''' Mixer renders a stream of frames: the looped tone plus one-shot
+  sounds (pulse clicks) placed at exact frames.
+
+  Frame f of the stream is due to leave for the device at
+  start_time + f / rate, which lets callers turn capture times of
+  events into frames.
+  '''
+
+  def __init__(self, start_time, rate=SAMPLE_RATE):
+    self.start_time_ = start_time
+    self.rate_ = rate
+    self.lock_ = threading.Lock()
+    self.loop_ = None
+    self.loop_position_ = 0
+    # One-shot sounds as [first frame, PCM].
+    self.sounds_ = []
+    # Next frame to render.
+    self.frame_ = 0
+
+  def FrameAt(self, timestamp):
+    ''' FrameAt returns the frame due at timestamp.'''
+    return int(round((timestamp - self.start_time_) * self.rate_))
+
+  def TimeOf(self, frame):
+    ''' TimeOf returns the time frame is due at.'''
+    return self.start_time_ + frame / self.rate_
+
+  def Restart(self, start_time):
+    ''' Restart the stream at frame 0, due at start_time.'''
+    with self.lock_:
+      self.start_time_ = start_time
+      self.loop_position_ = 0
+      self.sounds_ = []
+      self.frame_ = 0
+
+  def IsIdle(self):
+    ''' IsIdle returns whether the stream is silent from the next frame
+    on, with no tone looping and no sound scheduled.'''
+    with self.lock_:
+      return not self.loop_ and not self.sounds_
+
+  def SetLoop(self, pcm):
+    ''' Loop pcm from the next frame on, None for silence.'''
+    with self.lock_:
+      self.loop_ = pcm
+      self.loop_position_ = 0
+
+  def Schedule(self, pcm, frame):
+    ''' Mix pcm into the stream starting at frame.
+
+    Returns:
+      The frame the sound starts at, later than requested if frame has
+      been rendered already.
+    '''
+    with self.lock_:
+      frame = max(frame, self.frame_)
+      self.sounds_.append([frame, pcm])
+      return frame
+
+  def Render(self, frames):
+    ''' Render the next frames and return them as PCM.'''
+    size = frames * SAMPLE_WIDTH
+    with self.lock_:
+      if self.loop_:
+        data = self.loop_
+        output = data[self.loop_position_:self.loop_position_ + size]
+        # Wrap around the end of the loop without a gap.
+        while len(output) < size:
+          output += data[:size - len(output)]
+        self.loop_position_ = (self.loop_position_ + size) % len(data)
+      else:
+        output = b'\0' * size
+      first = self.frame_
+      self.frame_ += frames
+      pending = []
+      for sound in self.sounds_:
+        start, pcm = sound
+        if start >= self.frame_:
+          pending.append(sound)
+          continue
+        offset = (start - first) * SAMPLE_WIDTH
+        part = pcm[:size - offset]
+        output = audioop.add(
+          output,
+          b'\0' * offset + part + b'\0' * (size - offset - len(part)),
+          SAMPLE_WIDTH)
+        if len(pcm) > len(part):
+          # Continue in the next period.
+          pending.append([self.frame_, pcm[len(part):]])
+      self.sounds_ = pending
+    return output
+
+class StreamSink:
+  ''' StreamSink feeds a local audio stream from a Mixer on a thread.
+
+  Each period is written LEAD seconds before it is due, so the device
+  never starves and a click scheduled CLICK_DELAY after its pulse is
+  mixed in sample-accurately: the click follows the pulse by the same
+  delay whenever we happen to process the pulse.
+
+  The stream is opened by the first tone or click and closed again once
+  nothing played for IDLE_TIMEOUT, so an idle sink neither wakes up nor
+  holds the device linphone wants for calls. Reopening restarts the
+  mixer's frames, the first sound after a pause is late by the time
+  the device takes to open.
+
+  Subclasses implement the stream, all on the thread of the sink:
+    open_(): Open the device.
+    write_(data): Write a period of PCM to the device.
+    close_(): Close the device, called once open_ succeeded.
+  An exception of open_ or write_ is logged and closes the stream, the
+  next tone or click opens it again.
+  '''
+
+  # Seconds periods are written ahead of time.
+  LEAD = 0.02
+
+  # Seconds from the capture of a pulse to its click in the stream. The
+  # stream is rendered up to LEAD plus a period ahead, the rest is
+  # headroom for delivering and processing the pulse.
+  CLICK_DELAY = 0.04
+
+  # Seconds of silence before the stream is closed, longer than the
+  # pause between two digits.
+  IDLE_TIMEOUT = 5.0
+
+  def __init__(self, rate=SAMPLE_RATE, period_frames=PERIOD_FRAMES):
+    self.mixer_ = Mixer(clock.Monotonic() + self.LEAD, rate)
+    self.period_frames_ = period_frames
+    # Guards active_ and closed_, the thread waits on it while idle.
+    self.condition_ = threading.Condition()
+    # Whether the stream is open or about to be.
+    self.active_ = False
+    self.closed_ = False
+    self.thread_ = threading.Thread(target=self.run_, name='tones')
+    self.thread_.daemon = True
+    self.thread_.start()
+
+  def GetMixer(self):
+    return self.mixer_
+
+  def Start(self, tone, path):
+    with self.condition_:
+      self.wake_()
+      self.mixer_.SetLoop(tone.GetPCM())
+
+  def Stop(self):
+    self.mixer_.SetLoop(None)
+
+  def Click(self, tone, path, timestamp):
+    ''' Mix tone into the stream CLICK_DELAY after timestamp.
+
+    Returns:
+      The time the click is due at.
+    '''
+    with self.condition_:
+      self.wake_()
+      frame = self.mixer_.Schedule(
+        tone.GetPCM(), self.mixer_.FrameAt(timestamp + self.CLICK_DELAY))
+    return self.mixer_.TimeOf(frame)
+
+  def Close(self):
+    with self.condition_:
+      self.closed_ = True
+      self.condition_.notify()
+    self.thread_.join()
+
+  def wake_(self):
+    ''' Have the thread open the stream unless it's active. Call with
+    the condition held.'''
+    if not self.active_:
+      self.active_ = True
+      self.mixer_.Restart(clock.Monotonic() + self.LEAD)
+      self.condition_.notify()
+
+  def run_(self):
+    while True:
+      with self.condition_:
+        # Wait without a timeout, an idle sink doesn't wake up.
+        while not self.active_ and not self.closed_:
+          self.condition_.wait()
+        if self.closed_:
+          return
+      try:
+        self.open_()
+        try:
+          self.stream_()
+        finally:
+          self.close_()
+      except Exception as e:
+        # Give up on the stream, the next tone or click reopens it.
+        logging.error('Tone stream failed: %s', e)
+        with self.condition_:
+          self.active_ = False
+
+  def stream_(self):
+    ''' Write periods until the sink is closed or idle for
+    IDLE_TIMEOUT.'''
+    mixer = self.mixer_
+    frame = 0
+    idle_since = None
+    while True:
+      with self.condition_:
+        if self.closed_:
+          return
+        # Sleep until the next period is due to be written.
+        delay = mixer.TimeOf(frame) - self.LEAD - clock.Monotonic()
+        if delay > 0:
+          self.condition_.wait(delay)
+          continue
+        if not mixer.IsIdle():
+          idle_since = None
+        elif idle_since is None:
+          idle_since = clock.Monotonic()
+        elif clock.Monotonic() - idle_since > self.IDLE_TIMEOUT:
+          self.active_ = False
+          return
+      self.write_(mixer.Render(self.period_frames_))
+      frame += self.period_frames_
+
+class AlsaSink(StreamSink):
+  ''' AlsaSink streams tones to an ALSA device.'''
+
+  def __init__(self, device='default', rate=SAMPLE_RATE):
+    # Only import on demand, alsaaudio is optional.
+    import alsaaudio
+    self.alsaaudio_ = alsaaudio
+    self.device_ = device
+    self.rate_ = rate
+    self.pcm_ = None
+    StreamSink.__init__(self, rate)
+
+  def open_(self):
+    alsaaudio = self.alsaaudio_
+    self.pcm_ = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, alsaaudio.PCM_NORMAL,
+                              self.device_)
+    self.pcm_.setchannels(1)
+    self.pcm_.setrate(self.rate_)
+    self.pcm_.setformat(alsaaudio.PCM_FORMAT_S16_LE)
+    self.pcm_.setperiodsize(PERIOD_FRAMES)
+
+  def write_(self, data):
+    self.pcm_.write(data)
+
+  def close_(self):
+    self.pcm_.close()
+    self.pcm_ = None
+
+class AplaySink(StreamSink):
+  ''' AplaySink streams tones through aplay, which needs no Python
+  modules beyond the standard library. aplay runs while the stream is
+  open.'''
+
+  def __init__(self, device='default', rate=SAMPLE_RATE):
+    self.device_ = device
+    self.rate_ = rate
+    self.aplay_ = None
+    StreamSink.__init__(self, rate)
+
+  def open_(self):
+    self.aplay_ = subprocess.Popen(
+      ['aplay', '-q', '-D', self.device_, '-t', 'raw', '-f', 'S16_LE',
+       '-c', '1', '-r', str(self.rate_),
+       '--buffer-time=%d' % (4 * self.LEAD * 1e6)],
+      stdin=subprocess.PIPE)
+
+  def write_(self, data):
+    self.aplay_.stdin.write(data)
+    self.aplay_.stdin.flush()
+
+  def close_(self):
+    try:
+      self.aplay_.stdin.close()
+    except IOError:
+      pass
+    self.aplay_.wait()
+    self.aplay_ = None
+
+def DefaultOutput():
+  ''' Returns the stream output available here, 'alsa' or 'aplay', or
+  'linphone' if there is neither.'''
+  try:
+    import alsaaudio
+    return 'alsa'
+  except ImportError:
+    pass
+  if distutils.spawn.find_executable('aplay'):
+    return 'aplay'
+  return 'linphone'
+
+def CreateSink(output, core, loop, device='default'):
+  ''' Returns the sink for output, 'linphone', 'alsa', 'aplay' or 'auto'
+  for the DefaultOutput.'''
+  if output == 'auto':
+    output = DefaultOutput()
+  if output == 'linphone':
+    return LinphoneSink(core, loop)
+  if output == 'alsa':
+    return AlsaSink(device)
+  if output == 'aplay':
+    return AplaySink(device)
+  raise ValueError('Unknown tone output %s' % output)
+
+class ToneEngine:
+  ''' ToneEngine holds the decoded tones and plays one at a time. It
+  also plays one-shot sounds, like pulse clicks, on top.'''
+
+  def __init__(self, sink, min_file_duration=1.0):
+    ''' Construct ToneEngine instance.
+
+    Args:
+      sink: LinphoneSink, AlsaSink or AplaySink.
+      min_file_duration: Seconds tone files are at least long, short
+                         tones are repeated in the file to cut the
+                         number of restarts.
+    '''
+    self.sink_ = sink
+    self.min_file_duration_ = min_file_duration
+    self.tones_ = {}
+    # Names of tones that are played once rather than looped.
+    self.sounds_ = set()
+    # Tone files are written on first use.
+    self.files_ = {}
+    self.cache_dir_ = None
+    self.playing_ = None
+    # Whether tones and files belong to the engine this one was forked
+    # from.
+    self.forked_ = False
+
+  def Fork(self, sink):
+    ''' Returns a ToneEngine playing the tones of this one on sink.
+
+    Tones and their files are shared rather than copied, so the fork
+    costs little more than its sink. Close this engine after its forks.
+    '''
+    engine = ToneEngine(sink, self.min_file_duration_)
+    engine.tones_ = self.tones_
+    engine.sounds_ = self.sounds_
+    engine.files_ = self.files_
+    engine.cache_dir_ = self.cache_dir_
+    engine.forked_ = True
+    return engine
+
+  def AddTone(self, tone):
+    self.tones_[tone.GetName()] = tone
+    self.sounds_.discard(tone.GetName())
+    self.files_.pop(tone.GetName(), None)
+
+  def AddSound(self, tone):
+    ''' Add a tone that is played once with Click.'''
+    self.AddTone(tone)
+    self.sounds_.add(tone.GetName())
+
+  def GetFile(self, name):
+    ''' GetFile returns the path of a WAV file holding the tone name.'''
+    if name not in self.files_:
+      if not self.cache_dir_:
+        self.cache_dir_ = tempfile.mkdtemp(prefix='phony-tones-')
+      tone = self.tones_[name]
+      path = os.path.join(self.cache_dir_, name + '.wav')
+      min_duration = self.min_file_duration_
+      if name in self.sounds_:
+        min_duration = 0
+      repetitions = tone.Save(path, min_duration)
+      # The file is looped as a whole.
+      self.files_[name] = (path, Tone(name, tone.GetPCM() * repetitions,
+                                      tone.GetRate()))
+    return self.files_[name][0]
+
+  def Play(self, name):
+    ''' Play the tone name in a loop, replacing the current tone.'''
+    path = self.GetFile(name)
+    self.sink_.Start(self.files_[name][1], path)
+    self.playing_ = name
+
+  def Click(self, name, timestamp):
+    ''' Play the sound name once, mixed into the current tone.
+
+    Args:
+      name: Name of a sound added with AddSound.
+      timestamp: Capture time of the event the sound gives feedback on.
+                 Streaming sinks place the sound at a fixed delay from
+                 it.
+
+    Returns:
+      The time the sound is due to start playing.
+    '''
+    return self.sink_.Click(self.tones_[name], self.GetFile(name), timestamp)
+
+  def Stop(self):
+    ''' Stop the current tone.'''
+    if self.playing_:
+      self.sink_.Stop()
+      self.playing_ = None
+
+  def GetPlaying(self):
+    ''' GetPlaying returns the name of the tone being played or None.'''
+    return self.playing_
+
+  def Close(self):
+    self.Stop()
+    self.sink_.Close()
+    if self.cache_dir_ and not self.forked_:
+      shutil.rmtree(self.cache_dir_, ignore_errors=True)
+      self.cache_dir_ = None
+      self.files_ = {}
@@ -0,0 +1,259 @@
+import array
+import clock
+import event_loop
+import fake_linphone
+import logging
+import mock
+import os
+import shutil
+import tempfile
+import time
+import tones
+import unittest
+import wave
+
+class FakeSink:
+  def __init__(self):
+    self.calls = []
+
+  def Start(self, tone, path):
+    self.calls.append(('start', tone.GetName(), path))
+
+  def Stop(self):
+    self.calls.append(('stop',))
+
+  def Close(self):
+    self.calls.append(('close',))
+
+class TestTones(unittest.TestCase):
+  def setUp(self):
+    logging.basicConfig(level=logging.INFO)
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_ContinuousToneLoopsSeamlessly(self):
+    tone = tones.Synthesize('dial_tone', [425], [(1.0, 0.0)])
+    samples = array.array('h', tone.GetPCM())
+    self.assertEqual(1.0, tone.GetDuration())
+    # The step across the loop boundary is no larger than any other.
+    max_step = max(abs(samples[i + 1] - samples[i])
+                   for i in range(len(samples) - 1))
+    self.assertLessEqual(abs(samples[0] - samples[-1]), max_step)
+
+  def test_Cadence(self):
+    tone = tones.Synthesize('busy_tone', [425], [(0.48, 0.48)])
+    samples = array.array('h', tone.GetPCM())
+    self.assertAlmostEqual(0.96, tone.GetDuration())
+    on = int(0.48 * tones.SAMPLE_RATE)
+    self.assertGreater(max(samples[:on]), 5000)
+    self.assertEqual(0, max(abs(s) for s in samples[on:]))
+    # Bursts fade in.
+    self.assertLess(abs(samples[0]), 1000)
+
+  def test_LoadWavConverts(self):
+    path = os.path.join(self.dir, 'stereo.wav')
+    w = wave.open(path, 'wb')
+    w.setnchannels(2)
+    w.setsampwidth(2)
+    w.setframerate(16000)
+    w.writeframes(array.array('h', [1000, 3000] * 1600).tostring())
+    w.close()
+    tone = tones.LoadWav('ringback_tone', path)
+    self.assertAlmostEqual(0.1, tone.GetDuration(), places=2)
+    self.assertEqual(2000, array.array('h', tone.GetPCM())[100])
+
+  def test_LoadToneFallsBackToProfile(self):
+    tone = tones.LoadTone('busy_tone', os.path.join(self.dir, 'missing.wav'),
+                          'us')
+    self.assertEqual(1.0, tone.GetDuration())
+
+  def test_MixerPlacesSoundsAtFrames(self):
+    mixer = tones.Mixer(start_time=10.0, rate=1000)
+    self.assertEqual(25, mixer.FrameAt(10.025))
+    click = array.array('h', [100] * 15).tostring()
+    self.assertEqual(25, mixer.Schedule(click, 25))
+    mixer.SetLoop(array.array('h', [1, 2]).tostring())
+    samples = array.array('h', mixer.Render(20) + mixer.Render(20) +
+                          mixer.Render(20))
+    self.assertEqual([1, 2] * 12 + [1] + [102, 101] * 7 + [102] +
+                     [1, 2] * 10, list(samples))
+
+  def test_MixerLateSound(self):
+    mixer = tones.Mixer(start_time=0.0, rate=1000)
+    mixer.Render(10)
+    # Frames that are rendered already can't be changed.
+    self.assertEqual(10, mixer.Schedule(b'\x01\x00', 5))
+    self.assertEqual([1, 0], list(array.array('h', mixer.Render(2))))
+
+  def test_StreamSinkClickDelay(self):
+    written = []
+    class RecordingSink(tones.StreamSink):
+      def open_(self):
+        pass
+      def write_(self, data):
+        written.append(data)
+      def close_(self):
+        pass
+    sink = RecordingSink(period_frames=80)
+    click = tones.Tone('pulse', array.array('h', [1000] * 10).tostring())
+    pulse_ts = sink.GetMixer().TimeOf(400) + 0.001
+    due = sink.Click(click, None, pulse_ts)
+    self.assertAlmostEqual(pulse_ts + tones.StreamSink.CLICK_DELAY, due,
+                           delta=1.0 / tones.SAMPLE_RATE)
+    frame = sink.GetMixer().FrameAt(due)
+    while len(written) * 80 < frame + 10:
+      time.sleep(0.01)
+    sink.Close()
+    samples = array.array('h', b''.join(written))
+    self.assertEqual(frame, samples.tolist().index(1000))
+
+  def test_StreamSinkClosesWhenIdle(self):
+    calls = []
+    class RecordingSink(tones.StreamSink):
+      IDLE_TIMEOUT = 0.05
+      def open_(self):
+        calls.append('open')
+      def write_(self, data):
+        calls.append('write')
+      def close_(self):
+        calls.append('close')
+    sink = RecordingSink(period_frames=80)
+    time.sleep(0.05)
+    # Nothing is opened or written before the first sound.
+    self.assertEqual([], calls)
+    self.assertTrue(sink.GetMixer().IsIdle())
+    click = tones.Tone('pulse', array.array('h', [1000] * 10).tostring())
+    sink.Click(click, None, clock.Monotonic())
+    self.assertFalse(sink.GetMixer().IsIdle())
+    deadline = time.time() + 2
+    while 'close' not in calls and time.time() < deadline:
+      time.sleep(0.01)
+    self.assertEqual('open', calls[0])
+    self.assertEqual('close', calls[-1])
+    written = calls.count('write')
+    time.sleep(0.05)
+    self.assertEqual(written, calls.count('write'))
+    # The next sound opens the stream again.
+    sink.Start(click, None)
+    while calls.count('open') < 2 and time.time() < deadline:
+      time.sleep(0.01)
+    sink.Close()
+    self.assertEqual(['open', 'close'],
+                     [c for c in calls if c != 'write'][2:])
+
+  def test_StreamSinkReopensAfterError(self):
+    calls = []
+    class FailingSink(tones.StreamSink):
+      def open_(self):
+        calls.append('open')
+        if calls.count('open') == 1:
+          raise IOError('device busy')
+      def write_(self, data):
+        calls.append('write')
+        if calls.count('write') == 2:
+          raise IOError('broken pipe')
+      def close_(self):
+        calls.append('close')
+    click = tones.Tone('pulse', array.array('h', [1000] * 10).tostring())
+    sink = FailingSink(period_frames=80)
+    def WaitFor(count):
+      deadline = time.time() + 2
+      while calls.count('open') < count and time.time() < deadline:
+        time.sleep(0.01)
+      while sink.active_ and time.time() < deadline:
+        time.sleep(0.01)
+    with mock.patch('logging.error') as error:
+      # Opening fails, then writing fails.
+      for opens in [1, 2]:
+        sink.Click(click, None, clock.Monotonic())
+        WaitFor(opens)
+      self.assertEqual(2, error.call_count)
+    self.assertEqual(['open', 'open', 'write', 'write', 'close'], calls)
+    # The next sound opens the stream again.
+    sink.Start(click, None)
+    deadline = time.time() + 2
+    while calls.count('write') < 4 and time.time() < deadline:
+      time.sleep(0.01)
+    sink.Close()
+    self.assertEqual(3, calls.count('open'))
+    self.assertEqual('close', calls[-1])
+
+  def test_EnginePlaysFromCacheFiles(self):
+    sink = FakeSink()
+    engine = tones.ToneEngine(sink, min_file_duration=2)
+    engine.AddTone(tones.Synthesize('busy_tone', [425], [(0.48, 0.48)]))
+    engine.Play('busy_tone')
+    engine.Play('busy_tone')
+    path = engine.GetFile('busy_tone')
+    # Short tones are repeated in the file.
+    self.assertEqual(3 * 0.96 * tones.SAMPLE_RATE,
+                     wave.open(path).getnframes())
+    self.assertEqual('busy_tone', engine.GetPlaying())
+    engine.Stop()
+    engine.Stop()
+    engine.Close()
+    self.assertEqual([('start', 'busy_tone', path),
+                      ('start', 'busy_tone', path),
+                      ('stop',), ('close',)], sink.calls)
+    self.assertFalse(os.path.exists(path))
+
+  def test_ForkSharesFiles(self):
+    sink = FakeSink()
+    engine = tones.ToneEngine(sink)
+    engine.AddTone(tones.Synthesize('dial_tone', [425], [(1, 0)]))
+    path = engine.GetFile('dial_tone')
+    fork_sink = FakeSink()
+    fork = engine.Fork(fork_sink)
+    fork.Play('dial_tone')
+    self.assertIsNone(engine.GetPlaying())
+    fork.Close()
+    # The files belong to the original engine.
+    self.assertTrue(os.path.exists(path))
+    engine.Close()
+    self.assertFalse(os.path.exists(path))
+    self.assertEqual([('start', 'dial_tone', path), ('stop',), ('close',)],
+                     fork_sink.calls)
+
+  def test_LinphoneSinkRestartsOnSchedule(self):
+    core = fake_linphone.Core(fake_linphone.CoreCbs())
+    loop = event_loop.EventLoop()
+    sink = tones.LinphoneSink(core, loop)
+    tone = tones.Synthesize('busy_tone', [425], [(0.01, 0.01)])
+    sink.Start(tone, 'busy_tone.wav')
+    start = core.GetRecords('play_local')[0].timestamp
+    loop.CallLater(0.1, loop.Stop)
+    loop.Run()
+    sink.Stop()
+    records = core.GetRecords('play_local')
+    self.assertGreaterEqual(len(records), 5)
+    # Restarts are due at whole multiples of the tone's duration.
+    for i, r in enumerate(records):
+      self.assertGreaterEqual(r.timestamp - start, i * tone.GetDuration())
+
+  def test_LinphoneSinkWaitsForCore(self):
+    loop = event_loop.EventLoop()
+    sink = tones.LinphoneSink(None, loop)
+    tone = tones.Synthesize('dial_tone', [425], [(1, 0)])
+    sink.Click(tone, 'pulse.wav', 0)
+    sink.Start(tone, 'dial_tone.wav')
+    core = fake_linphone.Core(fake_linphone.CoreCbs())
+    sink.SetCore(core)
+    self.assertEqual([('dial_tone.wav',)],
+                     [r.args for r in core.GetRecords('play_local')])
+    sink.Stop()
+
+  def test_DefaultOutput(self):
+    with mock.patch.dict('sys.modules', {'alsaaudio': None}):
+      with mock.patch('distutils.spawn.find_executable') as find:
+        find.return_value = '/usr/bin/aplay'
+        self.assertEqual('aplay', tones.DefaultOutput())
+        find.return_value = None
+        self.assertEqual('linphone', tones.DefaultOutput())
+        loop = event_loop.EventLoop()
+        self.assertIsInstance(tones.CreateSink('auto', None, loop),
+                              tones.LinphoneSink)
+
+if __name__ == '__main__':
+  unittest.main()